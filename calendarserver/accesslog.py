@@ -36,7 +36,9 @@ except ImportError:
 from sys import platform
 import time
 
-from calendarserver.logAnalysis import getAdjustedMethodName
+from calendarserver.histogram import histogramAdd, histogramMerge
+from calendarserver.logAnalysis import getAdjustedMethodName, \
+    getAdjustedClientName
 
 from twext.python.log import Logger
 from twext.who.idirectory import RecordType
@@ -53,6 +55,156 @@ from twistedcaldav.config import config
 log = Logger()
 
 
+# Maximum number of distinct user agents tracked in each stats period, any
+# others are counted as "Other"
+MAX_USER_AGENTS = 50
+
+
+def initRequestStats():
+    """
+    Return an empty set of request stats. These are the stats that can be
+    aggregated in any process (worker or master) and then merged together.
+
+    @rtype: L{dict}
+    """
+
+    def initTimeHistogram():
+        return {
+            "<10ms": 0,
+            "10ms<->100ms": 0,
+            "100ms<->1s": 0,
+            "1s<->10s": 0,
+            "10s<->30s": 0,
+            "30s<->60s": 0,
+            ">60s": 0,
+            "Over 1s": 0,
+            "Over 10s": 0,
+        }
+
+    return {
+        "requests": 0,
+        "method": collections.defaultdict(int),
+        "method-t": collections.defaultdict(float),
+        "500": 0,
+        "401": 0,
+        "t": 0.0,
+        "t-resp-wr": 0.0,
+        "slots": 0,
+        "T": initTimeHistogram(),
+        "T-RESP-WR": initTimeHistogram(),
+        "T-MAX": 0.0,
+        "T-HIST": {},
+        "T-RESP-WR-HIST": {},
+        "method-hist": collections.defaultdict(dict),
+        "user-agent-hist": collections.defaultdict(dict),
+    }
+
+
+def _userAgentKey(current, stats):
+    """
+    Return the key to use for the user agent of a request, limiting the number
+    of distinct user agents tracked.
+    """
+    try:
+        agent = getAdjustedClientName(stats)
+    except KeyError:
+        agent = "-"
+    if agent not in current["user-agent-hist"] and len(current["user-agent-hist"]) >= MAX_USER_AGENTS:
+        agent = "Other"
+    return agent
+
+
+def updateRequestStats(current, stats):
+    """
+    Add the details of one request to a set of request stats.
+
+    @param current: the stats to update
+    @type current: L{dict}
+    @param stats: the access log details of the request
+    @type stats: L{dict}
+    """
+    adjustedMethod = getAdjustedMethodName(stats)
+
+    current["requests"] += 1
+    current["method"][adjustedMethod] += 1
+    current["method-t"][adjustedMethod] += stats.get("t", 0.0)
+    if stats["statusCode"] >= 500:
+        current["500"] += 1
+    elif stats["statusCode"] == 401:
+        current["401"] += 1
+    current["t"] += stats.get("t", 0.0)
+    current["t-resp-wr"] += stats.get("t-resp-wr", 0.0)
+    current["slots"] += stats.get("outstandingRequests", 0)
+
+    def histogramUpdate(t, key):
+        if t >= 60000.0:
+            current[key][">60s"] += 1
+        elif t >= 30000.0:
+            current[key]["30s<->60s"] += 1
+        elif t >= 10000.0:
+            current[key]["10s<->30s"] += 1
+        elif t >= 1000.0:
+            current[key]["1s<->10s"] += 1
+        elif t >= 100.0:
+            current[key]["100ms<->1s"] += 1
+        elif t >= 10.0:
+            current[key]["10ms<->100ms"] += 1
+        else:
+            current[key]["<10ms"] += 1
+        if t >= 1000.0:
+            current[key]["Over 1s"] += 1
+        elif t >= 10000.0:
+            current[key]["Over 10s"] += 1
+
+    t = stats.get("t", None)
+    if t is not None:
+        histogramUpdate(t, "T")
+        histogramAdd(current["T-HIST"], t)
+        histogramAdd(current["method-hist"][adjustedMethod], t)
+        histogramAdd(current["user-agent-hist"][_userAgentKey(current, stats)], t)
+    current["T-MAX"] = max(current["T-MAX"], t)
+    t = stats.get("t-resp-wr", None)
+    if t is not None:
+        histogramUpdate(t, "T-RESP-WR")
+        histogramAdd(current["T-RESP-WR-HIST"], t)
+
+
+def mergeRequestStats(current, stats):
+    """
+    Merge one set of request stats into another.
+
+    @param current: the stats to update
+    @type current: L{dict}
+    @param stats: the stats to merge in
+    @type stats: L{dict}
+    """
+    current["requests"] += stats["requests"]
+    for method in stats["method"].keys():
+        current["method"][method] += stats["method"][method]
+    for method in stats["method-t"].keys():
+        current["method-t"][method] += stats["method-t"][method]
+    current["500"] += stats["500"]
+    current["401"] += stats["401"]
+    current["t"] += stats["t"]
+    current["t-resp-wr"] += stats["t-resp-wr"]
+    current["slots"] += stats["slots"]
+
+    for bin in stats["T"].keys():
+        current["T"][bin] += stats["T"][bin]
+    current["T-MAX"] = max(current["T-MAX"], stats["T-MAX"])
+    for bin in stats["T-RESP-WR"].keys():
+        current["T-RESP-WR"][bin] += stats["T-RESP-WR"][bin]
+
+    histogramMerge(current["T-HIST"], stats.get("T-HIST", {}))
+    histogramMerge(current["T-RESP-WR-HIST"], stats.get("T-RESP-WR-HIST", {}))
+    for method, histogram in stats.get("method-hist", {}).items():
+        histogramMerge(current["method-hist"][method], histogram)
+    for agent, histogram in stats.get("user-agent-hist", {}).items():
+        if agent not in current["user-agent-hist"] and len(current["user-agent-hist"]) >= MAX_USER_AGENTS:
+            agent = "Other"
+        histogramMerge(current["user-agent-hist"][agent], histogram)
+
+
 class DirectoryLogWrapperResource(LogWrapperResource):
 
     def __init__(self, resource, directory):
@@ -383,6 +535,35 @@ class RotatingFileAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
         if stats["type"] == "access-log":
             self.accessLog(stats["log-format"] % stats)
 
+    def logStatsBatch(self, lines, stats):
+        """
+        Write a batch of pre-formatted access log lines and merge the stats
+        aggregated by a worker since its previous batch.
+
+        @param lines: access log lines
+        @type lines: L{list} of L{str}
+        @param stats: request stats as built by L{updateRequestStats}
+        @type stats: L{dict}
+        """
+
+        # Only use the L{SystemMonitor} when stats socket is in use
+        if config.Stats.EnableUnixStatsSocket or config.Stats.EnableTCPStatsSocket:
+
+            # Initialize a L{SystemMonitor} on the first call
+            if self.systemStats is None:
+                self.systemStats = SystemMonitor()
+
+            if stats and stats["requests"]:
+                currentStats = self.ensureSequentialStats()
+                if currentStats["requests"] == 0:
+                    currentStats["cpu"] = 0.0
+                mergeRequestStats(currentStats, stats)
+                currentStats["max-slots"] = max(currentStats["max-slots"], self.limiter.maxOutstandingRequests if hasattr(self, "limiter") else 0)
+                currentStats["cpu"] += self.systemStats.items["cpu use"] * stats["requests"]
+
+        for line in lines:
+            self.accessLog(line)
+
     def getStats(self):
         """
         Return the stats
@@ -468,126 +649,27 @@ class RotatingFileAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
         return self.statsByMinute[-1][1]
 
     def initStats(self):
-
-        def initTimeHistogram():
-            return {
-                "<10ms": 0,
-                "10ms<->100ms": 0,
-                "100ms<->1s": 0,
-                "1s<->10s": 0,
-                "10s<->30s": 0,
-                "30s<->60s": 0,
-                ">60s": 0,
-                "Over 1s": 0,
-                "Over 10s": 0,
-            }
-
-        return {
-            "requests": 0,
-            "method": collections.defaultdict(int),
-            "method-t": collections.defaultdict(float),
-            "500": 0,
-            "401": 0,
-            "t": 0.0,
-            "t-resp-wr": 0.0,
-            "slots": 0,
-            "max-slots": 0,
-            "T": initTimeHistogram(),
-            "T-RESP-WR": initTimeHistogram(),
-            "T-MAX": 0.0,
-            "cpu": self.systemStats.items["cpu use"],
-        }
+        stats = initRequestStats()
+        stats["max-slots"] = 0
+        stats["cpu"] = self.systemStats.items["cpu use"]
+        return stats
 
     def updateStats(self, current, stats):
         # Gather specific information and aggregate into our persistent stats
-        adjustedMethod = getAdjustedMethodName(stats)
-
         if current["requests"] == 0:
             current["cpu"] = 0.0
-        current["requests"] += 1
-        current["method"][adjustedMethod] += 1
-        current["method-t"][adjustedMethod] += stats.get("t", 0.0)
-        if stats["statusCode"] >= 500:
-            current["500"] += 1
-        elif stats["statusCode"] == 401:
-            current["401"] += 1
-        current["t"] += stats.get("t", 0.0)
-        current["t-resp-wr"] += stats.get("t-resp-wr", 0.0)
-        current["slots"] += stats.get("outstandingRequests", 0)
+        updateRequestStats(current, stats)
         current["max-slots"] = max(current["max-slots"], self.limiter.maxOutstandingRequests if hasattr(self, "limiter") else 0)
         current["cpu"] += self.systemStats.items["cpu use"]
 
-        def histogramUpdate(t, key):
-            if t >= 60000.0:
-                current[key][">60s"] += 1
-            elif t >= 30000.0:
-                current[key]["30s<->60s"] += 1
-            elif t >= 10000.0:
-                current[key]["10s<->30s"] += 1
-            elif t >= 1000.0:
-                current[key]["1s<->10s"] += 1
-            elif t >= 100.0:
-                current[key]["100ms<->1s"] += 1
-            elif t >= 10.0:
-                current[key]["10ms<->100ms"] += 1
-            else:
-                current[key]["<10ms"] += 1
-            if t >= 1000.0:
-                current[key]["Over 1s"] += 1
-            elif t >= 10000.0:
-                current[key]["Over 10s"] += 1
-
-        t = stats.get("t", None)
-        if t is not None:
-            histogramUpdate(t, "T")
-        current["T-MAX"] = max(current["T-MAX"], t)
-        t = stats.get("t-resp-wr", None)
-        if t is not None:
-            histogramUpdate(t, "T-RESP-WR")
-
     def mergeStats(self, current, stats):
         # Gather specific information and aggregate into our persistent stats
         if current["requests"] == 0:
             current["cpu"] = 0.0
-        current["requests"] += stats["requests"]
-        for method in stats["method"].keys():
-            current["method"][method] += stats["method"][method]
-        for method in stats["method-t"].keys():
-            current["method-t"][method] += stats["method-t"][method]
-        current["500"] += stats["500"]
-        current["401"] += stats["401"]
-        current["t"] += stats["t"]
-        current["t-resp-wr"] += stats["t-resp-wr"]
-        current["slots"] += stats["slots"]
+        mergeRequestStats(current, stats)
         current["max-slots"] = max(current["max-slots"], stats["max-slots"])
         current["cpu"] += stats["cpu"]
 
-        def histogramUpdate(t, key):
-            if t >= 60000.0:
-                current[key][">60s"] += 1
-            elif t >= 30000.0:
-                current[key]["30s<->60s"] += 1
-            elif t >= 10000.0:
-                current[key]["10s<->30s"] += 1
-            elif t >= 1000.0:
-                current[key]["1s<->10s"] += 1
-            elif t >= 100.0:
-                current[key]["100ms<->1s"] += 1
-            elif t >= 10.0:
-                current[key]["10ms<->100ms"] += 1
-            else:
-                current[key]["<10ms"] += 1
-            if t >= 1000.0:
-                current[key]["Over 1s"] += 1
-            elif t >= 10000.0:
-                current[key]["Over 10s"] += 1
-
-        for bin in stats["T"].keys():
-            current["T"][bin] += stats["T"][bin]
-        current["T-MAX"] = max(current["T-MAX"], stats["T-MAX"])
-        for bin in stats["T-RESP-WR"].keys():
-            current["T-RESP-WR"][bin] += stats["T-RESP-WR"][bin]
-
 
 class SystemMonitor(object):
     """
@@ -644,16 +726,51 @@ class LogStats(amp.Command):
     arguments = [("message", amp.String())]
 
 
+class LogStatsBatch(amp.Command):
+    """
+    A batch of access log lines, with the request stats aggregated by the
+    worker for those requests (JSON encoded).
+    """
+    arguments = [
+        ("lines", amp.ListOf(amp.String())),
+        ("stats", amp.String()),
+    ]
+
+
 class AMPCommonAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
+    """
+    Worker side access log observer that forwards to the master. When
+    C{config.Stats.BatchIntervalMS} is non-zero, log lines are formatted and
+    stats aggregated here, and sent to the master in one batch per interval,
+    rather than one AMP message per request.
+    """
 
-    def __init__(self):
+    # Send a batch early if it gets this big, so it stays well within the
+    # AMP value size limit
+    maxBatchRequests = 200
+    maxBatchBytes = 32 * 1024
+
+    def __init__(self, reactor=None):
         self.protocol = None
         self._buffer = []
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self._resetBatch()
+
+    def _resetBatch(self):
+        self._batchLines = []
+        self._batchBytes = 0
+        self._batchStats = initRequestStats()
+        self._batchCall = None
 
     def flushBuffer(self):
         if self._buffer:
-            for msg in self._buffer:
+            buffered = self._buffer
+            self._buffer = []
+            for msg in buffered:
                 self.logStats(msg)
+        self.flushBatch()
 
     def addClient(self, connectedClient):
         """
@@ -662,12 +779,19 @@ class AMPCommonAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
         self.protocol = connectedClient
         self.flushBuffer()
 
+    def stop(self):
+        self.flushBatch()
+        super(AMPCommonAccessLoggingObserver, self).stop()
+
     def logStats(self, message):
         """
         Log server stats via the remote AMP Protocol
         """
 
         if self.protocol is not None:
+            if config.Stats.BatchIntervalMS and message.get("type") == "access-log":
+                self.batchStats(message)
+                return
             message = json.dumps(message)
             if isinstance(message, unicode):
                 message = message.encode("utf-8")
@@ -676,6 +800,45 @@ class AMPCommonAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
         else:
             self._buffer.append(message)
 
+    def batchStats(self, message):
+        """
+        Add one request to the current batch, scheduling the batch to be sent
+        if this is the first request in it.
+
+        @param message: the access log details of the request
+        @type message: L{dict}
+        """
+        line = message["log-format"] % message
+        if isinstance(line, unicode):
+            line = line.encode("utf-8")
+        self._batchLines.append(line)
+        self._batchBytes += len(line)
+        updateRequestStats(self._batchStats, message)
+
+        if len(self._batchLines) >= self.maxBatchRequests or self._batchBytes >= self.maxBatchBytes:
+            self.flushBatch()
+        elif self._batchCall is None:
+            self._batchCall = self._reactor.callLater(
+                config.Stats.BatchIntervalMS / 1000.0, self.flushBatch
+            )
+
+    def flushBatch(self):
+        """
+        Send the current batch to the master.
+        """
+        if self._batchCall is not None and self._batchCall.active():
+            self._batchCall.cancel()
+        lines = self._batchLines
+        stats = self._batchStats
+        self._resetBatch()
+        if not lines or self.protocol is None:
+            return
+
+        d = self.protocol.callRemote(
+            LogStatsBatch, lines=lines, stats=json.dumps(stats)
+        )
+        d.addErrback(log.error)
+
 
 class AMPLoggingProtocol(amp.AMP):
     """
@@ -694,6 +857,12 @@ class AMPLoggingProtocol(amp.AMP):
 
     LogStats.responder(logStats)
 
+    def logStatsBatch(self, lines, stats):
+        self.observer.logStatsBatch(lines, json.loads(stats))
+        return {}
+
+    LogStatsBatch.responder(logStatsBatch)
+
 
 class AMPLoggingFactory(protocol.ServerFactory):
 
@@ -24,6 +24,9 @@ from twisted.protocols.basic import LineReceiver
 
 from twistedcaldav.config import config
 
+from calendarserver.profiling import ProfilerService
+from calendarserver.sqlstats import SQLStatsService, mergeSQLStats
+
 from txdav.common.datastore.work.load_work import TestWork
 from txdav.dps.client import DirectoryService as DirectoryProxyClientService
 from txdav.who.cache import CachingDirectoryService
@@ -48,6 +51,10 @@ class DashboardProtocol (LineReceiver):
     unknown_cmd = json.dumps({"result": "unknown command"})
     bad_cmd = json.dumps({"result": "bad command"})
 
+    # Longest on-demand profile capture allowed. The response to the whole
+    # request is held until the capture is done, so keep this short.
+    maxProfileSeconds = 30.0
+
     def lineReceived(self, line):
         """
         Process a request which is expected to be a JSON object.
@@ -81,6 +88,13 @@ class DashboardProtocol (LineReceiver):
             elif data.startswith("stats_"):
                 result = yield self.data_stats()
                 result = result.get(data[6:], "")
+            elif data.startswith("profile_"):
+                try:
+                    seconds = min(self.maxProfileSeconds, float(data[8:]))
+                except ValueError:
+                    result = ""
+                else:
+                    result = yield self.data_profile(seconds)
             else:
                 result = ""
             results[data] = result
@@ -111,6 +125,15 @@ class DashboardProtocol (LineReceiver):
             results.append(result)
         return succeed({"slots": results, "overloaded": self.factory.limiter.overloaded if self.factory.limiter is not None else False})
 
+    def data_memory(self):
+        """
+        Return the memory use of each worker, as seen by the memory limiter.
+
+        @return: the JSON result.
+        @rtype: L{list}
+        """
+        return succeed(self.factory.memoryLimiter.stats() if self.factory.memoryLimiter is not None else [])
+
     def data_jobcount(self):
         """
         Return a count of job types.
@@ -180,6 +203,39 @@ class DashboardProtocol (LineReceiver):
 
         returnValue(results)
 
+    def data_profile(self, seconds=0):
+        """
+        Return the sampling profiler stacks of each worker in folded
+        flame-graph format. "profile" returns the continuously collected
+        samples, "profile_<seconds>" captures new samples for that long (at
+        most L{maxProfileSeconds}).
+
+        @param seconds: zero for the continuously collected samples, otherwise
+            the number of seconds to capture for
+        @type seconds: L{float}
+
+        @return: the JSON result, keyed by process id.
+        @rtype: L{dict}
+        """
+        return ProfilerService.collect(seconds)
+
+    @inlineCallbacks
+    def data_sql(self):
+        """
+        Return the SQL connection pool wait, statement and transaction hold
+        time statistics of each process, and of all of them combined.
+
+        @return: the JSON result, with the statistics of each process keyed
+            by process id in C{"processes"}, and the combined statistics in
+            C{"total"}.
+        @rtype: L{dict}
+        """
+        processes = yield SQLStatsService.collect()
+        returnValue({
+            "processes": processes,
+            "total": mergeSQLStats(processes.values()),
+        })
+
     def data_directory(self):
         """
         Return a summary of directory service calls.
@@ -203,6 +259,7 @@ class DashboardServer(Factory):
         self.logger.limiter = self.limiter
         self.store = None
         self.directory = None
+        self.memoryLimiter = None
 
     def makeDirectoryProxyClient(self):
         if config.DirectoryProxy.Enabled:
@@ -0,0 +1,183 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Mergeable latency histograms.
+
+Values (typically times in milliseconds) are counted in logarithmically sized
+buckets so that any percentile can be recovered with a bounded relative
+error, independent of how the values are distributed. Because a histogram is
+just a count per bucket, histograms from different workers, minutes or
+servers can be combined by adding the counts, which is not possible with
+pre-computed averages or percentiles.
+
+A histogram is stored as a plain C{dict} mapping a bucket key (a C{str}) to a
+count, so it can be sent over AMP or the stats socket as JSON as-is, and
+summed by generic tools such as the dashboard aggregator.
+"""
+
+__all__ = [
+    "histogramAdd",
+    "histogramMerge",
+    "histogramCount",
+    "histogramPercentile",
+    "histogramPercentiles",
+    "DEFAULT_PERCENTILES",
+]
+
+import math
+
+# Maximum relative error of a reported percentile
+RELATIVE_ACCURACY = 0.01
+
+# Values at or below this are all counted in the zero bucket
+MIN_VALUE = 0.01
+
+_GAMMA = (1.0 + RELATIVE_ACCURACY) / (1.0 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+_ZERO_KEY = "z"
+
+DEFAULT_PERCENTILES = (50.0, 95.0, 99.0, 99.9,)
+
+
+def bucketKey(value):
+    """
+    Return the histogram bucket key for a value.
+
+    @param value: the value to bucket
+    @type value: L{float}
+
+    @return: the bucket key
+    @rtype: L{str}
+    """
+    if value <= MIN_VALUE:
+        return _ZERO_KEY
+    return str(int(math.ceil(math.log(value) / _LOG_GAMMA)))
+
+
+def bucketValue(key):
+    """
+    Return the representative value for a histogram bucket key. This is within
+    L{RELATIVE_ACCURACY} of every value counted in the bucket.
+
+    @param key: the bucket key
+    @type key: L{str}
+
+    @return: the value
+    @rtype: L{float}
+    """
+    if key == _ZERO_KEY:
+        return 0.0
+    return 2.0 * (_GAMMA ** int(key)) / (_GAMMA + 1.0)
+
+
+def histogramAdd(histogram, value, count=1):
+    """
+    Count a value in a histogram.
+
+    @param histogram: the histogram to update
+    @type histogram: L{dict}
+    @param value: the value to add, C{None} is ignored
+    @type value: L{float}
+    @param count: number of times to count the value
+    @type count: L{int}
+    """
+    if value is None:
+        return
+    key = bucketKey(value)
+    histogram[key] = histogram.get(key, 0) + count
+
+
+def histogramMerge(histogram, other):
+    """
+    Add the counts of one histogram into another.
+
+    @param histogram: the histogram to update
+    @type histogram: L{dict}
+    @param other: the histogram to merge in
+    @type other: L{dict}
+    """
+    for key, count in other.items():
+        histogram[key] = histogram.get(key, 0) + count
+
+
+def histogramCount(histogram):
+    """
+    Return the number of values counted in a histogram.
+
+    @param histogram: the histogram
+    @type histogram: L{dict}
+
+    @rtype: L{int}
+    """
+    return sum(histogram.values())
+
+
+def _sortedBuckets(histogram):
+    """
+    Return the non-empty buckets of a histogram as (value, count) pairs in
+    increasing value order.
+    """
+    return sorted(
+        [(bucketValue(key), count) for key, count in histogram.items() if count],
+    )
+
+
+def histogramPercentile(histogram, percentile):
+    """
+    Return the value at a percentile of a histogram.
+
+    @param histogram: the histogram
+    @type histogram: L{dict}
+    @param percentile: the percentile, in the range 0 - 100
+    @type percentile: L{float}
+
+    @return: the value, or C{0.0} for an empty histogram
+    @rtype: L{float}
+    """
+    return histogramPercentiles(histogram, (percentile,))[0]
+
+
+def histogramPercentiles(histogram, percentiles=DEFAULT_PERCENTILES):
+    """
+    Return the values at several percentiles of a histogram, sorting the
+    buckets only once.
+
+    @param histogram: the histogram
+    @type histogram: L{dict}
+    @param percentiles: the percentiles, each in the range 0 - 100
+    @type percentiles: L{tuple} of L{float}
+
+    @return: the values, in the same order as C{percentiles}, C{0.0} for an
+        empty histogram
+    @rtype: L{list} of L{float}
+    """
+    buckets = _sortedBuckets(histogram)
+    total = sum([count for _ignore_value, count in buckets])
+    if total == 0:
+        return [0.0] * len(percentiles)
+
+    results = []
+    for percentile in percentiles:
+        # Rank of the value we want (1-based), clamped to the valid range
+        rank = max(1, min(total, int(math.ceil(total * percentile / 100.0))))
+        seen = 0
+        for value, count in buckets:
+            seen += count
+            if seen >= rank:
+                results.append(value)
+                break
+    return results
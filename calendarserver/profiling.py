@@ -14,9 +14,31 @@
 # limitations under the License.
 ##
 
-from twisted.internet.defer import inlineCallbacks, returnValue
+"""
+Profiling tools: cProfile decorators for use during development, and an
+always-on sampling profiler for running servers.
+"""
+
 import cProfile as profile
+import os
 import pstats
+import sys
+import thread
+import threading
+import time
+import zlib
+
+from twext.python.log import Logger
+
+from twisted.internet.defer import DeferredList, inlineCallbacks, \
+    returnValue, succeed
+from twisted.internet.protocol import Factory
+from twisted.internet.task import deferLater
+from twisted.protocols import amp
+
+from twistedcaldav.config import config
+
+log = Logger()
 
 
 def profile_method():
@@ -58,3 +80,316 @@ def profile_inline_callback():
             returnValue(result)
         return inner
     return wrapper
+
+
+class SamplingProfiler(object):
+    """
+    A low overhead statistical profiler for a running process. A background
+    thread periodically samples the stack of the profiled thread (by default
+    the thread that started the profiler, i.e. the reactor thread) and counts
+    each distinct stack. Stacks are reported in the "folded" format used by
+    flame graph tools: one line per stack, with frames separated by C{;} from
+    outermost to innermost, followed by a space and the sample count.
+
+    The profiler always keeps the samples for the most recent one to two
+    L{window} periods. In addition, L{capture} collects a separate set of
+    samples for a specific time period.
+
+    @ivar interval: seconds between samples
+    @type interval: L{float}
+    @ivar window: seconds after which continuously collected samples are
+        rotated out
+    @type window: L{float}
+    """
+
+    # Deepest stack recorded - deeper stacks are truncated at the outermost
+    # end
+    maxDepth = 100
+
+    def __init__(self, interval=0.01, window=60.0, threadID=None):
+        self.interval = interval
+        self.window = window
+        self.threadID = threadID
+
+        self._lock = threading.Lock()
+        self._current = {}
+        self._previous = {}
+        self._rotated = 0
+        self._captures = []
+        self._frameNames = {}
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """
+        Start sampling.
+        """
+        if self._running:
+            return
+        if self.threadID is None:
+            self.threadID = thread.get_ident()
+        self._running = True
+        self._rotated = time.time()
+        self._thread = threading.Thread(target=self._run, name="SamplingProfiler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop sampling.
+        """
+        self._running = False
+        self._thread = None
+
+    def _run(self):
+        while self._running:
+            time.sleep(self.interval)
+            self.sample()
+
+    def _frameName(self, code):
+        """
+        Return a readable name for a code object, caching the result.
+        """
+        try:
+            return self._frameNames[code]
+        except KeyError:
+            filename = "/".join(code.co_filename.split(os.sep)[-2:])
+            name = "{}:{}:{}".format(filename, code.co_name, code.co_firstlineno)
+            self._frameNames[code] = name
+            return name
+
+    def sample(self):
+        """
+        Take one sample of the profiled thread's stack.
+        """
+        frame = sys._current_frames().get(self.threadID)
+        if frame is None:
+            return
+        names = []
+        while frame is not None and len(names) < self.maxDepth:
+            names.append(self._frameName(frame.f_code))
+            frame = frame.f_back
+        names.reverse()
+        stack = ";".join(names)
+        del frame
+
+        with self._lock:
+            now = time.time()
+            if now - self._rotated >= self.window:
+                self._previous = self._current
+                self._current = {}
+                self._rotated = now
+            self._current[stack] = self._current.get(stack, 0) + 1
+            for counts in self._captures:
+                counts[stack] = counts.get(stack, 0) + 1
+
+    def samples(self):
+        """
+        Return the continuously collected samples.
+
+        @return: mapping of folded stack to sample count
+        @rtype: L{dict}
+        """
+        with self._lock:
+            result = dict(self._previous)
+            for stack, count in self._current.items():
+                result[stack] = result.get(stack, 0) + count
+        return result
+
+    def capture(self, seconds, reactor=None):
+        """
+        Collect samples for a specific period of time.
+
+        @param seconds: how long to sample for
+        @type seconds: L{float}
+
+        @return: a L{Deferred} firing with a mapping of folded stack to sample
+            count
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        counts = {}
+        with self._lock:
+            self._captures.append(counts)
+
+        def _done():
+            with self._lock:
+                self._captures.remove(counts)
+            return counts
+        return deferLater(reactor, seconds, _done)
+
+
+def foldedStacks(counts, maxBytes=None):
+    """
+    Format samples as folded stacks, most frequent first.
+
+    @param counts: mapping of folded stack to sample count
+    @type counts: L{dict}
+    @param maxBytes: if not L{None}, drop the least frequent stacks so that the
+        zlib compressed result fits in this many bytes
+    @type maxBytes: L{int}
+
+    @rtype: L{str}
+    """
+    stacks = sorted(counts.items(), key=lambda x: x[1], reverse=True)
+    while True:
+        result = "\n".join(["{} {}".format(stack, count) for stack, count in stacks])
+        if maxBytes is None or len(stacks) <= 1 or len(zlib.compress(result)) <= maxBytes:
+            return result
+        stacks = stacks[:len(stacks) // 2]
+
+
+class ProfileSamples(amp.Command):
+    """
+    Sent by the master to a worker to get its profile samples. A C{seconds}
+    value of zero returns the continuously collected samples, otherwise a new
+    capture of that many seconds is done.
+    """
+    arguments = [
+        ("seconds", amp.Float()),
+    ]
+    response = [
+        ("pid", amp.Integer()),
+        ("stacks", amp.String()),
+    ]
+
+
+class AMPProfilerWorkerProtocol(amp.AMP):
+    """
+    Worker side protocol that answers L{ProfileSamples} from the master.
+    """
+
+    # Keep responses within the AMP value size limit
+    maxBytes = 60000
+
+    def __init__(self, profiler):
+        super(AMPProfilerWorkerProtocol, self).__init__()
+        self.profiler = profiler
+
+    @ProfileSamples.responder
+    def profileSamples(self, seconds):
+        if seconds > 0:
+            d = self.profiler.capture(seconds)
+        else:
+            d = succeed(self.profiler.samples())
+        d.addCallback(lambda counts: {
+            "pid": os.getpid(),
+            "stacks": zlib.compress(foldedStacks(counts, self.maxBytes)),
+        })
+        return d
+
+
+class AMPProfilerWorkerFactory(Factory):
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def buildProtocol(self, addr):
+        return AMPProfilerWorkerProtocol(self.profiler)
+
+
+class AMPProfilerMasterProtocol(amp.AMP):
+    """
+    Master side protocol for one worker connection.
+    """
+
+    def __init__(self, factory):
+        super(AMPProfilerMasterProtocol, self).__init__()
+        self.factory = factory
+
+    def connectionMade(self):
+        super(AMPProfilerMasterProtocol, self).connectionMade()
+        self.factory.workers.add(self)
+
+    def connectionLost(self, reason):
+        self.factory.workers.discard(self)
+        super(AMPProfilerMasterProtocol, self).connectionLost(reason)
+
+
+class AMPProfilerMasterFactory(Factory):
+
+    def __init__(self):
+        self.workers = set()
+
+    def buildProtocol(self, addr):
+        return AMPProfilerMasterProtocol(self)
+
+
+class ProfilerService(object):
+    """
+    Manages the L{SamplingProfiler} in each worker. The master calls
+    L{setupForMaster} and workers call L{setupForWorker}; a process that does
+    neither (e.g. a single process server) can call L{setupLocal}. The master
+    (or single process) then uses L{collect} to get the samples from every
+    process.
+    """
+
+    # Control socket message-routing constant
+    PROFILER_ROUTE = "profiler"
+
+    _profiler = None
+    _factory = None
+
+    @classmethod
+    def _startProfiler(cls):
+        if config.Profiling.Sampling.Enabled:
+            cls._profiler = SamplingProfiler(
+                interval=config.Profiling.Sampling.Interval,
+                window=config.Profiling.Sampling.WindowSeconds,
+            )
+            cls._profiler.start()
+        return cls._profiler
+
+    @classmethod
+    def setupForMaster(cls, controlSocket):
+        cls._factory = AMPProfilerMasterFactory()
+        controlSocket.addFactory(cls.PROFILER_ROUTE, cls._factory)
+
+    @classmethod
+    def setupForWorker(cls, controlSocket):
+        profiler = cls._startProfiler()
+        if profiler is not None:
+            controlSocket.addFactory(cls.PROFILER_ROUTE, AMPProfilerWorkerFactory(profiler))
+
+    @classmethod
+    def setupLocal(cls):
+        cls._startProfiler()
+
+    @classmethod
+    def reset(cls):
+        if cls._profiler is not None:
+            cls._profiler.stop()
+        cls._profiler = None
+        cls._factory = None
+
+    @classmethod
+    @inlineCallbacks
+    def collect(cls, seconds=0):
+        """
+        Get the profile samples of each process.
+
+        @param seconds: zero for the continuously collected samples, otherwise
+            the number of seconds to capture for
+        @type seconds: L{float}
+
+        @return: mapping of process id to folded stacks
+        @rtype: L{dict}
+        """
+        results = {}
+        if cls._factory is not None:
+            responses = yield DeferredList([
+                worker.callRemote(ProfileSamples, seconds=float(seconds))
+                for worker in tuple(cls._factory.workers)
+            ], consumeErrors=True)
+            for success, response in responses:
+                if success:
+                    results[str(response["pid"])] = zlib.decompress(response["stacks"])
+                else:
+                    log.error("Unable to get profile samples: {ex}", ex=response)
+        elif cls._profiler is not None:
+            if seconds > 0:
+                counts = yield cls._profiler.capture(seconds)
+            else:
+                counts = cls._profiler.samples()
+            results[str(os.getpid())] = foldedStacks(counts)
+        returnValue(results)
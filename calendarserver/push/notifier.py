@@ -145,6 +145,43 @@ class Notifier(object):
                     obj=self._storeObject, prefix=prefix, id=id,
                 )
 
+    @classmethod
+    @inlineCallbacks
+    def notifyMany(cls, notifiers, txn, priority=PushPriority.high):
+        """
+        Send the notifications for several store objects together. The push
+        ids of all the objects are collected first so that an id shared by
+        several of them (e.g. a common parent home) is only enqueued once.
+
+        @param notifiers: the notifiers to send
+        @type notifiers: iterable of L{Notifier}
+        @param txn: The transaction to create the work items with
+        @type txn: L{CommonStoreTransaction}
+        @param priority: the priority level
+        @type priority: L{PushPriority}
+        """
+        seen = set()
+        for notifier in notifiers:
+            if not notifier._notify:
+                cls.log.debug(
+                    "Skipping notification for: {obj}",
+                    obj=notifier._storeObject,
+                )
+                continue
+
+            ids = (notifier._storeObject.notifierID(),)
+            if hasattr(notifier._storeObject, "parentNotifierID"):
+                ids += (notifier._storeObject.parentNotifierID(),)
+
+            for prefix, id in ids:
+                key = (notifier._notifierFactory, prefix, id,)
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield notifier._notifierFactory.send(
+                    prefix, id, txn,
+                    priority=priority)
+
     def clone(self, storeObject):
         return self.__class__(self._notifierFactory, storeObject)
 
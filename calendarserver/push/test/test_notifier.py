@@ -18,6 +18,7 @@ from twistedcaldav.test.util import StoreTestCase
 from calendarserver.push.notifier import PushDistributor
 from calendarserver.push.notifier import getPubSubAPSConfiguration
 from calendarserver.push.notifier import PushNotificationWork
+from calendarserver.push.notifier import Notifier
 from twisted.internet.defer import inlineCallbacks, succeed
 from twistedcaldav.config import ConfigDict
 from txdav.common.datastore.test.util import populateCalendarsFrom
@@ -367,3 +368,22 @@ class NotifierFactory(StoreTestCase):
                 ("/CalDAV/example.com/user01/notification/", PushPriority.high)])
         )
         yield self.commit()
+
+    @inlineCallbacks
+    def test_notifyMany(self):
+
+        home = yield self.homeUnderTest(name="user01")
+        calendar = yield self.calendarUnderTest(home="user01")
+        notifiers = [
+            home.getNotifier("push"),
+            calendar.getNotifier("push"),
+            calendar.getNotifier("push"),
+        ]
+        yield Notifier.notifyMany(notifiers, self.transactionUnderTest(), priority=PushPriority.high)
+        self.assertEquals(
+            sorted(self.notifierFactory.history),
+            sorted([
+                ("/CalDAV/example.com/user01/", PushPriority.high),
+                ("/CalDAV/example.com/user01/calendar_1/", PushPriority.high)])
+        )
+        yield self.commit()
@@ -0,0 +1,544 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Latency statistics for the SQL transactions of a process, read via the stats
+socket.
+
+The transaction factory of a process's database connection pool is wrapped so
+that each transaction records:
+
+    - how long it waited for a connection from the pool,
+    - how long each statement took, by statement "shape" (the SQL with its
+      literals and parameter lists normalized),
+    - how long it held its connection (until its commit or abort finished).
+
+Times are counted in mergeable histograms (see L{calendarserver.histogram})
+covering the most recent one to two windows, so the stats of each worker can
+be combined. Transactions held for longer than a threshold are logged and
+reported along with their label, as are the transactions that are still open
+past that threshold.
+"""
+
+__all__ = [
+    "SQLStats",
+    "SQLStatsService",
+    "statementShape",
+    "mergeSQLStats",
+]
+
+from collections import deque
+import json
+import os
+import re
+import time
+import zlib
+
+from twext.python.log import Logger
+
+from twisted.internet.defer import DeferredList, inlineCallbacks, returnValue
+from twisted.internet.protocol import Factory
+from twisted.protocols import amp
+
+from twistedcaldav.config import config
+
+from calendarserver.histogram import histogramAdd, histogramMerge
+
+log = Logger()
+
+_COMMENTS = re.compile(r"--[^\n]*(\n|$)")
+_WHITESPACE = re.compile(r"\s+")
+_PARAMETERS = re.compile(r"%\(\w+\)s|%s|:\d+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+# Number of distinct statements whose shape is remembered
+_shapeCacheSize = 2000
+_shapeCache = {}
+
+
+def statementShape(sql):
+    """
+    Return the shape of an SQL statement: the statement with comments (such
+    as the transaction label) removed, whitespace collapsed, parameters and
+    literals replaced by C{?}, and lists of parameters replaced by C{(?...)},
+    so that statements which only differ in their values, or in the number
+    of values in an C{IN} list, have the same shape.
+
+    @param sql: the SQL statement
+    @type sql: L{str}
+
+    @rtype: L{str}
+    """
+    try:
+        return _shapeCache[sql]
+    except KeyError:
+        pass
+    shape = _COMMENTS.sub(" ", sql)
+    shape = _WHITESPACE.sub(" ", shape).strip()
+    shape = _PARAMETERS.sub("?", shape)
+    shape = _LITERALS.sub("?", shape)
+    shape = _LISTS.sub("(?...)", shape)
+    if len(_shapeCache) >= _shapeCacheSize:
+        _shapeCache.clear()
+    _shapeCache[sql] = shape
+    return shape
+
+
+def _newWindow():
+    return {
+        "transactions": 0,
+        "wait": {},
+        "hold": {},
+        "statements": {},
+    }
+
+
+def _mergeWindow(result, window):
+    """
+    Add the stats of one window (or report) into another.
+    """
+    result["transactions"] += window["transactions"]
+    histogramMerge(result["wait"], window["wait"])
+    histogramMerge(result["hold"], window["hold"])
+    for shape, stats in window["statements"].items():
+        current = result["statements"].setdefault(shape, {"count": 0, "time": 0.0, "histogram": {}})
+        current["count"] += stats["count"]
+        current["time"] += stats["time"]
+        histogramMerge(current["histogram"], stats["histogram"])
+
+
+def mergeSQLStats(reports):
+    """
+    Combine the reports of several processes.
+
+    @param reports: the reports returned by L{SQLStats.report}
+    @type reports: iterable of L{dict}
+
+    @return: the combined report
+    @rtype: L{dict}
+    """
+    result = _newWindow()
+    result.update({"long": [], "open": [], "pool": {"held": 0, "waiting": 0}})
+    for report in reports:
+        _mergeWindow(result, report)
+        result["long"].extend(report["long"])
+        result["open"].extend(report["open"])
+        result["pool"]["held"] += report["pool"]["held"]
+        result["pool"]["waiting"] += report["pool"]["waiting"]
+    result["long"].sort(key=lambda item: item["held"], reverse=True)
+    result["open"].sort(key=lambda item: item["held"], reverse=True)
+    return result
+
+
+class InstrumentedTransaction(object):
+    """
+    Wraps an L{IAsyncTransaction} to record its statements with an
+    L{SQLStats}. Everything other than L{execSQL}, L{commit} and L{abort} is
+    passed straight through; statements run through a C{commandBlock} are
+    only counted in the time the transaction is held.
+    """
+
+    def __init__(self, stats, txn, label):
+        self._stats = stats
+        self._txn = txn
+        self.label = label
+        self.created = stats.clock()
+        self.acquired = None
+        self.statementCount = 0
+        self.finished = False
+
+    def __getattr__(self, name):
+        return getattr(self._txn, name)
+
+    def __repr__(self):
+        return "<InstrumentedTransaction {!r} {!r}>".format(self.label, self._txn)
+
+    def execSQL(self, sql, *args, **kwargs):
+        """
+        Execute some SQL, recording how long it takes.
+        """
+        self.statementCount += 1
+        started = self._stats.clock()
+
+        def _done(result):
+            self._stats.statementDone(sql, self._stats.clock() - started)
+            return result
+        return self._txn.execSQL(sql, *args, **kwargs).addBoth(_done)
+
+    def _end(self, d):
+        def _done(result):
+            self._stats.transactionDone(self)
+            return result
+        return d.addBoth(_done)
+
+    def commit(self):
+        return self._end(self._txn.commit())
+
+    def abort(self):
+        return self._end(self._txn.abort())
+
+
+class SQLStats(object):
+    """
+    Collects the SQL latency statistics of a process.
+
+    The time a transaction waits for a pool connection is not visible from
+    outside the pool, so it is derived from the pool's occupancy: the pool
+    gives each transaction a connection when it is created, and when all
+    C{maxConnections} are held, transactions wait in turn for a connection
+    to be released by one that finishes.
+
+    @ivar maxConnections: the size of the connection pool, or C{None} if the
+        pool is shared with other processes, in which case wait times are not
+        recorded
+    @type maxConnections: L{int}
+    @ivar window: seconds after which statistics are rotated out
+    @type window: L{float}
+    @ivar longSeconds: transactions held for longer than this are reported
+    @type longSeconds: L{float}
+    @ivar maxShapes: the number of distinct statement shapes recorded in a
+        window, any more are counted as C{"other"}
+    @type maxShapes: L{int}
+    """
+
+    # Number of long-held transactions remembered
+    maxLong = 20
+
+    def __init__(self, maxConnections=None, window=60.0, longSeconds=10.0, maxShapes=200, clock=time.time):
+        self.maxConnections = maxConnections
+        self.window = window
+        self.longSeconds = longSeconds
+        self.maxShapes = maxShapes
+        self.clock = clock
+
+        self._current = _newWindow()
+        self._previous = _newWindow()
+        self._rotated = self.clock()
+        self._open = set()
+        self._held = 0
+        self._waiting = deque()
+        self._long = deque(maxlen=self.maxLong)
+
+    def wrap(self, txnFactory):
+        """
+        Wrap a transaction factory so that its transactions are recorded.
+
+        @param txnFactory: the transaction factory
+        @type txnFactory: callable taking a C{label} keyword argument
+
+        @return: the wrapped factory
+        """
+        def _newTransaction(label="<unlabeled>"):
+            return self.transactionStarted(InstrumentedTransaction(self, txnFactory(label=label), label))
+        return _newTransaction
+
+    def _window(self):
+        """
+        The current window, rotating the windows if it is time to.
+        """
+        now = self.clock()
+        if now - self._rotated >= self.window:
+            self._previous = self._current
+            self._current = _newWindow()
+            self._rotated = now
+        return self._current
+
+    def _acquire(self, txn):
+        self._held += 1
+        txn.acquired = self.clock()
+        if self.maxConnections is not None:
+            histogramAdd(self._window()["wait"], (txn.acquired - txn.created) * 1000.0)
+
+    def transactionStarted(self, txn):
+        """
+        Record a new transaction.
+
+        @param txn: the transaction
+        @type txn: L{InstrumentedTransaction}
+
+        @return: C{txn}
+        """
+        self._open.add(txn)
+        if self.maxConnections is None or self._held < self.maxConnections:
+            self._acquire(txn)
+        else:
+            self._waiting.append(txn)
+        return txn
+
+    def transactionDone(self, txn):
+        """
+        Record the end of a transaction's commit or abort, and hand its
+        connection to the next waiting transaction.
+
+        @param txn: the transaction
+        @type txn: L{InstrumentedTransaction}
+        """
+        if txn.finished:
+            return
+        txn.finished = True
+        self._open.discard(txn)
+        window = self._window()
+        window["transactions"] += 1
+        if txn.acquired is None:
+            # Finished without ever getting a connection
+            self._waiting.remove(txn)
+            return
+
+        self._held -= 1
+        held = self.clock() - txn.acquired
+        histogramAdd(window["hold"], held * 1000.0)
+        if held > self.longSeconds:
+            log.warn(
+                "SQL transaction held for {held:.1f} seconds: {label} ({count} statements)",
+                held=held, label=txn.label, count=txn.statementCount,
+            )
+            self._long.append({
+                "label": txn.label,
+                "held": held,
+                "statements": txn.statementCount,
+                "ended": self.clock(),
+            })
+
+        while self._waiting and (self.maxConnections is None or self._held < self.maxConnections):
+            self._acquire(self._waiting.popleft())
+
+    def statementDone(self, sql, seconds):
+        """
+        Record the time a statement took.
+
+        @param sql: the SQL statement
+        @type sql: L{str}
+        @param seconds: how long it took
+        @type seconds: L{float}
+        """
+        statements = self._window()["statements"]
+        shape = statementShape(sql)
+        if shape not in statements and len(statements) >= self.maxShapes:
+            shape = "other"
+        stats = statements.get(shape)
+        if stats is None:
+            stats = statements[shape] = {"count": 0, "time": 0.0, "histogram": {}}
+        stats["count"] += 1
+        stats["time"] += seconds * 1000.0
+        histogramAdd(stats["histogram"], seconds * 1000.0)
+
+    def report(self, maxShapes=None):
+        """
+        Return the statistics of the most recent one to two windows. Times
+        are in milliseconds, except for the long-held and open transactions
+        which are in seconds.
+
+        @param maxShapes: only report this many statement shapes, those with
+            the most total time, or C{None} for all
+        @type maxShapes: L{int}
+
+        @return: the statistics, with keys C{"transactions"}, C{"wait"} and
+            C{"hold"} (histograms), C{"statements"} (mapping of statement
+            shape to count, total time and histogram), C{"long"} (the most
+            recent long-held transactions), C{"open"} (transactions that are
+            still open and held for longer than C{longSeconds}) and
+            C{"pool"} (the number of connections held and transactions
+            waiting)
+        @rtype: L{dict}
+        """
+        self._window()
+        result = _newWindow()
+        _mergeWindow(result, self._previous)
+        _mergeWindow(result, self._current)
+        if maxShapes is not None and len(result["statements"]) > maxShapes:
+            shapes = sorted(result["statements"].items(), key=lambda item: item[1]["time"], reverse=True)
+            result["statements"] = dict(shapes[:maxShapes])
+
+        now = self.clock()
+        result["long"] = list(self._long)
+        result["open"] = sorted([
+            {
+                "label": txn.label,
+                "held": now - txn.acquired,
+                "statements": txn.statementCount,
+            }
+            for txn in self._open
+            if txn.acquired is not None and now - txn.acquired > self.longSeconds
+        ], key=lambda item: item["held"], reverse=True)
+        result["pool"] = {
+            "max": self.maxConnections,
+            "held": self._held,
+            "waiting": len(self._waiting),
+        }
+        return result
+
+
+def _compressedReport(stats, maxBytes):
+    """
+    Return a process's report as compressed JSON, dropping the statement
+    shapes with the least total time until it fits in C{maxBytes}.
+    """
+    maxShapes = None
+    while True:
+        report = stats.report(maxShapes)
+        result = zlib.compress(json.dumps(report))
+        if len(result) <= maxBytes or not report["statements"]:
+            return result
+        maxShapes = len(report["statements"]) // 2
+
+
+class SQLPoolStats(amp.Command):
+    """
+    Sent by the master to a worker to get its SQL statistics.
+    """
+    arguments = []
+    response = [
+        ("pid", amp.Integer()),
+        ("stats", amp.String()),
+    ]
+
+
+class AMPSQLStatsWorkerProtocol(amp.AMP):
+    """
+    Worker side protocol that answers L{SQLPoolStats} from the master.
+    """
+
+    # Keep responses within the AMP value size limit
+    maxBytes = 60000
+
+    def __init__(self, stats):
+        super(AMPSQLStatsWorkerProtocol, self).__init__()
+        self.stats = stats
+
+    @SQLPoolStats.responder
+    def sqlPoolStats(self):
+        return {
+            "pid": os.getpid(),
+            "stats": _compressedReport(self.stats, self.maxBytes),
+        }
+
+
+class AMPSQLStatsWorkerFactory(Factory):
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def buildProtocol(self, addr):
+        return AMPSQLStatsWorkerProtocol(self.stats)
+
+
+class AMPSQLStatsMasterProtocol(amp.AMP):
+    """
+    Master side protocol for one worker connection.
+    """
+
+    def __init__(self, factory):
+        super(AMPSQLStatsMasterProtocol, self).__init__()
+        self.factory = factory
+
+    def connectionMade(self):
+        super(AMPSQLStatsMasterProtocol, self).connectionMade()
+        self.factory.workers.add(self)
+
+    def connectionLost(self, reason):
+        self.factory.workers.discard(self)
+        super(AMPSQLStatsMasterProtocol, self).connectionLost(reason)
+
+
+class AMPSQLStatsMasterFactory(Factory):
+
+    def __init__(self):
+        self.workers = set()
+
+    def buildProtocol(self, addr):
+        return AMPSQLStatsMasterProtocol(self)
+
+
+class SQLStatsService(object):
+    """
+    Manages the L{SQLStats} of each process. Any process with a database
+    connection pool uses L{instrument} to wrap the pool's transaction
+    factory. The master calls L{setupForMaster} and workers call
+    L{setupForWorker}; the master (or single process) then uses L{collect} to
+    get the statistics of every process.
+    """
+
+    # Control socket message-routing constant
+    SQLSTATS_ROUTE = "sqlstats"
+
+    _stats = None
+    _factory = None
+
+    @classmethod
+    def instrument(cls, txnFactory, maxConnections=None):
+        """
+        Wrap a transaction factory to record the SQL statistics of this
+        process, if enabled.
+
+        @param txnFactory: the transaction factory
+        @type txnFactory: callable taking a C{label} keyword argument
+        @param maxConnections: the size of the connection pool, or C{None} if
+            the pool is shared with other processes
+        @type maxConnections: L{int}
+
+        @return: the transaction factory to use
+        """
+        if txnFactory is None or not config.SQLStats.Enabled:
+            return txnFactory
+        if cls._stats is None:
+            cls._stats = SQLStats(
+                maxConnections=maxConnections,
+                window=config.SQLStats.WindowSeconds,
+                longSeconds=config.SQLStats.LongTransactionSeconds,
+                maxShapes=config.SQLStats.MaxStatementShapes,
+            )
+        return cls._stats.wrap(txnFactory)
+
+    @classmethod
+    def setupForMaster(cls, controlSocket):
+        cls._factory = AMPSQLStatsMasterFactory()
+        controlSocket.addFactory(cls.SQLSTATS_ROUTE, cls._factory)
+
+    @classmethod
+    def setupForWorker(cls, controlSocket):
+        if cls._stats is not None:
+            controlSocket.addFactory(cls.SQLSTATS_ROUTE, AMPSQLStatsWorkerFactory(cls._stats))
+
+    @classmethod
+    def reset(cls):
+        cls._stats = None
+        cls._factory = None
+
+    @classmethod
+    @inlineCallbacks
+    def collect(cls):
+        """
+        Get the SQL statistics of each process.
+
+        @return: mapping of process id to the process's report (see
+            L{SQLStats.report})
+        @rtype: L{dict}
+        """
+        results = {}
+        if cls._stats is not None:
+            results[str(os.getpid())] = cls._stats.report()
+        if cls._factory is not None:
+            responses = yield DeferredList([
+                worker.callRemote(SQLPoolStats)
+                for worker in tuple(cls._factory.workers)
+            ], consumeErrors=True)
+            for success, response in responses:
+                if success:
+                    results[str(response["pid"])] = json.loads(zlib.decompress(response["stats"]))
+                else:
+                    log.error("Unable to get SQL statistics: {ex}", ex=response)
+        returnValue(results)
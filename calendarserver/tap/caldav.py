@@ -79,7 +79,8 @@ from calendarserver.tools.util import checkDirectory
 from txweb2.channel.http import (
     LimitingHTTPFactory, SSLRedirectRequest, HTTPChannel
 )
-from txweb2.metafd import ConnectionLimiter, ReportingHTTPService
+from txweb2.metafd import ConnectionLimiter, ReportingHTTPService, \
+    AffinityDispatchPolicy
 from txweb2.server import Site
 
 from txdav.base.datastore.dbapiclient import DBAPIConnector
@@ -111,6 +112,8 @@ from calendarserver.accesslog import RotatingFileAccessLoggingObserver
 from calendarserver.controlsocket import ControlSocket
 from calendarserver.controlsocket import ControlSocketConnectingService
 from calendarserver.dashboard_service import DashboardServer
+from calendarserver.profiling import ProfilerService
+from calendarserver.sqlstats import SQLStatsService
 from calendarserver.push.amppush import AMPPushMaster, AMPPushForwarder
 from calendarserver.push.applepush import ApplePushNotifierService, APNPurgingWork
 from calendarserver.push.notifier import PushDistributor
@@ -982,6 +985,12 @@ class CalDAVServiceMaker (object):
         # Allow worker to post alerts to master
         AlertPoster.setupForWorker(controlSocketClient)
 
+        # Sample stacks for the master to report via the stats socket
+        ProfilerService.setupForWorker(controlSocketClient)
+
+        # SQL statistics for the master to report via the stats socket
+        SQLStatsService.setupForWorker(controlSocketClient)
+
         def decorateTransaction(txn):
             txn._pushDistributor = pushDistributor
             txn._rootResource = result.rootResource
@@ -1392,6 +1401,8 @@ class CalDAVServiceMaker (object):
             # Start listening on the stats socket, for administrators to inspect
             # the current stats on the server.
             stats = None
+            if config.Stats.EnableUnixStatsSocket or config.Stats.EnableTCPStatsSocket:
+                ProfilerService.setupLocal()
             if config.Stats.EnableUnixStatsSocket:
                 stats = DashboardServer(logObserver, None)
                 stats.store = store
@@ -1576,7 +1587,14 @@ class CalDAVServiceMaker (object):
                 )
                 cp.setName("db")
                 cp.setServiceParent(ms)
-                store = storeFromConfigWithoutDPS(config, cp.connection)
+                store = storeFromConfigWithoutDPS(
+                    config,
+                    SQLStatsService.instrument(
+                        cp.connection,
+                        # A shared pool is also used by the workers
+                        maxConnections=None if config.SharedConnectionPool else config.MaxDBConnectionsPerPool,
+                    )
+                )
 
                 pps = PreProcessingService(
                     createMainService, cp, store, logObserver, storageService
@@ -1751,6 +1769,12 @@ class CalDAVServiceMaker (object):
         # Allow master to receive alert posts from workers
         AlertPoster.setupForMaster(controlSocket)
 
+        # Allow master to collect profile samples from workers
+        ProfilerService.setupForMaster(controlSocket)
+
+        # Allow master to collect SQL statistics from workers
+        SQLStatsService.setupForMaster(controlSocket)
+
         # Optionally set up AMPPushMaster
         if (
             config.Notifications.Enabled and
@@ -1786,10 +1810,14 @@ class CalDAVServiceMaker (object):
                 monitor.signalAll(signalNum, startswithname="caldav")
         signal.signal(signal.SIGUSR1, forwardSignalToWorkers)
 
+        memoryLimiter = None
         if config.MemoryLimiter.Enabled:
             memoryLimiter = MemoryLimitService(
                 monitor, config.MemoryLimiter.Seconds,
-                config.MemoryLimiter.Bytes, config.MemoryLimiter.ResidentOnly
+                config.MemoryLimiter.Bytes, config.MemoryLimiter.ResidentOnly,
+                softLimitBytes=config.MemoryLimiter.SoftBytes or None,
+                drainSeconds=config.MemoryLimiter.DrainSeconds,
+                maxConcurrentRecycles=config.MemoryLimiter.MaxConcurrentRecycles,
             )
             memoryLimiter.setName("ml")
             memoryLimiter.setServiceParent(s)
@@ -1802,9 +1830,16 @@ class CalDAVServiceMaker (object):
         inheritSSLFDs = []
 
         if config.UseMetaFD:
+            if config.ConnectionAffinity.Enabled:
+                dispatchPolicy = AffinityDispatchPolicy(
+                    loadFactor=config.ConnectionAffinity.LoadFactor
+                )
+            else:
+                dispatchPolicy = None
             cl = ConnectionLimiter(config.MaxAccepts,
                                    (config.MaxRequests *
-                                    config.MultiProcess.ProcessCount))
+                                    config.MultiProcess.ProcessCount),
+                                   dispatchPolicy=dispatchPolicy)
             dispatcher = cl.dispatcher
         else:
             # keep a reference to these so they don't close
@@ -1878,6 +1913,9 @@ class CalDAVServiceMaker (object):
             statsService.setName("tcp-stats")
             statsService.setServiceParent(s)
 
+        if stats is not None:
+            stats.memoryLimiter = memoryLimiter
+
         # Finally, let's get the real show on the road.  Create a service that
         # will spawn all of our worker processes when started, and wrap that
         # service in zero to two necessary layers before it's started: first,
@@ -2101,6 +2139,31 @@ class TwistdSlaveProcess(object):
         if self.metaSocket is not None:
             self.metaSocket.stop()
 
+    def draining(self):
+        """
+        Called when the process is to be recycled. The socket is marked as
+        "draining" which means it is not active and won't be dispatched to,
+        but the process carries on with the connections it already has.
+
+        @return: C{True} if the process can be drained, C{False} if it has no
+            metafd socket and should just be stopped
+        @rtype: C{bool}
+        """
+        if self.metaSocket is not None:
+            self.metaSocket.status.drain()
+            return True
+        return False
+
+    def outstandingConnections(self):
+        """
+        @return: the number of connections dispatched to the process that it
+            has not finished with yet
+        @rtype: C{int}
+        """
+        if self.metaSocket is not None:
+            return self.metaSocket.status.effective()
+        return 0
+
     def getName(self):
         return "{}-{}".format(self.prefix, self.id)
 
@@ -2288,6 +2351,12 @@ class DelayedStartupProcessMonitor(Service, object):
             def stopped(self):
                 pass
 
+            def draining(self):
+                return False
+
+            def outstandingConnections(self):
+                return 0
+
             def getName(self):
                 return name
 
@@ -2374,6 +2443,35 @@ class DelayedStartupProcessMonitor(Service, object):
                     self.killTime, self._forceStopProcess, proc
                 )
 
+    def drainProcess(self, name):
+        """
+        Stop dispatching new connections to a process, so that it can be
+        stopped once it has finished with the connections it already has.
+
+        @param name: The name of the process to be drained
+
+        @return: C{True} if the process is draining, C{False} if it cannot be
+            drained
+        @rtype: C{bool}
+        """
+        if name not in self.processes:
+            raise KeyError("Unrecognized process name: {}".format(name))
+        if name not in self.protocols:
+            return False
+        return self.processes[name][0].draining()
+
+    def outstandingConnections(self, name):
+        """
+        @param name: The name of the process
+
+        @return: the number of connections dispatched to the process that it
+            has not finished with yet
+        @rtype: C{int}
+        """
+        if name not in self.processes:
+            return 0
+        return self.processes[name][0].outstandingConnections()
+
     def processEnded(self, name):
         """
         When a child process has ended it calls me so I can fire the
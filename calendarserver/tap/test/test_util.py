@@ -90,6 +90,25 @@ class StubProcessMonitor(object):
         self.history.append(name)
 
 
+class StubDrainingProcessMonitor(StubProcessMonitor):
+
+    def __init__(self, processes, protocols):
+        super(StubDrainingProcessMonitor, self).__init__(processes, protocols)
+        self.draining = []
+        self.outstanding = {}
+        self.canDrain = True
+
+    def drainProcess(self, name):
+        self.draining.append(name)
+        return self.canDrain
+
+    def outstandingConnections(self, name):
+        return self.outstanding.get(name, 0)
+
+    def processEnded(self, name, pid):
+        self.protocols[name] = StubProtocol(StubProcess(pid))
+
+
 class MemoryLimitServiceTestCase(TestCase):
 
     def test_checkMemory(self):
@@ -137,6 +156,187 @@ class MemoryLimitServiceTestCase(TestCase):
         clock.advance(10)
         self.assertEquals(processMonitor.history, ['process #1', 'process #2', 'process #3'])
 
+    def _drainingService(self, data, **kwargs):
+        """
+        Set up a L{MemoryLimitService} which drains processes, with the
+        memory use of each process given by C{data}, a C{dict} mapping names
+        to (pid, memory).
+        """
+        processes = []
+        protocols = {}
+        for name, (pid, _ignore_memory) in sorted(data.items()):
+            protocols[name] = StubProtocol(StubProcess(pid))
+            processes.append(name)
+        processMonitor = StubDrainingProcessMonitor(processes, protocols)
+        clock = Clock()
+        service = MemoryLimitService(processMonitor, 10, 100, True, reactor=clock, **kwargs)
+
+        memory = dict(data.values())
+        service._memoryForPID = lambda pid, residentOnly: memory[pid]
+        return service, processMonitor, clock, memory
+
+    def test_drainBeforeStop(self):
+        """
+        A process over the limit is drained first, and only stopped once it
+        has no outstanding connections.
+        """
+        service, processMonitor, clock, _ignore_memory = self._drainingService(
+            {"process #1": (101, 50), "process #2": (102, 150)},
+            drainSeconds=30,
+        )
+        processMonitor.outstanding["process #2"] = 3
+
+        service.startService()
+        clock.advance(10)
+        self.assertEquals(processMonitor.draining, ["process #2"])
+        self.assertEquals(processMonitor.history, [])
+
+        # Further checks do not recycle it again
+        clock.advance(10)
+        self.assertEquals(processMonitor.draining, ["process #2"])
+        self.assertEquals(processMonitor.history, [])
+
+        processMonitor.outstanding["process #2"] = 0
+        clock.advance(1)
+        self.assertEquals(processMonitor.history, ["process #2"])
+
+        # Once restarted, it is no longer being recycled
+        processMonitor.processEnded("process #2", 202)
+        clock.advance(1)
+        self.assertEquals(service._recycling, {})
+        service.stopService()
+
+    def test_drainDeadline(self):
+        """
+        A process that is draining is stopped once the drain deadline has
+        passed, even if it still has outstanding connections.
+        """
+        service, processMonitor, clock, _ignore_memory = self._drainingService(
+            {"process #1": (101, 150)},
+            drainSeconds=30,
+        )
+        processMonitor.outstanding["process #1"] = 3
+
+        service.startService()
+        clock.advance(10)
+        self.assertEquals(processMonitor.draining, ["process #1"])
+        clock.pump([1] * 29)
+        self.assertEquals(processMonitor.history, [])
+        clock.advance(1)
+        self.assertEquals(processMonitor.history, ["process #1"])
+        service.stopService()
+
+    def test_softLimit(self):
+        """
+        Processes over the soft limit are recycled one at a time, and their
+        memory use and growth are reported in L{MemoryLimitService.stats}.
+        """
+        service, processMonitor, clock, memory = self._drainingService(
+            {"process #1": (101, 50), "process #2": (102, 60), "process #3": (103, 70)},
+            softLimitBytes=55, drainSeconds=30, maxConcurrentRecycles=1,
+        )
+        processMonitor.outstanding["process #2"] = 1
+
+        service.startService()
+        clock.advance(10)
+        self.assertEquals(processMonitor.draining, ["process #2"])
+        self.assertEquals(
+            [(stat["name"], stat["state"]) for stat in service.stats()],
+            [("process #1", ""), ("process #2", "recycling"), ("process #3", "pending")],
+        )
+
+        # The next one is only recycled once the first has restarted
+        processMonitor.outstanding["process #2"] = 0
+        clock.advance(1)
+        self.assertEquals(processMonitor.history, ["process #2"])
+        self.assertEquals(processMonitor.draining, ["process #2"])
+        processMonitor.processEnded("process #2", 202)
+        memory[202] = 10
+        clock.advance(1)
+        self.assertEquals(processMonitor.draining, ["process #2", "process #3"])
+
+        # Growth is measured between checks of the same process
+        memory[101] = 52
+        clock.advance(8)
+        stats = dict((stat["name"], stat) for stat in service.stats())
+        self.assertEquals(stats["process #1"]["rate"], 0.2)
+        self.assertEquals(stats["process #2"]["pid"], 202)
+        self.assertEquals(stats["process #2"]["rate"], 0.0)
+        service.stopService()
+
+    def _checkStoppedImmediately(self, service, processMonitor, clock, memory):
+        """
+        Processes over the soft limit are stopped one at a time, the next one
+        once the previous one has restarted.
+        """
+        service.startService()
+        clock.advance(10)
+        self.assertEquals(processMonitor.history, ["process #2"])
+
+        # Further checks do not stop the next one until it has restarted
+        clock.advance(10)
+        self.assertEquals(processMonitor.history, ["process #2"])
+
+        processMonitor.processEnded("process #2", 202)
+        memory[202] = 10
+        clock.advance(1)
+        self.assertEquals(processMonitor.history, ["process #2", "process #3"])
+        self.assertEquals(service._recycling.keys(), ["process #3"])
+
+        processMonitor.processEnded("process #3", 203)
+        memory[203] = 10
+        clock.advance(1)
+        self.assertEquals(service._recycling, {})
+        self.assertEquals(service._pending, [])
+
+        # A process that goes over the soft limit again is recycled again
+        memory[202] = 60
+        clock.advance(10)
+        self.assertEquals(processMonitor.history, ["process #2", "process #3", "process #2"])
+        service.stopService()
+
+    def test_softLimitNoDrain(self):
+        """
+        With no C{drainSeconds}, processes over the soft limit are stopped
+        straight away, one at a time.
+        """
+        service, processMonitor, clock, memory = self._drainingService(
+            {"process #1": (101, 50), "process #2": (102, 60), "process #3": (103, 70)},
+            softLimitBytes=55, drainSeconds=0, maxConcurrentRecycles=1,
+        )
+        self._checkStoppedImmediately(service, processMonitor, clock, memory)
+        self.assertEquals(processMonitor.draining, [])
+
+    def test_softLimitCannotDrain(self):
+        """
+        Processes over the soft limit which cannot be drained are stopped
+        straight away, one at a time.
+        """
+        service, processMonitor, clock, memory = self._drainingService(
+            {"process #1": (101, 50), "process #2": (102, 60), "process #3": (103, 70)},
+            softLimitBytes=55, drainSeconds=30, maxConcurrentRecycles=1,
+        )
+        processMonitor.canDrain = False
+        self._checkStoppedImmediately(service, processMonitor, clock, memory)
+        self.assertEquals(processMonitor.draining, ["process #2", "process #3", "process #2"])
+
+    def test_hardLimitNotQueued(self):
+        """
+        Processes over the hard limit are recycled straight away, whatever
+        the number of concurrent recycles.
+        """
+        service, processMonitor, clock, _ignore_memory = self._drainingService(
+            {"process #1": (101, 150), "process #2": (102, 160), "process #3": (103, 70)},
+            softLimitBytes=55, drainSeconds=30, maxConcurrentRecycles=1,
+        )
+        processMonitor.outstanding["process #1"] = 1
+        processMonitor.outstanding["process #2"] = 1
+
+        service.startService()
+        clock.advance(10)
+        self.assertEquals(processMonitor.draining, ["process #1", "process #2"])
+        service.stopService()
+
     def test_memoryForPID(self):
         """
         Test that L{memoryForPID} returns a valid result.
@@ -34,6 +34,7 @@ from calendarserver.provision.root import RootResource
 from calendarserver.push.applepush import APNSubscriptionResource
 from calendarserver.push.notifier import NotifierFactory
 from calendarserver.push.util import getAPNTopicFromConfig
+from calendarserver.sqlstats import SQLStatsService
 from calendarserver.tools import diagnose
 from calendarserver.tools.util import checkDirectory
 from calendarserver.webadmin.delegation import WebAdminResource
@@ -811,6 +812,8 @@ def getDBPool(config):
         txnFactory = transactionFactoryFromFD(
             int(config.DBAMPFD), DatabaseType(dialect, paramstyle, config.DBFeatures)
         )
+        # The connection pool is in the master, shared by all workers
+        txnFactory = SQLStatsService.instrument(txnFactory)
     elif not config.UseDatabase:
         txnFactory = None
     elif not config.SharedConnectionPool:
@@ -824,7 +827,9 @@ def getDBPool(config):
 
         pool = ConnectionPool(connectionFactory, dbtype=DatabaseType(dialect, paramstyle, config.DBFeatures),
                               maxConnections=config.MaxDBConnectionsPerPool)
-        txnFactory = pool.connection
+        txnFactory = SQLStatsService.instrument(
+            pool.connection, maxConnections=config.MaxDBConnectionsPerPool
+        )
     else:
         raise UsageError(
             "trying to use DB in slave, but no connection info from parent"
@@ -920,9 +925,22 @@ class MemoryLimitService(Service, object):
     A service which when paired with a DelayedStartupProcessMonitor will periodically
     examine the memory usage of the monitored processes and stop any which exceed
     a configured limit.  Memcached processes are ignored.
+
+    When C{drainSeconds} is set, processes are recycled gracefully: no new
+    connections are dispatched to the process, and it is only stopped once
+    its outstanding connections are done, or C{drainSeconds} have passed.
+    Processes over the soft limit are queued for recycling, with at most
+    C{maxConcurrentRecycles} being recycled at a time; processes over the
+    (hard) limit are recycled straight away.
     """
 
-    def __init__(self, processMonitor, intervalSeconds, limitBytes, residentOnly, reactor=None):
+    # How often to check on processes being drained
+    drainCheckSeconds = 1
+
+    def __init__(
+        self, processMonitor, intervalSeconds, limitBytes, residentOnly, reactor=None,
+        softLimitBytes=None, drainSeconds=0, maxConcurrentRecycles=1,
+    ):
         """
         @param processMonitor: the DelayedStartupProcessMonitor
         @param intervalSeconds: how often to check
@@ -932,16 +950,41 @@ class MemoryLimitService(Service, object):
         @param residentOnly: whether only resident memory should be included
         @type residentOnly: C{boolean}
         @param reactor: for testing
+        @param softLimitBytes: any monitored process over this limit is
+            recycled when fewer than C{maxConcurrentRecycles} processes are
+            being recycled, or C{None} for no soft limit
+        @type softLimitBytes: C{int}
+        @param drainSeconds: how long to wait for a process's outstanding
+            connections to finish before stopping it, or C{0} to stop
+            processes immediately
+        @type drainSeconds: C{int}
+        @param maxConcurrentRecycles: how many processes over the soft limit
+            may be recycled at the same time
+        @type maxConcurrentRecycles: C{int}
         """
         self._processMonitor = processMonitor
         self._seconds = intervalSeconds
         self._bytes = limitBytes
         self._residentOnly = residentOnly
+        self._softBytes = softLimitBytes
+        self._drainSeconds = drainSeconds
+        self._maxRecycles = maxConcurrentRecycles
         self._delayedCall = None
+        self._drainCall = None
         if reactor is None:
             from twisted.internet import reactor
         self._reactor = reactor
 
+        # Latest memory use of each process: name -> (pid, time, bytes,
+        # growth in bytes per second)
+        self._usage = {}
+
+        # Processes over the soft limit waiting to be recycled, in order
+        self._pending = []
+
+        # Processes being recycled: name -> (pid, deadline, stopped)
+        self._recycling = {}
+
         # Unit tests can swap out _memoryForPID
         self._memoryForPID = memoryForPID
 
@@ -960,21 +1003,28 @@ class MemoryLimitService(Service, object):
         if self._delayedCall is not None and self._delayedCall.active():
             self._delayedCall.cancel()
             self._delayedCall = None
+        if self._drainCall is not None and self._drainCall.active():
+            self._drainCall.cancel()
+            self._drainCall = None
+
+    def _pidForName(self, name):
+        proto = self._processMonitor.protocols.get(name, None)
+        return proto.transport.pid if proto is not None else None
 
     def checkMemory(self):
         """
-        Stop any processes monitored by our paired processMonitor whose resident
-        memory exceeds our configured limitBytes.  Reschedule intervalSeconds in
+        Stop (or recycle) any processes monitored by our paired processMonitor
+        whose resident memory exceeds our configured limitBytes, and queue for
+        recycling those over softLimitBytes.  Reschedule intervalSeconds in
         the future.
         """
         try:
+            now = self._reactor.seconds()
             for name in self._processMonitor.processes:
                 if name.startswith("memcached"):
                     continue
-                proto = self._processMonitor.protocols.get(name, None)
-                if proto is not None:
-                    proc = proto.transport
-                    pid = proc.pid
+                pid = self._pidForName(name)
+                if pid is not None:
                     try:
                         memory = self._memoryForPID(pid, self._residentOnly)
                     except Exception, e:
@@ -982,16 +1032,129 @@ class MemoryLimitService(Service, object):
                             "Unable to determine memory usage of PID: {pid} ({err})",
                             pid=pid, err=e)
                         continue
+
+                    previous = self._usage.get(name)
+                    if previous is not None and previous[0] == pid and now > previous[1]:
+                        rate = (memory - previous[2]) / (now - previous[1])
+                    else:
+                        rate = 0.0
+                    self._usage[name] = (pid, now, memory, rate,)
+
+                    if name in self._recycling:
+                        continue
                     if memory > self._bytes:
-                        log.warn(
-                            "Killing large process: {name} PID:{pid} {memtype}:{mem}",
-                            name=name, pid=pid,
-                            memtype=("Resident" if self._residentOnly else "Virtual"),
-                            mem=memory)
-                        self._processMonitor.stopProcess(name)
+                        if name in self._pending:
+                            self._pending.remove(name)
+                        if self._drainSeconds:
+                            self._recycle(name, pid, memory)
+                        else:
+                            log.warn(
+                                "Killing large process: {name} PID:{pid} {memtype}:{mem}",
+                                name=name, pid=pid,
+                                memtype=("Resident" if self._residentOnly else "Virtual"),
+                                mem=memory)
+                            self._processMonitor.stopProcess(name)
+                    elif self._softBytes is not None and memory > self._softBytes:
+                        if name not in self._pending:
+                            log.info(
+                                "Scheduling recycling of large process: {name} PID:{pid} {memtype}:{mem}",
+                                name=name, pid=pid,
+                                memtype=("Resident" if self._residentOnly else "Virtual"),
+                                mem=memory)
+                            self._pending.append(name)
+
+            self._recyclePending()
         finally:
             self._delayedCall = self._reactor.callLater(self._seconds, self.checkMemory)
 
+    def _recyclePending(self):
+        """
+        Start recycling the processes queued by the soft limit, as long as
+        fewer than maxConcurrentRecycles are being recycled.
+        """
+        while self._pending and len(self._recycling) < self._maxRecycles:
+            name = self._pending.pop(0)
+            pid = self._pidForName(name)
+            if pid is not None and name not in self._recycling:
+                self._recycle(name, pid, self._usage.get(name, (None, None, 0, None))[2])
+
+    def _recycle(self, name, pid, memory):
+        """
+        Stop dispatching new connections to a process, and stop it once
+        they are done or drainSeconds have passed.
+        """
+        log.warn(
+            "Recycling large process: {name} PID:{pid} {memtype}:{mem}",
+            name=name, pid=pid,
+            memtype=("Resident" if self._residentOnly else "Virtual"),
+            mem=memory)
+        if self._drainSeconds and self._processMonitor.drainProcess(name):
+            self._recycling[name] = (pid, self._reactor.seconds() + self._drainSeconds, False,)
+            self._scheduleDrainCheck()
+        else:
+            # Still counts against maxConcurrentRecycles until it has
+            # restarted, which the drain check notices
+            self._recycling[name] = (pid, None, True,)
+            self._processMonitor.stopProcess(name)
+            self._scheduleDrainCheck()
+
+    def _scheduleDrainCheck(self):
+        if self._drainCall is None or not self._drainCall.active():
+            self._drainCall = self._reactor.callLater(self.drainCheckSeconds, self.checkDraining)
+
+    def checkDraining(self):
+        """
+        Stop the processes being recycled that have no outstanding connections
+        left, or whose drain deadline has passed, and forget those that have
+        been restarted.
+        """
+        self._drainCall = None
+        now = self._reactor.seconds()
+        for name, (pid, deadline, stopped) in self._recycling.items():
+            if self._pidForName(name) != pid:
+                # The process has exited
+                del self._recycling[name]
+            elif not stopped:
+                outstanding = self._processMonitor.outstandingConnections(name)
+                if outstanding == 0 or now >= deadline:
+                    if outstanding:
+                        log.warn(
+                            "Stopping recycled process with outstanding connections: {name} PID:{pid} connections:{count}",
+                            name=name, pid=pid, count=outstanding)
+                    self._recycling[name] = (pid, deadline, True,)
+                    self._processMonitor.stopProcess(name)
+
+        # Start the next queued ones in place of those that have been restarted
+        self._recyclePending()
+        if self._recycling:
+            self._scheduleDrainCheck()
+
+    def stats(self):
+        """
+        The memory use of each monitored process, for the dashboard.
+
+        @return: a C{list} of C{dict}s with the process name, PID, memory
+            use, growth rate in bytes per second (between the last two
+            checks) and whether it is queued for, or being, recycled.
+        @rtype: C{list}
+        """
+        results = []
+        for name, (pid, _ignore_time, memory, rate) in sorted(self._usage.items()):
+            if name in self._recycling:
+                state = "recycling"
+            elif name in self._pending:
+                state = "pending"
+            else:
+                state = ""
+            results.append({
+                "name": name,
+                "pid": pid,
+                "memory": memory,
+                "rate": rate,
+                "state": state,
+            })
+        return results
+
 
 def checkDirectories(config):
     """
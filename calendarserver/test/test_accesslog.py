@@ -14,13 +14,18 @@
 # limitations under the License.
 ##
 
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock
 from twisted.trial.unittest import TestCase
 from calendarserver.accesslog import SystemMonitor, \
-    RotatingFileAccessLoggingObserver
+    RotatingFileAccessLoggingObserver, AMPCommonAccessLoggingObserver, \
+    LogStats, LogStatsBatch, initRequestStats, updateRequestStats
+from calendarserver.histogram import histogramCount, histogramPercentile
 from twistedcaldav.stdconfig import config as stdconfig
 from twistedcaldav.config import config
 import time
 import collections
+import json
 
 hasattr(stdconfig, "Servers")   # Quell pyflakes
 
@@ -174,3 +179,110 @@ class AccessLog(TestCase):
         observer.stop()
         self.assertTrue("uid" not in stats)
         self.assertTrue("user-agent" not in stats)
+
+    def test_requestStatsHistograms(self):
+        """
+        Request stats include mergeable latency histograms, overall, per
+        method and per user agent.
+        """
+
+        stats = initRequestStats()
+        for t in range(1, 101):
+            updateRequestStats(stats, {
+                "method": "GET",
+                "uri": "/index.html",
+                "statusCode": 200,
+                "userAgent": "Mozilla/5.0 (Macintosh)",
+                "t": float(t),
+            })
+        updateRequestStats(stats, {
+            "method": "PUT",
+            "uri": "/index.html",
+            "statusCode": 500,
+            "userAgent": "-",
+            "t": 1000.0,
+        })
+
+        self.assertEqual(stats["requests"], 101)
+        self.assertEqual(stats["500"], 1)
+        self.assertEqual(histogramCount(stats["T-HIST"]), 101)
+        self.assertEqual(histogramCount(stats["method-hist"]["GET"]), 100)
+        self.assertEqual(histogramCount(stats["method-hist"]["PUT"]), 1)
+        self.assertEqual(sum(map(histogramCount, stats["user-agent-hist"].values())), 101)
+        self.assertAlmostEqual(histogramPercentile(stats["method-hist"]["GET"], 50), 50.0, delta=0.5)
+        self.assertAlmostEqual(histogramPercentile(stats["T-HIST"], 100), 1000.0, delta=10.0)
+
+        # Histograms survive being sent over AMP as JSON
+        json.dumps(stats)
+
+    def test_batchedWorkerStats(self):
+        """
+        L{AMPCommonAccessLoggingObserver} sends access log lines and merged
+        stats to the master in a batch, and L{RotatingFileAccessLoggingObserver}
+        logs them and merges the stats.
+        """
+
+        self.patch(config.Stats, "BatchIntervalMS", 500)
+        self.patch(config.Stats, "EnableUnixStatsSocket", True)
+        self.patch(config.Stats, "EnableTCPStatsSocket", False)
+
+        logpath = self.mktemp()
+        master = RotatingFileAccessLoggingObserver(logpath)
+        master.start()
+        self.addCleanup(master.stop)
+
+        class FakeProtocol(object):
+            def callRemote(self, command, **kwargs):
+                if command is LogStatsBatch:
+                    master.logStatsBatch(kwargs["lines"], json.loads(kwargs["stats"]))
+                elif command is LogStats:
+                    master.logStats(json.loads(kwargs["message"]))
+                calls.append(command)
+                return succeed({})
+
+        calls = []
+        clock = Clock()
+        worker = AMPCommonAccessLoggingObserver(reactor=clock)
+        worker.addClient(FakeProtocol())
+
+        for ctr in range(3):
+            worker.logStats({
+                "type": "access-log",
+                "log-format": "request %(uri)s",
+                "method": "GET",
+                "uri": "/{}.html".format(ctr),
+                "statusCode": 200,
+                "userAgent": "-",
+                "t": 10.0,
+            })
+        self.assertEqual(calls, [])
+
+        clock.advance(0.5)
+        self.assertEqual(calls, [LogStatsBatch])
+
+        stats = master.getStats()
+        self.assertEqual(stats["current"]["requests"], 3)
+        self.assertEqual(stats["current"]["method"]["GET"], 3)
+        self.assertEqual(histogramCount(stats["current"]["T-HIST"]), 3)
+        with open(logpath) as f:
+            data = f.read()
+        for ctr in range(3):
+            self.assertIn("request /{}.html".format(ctr), data)
+
+        # Nothing more is sent while idle
+        clock.advance(10)
+        self.assertEqual(calls, [LogStatsBatch])
+
+        # Without batching each request is sent at once
+        self.patch(config.Stats, "BatchIntervalMS", 0)
+        worker.logStats({
+            "type": "access-log",
+            "log-format": "request %(uri)s",
+            "method": "GET",
+            "uri": "/unbatched.html",
+            "statusCode": 200,
+            "userAgent": "-",
+            "t": 10.0,
+        })
+        self.assertEqual(calls, [LogStatsBatch, LogStats])
+        self.assertEqual(master.getStats()["current"]["requests"], 4)
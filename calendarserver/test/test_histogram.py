@@ -0,0 +1,102 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+import json
+import random
+
+from twisted.trial.unittest import TestCase
+
+from calendarserver.histogram import histogramAdd, histogramMerge, \
+    histogramCount, histogramPercentile, histogramPercentiles, \
+    RELATIVE_ACCURACY
+from calendarserver.tools import dashview
+
+
+class Histogram(TestCase):
+    """
+    Tests for L{calendarserver.histogram}.
+    """
+
+    def assertClose(self, value, expected):
+        self.assertTrue(
+            abs(value - expected) <= expected * RELATIVE_ACCURACY,
+            "{} not within accuracy of {}".format(value, expected)
+        )
+
+    def test_empty(self):
+        self.assertEqual(histogramCount({}), 0)
+        self.assertEqual(histogramPercentiles({}), [0.0, 0.0, 0.0, 0.0])
+
+    def test_percentiles(self):
+        """
+        Percentiles are within the relative accuracy of the exact values.
+        """
+        histogram = {}
+        values = range(1, 1001)
+        for value in values:
+            histogramAdd(histogram, float(value))
+        histogramAdd(histogram, None)
+
+        self.assertEqual(histogramCount(histogram), 1000)
+        p50, p95, p99, p999 = histogramPercentiles(histogram)
+        self.assertClose(p50, 500.0)
+        self.assertClose(p95, 950.0)
+        self.assertClose(p99, 990.0)
+        self.assertClose(p999, 999.0)
+        self.assertClose(histogramPercentile(histogram, 100), 1000.0)
+        self.assertClose(histogramPercentile(histogram, 0), 1.0)
+
+    def test_zero(self):
+        histogram = {}
+        histogramAdd(histogram, 0.0, count=9)
+        histogramAdd(histogram, 10.0)
+        self.assertEqual(histogramPercentile(histogram, 50), 0.0)
+        self.assertClose(histogramPercentile(histogram, 99), 10.0)
+
+    def test_merge(self):
+        """
+        Merging histograms, including via JSON, gives the same result as
+        adding all values to one histogram.
+        """
+        values = [random.expovariate(0.01) for _ignore in range(2000)]
+        whole = {}
+        part1 = {}
+        part2 = {}
+        for ctr, value in enumerate(values):
+            histogramAdd(whole, value)
+            histogramAdd(part1 if ctr % 2 else part2, value)
+
+        merged = {}
+        histogramMerge(merged, json.loads(json.dumps(part1)))
+        histogramMerge(merged, part2)
+        self.assertEqual(merged, whole)
+
+        exact = sorted(values)
+        self.assertClose(histogramPercentile(merged, 99), exact[int(0.99 * len(exact)) - 1])
+
+    def test_dashview(self):
+        """
+        The copies of the histogram functions in the (standard library only)
+        dashboard agree with these.
+        """
+        random.seed(1)
+        histogram = {}
+        for _ignore in range(1000):
+            histogramAdd(histogram, random.expovariate(0.01))
+        histogramAdd(histogram, 0.0, 10)
+        self.assertEqual(dashview.histogramCount(histogram), histogramCount(histogram))
+        self.assertEqual(dashview.histogramPercentiles(histogram), histogramPercentiles(histogram))
+        self.assertEqual(dashview.histogramPercentiles({}), histogramPercentiles({}))
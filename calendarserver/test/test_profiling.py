@@ -0,0 +1,114 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+import os
+import thread
+import zlib
+
+from twisted.internet.task import Clock
+from twisted.test.iosim import connectedServerAndClient
+from twisted.trial.unittest import TestCase
+
+from calendarserver.profiling import SamplingProfiler, foldedStacks, \
+    AMPProfilerMasterFactory, AMPProfilerWorkerProtocol, ProfilerService
+
+
+def someFunction(profiler):
+    profiler.sample()
+
+
+class SamplingProfilerTests(TestCase):
+    """
+    Tests for L{calendarserver.profiling.SamplingProfiler}.
+    """
+
+    def test_sample(self):
+        """
+        Samples of the profiled thread are counted by folded stack.
+        """
+        profiler = SamplingProfiler(threadID=thread.get_ident())
+        someFunction(profiler)
+        someFunction(profiler)
+
+        samples = profiler.samples()
+        self.assertEqual(len(samples), 1)
+        stack, count = samples.items()[0]
+        self.assertEqual(count, 2)
+        frames = stack.split(";")
+        self.assertTrue(frames[-1].startswith("calendarserver/profiling.py:sample:"))
+        self.assertTrue(frames[-2].startswith("test/test_profiling.py:someFunction:"))
+
+    def test_window(self):
+        """
+        Continuous samples are kept for up to two windows.
+        """
+        profiler = SamplingProfiler(window=0, threadID=thread.get_ident())
+        profiler.sample()
+        profiler.sample()
+        self.assertEqual(sum(profiler.samples().values()), 2)
+        profiler.sample()
+        self.assertEqual(sum(profiler.samples().values()), 2)
+
+    def test_capture(self):
+        """
+        A capture only contains the samples taken during its period.
+        """
+        clock = Clock()
+        profiler = SamplingProfiler(threadID=thread.get_ident())
+        profiler.sample()
+        d = profiler.capture(10, reactor=clock)
+        profiler.sample()
+        profiler.sample()
+        clock.advance(10)
+        profiler.sample()
+        counts = self.successResultOf(d)
+        self.assertEqual(sum(counts.values()), 2)
+        self.assertEqual(sum(profiler.samples().values()), 4)
+
+    def test_foldedStacks(self):
+        counts = {"a;b": 2, "a;c": 5}
+        self.assertEqual(foldedStacks(counts), "a;c 5\na;b 2")
+
+        counts = dict([
+            ("{};{}".format(os.urandom(8).encode("hex"), ctr), ctr + 1)
+            for ctr in range(1000)
+        ])
+        result = foldedStacks(counts, maxBytes=1000)
+        self.assertTrue(len(zlib.compress(result)) <= 1000)
+        self.assertTrue(result.startswith(max(counts.keys(), key=counts.get)))
+
+    def test_collectFromWorkers(self):
+        """
+        L{ProfilerService.collect} in the master gets the folded stacks of each
+        worker over AMP.
+        """
+        profiler = SamplingProfiler(threadID=thread.get_ident())
+        someFunction(profiler)
+
+        factory = AMPProfilerMasterFactory()
+        self.patch(ProfilerService, "_factory", factory)
+        _ignore_client, _ignore_server, pump = connectedServerAndClient(
+            lambda: factory.buildProtocol(None),
+            lambda: AMPProfilerWorkerProtocol(profiler),
+        )
+        self.assertEqual(len(factory.workers), 1)
+
+        d = ProfilerService.collect()
+        pump.flush()
+        results = self.successResultOf(d)
+        self.assertEqual(results.keys(), [str(os.getpid())])
+        self.assertIn("someFunction", results[str(os.getpid())])
+        self.assertTrue(results[str(os.getpid())].endswith(" 1"))
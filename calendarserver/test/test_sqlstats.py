@@ -0,0 +1,233 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+import os
+
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.task import Clock
+from twisted.test.iosim import connectedServerAndClient
+from twisted.trial.unittest import TestCase
+
+from calendarserver.histogram import histogramCount, histogramPercentile
+from calendarserver.sqlstats import SQLStats, statementShape, mergeSQLStats, \
+    AMPSQLStatsMasterFactory, AMPSQLStatsWorkerProtocol, SQLStatsService
+
+
+class StubTransaction(object):
+    """
+    A transaction whose statements complete when the test fires them.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.pending = []
+        self.dialect = "stub"
+
+    def execSQL(self, sql, args=None, raiseOnZeroRowCount=None):
+        d = Deferred()
+        self.pending.append(d)
+        return d
+
+    def commit(self):
+        return succeed(None)
+
+    def abort(self):
+        return succeed(None)
+
+
+class SQLStatsTests(TestCase):
+    """
+    Tests for L{calendarserver.sqlstats.SQLStats}.
+    """
+
+    def setUp(self):
+        super(SQLStatsTests, self).setUp()
+        self.clock = Clock()
+        self.transactions = []
+
+        def txnFactory(label):
+            txn = StubTransaction(label)
+            self.transactions.append(txn)
+            return txn
+        self.txnFactory = txnFactory
+
+    def test_statementShape(self):
+        """
+        Statements that only differ in their values, or the length of their
+        parameter lists, have the same shape.
+        """
+        self.assertEqual(
+            statementShape("-- Label: test\nselect  A from B\n where C = %s and D in (%s, %s)"),
+            "select A from B where C = ? and D in (?...)",
+        )
+        self.assertEqual(
+            statementShape("select A from B where C = :1 and D in (:2, :3, :4)"),
+            "select A from B where C = ? and D in (?...)",
+        )
+        self.assertEqual(
+            statementShape("update B set C = 'it''s' where D = 12"),
+            "update B set C = ? where D = ?",
+        )
+        self.assertEqual(
+            statementShape("select A1 from B where C = %(c)s"),
+            "select A1 from B where C = ?",
+        )
+
+    def test_statements(self):
+        """
+        Statement times are recorded by statement shape, and transaction hold
+        times when they commit.
+        """
+        stats = SQLStats(clock=self.clock.seconds)
+        txnFactory = stats.wrap(self.txnFactory)
+
+        txn = txnFactory(label="test")
+        self.assertEqual(txn.label, "test")
+        self.assertEqual(txn.dialect, "stub")
+        for ctr in range(3):
+            d = txn.execSQL("select A from B where C = %s", [ctr])
+            self.clock.advance(0.1 * (ctr + 1))
+            txn._txn.pending[-1].callback([[ctr]])
+            self.assertEqual(self.successResultOf(d), [[ctr]])
+        txn.commit()
+
+        report = stats.report()
+        self.assertEqual(report["transactions"], 1)
+        self.assertEqual(report["statements"].keys(), ["select A from B where C = ?"])
+        statement = report["statements"]["select A from B where C = ?"]
+        self.assertEqual(statement["count"], 3)
+        self.assertAlmostEqual(statement["time"], 600.0)
+        self.assertTrue(abs(histogramPercentile(statement["histogram"], 100.0) - 300.0) <= 3.0)
+        self.assertTrue(abs(histogramPercentile(report["hold"], 50.0) - 600.0) <= 6.0)
+        self.assertEqual(report["long"], [])
+
+    def test_poolWait(self):
+        """
+        Transactions created when all the pool's connections are held wait for
+        one to be released.
+        """
+        stats = SQLStats(maxConnections=2, clock=self.clock.seconds)
+        txnFactory = stats.wrap(self.txnFactory)
+
+        txn1 = txnFactory(label="1")
+        txn2 = txnFactory(label="2")
+        txn3 = txnFactory(label="3")
+        txn4 = txnFactory(label="4")
+        self.assertEqual(stats.report()["pool"], {"max": 2, "held": 2, "waiting": 2})
+
+        self.clock.advance(1)
+        txn1.commit()
+        self.clock.advance(1)
+        txn4.abort()
+        txn2.abort()
+
+        report = stats.report()
+        self.assertEqual(report["pool"], {"max": 2, "held": 1, "waiting": 0})
+        self.assertEqual(histogramCount(report["wait"]), 3)
+        self.assertEqual(histogramPercentile(report["wait"], 50.0), 0.0)
+        self.assertTrue(abs(histogramPercentile(report["wait"], 100.0) - 1000.0) <= 10.0)
+        self.assertEqual(txn3.acquired, 1)
+
+    def test_longHeld(self):
+        """
+        Transactions held for longer than C{longSeconds} are reported with
+        their label, whether they are still open or have finished.
+        """
+        stats = SQLStats(longSeconds=5, clock=self.clock.seconds)
+        txnFactory = stats.wrap(self.txnFactory)
+
+        txn1 = txnFactory(label="quick")
+        txn2 = txnFactory(label="slow")
+        txn2.execSQL("select 1")
+        self.clock.advance(1)
+        txn1.commit()
+        self.clock.advance(5)
+
+        report = stats.report()
+        self.assertEqual(report["long"], [])
+        self.assertEqual(report["open"], [{"label": "slow", "held": 6, "statements": 1}])
+
+        txn2.commit()
+        report = stats.report()
+        self.assertEqual(report["open"], [])
+        self.assertEqual(report["long"], [{"label": "slow", "held": 6, "statements": 1, "ended": 6}])
+
+    def test_window(self):
+        """
+        Statistics are kept for up to two windows.
+        """
+        stats = SQLStats(window=10, clock=self.clock.seconds)
+        txnFactory = stats.wrap(self.txnFactory)
+
+        txnFactory(label="1").commit()
+        self.clock.advance(10)
+        txnFactory(label="2").commit()
+        self.assertEqual(stats.report()["transactions"], 2)
+        self.clock.advance(10)
+        self.assertEqual(stats.report()["transactions"], 1)
+
+    def test_maxShapes(self):
+        """
+        Statement shapes beyond C{maxShapes} are counted as C{"other"}, and
+        reports can be limited to the shapes with the most time.
+        """
+        stats = SQLStats(maxShapes=2, clock=self.clock.seconds)
+        for ctr in range(4):
+            stats.statementDone("select {} from B".format("ABCD"[ctr]), ctr + 1)
+        self.assertEqual(
+            sorted(stats.report()["statements"].keys()),
+            ["other", "select A from B", "select B from B"],
+        )
+        self.assertEqual(stats.report()["statements"]["other"]["count"], 2)
+        self.assertEqual(stats.report(maxShapes=1)["statements"].keys(), ["other"])
+
+    def test_merge(self):
+        """
+        L{mergeSQLStats} combines the reports of several processes.
+        """
+        stats1 = SQLStats(clock=self.clock.seconds)
+        stats1.statementDone("select A from B", 1)
+        stats2 = SQLStats(clock=self.clock.seconds)
+        stats2.statementDone("select A from B", 2)
+        stats2.statementDone("select C from D", 3)
+
+        result = mergeSQLStats([stats1.report(), stats2.report()])
+        self.assertEqual(result["statements"]["select A from B"]["count"], 2)
+        self.assertEqual(result["statements"]["select A from B"]["time"], 3000.0)
+        self.assertEqual(result["statements"]["select C from D"]["count"], 1)
+
+    def test_collectFromWorkers(self):
+        """
+        L{SQLStatsService.collect} in the master gets the statistics of each
+        worker over AMP.
+        """
+        stats = SQLStats(clock=self.clock.seconds)
+        stats.statementDone("select A from B", 1)
+
+        factory = AMPSQLStatsMasterFactory()
+        self.patch(SQLStatsService, "_factory", factory)
+        self.patch(SQLStatsService, "_stats", None)
+        _ignore_client, _ignore_server, pump = connectedServerAndClient(
+            lambda: factory.buildProtocol(None),
+            lambda: AMPSQLStatsWorkerProtocol(stats),
+        )
+        self.assertEqual(len(factory.workers), 1)
+
+        d = SQLStatsService.collect()
+        pump.flush()
+        results = self.successResultOf(d)
+        self.assertEqual(results.keys(), [str(os.getpid())])
+        self.assertEqual(results[str(os.getpid())]["statements"]["select A from B"]["count"], 1)
@@ -44,7 +44,10 @@ from __future__ import print_function
 from uuid import uuid4
 import collections
 import itertools
+import json
+import os
 import sys
+import tempfile
 import time
 import traceback
 
@@ -56,9 +59,10 @@ from pycalendar.icalendar import definitions
 from pycalendar.icalendar.calendar import Calendar
 from pycalendar.period import Period
 from pycalendar.timezone import Timezone
-from twext.enterprise.dal.syntax import Select, Parameter, Count, Update
+from twext.enterprise.dal.syntax import Select, Parameter, Count, Update, Max
 from twext.python.log import Logger
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, gatherResults
+from twisted.internet.utils import getProcessValue
 from twisted.python import usage
 from twisted.python.usage import Options
 from twistedcaldav.datafilters.peruserdata import PerUserDataFilter
@@ -202,7 +206,7 @@ Component.validRecurrenceIDs = new_validRecurrenceIDs
 if not hasattr(Component, "maxAlarmCounts"):
     Component.hasDuplicateAlarms = new_hasDuplicateAlarms
 
-VERSION = "13"
+VERSION = "14"
 
 
 def printusage(e=None):
@@ -263,6 +267,12 @@ Options for --ical / --upgrade:
 --path     : Scan the calendar home or calendar identified by the
              specified URI
 
+Options for --ical (whole store only):
+
+--parallel N       : split the scan across N worker processes.
+--checkpoint DIR   : directory for --parallel progress files. Re-running
+                     with the same directory resumes an interrupted scan.
+
 Options for --mismatch:
 
 --uid      : look for mismatches with the specified iCalendar UID only.
@@ -320,6 +330,8 @@ v12: Fix double-booking false positives caused by timezones-by-reference.
 
 v13: Add new options for --nuke and --ical. Add fix for invalid GEO.
 
+v14: Add --parallel and --checkpoint for --ical.
+
 """ % (VERSION,)
 
 
@@ -327,6 +339,39 @@ def safePercent(x, y, multiplier=100.0):
     return ((multiplier * x) / y) if y else 0
 
 
+def readCheckpoint(path):
+    """
+    Read a checkpoint file.
+
+    @param path: the file path
+    @type path: L{str}
+
+    @return: the saved state, or L{None} if there is no checkpoint
+    @rtype: L{dict}
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def writeCheckpoint(path, state):
+    """
+    Write a checkpoint file. A temporary file is renamed into place so that an
+    interrupted write leaves the previous checkpoint intact.
+
+    @param path: the file path
+    @type path: L{str}
+    @param state: the state to save
+    @type state: L{dict}
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.rename(tmp, path)
+
+
 class CalVerifyOptions(Options):
     """
     Command-line options for 'calendarserver_verify_data'
@@ -365,6 +410,9 @@ class CalVerifyOptions(Options):
         ['days', 'T', "365", "Number of days for scanning events into the future."],
         ['path', '', "", "Split event given its path."],
         ['rid', '', "", "Split date-time."],
+        ['parallel', '', "0", "Number of worker processes for a whole store --ical scan."],
+        ['checkpoint', '', "", "Checkpoint directory for --parallel (or file for --resource-range)."],
+        ['resource-range', '', "", "Scan only resource IDs LO:HI - used by --parallel worker processes."],
     ]
 
     def __init__(self):
@@ -648,6 +696,48 @@ class CalVerifyService(WorkerService, object):
         ).on(self.txn, **kwds))
         returnValue(tuple(rows))
 
+    @inlineCallbacks
+    def getMaxResourceID(self):
+        co = schema.CALENDAR_OBJECT
+        rows = (yield Select(
+            [Max(co.RESOURCE_ID), ],
+            From=co,
+        ).on(self.txn))
+        returnValue(int(rows[0][0]) if rows and rows[0][0] is not None else 0)
+
+    @inlineCallbacks
+    def getResourceDataRange(self, after, upto, limit):
+        """
+        Get the next batch of calendar objects in a range of resource IDs,
+        including their data so that each one does not need a separate query.
+
+        @param after: only return resource IDs greater than this
+        @type after: L{int}
+        @param upto: only return resource IDs up to and including this
+        @type upto: L{int}
+        @param limit: maximum number of rows to return
+        @type limit: L{int}
+
+        @return: rows of owner UID, resource ID, iCalendar UID, calendar name
+            and iCalendar text, in resource ID order
+        @rtype: L{tuple}
+        """
+        co = schema.CALENDAR_OBJECT
+        cb = schema.CALENDAR_BIND
+        ch = schema.CALENDAR_HOME
+        kwds = {"After": after, "Upto": upto}
+        rows = (yield Select(
+            [ch.OWNER_UID, co.RESOURCE_ID, co.ICALENDAR_UID, cb.CALENDAR_RESOURCE_NAME, co.ICALENDAR_TEXT],
+            From=ch.join(
+                cb, type="inner", on=(ch.RESOURCE_ID == cb.CALENDAR_HOME_RESOURCE_ID)).join(
+                co, type="inner", on=(cb.CALENDAR_RESOURCE_ID == co.CALENDAR_RESOURCE_ID).And(
+                    cb.BIND_MODE == _BIND_MODE_OWN)),
+            Where=(co.RESOURCE_ID > Parameter("After")).And(co.RESOURCE_ID <= Parameter("Upto")),
+            OrderBy=co.RESOURCE_ID,
+            Limit=limit,
+        ).on(self.txn, **kwds))
+        returnValue(tuple(rows))
+
     @inlineCallbacks
     def getAllResourceInfoForResourceID(self, resid):
         co = schema.CALENDAR_OBJECT
@@ -700,14 +790,27 @@ class CalVerifyService(WorkerService, object):
                 co.RESOURCE_ID == Parameter("ResourceID")
             ),
         ).on(self.txn, **kwds))
+        returnValue(self.parseCalendar(rows[0][0]) if rows else None)
+
+    def parseCalendar(self, text):
+        """
+        Parse calendar data, recording any error in C{self.parseError} and
+        C{self.parseException}.
+
+        @param text: the iCalendar data
+        @type text: L{str}
+
+        @return: the calendar or L{None} if it could not be parsed
+        @rtype: L{Calendar}
+        """
+        self.parseError = None
+        self.parseException = None
         try:
-            caldata = Calendar.parseText(rows[0][0]) if rows else None
+            return Calendar.parseText(text)
         except ErrorBase as e:
             self.parseError = "Failed to parse"
             self.parseException = str(e)
-            returnValue(None)
-
-        returnValue(caldata)
+            return None
 
     @inlineCallbacks
     def getCalendarForOwnerByUID(self, owner, uid):
@@ -962,6 +1065,9 @@ class BadDataService(CalVerifyService):
     Service which scans for bad calendar data.
     """
 
+    # Number of resources read per query in a --resource-range scan
+    rangeBatchSize = 500
+
     def title(self):
         return "Bad Data Service"
 
@@ -979,6 +1085,15 @@ class BadDataService(CalVerifyService):
 
         self.tzid = Timezone(tzid=self.options["tzid"] if self.options["tzid"] else "America/Los_Angeles")
 
+        if self.options.get("resource-range"):
+            yield self.rangeScan()
+            self.printSummary()
+            returnValue(None)
+        elif int(self.options.get("parallel") or 0) > 0 and not (self.options["uuid"] or self.options["uid"] or self.options["path"]):
+            yield self.parallelScan()
+            self.printSummary()
+            returnValue(None)
+
         self.txn = self.store.newTransaction()
 
         if self.options["verbose"]:
@@ -1079,6 +1194,26 @@ class BadDataService(CalVerifyService):
                 ("%d%%" % safePercent(count, total)).rjust(rjust)
             ).ljust(80) + "\n")
 
+        yield self.reportBadData(results_bad, total)
+
+        if self.options["verbose"]:
+            diff_time = time.time() - t
+            self.output.write("Time: %.2f s  Average: %.1f ms/resource\n" % (
+                diff_time,
+                safePercent(diff_time, total, 1000.0),
+            ))
+
+    @inlineCallbacks
+    def reportBadData(self, results_bad, total):
+        """
+        Print the table of bad calendar data and record the results.
+
+        @param results_bad: the bad resources as (owner, uid, resid, message)
+        @type results_bad: L{list}
+        @param total: the number of resources checked
+        @type total: L{int}
+        """
+
         # Print table of results
         table = tables.Table()
         table.addHeader(("Owner", "Event UID", "RID", "Problem",))
@@ -1097,25 +1232,176 @@ class BadDataService(CalVerifyService):
         self.results["Bad iCalendar data"] = results_bad
         table.printTable(os=self.output)
 
-        if self.options["verbose"]:
-            diff_time = time.time() - t
-            self.output.write("Time: %.2f s  Average: %.1f ms/resource\n" % (
-                diff_time,
-                safePercent(diff_time, total, 1000.0),
+    @inlineCallbacks
+    def rangeScan(self):
+        """
+        Check the calendar resources with resource IDs in the --resource-range
+        "LO:HI" (inclusive). Resources are read, with their data, in batches
+        ordered by resource ID, each batch in its own transaction. When a
+        --checkpoint file is given, progress and results are saved to it
+        after each batch, and a scan started again with the same file
+        resumes after the last completed batch.
+
+        @return: the final checkpoint state
+        @rtype: L{dict}
+        """
+
+        lo, hi = [int(i) for i in self.options["resource-range"].split(":")]
+        checkpoint = self.options.get("checkpoint")
+        state = readCheckpoint(checkpoint) if checkpoint else None
+        if state is None or (state["lo"], state["hi"]) != (lo, hi):
+            state = {
+                "lo": lo,
+                "hi": hi,
+                "last": lo - 1,
+                "count": 0,
+                "bad": [],
+                "done": False,
+            }
+        elif state["done"]:
+            self.output.write("\nRange %d:%d already completed\n" % (lo, hi,))
+        else:
+            self.output.write("\nResuming range %d:%d after resource %d\n" % (lo, hi, state["last"],))
+
+        self.output.write("\n---- Verifying calendar object resources %d to %d ----\n" % (lo, hi,))
+        while not state["done"]:
+            self.txn = self.store.newTransaction()
+            rows = yield self.getResourceDataRange(state["last"], hi, self.rangeBatchSize)
+            for owner, resid, uid, calname, text in rows:
+                try:
+                    result, message = yield self.validCalendarData(resid, calname == "inbox", text=text)
+                except Exception, e:
+                    result = False
+                    message = "Exception for validCalendarData"
+                    if self.options["verbose"]:
+                        print(e)
+                if not result:
+                    state["bad"].append((owner, uid, resid, message))
+                state["count"] += 1
+                state["last"] = resid
+            yield self.txn.commit()
+            self.txn = None
+
+            if len(rows) < self.rangeBatchSize:
+                state["done"] = True
+            if checkpoint:
+                writeCheckpoint(checkpoint, state)
+            if self.options["verbose"]:
+                self.output.write("Checked: %d  Bad: %d  Last resource: %d\n" % (state["count"], len(state["bad"]), state["last"],))
+                self.output.flush()
+
+        self.total = state["count"]
+        self.logResult("Number of events to process", self.total)
+        self.addSummaryBreak()
+        yield self.reportBadData([tuple(item) for item in state["bad"]], self.total)
+
+        returnValue(state)
+
+    @inlineCallbacks
+    def parallelScan(self):
+        """
+        Check all calendar resources using --parallel worker processes, each
+        doing a L{rangeScan} of an equal part of the resource ID space. The
+        ranges and each worker's progress are saved in the --checkpoint
+        directory, so running again with the same directory only re-runs the
+        unfinished ranges. The results of all workers are merged into the
+        usual report.
+        """
+
+        checkpointDir = self.options.get("checkpoint") or tempfile.mkdtemp(prefix="calverify-")
+        if not os.path.exists(checkpointDir):
+            os.makedirs(checkpointDir)
+        self.output.write("\nCheckpoint directory: %s\n" % (checkpointDir,))
+
+        planPath = os.path.join(checkpointDir, "plan.json")
+        plan = readCheckpoint(planPath)
+        if plan is None:
+            workers = int(self.options["parallel"])
+            self.txn = self.store.newTransaction()
+            maxID = yield self.getMaxResourceID()
+            yield self.txn.commit()
+            self.txn = None
+            size = maxID // workers + 1
+            plan = {
+                "ranges": [(i * size, min((i + 1) * size - 1, maxID)) for i in range(workers)],
+            }
+            writeCheckpoint(planPath, plan)
+        else:
+            self.output.write("Resuming previous scan\n")
+
+        paths = [os.path.join(checkpointDir, "worker-%d.json" % (ctr,)) for ctr in range(len(plan["ranges"]))]
+        ds = []
+        for ctr, (lo, hi) in enumerate(plan["ranges"]):
+            state = readCheckpoint(paths[ctr])
+            if state is not None and state["done"]:
+                continue
+            logPath = os.path.join(checkpointDir, "worker-%d.log" % (ctr,))
+            ds.append(self.spawnWorker(lo, hi, paths[ctr], logPath))
+        if ds:
+            self.output.write("Starting %d worker processes\n" % (len(ds),))
+            self.output.flush()
+            yield gatherResults(ds)
+
+        # Merge the results of each worker
+        total = 0
+        results_bad = []
+        incomplete = []
+        for ctr, path in enumerate(paths):
+            state = readCheckpoint(path)
+            if state is None or not state["done"]:
+                incomplete.append(ctr)
+            if state is not None:
+                total += state["count"]
+                results_bad.extend([tuple(item) for item in state["bad"]])
+
+        self.total = total
+        self.logResult("Number of events to process", self.total)
+        self.addSummaryBreak()
+        if incomplete:
+            self.output.write("\nWorkers %s did not complete. Run again with --checkpoint %s to resume.\n" % (
+                ", ".join(map(str, incomplete)), checkpointDir,
             ))
+        yield self.reportBadData(results_bad, total)
+
+    def spawnWorker(self, lo, hi, checkpoint, logPath):
+        """
+        Run this tool in another process to do a L{rangeScan}.
+
+        @return: a L{Deferred} firing with the process exit code
+        """
+        args = [
+            sys.argv[0],
+            "--ical",
+            "--config", self.options["config"],
+            "--resource-range", "%d:%d" % (lo, hi,),
+            "--checkpoint", checkpoint,
+            "--output", logPath,
+        ]
+        if self.options["fix"]:
+            args.append("--fix")
+        if self.options["verbose"]:
+            args.append("--verbose")
+        return getProcessValue(sys.executable, args, env=os.environ, reactor=self.reactor)
 
     errorPrefix = "Calendar data had unfixable problems:\n  "
 
     @inlineCallbacks
-    def validCalendarData(self, resid, isinbox):
+    def validCalendarData(self, resid, isinbox, text=None):
         """
         Check the calendar resource for valid iCalendar data.
+
+        @param text: the resource's iCalendar data if already read, otherwise
+            it is read from the store
+        @type text: L{str}
         """
 
         result = True
         message = ""
 
-        caldata = yield self.getCalendar(resid, self.fix)
+        if text is None:
+            caldata = yield self.getCalendar(resid, self.fix)
+        else:
+            caldata = self.parseCalendar(text)
 
         # Look for possible GEO fix
         if caldata is None and self.parseError and "GEO value incorrect" in self.parseException:
@@ -31,6 +31,7 @@ from twisted.application.service import Service
 from twisted.internet.defer import inlineCallbacks, succeed
 from twisted.logger import FileLogObserver, formatEventAsClassicLogText
 from twisted.python.logfile import LogFile
+from twisted.python.usage import UsageError
 
 import sys
 from errno import ENOENT, EACCES
@@ -136,6 +137,55 @@ def utilityMain(
     reactor.run()
 
 
+def parseShard(value):
+    """
+    Parse a worker's C{"index:count"} shard option, as passed to the worker
+    processes of a tool's parallel mode.
+
+    @param value: the option value
+    @type value: C{str}
+
+    @return: the zero-based shard index and the number of shards
+    @rtype: C{tuple} of (C{int}, C{int})
+
+    @raise UsageError: if the value is not valid
+    """
+    try:
+        index, count = [int(item) for item in value.split(":")]
+    except ValueError:
+        raise UsageError("Shard must be of the form INDEX:COUNT: {}".format(value))
+    if count < 1 or not (0 <= index < count):
+        raise UsageError("Shard index must be between 0 and {}: {}".format(count - 1, value))
+    return (index, count,)
+
+
+def workerArguments(argv, option, extra):
+    """
+    Build the command line for a worker process of a tool's parallel mode:
+    the tool's own command line without the long option that requested the
+    parallel mode, followed by some extra arguments.
+
+    @param argv: the tool's command line arguments, without the program name
+    @type argv: C{list} of C{str}
+    @param option: the name of the option to remove, e.g. C{"parallel"}; it
+        is expected to take a value
+    @type option: C{str}
+    @param extra: arguments to add for the worker
+    @type extra: C{list} of C{str}
+
+    @rtype: C{list} of C{str}
+    """
+    result = []
+    args = iter(argv)
+    for arg in args:
+        if arg == "--" + option:
+            next(args, None)
+        elif not arg.startswith("--" + option + "="):
+            result.append(arg)
+    result.extend(extra)
+    return result
+
+
 class WorkerService(Service):
 
     def __init__(self, store):
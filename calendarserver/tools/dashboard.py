@@ -33,6 +33,8 @@ import sys
 import termios
 import time
 
+from calendarserver.histogram import histogramCount, histogramPercentiles
+
 LOG_FILENAME = 'db.log'
 #logging.basicConfig(filename=LOG_FILENAME, level=logging.DEBUG)
 
@@ -1168,6 +1170,136 @@ class DirectoryStatsWindow(BaseWindow):
             self.window.refresh()
 
 
+class MemoryWindow(BaseWindow):
+    """
+    Displays the memory use of the server's worker processes, as seen by the
+    memory limiter.
+    """
+
+    help = "Worker Memory"
+    clientItem = "memory"
+
+    windowTitle = "Worker Memory"
+    formatWidth = 64
+    additionalRows = 5
+
+    def updateRowCount(self):
+        self.rowCount = len(defaultIfNone(self.readItem(self.clientItem), ()))
+
+    def update(self):
+        records = defaultIfNone(self.clientData(), ())
+        if len(records) != self.rowCount:
+            self.needsReset = True
+            return
+        self.iter += 1
+
+        s1 = " {:<16}{:>8}{:>12}{:>14}{:>12} ".format(
+            "Process", "PID", "Memory", "Growth", "State"
+        )
+        s2 = " {:<16}{:>8}{:>12}{:>14}{:>12} ".format(
+            "", "", "(MB)", "(KB/sec)", ""
+        )
+        pt = self.tableHeader((s1, s2,), len(records))
+
+        total_memory = 0
+        total_rate = 0.0
+        for record in records:
+            total_memory += record["memory"]
+            total_rate += record["rate"]
+            s = " {:<16}{:>8}{:>12.1f}{:>14.1f}{:>12} ".format(
+                record["name"],
+                record["pid"],
+                record["memory"] / (1024.0 * 1024.0),
+                record["rate"] / 1024.0,
+                record["state"],
+            )
+            self.tableRow(
+                s, pt,
+                curses.A_REVERSE if record["state"] else curses.A_NORMAL,
+            )
+
+        s = " {:<24}{:>12.1f}{:>14.1f}{:>12} ".format(
+            "Total:",
+            total_memory / (1024.0 * 1024.0),
+            total_rate / 1024.0,
+            "",
+        )
+        self.tableFooter((s,), pt)
+
+        if self.usesCurses:
+            self.window.refresh()
+
+
+class SQLStatsWindow(BaseWindow):
+    """
+    Displays the SQL statements taking the most time, and the connection pool
+    wait and transaction hold times, of all the server's processes.
+    """
+
+    help = "SQL Statistics"
+    clientItem = "sql"
+
+    windowTitle = "SQL Statistics"
+    formatWidth = 90
+    additionalRows = 9
+
+    # Number of statement shapes shown
+    maxRows = 10
+
+    emptyRecords = {"total": {
+        "statements": {}, "wait": {}, "hold": {},
+        "pool": {"held": 0, "waiting": 0}, "long": [], "open": [],
+    }}
+
+    def updateRowCount(self):
+        records = defaultIfNone(self.readItem(self.clientItem), self.emptyRecords)
+        self.rowCount = min(len(records["total"]["statements"]), self.maxRows)
+
+    def update(self):
+        records = defaultIfNone(self.clientData(), self.emptyRecords)
+        total = records["total"]
+        if min(len(total["statements"]), self.maxRows) != self.rowCount:
+            self.needsReset = True
+            return
+        self.iter += 1
+
+        s1 = " {:<48}{:>8}{:>10}{:>10}{:>12} ".format(
+            "Statement", "Count", "Average", "99%", "Total"
+        )
+        s2 = " {:<48}{:>8}{:>10}{:>10}{:>12} ".format(
+            "", "", "(ms)", "(ms)", "(ms)"
+        )
+        pt = self.tableHeader((s1, s2,), self.rowCount)
+
+        statements = sorted(total["statements"].items(), key=lambda x: x[1]["time"], reverse=True)
+        for shape, stats in statements[:self.maxRows]:
+            s = " {:<48}{:>8}{:>10.1f}{:>10.1f}{:>12.1f} ".format(
+                shape[:47],
+                stats["count"],
+                safeDivision(stats["time"], stats["count"]),
+                histogramPercentiles(stats["histogram"], (99.0,))[0],
+                stats["time"],
+            )
+            self.tableRow(s, pt)
+
+        feet = []
+        for title, histogram in (("Pool wait", total["wait"]), ("Transaction hold", total["hold"])):
+            p50, p99 = histogramPercentiles(histogram, (50.0, 99.0,))
+            feet.append(" {:<88} ".format("{:<20}{:>8} 50%: {:.1f}ms 99%: {:.1f}ms".format(
+                title + ":", histogramCount(histogram), p50, p99,
+            )))
+        feet.append(" {:<88} ".format("Connections held: {} waiting: {}  Long held: {}  Open long: {}".format(
+            total["pool"]["held"], total["pool"]["waiting"], len(total["long"]), len(total["open"]),
+        )))
+        if total["open"]:
+            oldest = total["open"][0]
+            feet.append(" {:<88} ".format("Oldest open: {:.0f}s {}".format(oldest["held"], oldest["label"])[:88]))
+        self.tableFooter(feet, pt)
+
+        if self.usesCurses:
+            self.window.refresh()
+
+
 Dashboard.registerWindow(HelpWindow, "h")
 Dashboard.registerWindow(SystemWindow, "s")
 Dashboard.registerWindow(RequestStatsWindow, "r")
@@ -1176,6 +1308,8 @@ Dashboard.registerWindow(MethodsWindow, "m")
 Dashboard.registerWindow(AssignmentsWindow, "w")
 Dashboard.registerWindow(JobsWindow, "j")
 Dashboard.registerWindow(DirectoryStatsWindow, "d")
+Dashboard.registerWindow(MemoryWindow, "e")
+Dashboard.registerWindow(SQLStatsWindow, "b")
 
 Dashboard.registerWindowSet(SystemWindow, "H")
 Dashboard.registerWindowSet(RequestStatsWindow, "H")
@@ -35,6 +35,7 @@ import sched
 import socket
 import struct
 import sys
+import math
 import termios
 import time
 
@@ -42,6 +43,47 @@ LOG_FILENAME = "db.log"
 #logging.basicConfig(filename=LOG_FILENAME, level=logging.DEBUG)
 
 
+# The parts of calendarserver.histogram needed to show the latency
+# histograms, copied here so that this tool only needs the standard library.
+# These must be kept in step with that module.
+
+DEFAULT_PERCENTILES = (50.0, 95.0, 99.0, 99.9,)
+
+_HISTOGRAM_GAMMA = (1.0 + 0.01) / (1.0 - 0.01)
+
+
+def histogramCount(histogram):
+    """
+    Return the number of values counted in a histogram.
+    """
+    return sum(histogram.values())
+
+
+def histogramPercentiles(histogram, percentiles=DEFAULT_PERCENTILES):
+    """
+    Return the values at several percentiles of a histogram, C{0.0} for an
+    empty histogram.
+    """
+    buckets = sorted([
+        (0.0 if key == "z" else 2.0 * (_HISTOGRAM_GAMMA ** int(key)) / (_HISTOGRAM_GAMMA + 1.0), count)
+        for key, count in histogram.items() if count
+    ])
+    total = sum([count for _ignore_value, count in buckets])
+    if total == 0:
+        return [0.0] * len(percentiles)
+
+    results = []
+    for percentile in percentiles:
+        rank = max(1, min(total, int(math.ceil(total * percentile / 100.0))))
+        seen = 0
+        for value, count in buckets:
+            seen += count
+            if seen >= rank:
+                results.append(value)
+                break
+    return results
+
+
 class MyHelpFormatter(HelpFormatter):
     """
     Help message formatter which adds default values to argument help and
@@ -624,10 +666,20 @@ class Aggregator(object):
                 results[key] = max(map(itemgetter(key), serversdata))
 
         # Values that are summed dict values
-        for key in ("method", "method-t", "uid", "user-agent", "T", "T-RESP-WR",):
+        for key in ("method", "method-t", "uid", "user-agent", "T", "T-RESP-WR", "T-HIST", "T-RESP-WR-HIST",):
             if key in serversdata[0]:
                 results[key] = Aggregator.dictValueSums(map(itemgetter(key), serversdata))
 
+        # Values that are dicts of histograms, summed per histogram
+        for key in ("method-hist", "user-agent-hist",):
+            if key in serversdata[0]:
+                results[key] = OrderedDict()
+                for serverdata in map(itemgetter(key), serversdata):
+                    for name, histogram in serverdata.items():
+                        results[key][name] = Aggregator.dictValueSums(
+                            (results[key].get(name, {}), histogram,)
+                        )
+
         return results
 
     @staticmethod
@@ -1240,6 +1292,61 @@ class MethodsWindow(BaseWindow):
         self.lastResult = defaultIfNone(self.clientData(), {}).get("current", {}).get("method", {})
 
 
+class LatencyWindow(BaseWindow):
+    """
+    Display response time percentiles for the previous minute, overall, per
+    request method, and per client.
+    """
+
+    help = "Response Times"
+    clientItem = "stats"
+    stats_key = "1m"
+
+    windowTitle = "Response Time Percentiles (1m)"
+    formatWidth = 92
+    additionalRows = 6
+
+    def _records(self):
+        stats = defaultIfNone(self.clientData(), {}).get(self.stats_key, {})
+        return (
+            stats.get("T-HIST", {}),
+            stats.get("method-hist", {}),
+            stats.get("user-agent-hist", {}),
+        )
+
+    def updateRowCount(self):
+        _ignore_total, methods, agents = self._records()
+        self.rowCount = len(methods) + len(agents)
+
+    def update(self):
+        total, methods, agents = self._records()
+        if len(methods) + len(agents) != self.rowCount:
+            self.needsReset = True
+            return
+        self.iter += 1
+
+        s1 = " {:<40}{:>10}{:>10}{:>10}{:>10}{:>10} ".format(
+            "Method / Client", "Number", "p50", "p95", "p99", "p99.9",
+        )
+        s2 = " {:<40}{:>10}{:>10}{:>10}{:>10}{:>10} ".format(
+            "", "", "(ms)", "(ms)", "(ms)", "(ms)",
+        )
+        pt = self.tableHeader((s1, s2,), self.rowCount)
+
+        def _row(name, histogram):
+            items = [name[:39], histogramCount(histogram)]
+            items.extend(histogramPercentiles(histogram, DEFAULT_PERCENTILES))
+            return " {:<40}{:>10}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f} ".format(*items)
+
+        for records in (methods, agents,):
+            for name in sorted(records.keys()):
+                self.tableRow(_row(name, records[name]), pt)
+
+        self.tableFooter((_row("Total:", total),), pt)
+
+        self.window.refresh()
+
+
 class AssignmentsWindow(BaseWindow):
     """
     Displays the status of the server's master process worker slave slots.
@@ -1469,6 +1576,7 @@ Dashboard.registerWindow(SystemWindow, "s")
 Dashboard.registerWindow(RequestStatsWindow, "r")
 Dashboard.registerWindow(HTTPSlotsWindow, "c")
 Dashboard.registerWindow(MethodsWindow, "m")
+Dashboard.registerWindow(LatencyWindow, "l")
 Dashboard.registerWindow(AssignmentsWindow, "w")
 Dashboard.registerWindow(JobsWindow, "j")
 Dashboard.registerWindow(DirectoryStatsWindow, "d")
@@ -27,6 +27,11 @@ storage; it does not operate by talking to the server via the network.  It
 therefore does not apply any of the access restrictions that the server would.
 As such, one should be mindful that data exported via this tool may be sensitive.
 
+With --parallel N (which requires --directory) the homes to export are split
+across N worker processes. Each worker exports one home per transaction and
+streams each collection to its file one calendar object at a time, rather than
+building the whole calendar in memory first.
+
 Please also note that this is not an appropriate tool for backups, as there is
 data associated with users and calendars beyond the iCalendar as visible to the
 owner of that calendar, including DAV properties, information about sharing, and
@@ -41,14 +46,18 @@ import shutil
 import sys
 
 from calendarserver.tools.cmdline import utilityMain, WorkerService
+from calendarserver.tools.cmdline import parseShard, workerArguments
 from twext.enterprise.dal.syntax import Select
 from twext.python.log import Logger
 from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+from twisted.internet.defer import gatherResults
+from twisted.internet.utils import getProcessValue
 from twisted.python.text import wordWrap
 from twisted.python.usage import Options, UsageError
 from twistedcaldav import customxml
 from twistedcaldav.ical import Component, Property
 from twistedcaldav.stdconfig import DEFAULT_CONFIG_FILE
+from twistedcaldav.timezones import readTZ, TimezoneException
 from txdav.base.propertystore.base import PropertyName
 from txdav.caldav.datastore.scheduling.utils import normalizeCUAddr
 from txdav.caldav.datastore.sql import Calendar
@@ -58,6 +67,9 @@ from txdav.xml import element as davxml
 
 log = Logger()
 
+# Number of calendar objects loaded at a time when streaming a collection
+STREAM_BATCH_SIZE = 100
+
 
 def usage(e=None):
     if e:
@@ -110,6 +122,8 @@ class ExportOptions(Options):
         self.exportAll = False
         self.exportAllType = "VEVENT"
         self.convertToMailto = False
+        self.parallel = 0
+        self.shard = None
 
     def opt_uid(self, uid):
         """
@@ -192,6 +206,27 @@ class ExportOptions(Options):
         else:
             self.exportAllType = "VCARD"
 
+    def opt_parallel(self, count):
+        """
+        Export using this many worker processes, each streaming its share of
+        the homes to the output directory (requires --directory).
+        """
+        try:
+            self.parallel = int(count)
+        except ValueError:
+            raise UsageError("Number of workers must be an integer: {}".format(count))
+
+    def opt_shard(self, shard):
+        """
+        Export only one share of the homes (format: 'index:count'); used by
+        --parallel worker processes.
+        """
+        self.shard = parseShard(shard)
+
+    def postOptions(self):
+        if (self.parallel or self.shard is not None) and not self.outputDirectoryName:
+            raise UsageError("--parallel requires --directory")
+
     def openOutput(self):
         """
         Open the appropriate output file based on the '--output' option.
@@ -397,6 +432,188 @@ def exportToDirectory(collections, dirname, convertToMailto=False):
                     fileobj.write(vcard.getText())
 
 
+class CalendarStreamWriter(object):
+    """
+    Writes a VCALENDAR to a file one subcomponent at a time, so that the
+    whole calendar never needs to be held in memory.
+
+    VTIMEZONEs are written once each, at the end of the VCALENDAR, for every
+    TZID that the written components refer to. They are taken from the
+    exported objects themselves where present, otherwise from the server's
+    timezone database.
+    """
+
+    def __init__(self, fileobj, convertToMailto=False):
+        self.fileobj = fileobj
+        self.convertToMailto = convertToMailto
+        self.timezones = {}
+        self.tzids = set()
+
+    def begin(self, properties=()):
+        """
+        Write the start of the VCALENDAR.
+
+        @param properties: extra VCALENDAR properties to write
+        @type properties: iterable of L{Property}
+        """
+        comp = Component.newCalendar()
+        for prop in properties:
+            comp.addProperty(prop)
+        text = str(comp)
+        self.fileobj.write(text[:text.rindex("END:VCALENDAR")])
+
+    def addCalendar(self, calendar):
+        """
+        Write all the subcomponents of a calendar object's VCALENDAR, keeping
+        its VTIMEZONEs until L{end}.
+
+        @param calendar: the calendar object data
+        @type calendar: L{Component}
+        """
+        for sub in calendar.subcomponents():
+            if sub.name() == "VTIMEZONE":
+                self.timezones.setdefault(sub.propertyValue("TZID"), sub)
+            else:
+                if self.convertToMailto:
+                    convertCUAsToMailto(sub)
+                self.tzids.update(sub.timezoneIDs())
+                self.fileobj.write(str(sub))
+
+    def end(self):
+        """
+        Write the referenced VTIMEZONEs and the end of the VCALENDAR.
+        """
+        for tzid in sorted(self.tzids):
+            if tzid in self.timezones:
+                self.fileobj.write(str(self.timezones[tzid]))
+                continue
+            try:
+                tzcal = Component.fromString(readTZ(tzid))
+            except TimezoneException:
+                # Leave it to the importer to cope, as exportToFile does
+                continue
+            for timezone in tzcal.subcomponents():
+                if timezone.name() == "VTIMEZONE":
+                    self.fileobj.write(str(timezone))
+        self.fileobj.write("END:VCALENDAR\r\n")
+
+
+@inlineCallbacks
+def streamObjects(collection, batchSize=STREAM_BATCH_SIZE):
+    """
+    Load the object resources of a collection a batch at a time.
+
+    @param collection: the collection
+    @type collection: L{CommonHomeChild}
+    @param batchSize: the number of objects to load at once
+    @type batchSize: C{int}
+
+    @return: a L{Deferred} firing with an iterator of L{Deferred}s, each
+        firing with a C{list} of the next batch of objects
+    """
+    names = yield collection.listObjectResources()
+
+    def batches():
+        # Don't use objectResourcesWithNames() as that caches every object
+        # on the collection.
+        for start in range(0, len(names), batchSize):
+            yield collection._objectResourceClass.loadAllObjectsWithNames(
+                collection, names[start:start + batchSize]
+            )
+    returnValue(batches())
+
+
+@inlineCallbacks
+def streamToFile(calendars, fileobj, convertToMailto=False):
+    """
+    Export some calendars to a file as their owner would see them, like
+    L{exportToFile}, but streaming each calendar object to the file rather
+    than building the whole calendar in memory.
+
+    @param calendars: an iterable of L{ICalendar} providers (or L{Deferred}s of
+        same).
+
+    @param fileobj: an object with a C{write} method that will accept some
+        iCalendar data.
+
+    @return: a L{Deferred} which fires when the export is complete.  (Note that
+        the file will not be closed.)
+    @rtype: L{Deferred} that fires with C{None}
+    """
+    writer = CalendarStreamWriter(fileobj, convertToMailto)
+    writer.begin()
+    for calendar in calendars:
+        calendar = yield calendar
+        yield _streamCalendar(writer, calendar)
+    writer.end()
+
+
+@inlineCallbacks
+def _streamCalendar(writer, calendar):
+    """
+    Write every object in a calendar to a L{CalendarStreamWriter}.
+    """
+    homeUID = calendar.ownerCalendarHome().uid()
+    for batch in (yield streamObjects(calendar)):
+        for obj in (yield batch):
+            evt = yield obj.filteredComponent(homeUID, True)
+            writer.addCalendar(evt)
+
+
+@inlineCallbacks
+def streamToDirectory(collections, dirname, convertToMailto=False):
+    """
+    Export some collections to a directory as their owner would see them,
+    like L{exportToDirectory}, but streaming each object to its file rather
+    than building the whole collection in memory.
+
+    @param collections: an iterable of L{ICalendar} or L{IAddressBook}
+        providers.
+
+    @param dirname: the path to a directory to store collection files in;
+        each collection being exported will have its own .ics or .vcf file
+
+    @return: a L{Deferred} which fires when the export is complete.
+    @rtype: L{Deferred} that fires with C{None}
+    """
+
+    for collection in collections:
+
+        if isinstance(collection, Calendar):
+            homeUID = collection.ownerCalendarHome().uid()
+
+            calendarProperties = collection.properties()
+            properties = []
+            for element, propertyName in (
+                (davxml.DisplayName, "NAME"),
+                (customxml.CalendarColor, "COLOR"),
+            ):
+
+                value = calendarProperties.get(PropertyName.fromElement(element), None)
+                if value:
+                    properties.append(Property(propertyName, str(value)))
+
+            source = "/calendars/__uids__/{}/{}/".format(homeUID, collection.name())
+            properties.append(Property("SOURCE", source))
+
+            filename = os.path.join(dirname, "{}_{}.ics".format(homeUID, collection.name()))
+            with open(filename, 'wb') as fileobj:
+                writer = CalendarStreamWriter(fileobj, convertToMailto)
+                writer.begin(properties)
+                yield _streamCalendar(writer, collection)
+                writer.end()
+
+        else: # addressbook
+
+            homeUID = collection.ownerAddressBookHome().uid()
+            filename = os.path.join(dirname, "{}_{}.vcf".format(homeUID, collection.name()))
+            with open(filename, 'wb') as fileobj:
+                for batch in (yield streamObjects(collection)):
+                    for obj in (yield batch):
+                        vcard = yield obj.component()
+                        fileobj.write(vcard.getText())
+
+
 def convertCUAsToMailto(comp):
     """
     Replace non-mailto: CUAs with mailto: CUAs where possible (i.e. there is an
@@ -424,25 +641,25 @@ class ExporterService(WorkerService, object):
         self.config = config
         self._directory = self.store.directoryService()
 
+        # Number of homes (or worker processes) that failed to export
+        self.failures = 0
+
     @inlineCallbacks
     def doWork(self):
         """
         Do the export, stopping the reactor when done.
         """
+        if self.options.parallel:
+            yield self.parallelExport()
+            return
+        elif self.options.shard is not None:
+            yield self.streamExport()
+            return
+
         txn = self.store.newTransaction()
 
         if self.options.exportAll:
-            if self.options.exportAllType == "VEVENT":
-                homeTable = schema.CALENDAR_HOME
-            else:
-                homeTable = schema.ADDRESSBOOK_HOME
-
-            rows = (yield Select(
-                [homeTable.OWNER_UID, ],
-                From=homeTable,
-            ).on(txn))
-            for uid in [row[0] for row in rows]:
-                self.options.exporters.append(UIDExporter(uid, exportType=self.options.exportAllType))
+            yield self.addAllHomes(txn)
 
         try:
 
@@ -452,13 +669,10 @@ class ExporterService(WorkerService, object):
             )
 
             if self.options.outputDirectoryName:
-                dirname = self.options.outputDirectoryName
-                if os.path.exists(dirname):
-                    shutil.rmtree(dirname)
-                os.mkdir(dirname)
-                yield exportToDirectory(allCollections, dirname, self.options.convertToMailto)
+                self.makeOutputDirectory()
+                yield exportToDirectory(allCollections, self.options.outputDirectoryName, self.options.convertToMailto)
             else:
-                yield exportToFile(allCollections, self.output, self.options.convertToMailto)
+                yield streamToFile(allCollections, self.output, self.options.convertToMailto)
                 self.output.close()
 
             yield txn.commit()
@@ -467,6 +681,86 @@ class ExporterService(WorkerService, object):
             # update stuff needed to happen, don't want to undo it.
         except:
             log.failure("doWork()")
+            self.failures += 1
+
+    @inlineCallbacks
+    def addAllHomes(self, txn):
+        """
+        Add an exporter for every home of the --all type, in UID order.
+        """
+        if self.options.exportAllType == "VEVENT":
+            homeTable = schema.CALENDAR_HOME
+        else:
+            homeTable = schema.ADDRESSBOOK_HOME
+
+        rows = (yield Select(
+            [homeTable.OWNER_UID, ],
+            From=homeTable,
+            OrderBy=homeTable.OWNER_UID,
+        ).on(txn))
+        for uid in [row[0] for row in rows]:
+            self.options.exporters.append(UIDExporter(uid, exportType=self.options.exportAllType))
+
+    def makeOutputDirectory(self):
+        """
+        Create an empty output directory, removing any previous one.
+        """
+        dirname = self.options.outputDirectoryName
+        if os.path.exists(dirname):
+            shutil.rmtree(dirname)
+        os.mkdir(dirname)
+
+    @inlineCallbacks
+    def parallelExport(self):
+        """
+        Export using --parallel worker processes, each doing a
+        L{streamExport} of its shard of the homes into the output directory.
+        """
+        self.makeOutputDirectory()
+        count = self.options.parallel
+        results = yield gatherResults([self.spawnWorker(index, count) for index in range(count)])
+        failed = [str(index) for index, result in enumerate(results) if result != 0]
+        if failed:
+            log.error("Export workers {workers} failed", workers=", ".join(failed))
+            self.failures += len(failed)
+
+    def spawnWorker(self, index, count):
+        """
+        Run this tool in another process to export one shard of the homes.
+
+        @return: a L{Deferred} firing with the process exit code
+        """
+        args = [sys.argv[0]] + workerArguments(
+            sys.argv[1:], "parallel", ["--shard", "{}:{}".format(index, count)]
+        )
+        return getProcessValue(sys.executable, args, env=os.environ, reactor=self.reactor)
+
+    @inlineCallbacks
+    def streamExport(self):
+        """
+        Export this worker's --shard of the homes into the (existing) output
+        directory, one home per transaction, streaming each collection. Homes
+        that fail to export are logged and counted in C{failures}.
+        """
+        if self.options.exportAll:
+            txn = self.store.newTransaction()
+            try:
+                yield self.addAllHomes(txn)
+            finally:
+                yield txn.commit()
+
+        index, count = self.options.shard
+        for exporter in self.options.exporters[index::count]:
+            txn = self.store.newTransaction()
+            try:
+                collections = yield exporter.listCollections(txn, self)
+                yield streamToDirectory(collections, self.options.outputDirectoryName, self.options.convertToMailto)
+            except:
+                log.failure("streamExport()")
+                self.failures += 1
+                yield txn.abort()
+            else:
+                yield txn.commit()
 
     def directoryService(self):
         """
@@ -509,9 +803,18 @@ def main(argv=sys.argv, stderr=sys.stderr, reactor=None):
             )
             sys.exit(1)
 
+    services = []
+
     def makeService(store):
         from twistedcaldav.config import config
         config.TransactionTimeoutSeconds = 0
-        return ExporterService(store, options, output, reactor, config)
+        service = ExporterService(store, options, output, reactor, config)
+        services.append(service)
+        return service
 
     utilityMain(options["config"], makeService, reactor, verbose=options["debug"])
+
+    # Exit non-zero if anything failed, so that a --parallel export notices
+    # failed workers
+    if [service for service in services if service.failures]:
+        sys.exit(1)
@@ -22,6 +22,11 @@ This tool imports calendar data
 This tool requires access to the calendar server's configuration and data
 storage; it does not operate by talking to the server via the network.  It
 therefore does not apply any of the access restrictions that the server would.
+
+Calendar objects are created in transactions of up to --batch-count objects or
+--batch-bytes of iCalendar data. With --parallel N (which requires
+--directory) the input files are split by calendar home across N worker
+processes.
 """
 
 from __future__ import print_function
@@ -31,8 +36,11 @@ import sys
 import uuid
 
 from calendarserver.tools.cmdline import utilityMain, WorkerService
+from calendarserver.tools.cmdline import parseShard, workerArguments
+from twext.enterprise.dal.syntax import SavepointAction
 from twext.python.log import Logger
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, returnValue, gatherResults
+from twisted.internet.utils import getProcessValue
 from twisted.python.text import wordWrap
 from twisted.python.usage import Options, UsageError
 from twistedcaldav import customxml
@@ -49,6 +57,11 @@ from txdav.xml import element as davxml
 
 log = Logger()
 
+# Default limits on the number of objects, and bytes of iCalendar data,
+# created in one transaction
+IMPORT_BATCH_COUNT = 50
+IMPORT_BATCH_BYTES = 1024 * 1024
+
 
 def usage(e=None):
     if e:
@@ -93,12 +106,16 @@ class ImportOptions(Options):
 
     optParameters = [
         ['config', 'f', DEFAULT_CONFIG_FILE, "Specify caldavd.plist configuration path."],
+        ['batch-count', '', IMPORT_BATCH_COUNT, "Maximum number of objects to create in one transaction.", int],
+        ['batch-bytes', '', IMPORT_BATCH_BYTES, "Maximum bytes of iCalendar data to create in one transaction.", int],
+        ['parallel', '', 0, "Import using this many worker processes (requires --directory).", int],
     ]
 
     def __init__(self):
         super(ImportOptions, self).__init__()
         self.inputName = '-'
         self.inputDirectoryName = None
+        self.shard = None
 
     def opt_directory(self, dirname):
         """
@@ -116,6 +133,19 @@ class ImportOptions(Options):
 
     opt_i = opt_input
 
+    def opt_shard(self, shard):
+        """
+        Import only one share of the input directory's calendar homes
+        (format: 'index:count'); used by --parallel worker processes.
+        """
+        self.shard = parseShard(shard)
+
+    def postOptions(self):
+        if (self["parallel"] or self.shard is not None) and not self.inputDirectoryName:
+            raise UsageError("--parallel requires --directory")
+        if self["batch-count"] < 1:
+            raise UsageError("--batch-count must be at least 1")
+
     def openInput(self):
         """
         Open the appropriate input file based on the '--input' option.
@@ -145,7 +175,10 @@ def getCollectionPropertyValue(collection, element):
 
 
 @inlineCallbacks
-def importCollectionComponent(store, component):
+def importCollectionComponent(
+    store, component,
+    batchCount=IMPORT_BATCH_COUNT, batchBytes=IMPORT_BATCH_BYTES
+):
     """
     Import a component representing a collection (e.g. VCALENDAR) into the
     store.
@@ -159,12 +192,19 @@ def importCollectionComponent(store, component):
     calendar-color.
 
     Subcomponents (e.g. VEVENTs) are grouped into resources by UID.  Objects
-    which have a UID already in use within the home will be skipped.
+    which have a UID already in use within the home will be skipped.  Objects
+    the owner organizes (or which are unscheduled) are created in batches,
+    each batch in one transaction.
 
     @param store: The db store to add the component to
     @type store: L{IDataStore}
     @param component: The component to store
     @type component: L{twistedcaldav.ical.Component}
+    @param batchCount: maximum number of objects to create in one transaction
+    @type batchCount: C{int}
+    @param batchBytes: maximum size of the iCalendar data of the objects
+        created in one transaction
+    @type batchBytes: C{int}
     """
 
     sourceURI = component.propertyValue("SOURCE")
@@ -197,8 +237,8 @@ def importCollectionComponent(store, component):
             )
     yield txn.commit()
 
-    # Populate the collection; NB we use a txn for each object, and we might
-    # want to batch them?
+    # Populate the collection
+    batch = _ImportBatch(store, ownerUID, collectionResourceName, batchCount, batchBytes)
     groupedComponents = Component.componentsFromComponent(component)
     for groupedComponent in groupedComponents:
 
@@ -224,24 +264,7 @@ def importCollectionComponent(store, component):
                     storeDirectly = False
 
         if storeDirectly:
-            resourceName = "{}.ics".format(str(uuid.uuid4()))
-            try:
-                yield storeComponentInHomeAndCalendar(
-                    store, groupedComponent, ownerUID, collectionResourceName,
-                    resourceName
-                )
-                print("Imported: {}".format(uid))
-            except UIDExistsError:
-                # That event is already in the home
-                print("Skipping since UID already exists: {}".format(uid))
-
-            except Exception, e:
-                print(
-                    "Failed to import due to: {error}\n{comp}".format(
-                        error=e,
-                        comp=groupedComponent
-                    )
-                )
+            yield batch.add(uid, groupedComponent)
 
         else:
             # Owner is an attendee, not the organizer
@@ -279,6 +302,127 @@ def importCollectionComponent(store, component):
                 )
                 yield txn.commit()
 
+    yield batch.flush()
+
+
+class _ImportBatch(object):
+    """
+    Calendar objects waiting to be created in a collection in one
+    transaction, bounded by number of objects and size of their iCalendar
+    data.
+    """
+
+    def __init__(self, store, homeUID, collectionResourceName, maxCount, maxBytes):
+        self.store = store
+        self.homeUID = homeUID
+        self.collectionResourceName = collectionResourceName
+        self.maxCount = maxCount
+        self.maxBytes = maxBytes
+        self.pending = []
+        self.size = 0
+
+    @inlineCallbacks
+    def add(self, uid, component):
+        """
+        Add an object to the batch, creating the batch's objects if it is
+        now full.
+        """
+        self.pending.append((uid, component,))
+        self.size += len(str(component))
+        if len(self.pending) >= self.maxCount or self.size >= self.maxBytes:
+            yield self.flush()
+
+    @inlineCallbacks
+    def flush(self):
+        """
+        Create the pending objects, reporting each one's outcome.
+        """
+        pending = self.pending
+        if not pending:
+            return
+        self.pending = []
+        self.size = 0
+
+        try:
+            results = yield storeComponentsInHomeAndCalendar(
+                self.store, [component for _ignore_uid, component in pending],
+                self.homeUID, self.collectionResourceName,
+            )
+        except Exception, e:
+            results = [e] * len(pending)
+
+        for (uid, component), error in zip(pending, results):
+            if error is None:
+                print("Imported: {}".format(uid))
+            elif isinstance(error, UIDExistsError):
+                # That event is already in the home
+                print("Skipping since UID already exists: {}".format(uid))
+            else:
+                print(
+                    "Failed to import due to: {error}\n{comp}".format(
+                        error=error,
+                        comp=component
+                    )
+                )
+
+
+@inlineCallbacks
+def storeComponentsInHomeAndCalendar(
+    store, components, homeUID, collectionResourceName
+):
+    """
+    Add several components to the store as objectResources, in one
+    transaction. Each one is created under its own savepoint so that one
+    which fails (e.g. because its UID is already in use in the home) does
+    not prevent the others being stored.
+
+    If the calendar home does not yet exist for homeUID it will be created.
+    If the collection by the name collectionResourceName does not yet exist
+    it will be created.
+
+    @param store: The db store to add the components to
+    @type store: L{IDataStore}
+    @param components: The components to store
+    @type components: C{list} of L{twistedcaldav.ical.Component}
+    @param homeUID: uid of the home collection
+    @type homeUID: C{str}
+    @param collectionResourceName: name of the collection resource
+    @type collectionResourceName: C{str}
+
+    @return: a L{Deferred} firing with a C{list} containing, for each
+        component, C{None} if it was stored or the exception that prevented
+        it being stored
+    """
+    txn = store.newTransaction()
+    try:
+        home = yield txn.calendarHomeWithUID(homeUID, create=True)
+        collection = yield home.childWithName(collectionResourceName)
+        if not collection:
+            collection = yield home.createChildWithName(collectionResourceName)
+
+        results = []
+        for component in components:
+            savepoint = SavepointAction("importObject")
+            yield savepoint.acquire(txn)
+            try:
+                yield collection._createCalendarObjectWithNameInternal(
+                    "{}.ics".format(str(uuid.uuid4())), component,
+                    ComponentUpdateState.NORMAL
+                )
+            except Exception, e:
+                yield savepoint.rollback(txn)
+                results.append(e)
+            else:
+                yield savepoint.release(txn)
+                results.append(None)
+    except:
+        yield txn.abort()
+        raise
+    else:
+        yield txn.commit()
+
+    returnValue(results)
+
 
 @inlineCallbacks
 def storeComponentInHomeAndCalendar(
@@ -331,6 +475,8 @@ class ImporterService(WorkerService, object):
         self.reactor = reactor
         self.config = config
         self._directory = self.store.directoryService()
+        # Number of imports (or worker processes) that failed
+        self.failures = 0
 
         TimezoneCache.create()
 
@@ -347,12 +493,15 @@ class ImporterService(WorkerService, object):
                         "Directory does not exist: {}\n".format(dirname)
                     )
                     sys.exit(1)
-                for filename in os.listdir(dirname):
+                if self.options["parallel"]:
+                    yield self.parallelImport()
+                    return
+                for filename in self.inputFilenames(dirname):
                     fullpath = os.path.join(dirname, filename)
                     print("Importing {}".format(fullpath))
                     with open(fullpath, 'r') as fileobj:
                         component = Component.allFromStream(fileobj)
-                    yield importCollectionComponent(self.store, component)
+                    yield self.importComponent(component)
 
             else:
                 try:
@@ -365,9 +514,65 @@ class ImporterService(WorkerService, object):
 
                 component = Component.allFromStream(input)
                 input.close()
-                yield importCollectionComponent(self.store, component)
+                yield self.importComponent(component)
         except:
             log.failure("doWork()")
+            self.failures += 1
+
+    def importComponent(self, component):
+        """
+        Import one collection's component with the --batch-count and
+        --batch-bytes limits.
+        """
+        return importCollectionComponent(
+            self.store, component,
+            self.options["batch-count"], self.options["batch-bytes"]
+        )
+
+    def inputFilenames(self, dirname):
+        """
+        List the files to import from the input directory. With --shard only
+        the files of this worker's share of the calendar homes are listed,
+        going by the C{homeUID_collection.ics} names that
+        C{calendarserver_export --directory} writes, so that no two workers
+        import into the same home.
+
+        @param dirname: the input directory
+        @type dirname: C{str}
+
+        @rtype: C{list} of C{str}
+        """
+        filenames = sorted(os.listdir(dirname))
+        if self.options.shard is not None:
+            index, count = self.options.shard
+            homes = sorted(set([filename.split("_", 1)[0] for filename in filenames]))
+            selected = set(homes[index::count])
+            filenames = [filename for filename in filenames if filename.split("_", 1)[0] in selected]
+        return filenames
+
+    @inlineCallbacks
+    def parallelImport(self):
+        """
+        Import the input directory using --parallel worker processes, each
+        importing its shard of the calendar homes.
+        """
+        count = self.options["parallel"]
+        results = yield gatherResults([self.spawnWorker(index, count) for index in range(count)])
+        failed = [str(index) for index, result in enumerate(results) if result != 0]
+        if failed:
+            log.error("Import workers {workers} failed", workers=", ".join(failed))
+            self.failures += len(failed)
+
+    def spawnWorker(self, index, count):
+        """
+        Run this tool in another process to import one shard of the homes.
+
+        @return: a L{Deferred} firing with the process exit code
+        """
+        args = [sys.argv[0]] + workerArguments(
+            sys.argv[1:], "parallel", ["--shard", "{}:{}".format(index, count)]
+        )
+        return getProcessValue(sys.executable, args, env=os.environ, reactor=self.reactor)
 
     def directoryService(self):
         """
@@ -399,8 +604,17 @@ def main(argv=sys.argv, reactor=None):
     except UsageError, e:
         usage(e)
 
+    services = []
+
     def makeService(store):
         from twistedcaldav.config import config
-        return ImporterService(store, options, reactor, config)
+        service = ImporterService(store, options, reactor, config)
+        services.append(service)
+        return service
 
     utilityMain(options["config"], makeService, reactor, verbose=options["debug"])
+
+    # Exit non-zero if anything failed, so that a --parallel import notices
+    # failed workers
+    if [service for service in services if service.failures]:
+        sys.exit(1)
@@ -22,6 +22,7 @@ import datetime
 from getopt import getopt, GetoptError
 import os
 import sys
+import time
 
 from calendarserver.tools import tables
 from calendarserver.tools.cmdline import utilityMain, WorkerService
@@ -33,12 +34,13 @@ from twext.enterprise.dal.syntax import Delete, Select, Union, Parameter, Max
 from twext.enterprise.jobs.workitem import WorkItem, RegeneratingWorkItem
 from twext.python.log import Logger
 
-from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed, \
+    DeferredSemaphore, gatherResults
 
 from twistedcaldav import caldavxml
 from twistedcaldav.config import config
 from twistedcaldav.dateops import parseSQLDateToPyCalendar, pyCalendarToSQLTimestamp
-from twistedcaldav.ical import Component, InvalidICalendarDataError
+from twistedcaldav.ical import LazyComponent, InvalidICalendarDataError
 
 from txdav.caldav.datastore.query.filter import Filter
 from txdav.common.datastore.sql_tables import schema, _HOME_STATUS_NORMAL, _BIND_MODE_OWN
@@ -48,6 +50,7 @@ log = Logger()
 
 DEFAULT_BATCH_SIZE = 100
 DEFAULT_RETAIN_DAYS = 365
+DEFAULT_TIME_BUDGET = 2.0
 
 
 class PrincipalPurgePollingWork(
@@ -275,9 +278,22 @@ class PurgeOldEventsService(WorkerService):
     uuid = None
     cutoff = None
     batchSize = None
+    timeBudget = DEFAULT_TIME_BUDGET
     dryrun = False
     debug = False
 
+    # Number of calendar homes examined by each query for old resources
+    homeBatchSize = 100
+
+    # Number of resources whose data is read and parsed together when the
+    # time range index cannot tell whether they are old, and how many such
+    # batches are in progress at once
+    evaluateBatchSize = 100
+    evaluateConcurrency = 4
+
+    # Upper limit on the number of resources removed in one transaction
+    maxRemoveBatchSize = 5000
+
     @classmethod
     def usage(cls, e=None):
 
@@ -291,6 +307,8 @@ class PurgeOldEventsService(WorkerService):
         print("  -f --config <path>: Specify caldavd.plist configuration path")
         print("  -u --uuid <uuid>: Only process this user(s) [REQUIRED]")
         print("  -d --days <number>: specify how many days in the past to retain (default=%d)" % (DEFAULT_RETAIN_DAYS,))
+        print("  -b --batch <number>: number of events to remove in the first transaction (default=%d)" % (DEFAULT_BATCH_SIZE,))
+        print("  -t --time-budget <seconds>: target duration of each removal transaction (default=%.1f)" % (DEFAULT_TIME_BUDGET,))
         print("  -n --dry-run: calculate how many events to purge, but do not purge data")
         print("  -v --verbose: print progress information")
         print("  -D --debug: debug logging")
@@ -307,9 +325,10 @@ class PurgeOldEventsService(WorkerService):
 
         try:
             (optargs, args) = getopt(
-                sys.argv[1:], "Dd:b:f:hnu:v", [
+                sys.argv[1:], "Dd:b:t:f:hnu:v", [
                     "days=",
                     "batch=",
+                    "time-budget=",
                     "dry-run",
                     "config=",
                     "uuid=",
@@ -328,6 +347,7 @@ class PurgeOldEventsService(WorkerService):
         uuid = None
         days = DEFAULT_RETAIN_DAYS
         batchSize = DEFAULT_BATCH_SIZE
+        timeBudget = DEFAULT_TIME_BUDGET
         dryrun = False
         verbose = False
         debug = False
@@ -350,6 +370,13 @@ class PurgeOldEventsService(WorkerService):
                     print("Invalid value for --batch: %s" % (arg,))
                     cls.usage(e)
 
+            elif opt in ("-t", "--time-budget"):
+                try:
+                    timeBudget = float(arg)
+                except ValueError, e:
+                    print("Invalid value for --time-budget: %s" % (arg,))
+                    cls.usage(e)
+
             elif opt in ("-v", "--verbose"):
                 verbose = True
 
@@ -383,6 +410,7 @@ class PurgeOldEventsService(WorkerService):
         cutoff.offsetDay(-days)
         cls.cutoff = cutoff
         cls.batchSize = batchSize
+        cls.timeBudget = timeBudget
         cls.dryrun = dryrun
         cls.debug = debug
 
@@ -430,120 +458,40 @@ class PurgeOldEventsService(WorkerService):
         log.debug("  Found {len} calendar homes", len=len(rows))
         returnValue(sorted(rows, key=lambda x: x[1]))
 
-    @inlineCallbacks
-    def getMatchingCalendarIDs(self, home_id, owner_uid):
-        """
-        Find all the owned calendars for the specified calendar home.
-
-        @param home_id: resource-id of calendar home to check
-        @type home_id: L{int}
-        @param owner_uid: owner UUID of home to check
-        @type owner_uid: L{str}
-        """
-        log.debug("Checking calendar home: {id} '{uid}'", id=home_id, uid=owner_uid)
-        txn = self.store.newTransaction(label="Find matching calendars")
-        cb = schema.CALENDAR_BIND
-        kwds = {"home_id": home_id}
-        rows = (yield Select(
-            [cb.CALENDAR_RESOURCE_ID, cb.CALENDAR_RESOURCE_NAME, ],
-            From=cb,
-            Where=(cb.CALENDAR_HOME_RESOURCE_ID == Parameter("home_id")).And(
-                cb.BIND_MODE == _BIND_MODE_OWN
-            ),
-        ).on(txn, **kwds))
-        yield txn.commit()
-        log.debug("  Found {len} calendars", len=len(rows))
-        returnValue(rows)
-
     PurgeEvent = collections.namedtuple("PurgeEvent", ("home", "calendar", "resource",))
 
-    @inlineCallbacks
-    def getResourceIDsToPurge(self, home_id, calendar_id, calendar_name):
-        """
-        For the given calendar find which calendar objects are older than the cut-off and return the
-        resource-ids of those.
-
-        @param home_id: resource-id of calendar home
-        @type home_id: L{int}
-        @param calendar_id: resource-id of the calendar to check
-        @type calendar_id: L{int}
-        @param calendar_name: name of the calendar to check
-        @type calendar_name: L{str}
-        """
-
-        log.debug("  Checking calendar: {id} '{name}'", id=calendar_id, name=calendar_name)
-        purge = set()
-        txn = self.store.newTransaction(label="Find matching resources")
-        co = schema.CALENDAR_OBJECT
-        tr = schema.TIME_RANGE
-        kwds = {"calendar_id": calendar_id}
-        rows = (yield Select(
-            [co.RESOURCE_ID, co.RECURRANCE_MAX, co.RECURRANCE_MIN, Max(tr.END_DATE)],
-            From=co.join(tr, on=(co.RESOURCE_ID == tr.CALENDAR_OBJECT_RESOURCE_ID)),
-            Where=(co.CALENDAR_RESOURCE_ID == Parameter("calendar_id")).And(
-                co.ICALENDAR_TYPE == "VEVENT"
-            ),
-            GroupBy=(co.RESOURCE_ID, co.RECURRANCE_MAX, co.RECURRANCE_MIN,),
-            Having=(
-                (co.RECURRANCE_MAX == None).And(Max(tr.END_DATE) < pyCalendarToSQLTimestamp(self.cutoff))
-            ).Or(
-                (co.RECURRANCE_MAX != None).And(co.RECURRANCE_MAX < pyCalendarToSQLTimestamp(self.cutoff))
-            ),
-        ).on(txn, **kwds))
-
-        log.debug("    Found {len} resources to check", len=len(rows))
-        for resource_id, recurrence_max, recurrence_min, max_end_date in rows:
-
-            recurrence_max = parseSQLDateToPyCalendar(recurrence_max) if recurrence_max else None
-            recurrence_min = parseSQLDateToPyCalendar(recurrence_min) if recurrence_min else None
-            max_end_date = parseSQLDateToPyCalendar(max_end_date) if max_end_date else None
-
-            # Find events where we know the max(end_date) represents a valid,
-            # untruncated expansion
-            if recurrence_min is None or recurrence_min < self.cutoff:
-                if recurrence_max is None:
-                    # Here we know max_end_date is the fully expand final instance
-                    if max_end_date < self.cutoff:
-                        purge.add(self.PurgeEvent(home_id, calendar_id, resource_id,))
-                    continue
-                elif recurrence_max > self.cutoff:
-                    # Here we know that there are instances newer than the cut-off
-                    # but they have not yet been indexed out that far
-                    continue
-
-            # Manually detect the max_end_date from the actual calendar data
-            calendar = yield self.getCalendar(txn, resource_id)
-            if calendar is not None:
-                if self.checkLastInstance(calendar):
-                    purge.add(self.PurgeEvent(home_id, calendar_id, resource_id,))
-
-        yield txn.commit()
-        log.debug("    Found {len} resources to purge", len=len(purge))
-        returnValue(purge)
-
-    @inlineCallbacks
-    def getCalendar(self, txn, resid):
+    def checkIndexedTimes(self, recurrence_max, recurrence_min, max_end_date):
         """
-        Get the calendar data for a calendar object resource.
-
-        @param resid: resource-id of the calendar object resource to load
-        @type resid: L{int}
+        Determine from the time range index alone whether a calendar object resource
+        is older than the cut-off.
+
+        @param recurrence_max: the RECURRANCE_MAX value of the resource
+        @type recurrence_max: L{str} or L{None}
+        @param recurrence_min: the RECURRANCE_MIN value of the resource
+        @type recurrence_min: L{str} or L{None}
+        @param max_end_date: the latest indexed instance end
+        @type max_end_date: L{str} or L{None}
+
+        @return: L{True} if the resource is old, L{False} if it is not, or L{None} if
+            the index is truncated and the calendar data has to be examined
+        @rtype: L{bool} or L{None}
         """
-        co = schema.CALENDAR_OBJECT
-        kwds = {"ResourceID": resid}
-        rows = (yield Select(
-            [co.ICALENDAR_TEXT],
-            From=co,
-            Where=(
-                co.RESOURCE_ID == Parameter("ResourceID")
-            ),
-        ).on(txn, **kwds))
-        try:
-            caldata = Component.fromString(rows[0][0]) if rows else None
-        except InvalidICalendarDataError:
-            returnValue(None)
-
-        returnValue(caldata)
+        recurrence_max = parseSQLDateToPyCalendar(recurrence_max) if recurrence_max else None
+        recurrence_min = parseSQLDateToPyCalendar(recurrence_min) if recurrence_min else None
+        max_end_date = parseSQLDateToPyCalendar(max_end_date) if max_end_date else None
+
+        # Find events where we know the max(end_date) represents a valid,
+        # untruncated expansion
+        if recurrence_min is None or recurrence_min < self.cutoff:
+            if recurrence_max is None:
+                # Here we know max_end_date is the fully expand final instance
+                return max_end_date < self.cutoff
+            elif recurrence_max > self.cutoff:
+                # Here we know that there are instances newer than the cut-off
+                # but they have not yet been indexed out that far
+                return False
+
+        return None
 
     def checkLastInstance(self, calendar):
         """
@@ -552,8 +500,16 @@ class PurgeOldEventsService(WorkerService):
 
         @param calendar: the calendar object to examine
         @type calendar: L{Component}
+
+        @raise InvalidICalendarDataError: if C{calendar} is a L{LazyComponent}
+            with invalid data
         """
 
+        # Unbounded recurrence never ends - this can be determined from a
+        # LazyComponent's summary without parsing all the data.
+        if calendar.isRecurringUnbounded():
+            return False
+
         # Is it recurring
         master = calendar.masterComponent()
         if not calendar.isRecurring() or master is None:
@@ -564,8 +520,6 @@ class PurgeOldEventsService(WorkerService):
                         return False
             else:
                 return True
-        elif calendar.isRecurringUnbounded():
-            return False
         else:
             # First test all sub-components
             # Just check the end date
@@ -586,54 +540,178 @@ class PurgeOldEventsService(WorkerService):
         return True
 
     @inlineCallbacks
-    def getResourcesToPurge(self, home_id, owner_uid):
+    def getCandidatesForHomes(self, home_ids):
+        """
+        Find the calendar object resources older than the cut-off in all the owned
+        calendars of a set of calendar homes, using a single query.
+
+        @param home_ids: resource-ids of the calendar homes to check
+        @type home_ids: L{list} of L{int}
+
+        @return: a L{tuple} of the L{set} of L{PurgeEvent}s known to be old, and the
+            L{list} of L{PurgeEvent}s whose calendar data has to be examined
+        @rtype: L{tuple}
+        """
+        log.debug("Checking {len} calendar homes", len=len(home_ids))
+        purge = set()
+        uncertain = []
+        txn = self.store.newTransaction(label="Find matching resources")
+        cb = schema.CALENDAR_BIND
+        co = schema.CALENDAR_OBJECT
+        tr = schema.TIME_RANGE
+        kwds = {"homeIDs": home_ids}
+        rows = (yield Select(
+            [
+                cb.CALENDAR_HOME_RESOURCE_ID, co.CALENDAR_RESOURCE_ID, co.RESOURCE_ID,
+                co.RECURRANCE_MAX, co.RECURRANCE_MIN, Max(tr.END_DATE),
+            ],
+            From=cb.join(
+                co, on=(cb.CALENDAR_RESOURCE_ID == co.CALENDAR_RESOURCE_ID)
+            ).join(
+                tr, on=(co.RESOURCE_ID == tr.CALENDAR_OBJECT_RESOURCE_ID)
+            ),
+            Where=(cb.CALENDAR_HOME_RESOURCE_ID.In(Parameter("homeIDs", len(home_ids)))).And(
+                cb.BIND_MODE == _BIND_MODE_OWN
+            ).And(
+                co.ICALENDAR_TYPE == "VEVENT"
+            ),
+            GroupBy=(
+                cb.CALENDAR_HOME_RESOURCE_ID, co.CALENDAR_RESOURCE_ID, co.RESOURCE_ID,
+                co.RECURRANCE_MAX, co.RECURRANCE_MIN,
+            ),
+            Having=(
+                (co.RECURRANCE_MAX == None).And(Max(tr.END_DATE) < pyCalendarToSQLTimestamp(self.cutoff))
+            ).Or(
+                (co.RECURRANCE_MAX != None).And(co.RECURRANCE_MAX < pyCalendarToSQLTimestamp(self.cutoff))
+            ),
+        ).on(txn, **kwds))
+        yield txn.commit()
+
+        for home_id, calendar_id, resource_id, recurrence_max, recurrence_min, max_end_date in rows:
+            event = self.PurgeEvent(home_id, calendar_id, resource_id,)
+            old = self.checkIndexedTimes(recurrence_max, recurrence_min, max_end_date)
+            if old is None:
+                uncertain.append(event)
+            elif old:
+                purge.add(event)
+
+        log.debug(
+            "  Found {len} resources to purge and {uncertain} to examine",
+            len=len(purge), uncertain=len(uncertain),
+        )
+        returnValue((purge, uncertain,))
+
+    @inlineCallbacks
+    def evaluateBatch(self, events):
         """
-        Find all the resource-ids of calendar object resources that need to be purged in the specified home.
+        Read and examine the calendar data of a batch of resources whose age could not
+        be determined from the time range index.
+
+        @param events: the resources to examine
+        @type events: L{list} of L{PurgeEvent}
+
+        @return: the resources that are older than the cut-off
+        @rtype: L{set} of L{PurgeEvent}
+        """
+        byID = dict([(event.resource, event) for event in events])
+        txn = self.store.newTransaction(label="Examine resources")
+        co = schema.CALENDAR_OBJECT
+        kwds = {"resourceIDs": byID.keys()}
+        rows = (yield Select(
+            [co.RESOURCE_ID, co.ICALENDAR_TEXT],
+            From=co,
+            Where=co.RESOURCE_ID.In(Parameter("resourceIDs", len(byID))),
+        ).on(txn, **kwds))
+        yield txn.commit()
+
+        purge = set()
+        for resource_id, text in rows:
+            try:
+                if self.checkLastInstance(LazyComponent.fromString(text)):
+                    purge.add(byID[resource_id])
+            except InvalidICalendarDataError:
+                continue
+        returnValue(purge)
 
-        @param home_id: resource-id of calendar home to check
-        @type home_id: L{int}
-        @param owner_uid: owner UUID of home to check
-        @type owner_uid: L{str}
+    @inlineCallbacks
+    def evaluateResources(self, events):
         """
+        Examine the calendar data of resources whose age could not be determined from
+        the time range index, several batches at a time.
+
+        @param events: the resources to examine
+        @type events: L{list} of L{PurgeEvent}
 
+        @return: the resources that are older than the cut-off
+        @rtype: L{set} of L{PurgeEvent}
+        """
+        semaphore = DeferredSemaphore(self.evaluateConcurrency)
+        results = yield gatherResults([
+            semaphore.run(self.evaluateBatch, events[i:i + self.evaluateBatchSize])
+            for i in range(0, len(events), self.evaluateBatchSize)
+        ])
         purge = set()
-        calendars = yield self.getMatchingCalendarIDs(home_id, owner_uid)
-        for calendar_id, calendar_name in calendars:
-            purge.update((yield self.getResourceIDsToPurge(home_id, calendar_id, calendar_name)))
+        for result in results:
+            purge.update(result)
+        returnValue(purge)
 
+    @inlineCallbacks
+    def getAllResourcesToPurge(self, homes):
+        """
+        Find all the calendar object resources to purge in the specified homes.
+
+        @param homes: resource-id and owner UUID of each calendar home to check
+        @type homes: L{list} of L{tuple}
+
+        @return: the resources to purge
+        @rtype: L{set} of L{PurgeEvent}
+        """
+        purge = set()
+        uncertain = []
+        for i in range(0, len(homes), self.homeBatchSize):
+            home_ids = [home_id for home_id, _ignore_owner_uid in homes[i:i + self.homeBatchSize]]
+            old, unknown = yield self.getCandidatesForHomes(home_ids)
+            purge.update(old)
+            uncertain.extend(unknown)
+
+        if uncertain:
+            purge.update((yield self.evaluateResources(uncertain)))
         returnValue(purge)
 
     @inlineCallbacks
-    def purgeResources(self, events):
+    def removeResources(self, events):
         """
-        Remove up to batchSize events and return how
-        many were removed.
+        Remove a batch of events using a fixed number of bulk statements for each
+        affected calendar, and return how many were removed.
+
+        @param events: the resources to remove
+        @type events: L{list} of L{PurgeEvent}
+
+        @return: the number of resources removed
+        @rtype: L{int}
         """
 
-        txn = self.store.newTransaction(label="Remove old events")
-        count = 0
-        last_home = None
-        last_calendar = None
+        byCalendar = collections.defaultdict(list)
         for event in events:
-            if event.home != last_home:
-                home = (yield txn.calendarHomeWithResourceID(event.home))
-                last_home = event.home
-            if event.calendar != last_calendar:
-                calendar = (yield home.childWithID(event.calendar))
-                last_calendar = event.calendar
-            resource = (yield calendar.objectResourceWithID(event.resource))
-            yield resource.purge(implicitly=False)
-            log.debug(
-                "Removed resource {id} '{name}' from calendar {pid} '{pname}' of calendar home '{uid}'",
-                id=resource.id(),
-                name=resource.name(),
-                pid=resource.parentCollection().id(),
-                pname=resource.parentCollection().name(),
-                uid=resource.parentCollection().ownerHome().uid()
-            )
-            count += 1
+            byCalendar[(event.home, event.calendar)].append(event.resource)
+
+        txn = self.store.newTransaction(label="Remove old events")
+        for (home_id, calendar_id), resourceIDs in sorted(byCalendar.items()):
+            home = yield txn.calendarHomeWithResourceID(home_id)
+            calendar = (yield home.childWithID(calendar_id)) if home is not None else None
+            if calendar is not None:
+                removed = yield calendar.removeObjectResourcesWithIDs(resourceIDs)
+                log.debug(
+                    "Removed {len} resources from calendar {pid} '{pname}' of calendar home '{uid}'",
+                    len=len(removed),
+                    pid=calendar.id(),
+                    pname=calendar.name(),
+                    uid=home.uid(),
+                )
         yield txn.commit()
-        returnValue(count)
+
+        # Resources already removed by someone else still count as done
+        returnValue(len(events))
 
     @inlineCallbacks
     def doWork(self):
@@ -655,10 +733,7 @@ class PurgeOldEventsService(WorkerService):
 
         log.info("Searching for old events...")
 
-        purge = set()
-        homes = yield self.getMatchingHomeUIDs()
-        for home_id, owner_uid in homes:
-            purge.update((yield self.getResourcesToPurge(home_id, owner_uid)))
+        purge = yield self.getAllResourcesToPurge(homes)
 
         if self.dryrun:
             eventCount = len(purge)
@@ -676,14 +751,22 @@ class PurgeOldEventsService(WorkerService):
 
         log.info("Removing {len} events older than {cutoff}...", len=len(purge), cutoff=self.cutoff)
 
-        numEventsRemoved = -1
+        # Size each removal transaction so that it takes about timeBudget seconds,
+        # starting with batchSize events
+        batchSize = self.batchSize
         totalRemoved = 0
-        while numEventsRemoved:
-            numEventsRemoved = (yield self.purgeResources(purge[:self.batchSize]))
-            if numEventsRemoved:
-                totalRemoved += numEventsRemoved
-                log.debug("  Removed {removed} of {total} events...", removed=totalRemoved, total=totalEvents)
-                purge = purge[numEventsRemoved:]
+        while purge:
+            batch = purge[:batchSize]
+            start = time.time()
+            numEventsRemoved = (yield self.removeResources(batch))
+            elapsed = time.time() - start
+            totalRemoved += numEventsRemoved
+            purge = purge[len(batch):]
+            log.debug("  Removed {removed} of {total} events...", removed=totalRemoved, total=totalEvents)
+
+            if self.timeBudget and elapsed > 0:
+                batchSize = int(len(batch) * self.timeBudget / elapsed)
+                batchSize = max(1, min(batchSize, self.maxRemoveBatchSize, len(batch) * 2))
 
         if totalRemoved == 0:
             log.info("No events were removed")
@@ -658,6 +658,75 @@ class CalVerifyDataTests(StoreTestCase):
         sync_token_new = (yield (yield self.calendarUnderTest()).syncToken())
         self.assertNotEqual(sync_token_old, sync_token_new)
 
+    @inlineCallbacks
+    def test_parallelScanBadData(self):
+        """
+        BadDataService with --parallel splits the scan into resource ID ranges
+        and merges the results of each range, and a second run with the same
+        checkpoint directory does not scan again.
+        """
+
+        yield self.commit()
+
+        options = {
+            "ical": True,
+            "fix": False,
+            "nobase64": False,
+            "verbose": False,
+            "uid": "",
+            "uuid": "",
+            "path": "",
+            "tzid": "",
+            "parallel": 3,
+            "checkpoint": self.mktemp(),
+        }
+
+        spawned = []
+
+        @inlineCallbacks
+        def _spawnWorker(lo, hi, checkpoint, logPath):
+            spawned.append((lo, hi,))
+            workerOptions = options.copy()
+            workerOptions["resource-range"] = "%d:%d" % (lo, hi,)
+            workerOptions["checkpoint"] = checkpoint
+            worker = BadDataService(self._sqlCalendarStore, workerOptions, StringIO(), reactor, config)
+            worker.rangeBatchSize = 2
+            worker.emailDomain = "example.com"
+            yield worker.doAction()
+
+        output = StringIO()
+        calverify = BadDataService(self._sqlCalendarStore, options, output, reactor, config)
+        calverify.emailDomain = "example.com"
+        self.patch(calverify, "spawnWorker", _spawnWorker)
+        yield calverify.doAction()
+
+        self.assertEqual(len(spawned), 3)
+        self.assertEqual(calverify.results["Number of events to process"], self.number_to_process)
+        self.verifyResultsByUID(calverify.results["Bad iCalendar data"], set((
+            ("home1", "BAD1",),
+            ("home1", "BAD2",),
+            ("home1", "BAD3",),
+            ("home1", "BAD4",),
+            ("home1", "BAD5",),
+            ("home1", "BAD6",),
+            ("home1", "BAD10",),
+            ("home1", "BAD11",),
+            ("home1", "BAD12",),
+            ("home1", "BAD13",),
+            ("home1", "BAD14",),
+        )))
+
+        # Resume a completed scan
+        del spawned[:]
+        calverify = BadDataService(self._sqlCalendarStore, options, StringIO(), reactor, config)
+        calverify.emailDomain = "example.com"
+        self.patch(calverify, "spawnWorker", _spawnWorker)
+        yield calverify.doAction()
+
+        self.assertEqual(spawned, [])
+        self.assertEqual(calverify.results["Number of events to process"], self.number_to_process)
+        self.assertEqual(len(calverify.results["Bad iCalendar data"]), 11)
+
 
 class CalVerifyMismatchTestsBase(StoreTestCase):
     """
@@ -26,6 +26,7 @@ from twisted.trial.unittest import TestCase
 
 from twisted.internet.defer import inlineCallbacks
 from twisted.python.modules import getModule
+from twisted.python.usage import UsageError
 
 from twext.enterprise.ienterprise import AlreadyFinishedError
 
@@ -45,7 +46,7 @@ from twisted.internet.defer import Deferred
 
 from txdav.common.datastore.test.util import populateCalendarsFrom, populateAddressBooksFrom
 
-from calendarserver.tools.export import usage, exportToFile
+from calendarserver.tools.export import usage, exportToFile, streamToFile
 from txdav.carddav.datastore.test.common import adbk1Root
 
 
@@ -156,6 +157,19 @@ class CommandLine(TestCase):
         self.assertEquals(exp.uid, "jethroUID")
         self.assertEquals(exp.collections, ["fun stuff"])
 
+    def test_parallel(self):
+        """
+        The --parallel and --shard options need --directory.
+        """
+        eo = ExportOptions()
+        eo.parseOptions(["--all", "--directory", "out", "--parallel", "4"])
+        self.assertEquals(eo.parallel, 4)
+        eo = ExportOptions()
+        eo.parseOptions(["--all", "--directory", "out", "--shard", "1:4"])
+        self.assertEquals(eo.shard, (1, 4,))
+        self.assertRaises(UsageError, ExportOptions().parseOptions, ["--all", "--parallel", "4"])
+        self.assertRaises(UsageError, ExportOptions().parseOptions, ["--all", "--directory", "out", "--shard", "4:4"])
+
     def test_outputFileSelection(self):
         """
         The --output option selects the file to write to, '-' or no parameter
@@ -384,6 +398,44 @@ class IntegrationTests(StoreTestCase):
                           # sure we don't depend on caching effects elsewhere.
                           set(["America/New_Yrok", "US/Pacific"]))
 
+    @inlineCallbacks
+    def test_streamToFile(self):
+        """
+        L{streamToFile} writes the same events as L{exportToFile}, with each
+        referenced C{VTIMEZONE} once.
+        """
+        yield populateCalendarsFrom(
+            {
+                "user01": {
+                    "calendar1": {
+                        "1.ics": (one, {}),  # EST
+                        "2.ics": (another, {}),  # EST
+                        "3.ics": (third, {})  # PST
+                    }
+                }
+            }, self.store
+        )
+        self.patch(export, "STREAM_BATCH_SIZE", 2)
+
+        results = []
+        for exporter in (exportToFile, streamToFile):
+            io = StringIO()
+            yield exporter(
+                [(yield self.txn().calendarHomeWithUID("user01"))
+                    .calendarWithName("calendar1")], io
+            )
+            results.append(Component.fromString(io.getvalue()))
+
+        def subcomponents(result, name):
+            return sorted([str(c) for c in result.subcomponents() if c.name() == name])
+
+        self.assertEquals(len(subcomponents(results[1], "VEVENT")), 3)
+        self.assertEquals(subcomponents(results[0], "VEVENT"), subcomponents(results[1], "VEVENT"))
+        self.assertEquals(
+            set([tz.propertyValue("TZID") for tz in results[1].subcomponents() if tz.name() == "VTIMEZONE"]),
+            set(["America/New_Yrok", "US/Pacific"])
+        )
+
     @inlineCallbacks
     def test_perUserFiltering(self):
         """
@@ -502,6 +554,111 @@ class IntegrationTests(StoreTestCase):
                 set([child.basename() for child in outputDir.children()])
             )
 
+    @inlineCallbacks
+    def test_exportParallel(self):
+        """
+        Run the export with --all --parallel to get a directory of calendars
+        from all calendar homes, each home exported by one of the workers.
+        """
+        yield populateCalendarsFrom(
+            {
+                "user01": {
+                    "calendar1": {
+                        "valentines-day.ics": (valentines, {}),
+                        "new-years-day.ics": (newYears, {})
+                    }
+                },
+                "user02": {
+                    "calendar1": {
+                        "valentines-day.ics": (valentines, {})
+                    },
+                    "calendar2": {
+                        "new-years-day.ics": (newYears, {})
+                    }
+                }
+            }, self.store
+        )
+
+        outputDir = FilePath(self.mktemp())
+        shards = []
+
+        def _spawnWorker(service, index, count):
+            # Run the worker in this process
+            shards.append((index, count,))
+            options = ExportOptions()
+            options.parseOptions([
+                '--directory', outputDir.path, '--all',
+                '--shard', "{}:{}".format(index, count),
+            ])
+            worker = export.ExporterService(self.store, options, None, self, None)
+            return worker.streamExport().addCallback(lambda _ignore: 0)
+
+        self.patch(export.ExporterService, "spawnWorker", _spawnWorker)
+        main(['calendarserver_export', '--directory',
+              outputDir.path, '--all', '--parallel', '2'], reactor=self)
+        yield self.waitToStop
+        self.assertEquals(sorted(shards), [(0, 2,), (1, 2,)])
+        self.assertTrue(
+            set(["user01_calendar1.ics", "user02_calendar1.ics", "user02_calendar2.ics"]).issubset(
+                set([child.basename() for child in outputDir.children()])
+            )
+        )
+        result = Component.fromString(outputDir.child("user02_calendar2.ics").getContent())
+        self.assertEquals(
+            result.propertyValue("SOURCE"),
+            "/calendars/__uids__/user02/calendar2/"
+        )
+        self.assertEquals(
+            [c.propertyValue("UID") for c in result.subcomponents() if c.name() == "VEVENT"],
+            [Component.fromString(newYears).resourceUID()]
+        )
+
+    @inlineCallbacks
+    def test_streamExportFailure(self):
+        """
+        A home that fails to export is counted in the worker's failures, and
+        the other homes are still exported.
+        """
+        yield populateCalendarsFrom(
+            {
+                "user01": {
+                    "calendar1": {
+                        "valentines-day.ics": (valentines, {}),
+                    }
+                },
+                "user02": {
+                    "calendar1": {
+                        "new-years-day.ics": (newYears, {}),
+                    }
+                }
+            }, self.store
+        )
+
+        outputDir = FilePath(self.mktemp())
+        outputDir.makedirs()
+
+        streamToDirectory = export.streamToDirectory
+
+        def _streamToDirectory(collections, dirname, convertToMailto=False):
+            collections = list(collections)
+            if [c for c in collections if c.ownerCalendarHome().uid() == "user01"]:
+                raise RuntimeError("Export failed")
+            return streamToDirectory(collections, dirname, convertToMailto)
+
+        self.patch(export, "streamToDirectory", _streamToDirectory)
+        options = ExportOptions()
+        options.parseOptions([
+            '--directory', outputDir.path, '--uid', 'user01', '--uid', 'user02',
+            '--shard', "0:1",
+        ])
+        worker = export.ExporterService(self.store, options, None, self, None)
+        yield worker.streamExport()
+        self.assertEquals(worker.failures, 1)
+        self.assertEquals(len(self.flushLoggedErrors(RuntimeError)), 1)
+        names = [child.basename() for child in outputDir.children()]
+        self.assertTrue("user02_calendar1.ics" in names)
+        self.assertEquals([name for name in names if name.startswith("user01_")], [])
+
     @inlineCallbacks
     def test_exportOneAddressbook(self):
         """
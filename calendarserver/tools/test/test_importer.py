@@ -18,17 +18,21 @@
 Unit tests for L{calendarsever.tools.importer}.
 """
 
+import os
+
+from calendarserver.tools import importer
 from calendarserver.tools.importer import (
-    importCollectionComponent, ImportException,
-    storeComponentInHomeAndCalendar
+    importCollectionComponent, ImportException, ImporterService, main,
+    storeComponentInHomeAndCalendar, storeComponentsInHomeAndCalendar
 )
 from twext.enterprise.jobs.jobitem import JobItem
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, succeed
 from twistedcaldav import customxml
 from twistedcaldav.ical import Component
 from twistedcaldav.test.util import StoreTestCase
 from txdav.base.propertystore.base import PropertyName
+from txdav.common.icommondatastore import UIDExistsError
 from txdav.xml import element as davxml
 
 
@@ -351,6 +355,47 @@ class ImportTests(StoreTestCase):
 
         yield txn.commit()
 
+    @inlineCallbacks
+    def test_ImportComponentBatches(self):
+        """
+        Objects are imported in transactions limited by size as well as count.
+        """
+
+        component = Component.allFromString(DATA_NO_SCHEDULING)
+        yield importCollectionComponent(self.store, component, batchBytes=1)
+
+        txn = self.store.newTransaction()
+        home = yield txn.calendarHomeWithUID("user01")
+        collection = yield home.childWithName("calendar")
+        objects = yield collection.listObjectResources()
+        self.assertEquals(len(objects), 2)
+        yield txn.commit()
+
+    @inlineCallbacks
+    def test_storeComponentsInHomeAndCalendar(self):
+        """
+        A component that cannot be stored does not prevent the others in the
+        same transaction being stored.
+        """
+
+        components = Component.componentsFromComponent(
+            Component.allFromString(DATA_NO_SCHEDULING)
+        )
+        results = yield storeComponentsInHomeAndCalendar(
+            self.store, [components[0], components[0].duplicate(), components[1]],
+            "user01", "calendar"
+        )
+        self.assertEquals(results[0], None)
+        self.assertTrue(isinstance(results[1], UIDExistsError))
+        self.assertEquals(results[2], None)
+
+        txn = self.store.newTransaction()
+        home = yield txn.calendarHomeWithUID("user01")
+        collection = yield home.childWithName("calendar")
+        objects = yield collection.listObjectResources()
+        self.assertEquals(len(objects), 2)
+        yield txn.commit()
+
     @inlineCallbacks
     def test_ImportComponentOrganizer(self):
 
@@ -503,3 +548,39 @@ class ImportTests(StoreTestCase):
         yield txn.commit()
 
     test_ImportComponentAttendee.todo = "Need to fix iTip reply processing"
+
+
+class ParallelImportTests(StoreTestCase):
+    """
+    Tests for C{calendarserver_import --parallel}.
+    """
+
+    def fakeUtilityMain(self, configFileName, serviceClass, reactor=None, verbose=False):
+        """
+        Create the service and run its work, in place of running the reactor.
+        """
+        self.importService = serviceClass(self.store)
+        self.importService.doWork()
+
+    def test_failedWorker(self):
+        """
+        A worker process that exits non-zero is counted in the parent's
+        failures, and L{main} exits non-zero.
+        """
+        self.patch(importer, "utilityMain", self.fakeUtilityMain)
+        workers = []
+
+        def spawnWorker(service, index, count):
+            workers.append((index, count))
+            return succeed(1 if index == 1 else 0)
+        self.patch(ImporterService, "spawnWorker", spawnWorker)
+
+        inputDir = self.mktemp()
+        os.mkdir(inputDir)
+        self.assertRaises(
+            SystemExit, main,
+            ["calendarserver_import", "--directory", inputDir, "--parallel", "3"],
+            reactor=self
+        )
+        self.assertEquals(workers, [(0, 3), (1, 3), (2, 3)])
+        self.assertEquals(self.importService.failures, 1)
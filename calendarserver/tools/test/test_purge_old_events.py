@@ -24,7 +24,7 @@ from calendarserver.tools.purge import (
     PurgeOldEventsService, PurgeAttachmentsService, PurgePrincipalService, PrincipalPurgeHomeWork
 )
 from pycalendar.datetime import DateTime
-from twext.enterprise.dal.syntax import Update, Delete
+from twext.enterprise.dal.syntax import Update, Delete, Select
 from twext.enterprise.util import parseSQLTimestamp
 from twisted.internet import reactor
 from twisted.internet.defer import inlineCallbacks, returnValue, Deferred
@@ -745,6 +745,49 @@ class PurgeOldEventsTests(StoreTestCase):
         ))
         self.assertEquals(total, 0)
 
+    @inlineCallbacks
+    def test_purgeOldEvents_bulk(self):
+        """
+        Small home and evaluation batches and a tiny time budget still remove every
+        old event, and the bulk removal records the deletions for sync.
+        """
+        self.patch(PurgeOldEventsService, "homeBatchSize", 1)
+        self.patch(PurgeOldEventsService, "evaluateBatchSize", 1)
+        self.patch(PurgeOldEventsService, "timeBudget", 0.0001)
+
+        txn = self._sqlCalendarStore.newTransaction()
+        home = (yield txn.calendarHomeWithUID("home1"))
+        calendar = (yield home.calendarWithName("calendar1"))
+        token = (yield calendar.syncToken())
+        (yield txn.commit())
+
+        total = (yield PurgeOldEventsService.purgeOldEvents(
+            self._sqlCalendarStore,
+            None,
+            DateTime(now, 4, 1, 0, 0, 0),
+            50,
+            debug=True
+        ))
+        self.assertEquals(total, 13)
+
+        txn = self._sqlCalendarStore.newTransaction()
+        home = (yield txn.calendarHomeWithUID("home1"))
+        calendar = (yield home.calendarWithName("calendar1"))
+        self.assertNotEqual((yield calendar.syncToken()), token)
+        self.assertEqual((yield calendar.calendarObjectWithName("old.ics")), None)
+        self.assertNotEqual((yield calendar.calendarObjectWithName("endless.ics")), None)
+
+        rev = schema.CALENDAR_OBJECT_REVISIONS
+        rows = (yield Select(
+            [rev.DELETED],
+            From=rev,
+            Where=(rev.CALENDAR_RESOURCE_ID == calendar.id()).And(
+                rev.RESOURCE_NAME == "old.ics"
+            ),
+        ).on(txn))
+        self.assertEqual([bool(row[0]) for row in rows], [True])
+        (yield txn.commit())
+
     @inlineCallbacks
     def test_purgeUID(self):
         txn = self._sqlCalendarStore.newTransaction()
@@ -0,0 +1,108 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Benchmark a server's handling of sharing a calendar with a varying number of
+sharees in one request. Requests alternate between inviting all the sharees
+and removing them all again, so both directions are measured.
+
+Sharees are the test accounts following the sharer, so sharing with more than
+100 users needs a directory with more test accounts than the default one (see
+conf/auth/generate_test_accounts.py).
+"""
+
+from itertools import count
+from urllib2 import HTTPDigestAuthHandler
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.web.client import Agent
+from twisted.web.http import OK
+from twisted.web.http_headers import Headers
+
+from contrib.performance.httpauth import AuthHandlerAgent
+from contrib.performance.httpclient import StringProducer
+from contrib.performance.benchlib import CalDAVAccount, sample
+
+USERGUIDS = "10000000-0000-0000-0000-%012d"
+
+SHARE = """\
+<?xml version="1.0" encoding="utf-8"?>
+<CS:share xmlns:D="DAV:" xmlns:CS="http://calendarserver.org/ns/">
+%(sharees)s</CS:share>
+"""
+
+INVITE = """\
+ <CS:set>
+  <D:href>urn:x-uid:%(uid)s</D:href>
+  <CS:summary>Shared calendar benchmark</CS:summary>
+  <CS:read-write/>
+ </CS:set>
+"""
+
+UNINVITE = """\
+ <CS:remove>
+  <D:href>urn:x-uid:%(uid)s</D:href>
+ </CS:remove>
+"""
+
+
+@inlineCallbacks
+def measure(host, port, dtrace, sharees, samples):
+    userNumber = 1
+    user = password = "user%02d" % (userNumber,)
+    root = "/"
+    principal = "/"
+    calendar = "share-calendar-benchmark"
+
+    authinfo = HTTPDigestAuthHandler()
+    authinfo.add_password(
+        realm="Test Realm",
+        uri="http://%s:%d/" % (host, port),
+        user=user,
+        passwd=password)
+    agent = AuthHandlerAgent(Agent(reactor), authinfo)
+
+    # Start from a fresh calendar with no sharees
+    account = CalDAVAccount(
+        agent,
+        "%s:%d" % (host, port),
+        user=user, password=password,
+        root=root, principal=principal)
+    cal = "/calendars/users/%s/%s/" % (user, calendar)
+    yield account.deleteResource(cal)
+    yield account.makeCalendar(cal)
+
+    uids = [USERGUIDS % (i,) for i in range(userNumber + 1, userNumber + sharees + 1)]
+    bodies = [
+        SHARE % {"sharees": "".join([template % {"uid": uid} for uid in uids])}
+        for template in (INVITE, UNINVITE)
+    ]
+
+    method = 'POST'
+    uri = 'http://%s:%d%s' % (host, port, cal)
+    headers = Headers({"content-type": ["text/xml"]})
+    params = (
+        (method, uri, headers, StringProducer(bodies[i % 2]))
+        for i in count(0))
+
+    samples = yield sample(dtrace, samples, agent, params.next, OK)
+
+    # Delete the calendar we created to leave the server in roughly the same
+    # state as we found it.
+    yield account.deleteResource(cal)
+
+    returnValue(samples)
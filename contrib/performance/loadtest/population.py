@@ -29,11 +29,13 @@ from datetime import datetime
 from urllib2 import HTTPBasicAuthHandler
 from urllib2 import HTTPDigestAuthHandler
 from urllib2 import HTTPPasswordMgrWithDefaultRealm
+from random import Random
 import collections
 import json
 import os
 
 from twisted.internet.defer import DeferredList
+from twisted.python import context
 from twisted.python.failure import Failure
 from twisted.python.filepath import FilePath
 from twisted.python.util import FancyEqMixin
@@ -41,6 +43,8 @@ from twisted.python.log import msg, err
 
 from twistedcaldav.timezones import TimezoneCache
 
+from calendarserver.histogram import histogramAdd, histogramPercentiles
+
 from contrib.performance.stats import mean, median, stddev, mad
 from contrib.performance.loadtest.trafficlogger import loggedReactor
 from contrib.performance.loadtest.logger import SummarizingMixin
@@ -169,6 +173,7 @@ class CalendarClientSimulator(object):
         self.workerIndex = workerIndex
         self.workerCount = workerCount
         self.clients = []
+        self._openLoopProfiles = []
 
         TimezoneCache.create()
 
@@ -234,7 +239,14 @@ class CalendarClientSimulator(object):
         self._stopped = True
         return DeferredList(deferreds)
 
-    def add(self, numClients, clientsPerUser):
+    def add(self, numClients, clientsPerUser, openLoop=False):
+        """
+        Add new clients to the simulation and start them running.
+
+        @param openLoop: if C{True}, profiles with an C{action} do not run
+            their own loop, but are added to those that L{arrive} chooses
+            from.
+        """
         instanceNumber = 0
         for _ignore_n in range(numClients):
             number = self._nextUserNumber()
@@ -269,6 +281,14 @@ class CalendarClientSimulator(object):
                     if profile.enabled:
                         d = profile.initialize()
 
+                        if openLoop and getattr(profile, "action", None) is not None:
+                            d.addCallback(
+                                lambda _ignore, entry=(profile, profileType, reactor,):
+                                self._openLoopProfiles.append(entry)
+                            )
+                            d.addErrback(self._profileFailure, profileType, reactor)
+                            continue
+
                         def _run(result):
                             d2 = profile.run()
                             d2.addErrback(self._profileFailure, profileType, reactor)
@@ -279,6 +299,18 @@ class CalendarClientSimulator(object):
         # really used by much anyway.
         msg(type="status", clientCount=self._user - 1)
 
+    def arrive(self):
+        """
+        Start one operation of a randomly chosen open-loop profile (see
+        L{PoissonArrival}), whether or not earlier operations have finished.
+        """
+        if self._stopped or not self._openLoopProfiles:
+            return
+        profile, profileType, reactor = self._random.choice(self._openLoopProfiles)
+        d = profile.action()
+        if d is not None:
+            d.addErrback(self._profileFailure, profileType, reactor)
+
     def _dumpLogs(self, loggingReactor, reason):
         path = FilePath(mkdtemp())
         logstate = loggingReactor.getLogFiles()
@@ -325,6 +357,63 @@ class SmoothRampUp(object):
                 self.interval * i, simulator.add, self.groupSize, self.clientsPerUser)
 
 
+class PoissonArrival(object):
+    """
+    An open-loop arrival policy. Clients are introduced as for
+    L{SmoothRampUp}, but their profiles do not run their own loops, which
+    only schedule an operation once the previous one has finished and so give
+    a slow server less load. Instead, once all the clients have been
+    introduced and a warm-up period has passed, operations of randomly chosen
+    profiles are started at Poisson distributed times with a fixed mean rate,
+    whether or not earlier operations have finished.
+
+    Arrivals are scheduled against their intended times: if the simulator
+    falls behind, the arrivals that are due are started straight away, and
+    how late they are is passed to the operation as its scheduling C{lag}, so
+    that it is included in the latency reported by L{LatencyStatistics}.
+
+    @ivar rate: the mean number of operations per second, across all the
+        workers of a distributed simulation
+    @ivar warmup: the number of seconds between the last group of clients
+        being introduced and the first arrival
+    """
+
+    def __init__(self, reactor, rate, groups, groupSize, interval, clientsPerUser, warmup=60, seed=None):
+        self.reactor = reactor
+        self.rate = rate
+        self.groups = groups
+        self.groupSize = groupSize
+        self.interval = interval
+        self.clientsPerUser = clientsPerUser
+        self.warmup = warmup
+        self.random = Random(seed)
+        self._rate = None
+        self._next = None
+
+    def run(self, simulator):
+        for i in range(self.groups):
+            self.reactor.callLater(
+                self.interval * i, simulator.add, self.groupSize, self.clientsPerUser, openLoop=True)
+        self.reactor.callLater(
+            self.interval * self.groups + self.warmup, self._start, simulator)
+
+    def _start(self, simulator):
+        # Every worker runs the same policy, so each generates its share
+        self._rate = self.rate / simulator.workerCount
+        self._next = self.reactor.seconds()
+        self._schedule(simulator)
+
+    def _schedule(self, simulator):
+        self._next += self.random.expovariate(self._rate)
+        self.reactor.callLater(
+            max(0.0, self._next - self.reactor.seconds()), self._arrive, simulator, self._next)
+
+    def _arrive(self, simulator, intended):
+        # The next arrival does not wait for this operation
+        self._schedule(simulator)
+        context.call({'lag': self.reactor.seconds() - intended}, simulator.arrive)
+
+
 class StatisticsBase(object):
 
     def observe(self, event):
@@ -611,6 +700,121 @@ class ReportStatistics(StatisticsBase, SummarizingMixin):
         return reasons
 
 
+class LatencyStatistics(SummarizingMixin):
+    """
+    End-of-run summary of the p50, p99 and p99.9 latency of each operation,
+    checked against a latency SLA. Latencies are counted in mergeable
+    histograms with a bounded relative error (see L{calendarserver.histogram})
+    rather than kept individually.
+
+    The latency of an operation is measured from when it was meant to start:
+    its scheduling lag is added to its duration, which corrects for
+    coordinated omission with an open-loop arrival policy (L{PoissonArrival}).
+    For closed-loop profiles, the expected interval between an operation's
+    starts can be configured; as with HdrHistogram's
+    C{recordValueWithExpectedInterval}, an operation that takes longer than
+    that also counts, for each operation that should have started while it
+    was outstanding, the latency that operation would have seen.
+
+    @ivar _sla: maps an operation label, or C{"default"}, to its latency
+        limits in seconds at each of L{_percentiles}
+    @ivar _expectedIntervals: maps an operation label, or C{"default"}, to
+        the expected interval in seconds between its starts
+    """
+
+    _percentiles = (50.0, 99.0, 99.9,)
+
+    _sla_default = {
+        "default": [1.0, 5.0, 10.0],
+    }
+
+    _fields = [
+        ('operation', -30, '%-30s'),
+        ('count', 8, '%8s'),
+        ('failed', 8, '%8s'),
+        ('p50 (ms)', 12, '%12.1f'),
+        ('p99 (ms)', 12, '%12.1f'),
+        ('p99.9 (ms)', 12, '%12.1f'),
+        ('STATUS', 8, '%8s'),
+    ]
+
+    _SLA_REASON = "p%(percentile)g %(operation)s latency %(value).1fms exceeded SLA of %(limit).1fms"
+
+    def __init__(self, **params):
+        self._histograms = {}
+        self._counts = {}
+        self._sla = dict(self._sla_default)
+        self._sla.update(params.get("sla", {}))
+        self._expectedIntervals = params.get("expectedIntervals", {})
+
+    def observe(self, event):
+        if event.get('type') == 'operation' and event.get('phase') == 'end':
+            self.operationEnded(event)
+
+    def operationEnded(self, event):
+        label = event['label']
+        latency = event['duration'] + max(event.get('lag') or 0.0, 0.0)
+        histogram = self._histograms.setdefault(label, {})
+        histogramAdd(histogram, latency * 1000.0)
+
+        interval = self._expectedIntervals.get(label, self._expectedIntervals.get("default"))
+        if interval:
+            missed = latency - interval
+            while missed > 0:
+                histogramAdd(histogram, missed * 1000.0)
+                missed -= interval
+
+        counts = self._counts.setdefault(label, [0, 0])
+        counts[0] += 1
+        if not event['success']:
+            counts[1] += 1
+
+    def percentiles(self, label):
+        """
+        The latencies of an operation at each of L{_percentiles}.
+
+        @return: the latencies in milliseconds
+        @rtype: L{list} of L{float}
+        """
+        return histogramPercentiles(self._histograms[label], self._percentiles)
+
+    def _exceeded(self, label):
+        """
+        The percentiles at which an operation's latency exceeds its SLA.
+
+        @return: C{list} of (percentile, latency, limit) tuples, in
+            milliseconds
+        """
+        limits = self._sla.get(label, self._sla["default"])
+        return [
+            (percentile, value, limit * 1000.0)
+            for percentile, value, limit in zip(self._percentiles, self.percentiles(label), limits)
+            if value > limit * 1000.0
+        ]
+
+    def report(self, output):
+        output.write("\n")
+        self.printHeader(output, [
+            (label, width)
+            for (label, width, _ignore_fmt) in self._fields
+        ])
+        formats = [fmt for (_ignore_label, _ignore_width, fmt) in self._fields]
+        for label in sorted(self._histograms):
+            count, failed = self._counts[label]
+            self._printRow(
+                output, formats,
+                (label, count, failed,) + tuple(self.percentiles(label)) + ("FAIL" if self._exceeded(label) else "",)
+            )
+
+    def failures(self):
+        reasons = []
+        for label in sorted(self._histograms):
+            for percentile, value, limit in self._exceeded(label):
+                reasons.append(self._SLA_REASON % dict(
+                    percentile=percentile, operation=label.upper(), value=value, limit=limit))
+        return reasons
+
+
 def main():
     import random
 
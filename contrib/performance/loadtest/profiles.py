@@ -54,6 +54,11 @@ class ProfileBase(object):
     """
     Base class which provides some conveniences for profile
     implementations.
+
+    Profiles which act on their own schedule also provide an C{action} method
+    which performs one iteration of their behavior. Open-loop arrival
+    policies (see L{contrib.performance.loadtest.population.PoissonArrival})
+    call that at their own rate instead of running the profile's loop.
     """
     random = random
 
@@ -169,6 +174,7 @@ class ProfileBase(object):
                 client_id=self._client._client_id,
                 label=label,
                 success=success,
+                lag=lag,
             )
             return passthrough
         deferred.addBoth(finished)
@@ -270,6 +276,9 @@ END:VCALENDAR
         return loopWithDistribution(
             self._reactor, self._sendInvitationDistribution, self._invite)
 
+    def action(self):
+        return self._invite()
+
     def _addAttendee(self, event, attendees):
         """
         Create a new attendee to add to the list of attendees for the
@@ -617,6 +626,9 @@ END:VCALENDAR
         )
         return Deferred()
 
+    def action(self):
+        return self._addEvent()
+
     def _addEvent(self):
         # Don't perform any operations until the client is up and running
         if not self._client.started:
@@ -908,6 +920,9 @@ END:VCALENDAR
         )
         return Deferred()
 
+    def action(self):
+        return self._updateEvent()
+
     def _initEvent(self):
         # Don't perform any operations until the client is up and running
         if not self._client.started:
@@ -1023,6 +1038,9 @@ END:VCALENDAR
         )
         return Deferred()
 
+    def action(self):
+        return self._addTask()
+
     def _addTask(self):
         # Don't perform any operations until the client is up and running
         if not self._client.started:
@@ -1073,6 +1091,9 @@ class TimeRanger(ProfileBase):
         )
         return Deferred()
 
+    def action(self):
+        return self._runQuery()
+
     def _runQuery(self):
         # Don't perform any operations until the client is up and running
         if not self._client.started:
@@ -1109,6 +1130,9 @@ class DeepRefresher(ProfileBase):
         )
         return Deferred()
 
+    def action(self):
+        return self._deepRefresh()
+
     def _deepRefresh(self):
         # Don't perform any operations until the client is up and running
         if not self._client.started:
@@ -1140,6 +1164,9 @@ class APNSSubscriber(ProfileBase):
         )
         return Deferred()
 
+    def action(self):
+        return self._apnsSubscribe()
+
     def _apnsSubscribe(self):
         # Don't perform any operations until the client is up and running
         if not self._client.started:
@@ -1171,6 +1198,9 @@ class Resetter(ProfileBase):
         )
         return Deferred()
 
+    def action(self):
+        return self._resetAccount()
+
     def _resetAccount(self):
         # Don't perform any operations until the client is up and running
         if not self._client.started:
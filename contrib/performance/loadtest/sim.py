@@ -60,7 +60,7 @@ from contrib.performance.loadtest.ical import OS_X_10_6
 from contrib.performance.loadtest.profiles import Eventer, Inviter, Accepter
 from contrib.performance.loadtest.population import (
     Populator, ProfileType, ClientType, PopulationParameters, SmoothRampUp,
-    CalendarClientSimulator)
+    PoissonArrival, CalendarClientSimulator)
 from contrib.performance.loadtest.webadmin import LoadSimAdminResource
 
 from contrib.performance.loadtest.amphub import AMPHub
@@ -167,6 +167,9 @@ class SimOptions(Options):
         ("clients", None, _defaultClients,
          "Configuration plist file name from which to read client parameters.",
          FilePath),
+        ("rate", None, None,
+         "Override the operations per second of an open-loop arrival policy.",
+         float),
     ]
 
     def opt_logfile(self, filename):
@@ -230,6 +233,12 @@ class SimOptions(Options):
         finally:
             clientFile.close()
 
+        if self['rate'] is not None:
+            arrival = self.config.get("arrival", {})
+            if "factory" not in arrival or namedAny(arrival["factory"]) is not PoissonArrival:
+                raise UsageError("--rate requires the PoissonArrival arrival policy")
+            arrival["params"]["rate"] = self['rate']
+
 
 Arrival = namedtuple('Arrival', 'factory parameters')
 
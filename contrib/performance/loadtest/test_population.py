@@ -19,9 +19,14 @@
 Tests for some things in L{loadtest.population}.
 """
 
+from cStringIO import StringIO
+
+from twisted.internet.task import Clock
+from twisted.python import context
 from twisted.trial.unittest import TestCase
 
-from contrib.performance.loadtest.population import ReportStatistics
+from contrib.performance.loadtest.population import ReportStatistics, \
+    PoissonArrival, LatencyStatistics
 
 
 class ReportStatisticsTests(TestCase):
@@ -381,3 +386,134 @@ class ReportStatisticsTests(TestCase):
             ["Greater than 50% PUT{organizer-huge} exceeded 10 second response time"],
             logger.failures()
         )
+
+
+class StubSimulator(object):
+    """
+    Records the clients added and the operations started by an arrival
+    policy.
+    """
+
+    def __init__(self, clock, workerCount=1):
+        self.clock = clock
+        self.workerCount = workerCount
+        self.added = []
+        self.arrivals = []
+
+    def add(self, numClients, clientsPerUser, openLoop=False):
+        self.added.append((self.clock.seconds(), numClients, clientsPerUser, openLoop,))
+
+    def arrive(self):
+        self.arrivals.append((self.clock.seconds(), context.get('lag'),))
+
+
+class PoissonArrivalTests(TestCase):
+    """
+    Tests for L{loadtest.population.PoissonArrival}.
+    """
+
+    def test_clientsAdded(self):
+        """
+        Clients are added for open-loop operation in groups, and operations
+        only start after the warm-up period.
+        """
+        clock = Clock()
+        sim = StubSimulator(clock)
+        PoissonArrival(clock, 10, 3, 2, 5, 1, warmup=10, seed=1).run(sim)
+        clock.pump([0] + [1] * 30)
+        self.assertEqual(sim.added, [(0, 2, 1, True,), (5, 2, 1, True,), (10, 2, 1, True,)])
+        self.assertTrue(sim.arrivals)
+        self.assertTrue(sim.arrivals[0][0] >= 25)
+
+    def test_rate(self):
+        """
+        Operations are started at the configured mean rate, divided between
+        the workers.
+        """
+        clock = Clock()
+        sim = StubSimulator(clock, workerCount=2)
+        PoissonArrival(clock, 20, 1, 1, 0, 1, warmup=0, seed=1).run(sim)
+        clock.pump([1] * 1000)
+        rate = len(sim.arrivals) / 1000.0
+        self.assertTrue(9.5 < rate < 10.5, rate)
+
+    def test_lag(self):
+        """
+        Operations that start late, because the simulator is busy, are started
+        as soon as possible and given the time since they were due as their
+        lag, independently of earlier operations.
+        """
+        clock = Clock()
+        sim = StubSimulator(clock)
+        PoissonArrival(clock, 10, 1, 1, 0, 1, warmup=0, seed=1).run(sim)
+        clock.advance(0)
+        clock.advance(10)
+        self.assertTrue(len(sim.arrivals) > 50)
+        self.assertEqual(set([when for when, _ignore_lag in sim.arrivals]), set([10]))
+        lags = [lag for _ignore_when, lag in sim.arrivals]
+        self.assertEqual(lags, sorted(lags, reverse=True))
+        self.assertTrue(lags[0] > 9.0)
+
+
+class LatencyStatisticsTests(TestCase):
+    """
+    Tests for L{loadtest.population.LatencyStatistics}.
+    """
+
+    def _end(self, logger, label, duration, lag=None, success=True):
+        logger.observe(dict(
+            type='operation', phase='end', user='user01', client_type="test",
+            client_id="1234", label=label, duration=duration, lag=lag,
+            success=success,
+        ))
+
+    def test_percentiles(self):
+        """
+        The p50, p99 and p99.9 latencies of each operation are reported in
+        milliseconds, measured from when each operation was meant to start.
+        """
+        logger = LatencyStatistics()
+        for ctr in range(1000):
+            self._end(logger, "create", 0.1, lag=0.1 if ctr < 990 else 1.9, success=ctr > 0)
+        p50, p99, p999 = logger.percentiles("create")
+        self.assertTrue(abs(p50 - 200.0) <= 2.0, p50)
+        self.assertTrue(abs(p99 - 200.0) <= 2.0, p99)
+        self.assertTrue(abs(p999 - 2000.0) <= 20.0, p999)
+
+        output = StringIO()
+        logger.report(output)
+        self.assertIn("create", output.getvalue())
+        self.assertIn("1000        1", output.getvalue())
+        self.assertEqual(logger.failures(), [])
+
+    def test_sla(self):
+        """
+        Operations whose latency percentiles exceed the SLA, either the default
+        or their own, fail the test.
+        """
+        logger = LatencyStatistics(sla={"invite": [0.5, 1.0, 1.0]})
+        for ctr in range(100):
+            self._end(logger, "create", 0.1 if ctr else 12.0)
+            self._end(logger, "invite", 0.2 if ctr % 4 == 0 else 0.8)
+        failures = logger.failures()
+        self.assertEqual(len(failures), 2, failures)
+        self.assertTrue(failures[0].startswith("p99.9 CREATE latency "), failures)
+        self.assertTrue(failures[0].endswith(" exceeded SLA of 10000.0ms"), failures)
+        self.assertTrue(failures[1].startswith("p50 INVITE latency "), failures)
+        self.assertTrue(failures[1].endswith(" exceeded SLA of 500.0ms"), failures)
+
+        output = StringIO()
+        logger.report(output)
+        self.assertEqual(output.getvalue().count("FAIL"), 2)
+
+    def test_expectedInterval(self):
+        """
+        With an expected interval, an operation that takes longer than that
+        also counts the latencies of the operations that would have started
+        while it was outstanding.
+        """
+        logger = LatencyStatistics(expectedIntervals={"default": 1.0})
+        self._end(logger, "create", 0.1)
+        self._end(logger, "create", 4.5)
+        self.assertEqual(sum(logger._histograms["create"].values()), 6)
+        self.assertEqual(logger._counts["create"], [2, 0])
@@ -17,6 +17,7 @@
 
 from plistlib import writePlistToString
 from cStringIO import StringIO
+from random import Random
 
 from twisted.python.log import msg
 from twisted.python.usage import UsageError
@@ -101,6 +102,39 @@ class SimOptionsTests(TestCase):
             str(exc),
             "--config %s: syntax error: line 1, column 0" % (config.path,))
 
+    def test_rate(self):
+        """
+        The I{rate} option overrides the rate of the arrival policy.
+        """
+        config = FilePath(self.mktemp())
+        config.setContent(writePlistToString({
+            "arrival": {"factory": "contrib.performance.loadtest.population.PoissonArrival", "params": {"rate": 10.0}},
+        }))
+        clients = FilePath(self.mktemp())
+        clients.setContent(writePlistToString({"clients": []}))
+        options = SimOptions()
+        options.parseOptions(['--config', config.path, '--clients', clients.path, '--rate', '25'])
+        self.assertEqual(options.config["arrival"]["params"]["rate"], 25.0)
+
+
+    def test_rateOtherArrival(self):
+        """
+        The I{rate} option cannot be used with arrival policies other than
+        L{PoissonArrival}, including the default one.
+        """
+        clients = FilePath(self.mktemp())
+        clients.setContent(writePlistToString({"clients": []}))
+        for config in (
+            {"arrival": {"factory": "contrib.performance.loadtest.population.SmoothRampUp", "params": {"groups": 1}}},
+            {},
+        ):
+            configFile = FilePath(self.mktemp())
+            configFile.setContent(writePlistToString(config))
+            options = SimOptions()
+            exc = self.assertRaises(
+                UsageError, options.parseOptions,
+                ['--config', configFile.path, '--clients', clients.path, '--rate', '25'])
+            self.assertEqual(str(exc), "--rate requires the PoissonArrival arrival policy")
 
 class CalendarClientSimulatorTests(TestCase):
     """
@@ -216,6 +250,73 @@ class CalendarClientSimulatorTests(TestCase):
 
         self.assertEqual([], self.flushLoggedErrors())
 
+    def test_openLoop(self):
+        """
+        Profiles with an C{action}, of clients added for open-loop operation,
+        do not run their own loop; instead
+        L{CalendarClientSimulator.arrive} performs the action of one of them.
+        Profiles without an action run as normal.
+        """
+        class Client(object):
+
+            def __init__(self, reactor, serverAddress, principalPathTemplate, serializationPath, userInfo, auth, instanceNumber):
+                pass
+
+            def run(self):
+                return Deferred()
+
+            def stop(self):
+                return succeed(None)
+
+        class Profile(object):
+
+            def __init__(self, reactor, simulator, client, userNumber):
+                self.enabled = True
+                self.runs = 0
+                profiles.append(self)
+
+            def initialize(self):
+                return succeed(None)
+
+            def run(self):
+                self.runs += 1
+                return Deferred()
+
+        class LoopProfile(Profile):
+
+            actions = 0
+
+            def action(self):
+                self.actions += 1
+                return succeed(None)
+
+        profiles = []
+        params = PopulationParameters()
+        params.addClient(1, ClientType(
+            Client, {}, [ProfileType(LoopProfile, {}), ProfileType(Profile, {})])
+        )
+        sim = CalendarClientSimulator(
+            [self._user('alice')], Populator(None), Random(1), params, None,
+            {
+                "PodA": {
+                    "enabled": True,
+                    "uri": 'http://example.org:1234/',
+                    "stats": {"enabled": False},
+                },
+            },
+            None, None)
+        sim.add(1, 1, openLoop=True)
+        loopProfile, profile = profiles
+        self.assertEqual((loopProfile.runs, profile.runs,), (0, 1,))
+
+        sim.arrive()
+        sim.arrive()
+        self.assertEqual(loopProfile.actions, 2)
+
+        sim.stop()
+        sim.arrive()
+        self.assertEqual(loopProfile.actions, 2)
+
 
 class Reactor(object):
     message = "some event to be observed"
@@ -0,0 +1,226 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+from __future__ import print_function
+
+from getopt import getopt, GetoptError
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from twext.enterprise.ienterprise import DatabaseType, POSTGRES_DIALECT
+from twext.python.filepath import CachingFilePath
+
+from twisted.application.service import Service
+from twisted.internet.defer import succeed
+
+from txdav.base.datastore.dbapiclient import DBAPIConnector
+from txdav.base.datastore.subpostgres import PostgresService
+from txdav.caldav.datastore.sql import CalendarObject
+from txdav.common.datastore.sql import current_sql_schema
+from txdav.common.datastore.sql_prepared import PreparedQuery
+
+"""
+This tool measures the cost of the store's hot queries when executed as a
+plain DAL query, as a L{PreparedQuery}, and with SQL text that differs on
+every execution (as with per-statement labels). By default the queries run
+against a throwaway PostgreSQL cluster started with L{PostgresService} and
+loaded with the server's schema; -e runs them against an existing database
+with that schema instead.
+
+The driver prepares each distinct statement text once per connection, so the
+first two only parse the statement once, but the plain DAL query generates
+its SQL text again for each execution; unique text is parsed and planned by
+the server every time.
+"""
+
+QUERIES = (
+    ("textByID", CalendarObject._textByIDQuery, {"resourceID": 1}),
+    ("allColumnsWithParentAndName", CalendarObject._allColumnsWithParentAndName, {"parentID": 1, "name": "test.ics"}),
+    ("instances", CalendarObject._instanceQuery, {"resourceID": 1}),
+)
+
+
+class SyncTransaction(object):
+    """
+    Executes DAL queries directly on a DB-API connection.
+    """
+
+    def __init__(self, connection, unique=False):
+        self.dbtype = DatabaseType(POSTGRES_DIALECT, "pyformat")
+        self.dialect = self.dbtype.dialect
+        self.paramstyle = self.dbtype.paramstyle
+        self.cursor = connection.cursor()
+        self.unique = unique
+        self.count = 0
+
+    def execSQL(self, sql, args=None, raiseOnZeroRowCount=None):
+        if self.unique:
+            self.count += 1
+            sql = "-- {}\n{}".format(self.count, sql)
+        self.cursor.execute(sql, args)
+        return succeed(self.cursor.fetchall() if self.cursor.description else None)
+
+
+def usage(e=None):
+    name = os.path.basename(sys.argv[0])
+    print("usage: %s [options]" % (name,))
+    print("")
+    print("options:")
+    print("  -h --help: print this help and exit")
+    print("  -e: endpoint of an existing database [start a throwaway cluster]")
+    print("  -d: existing database name [caldav]")
+    print("  -u: existing database user [caldav]")
+    print("  -p: existing database password")
+    print("  -n: number of executions of each query [10000]")
+    print("")
+    print("This tool measures the cost of prepared versus unprepared queries.")
+
+    if e:
+        sys.exit(64)
+    else:
+        sys.exit(0)
+
+
+def measure(connection, query, kw, count, unique=False):
+    """
+    Execute a query C{count} times and return the mean time per execution in
+    microseconds.
+    """
+    txn = SyncTransaction(connection, unique)
+    start = time.time()
+    for _ignore in xrange(count):
+        query.on(txn, **kw)
+    elapsed = time.time() - start
+    txn.cursor.close()
+    connection.rollback()
+    return elapsed * 1000000.0 / count
+
+
+def report(connection, count):
+    """
+    Measure each of the queries and print a table of the results.
+    """
+    print("{:<30}{:>12}{:>12}{:>12}".format("Query (us/execution)", "DAL", "Prepared", "Unique"))
+    for name, query, kw in QUERIES:
+        prepared = query if isinstance(query, PreparedQuery) else PreparedQuery(name, query)
+        results = (
+            measure(connection, prepared.query, kw, count),
+            measure(connection, prepared, kw, count),
+            measure(connection, prepared.query, kw, count, unique=True),
+        )
+        print("{:<30}{:>12.1f}{:>12.1f}{:>12.1f}".format(name, *results))
+
+
+class ReportService(Service):
+    """
+    Runs L{report} once the throwaway database is ready, then stops the
+    reactor.
+    """
+
+    def __init__(self, connectionFactory, storageService, count, reactor):
+        self.connectionFactory = connectionFactory
+        self.count = count
+        self.reactor = reactor
+
+    def startService(self):
+        try:
+            connection = self.connectionFactory("prepared")
+            try:
+                report(connection, self.count)
+            finally:
+                connection.close()
+        finally:
+            self.reactor.stop()
+
+
+def throwawayReport(count):
+    """
+    Start a throwaway PostgreSQL cluster with the server's schema, run
+    L{report} against it, then shut the cluster down and remove it.
+    """
+    from twisted.internet import reactor
+
+    dbRoot = tempfile.mkdtemp(prefix="prepared")
+    try:
+        svc = PostgresService(
+            CachingFilePath(dbRoot),
+            lambda connectionFactory, storageService: ReportService(
+                connectionFactory, storageService, count, reactor
+            ),
+            current_sql_schema,
+            databaseName="caldav",
+            logFile=os.path.join(dbRoot, "postgres.log"),
+            options=[
+                "-c fsync=FALSE",
+                "-c synchronous_commit=off",
+                "-c full_page_writes=FALSE",
+            ],
+        )
+        reactor.addSystemEventTrigger("during", "startup", svc.startService)
+        reactor.addSystemEventTrigger("before", "shutdown", svc.stopService)
+        reactor.run()
+    finally:
+        shutil.rmtree(dbRoot, ignore_errors=True)
+
+
+def main():
+    try:
+        (optargs, _ignore_args) = getopt(
+            sys.argv[1:], "he:d:u:p:n:", [
+                "help",
+            ],
+        )
+    except GetoptError, e:
+        usage(e)
+
+    endpoint = None
+    database = "caldav"
+    user = "caldav"
+    password = ""
+    count = 10000
+
+    for opt, arg in optargs:
+        if opt in ("-h", "--help"):
+            usage()
+        elif opt == "-e":
+            endpoint = arg
+        elif opt == "-d":
+            database = arg
+        elif opt == "-u":
+            user = arg
+        elif opt == "-p":
+            password = arg
+        elif opt == "-n":
+            count = int(arg)
+        else:
+            raise NotImplementedError(opt)
+
+    if endpoint is None:
+        throwawayReport(count)
+        return
+
+    connector = DBAPIConnector.connectorFor(
+        "postgres", endpoint=endpoint, database=database, user=user, password=password,
+    )
+    connection = connector.connect("prepared")
+    report(connection, count)
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
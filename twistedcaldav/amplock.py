@@ -0,0 +1,483 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Event-driven distributed locks served by the master process.
+
+L{MemcacheLock} polls memcached until an C{add} succeeds. Here the master
+keeps a FIFO queue of waiters for each lock name and hands the lock to the
+next waiter as soon as it is released (or its lease expires), so waiters are
+woken without polling. Every grant carries a monotonically increasing fencing
+token which the holder uses to renew its lease or release the lock; a holder
+whose lease has expired can no longer affect the lock.
+
+Workers talk to the master's L{LockManager} over the control socket AMP
+channel once the server calls L{LockService.setupForMaster} and
+L{LockService.setupForWorker}; it does not do so until something takes an
+L{AMPLock}. A process that sets up neither uses a local manager directly.
+
+These locks replace L{MemcacheLock}, not the store's C{NamedLock}s: the
+implicit scheduling UID locks stay C{NamedLock}s because they have to
+exclude every server sharing the database, not just the workers of one
+master, and be released when the transaction that took them commits or
+aborts. Waiters on a C{NamedLock} are already woken by the database rather
+than by polling.
+"""
+
+__all__ = [
+    "LockManager",
+    "LockService",
+    "AMPLock",
+    "LockTimeoutError",
+    "LockServiceUnavailableError",
+]
+
+from collections import deque
+import itertools
+
+from twext.python.log import Logger
+
+from twisted.internet.defer import Deferred, fail, inlineCallbacks, maybeDeferred, returnValue, succeed
+from twisted.internet.protocol import Factory
+from twisted.protocols import amp
+
+from twistedcaldav.memcachelock import MemcacheLockTimeoutError
+
+log = Logger()
+
+
+class LockTimeoutError(MemcacheLockTimeoutError):
+    """
+    The lock could not be acquired within the requested timeout.
+    """
+
+
+class LockServiceUnavailableError(Exception):
+    """
+    A worker is not (yet) connected to the master's lock service.
+    """
+
+
+class _LockState(object):
+    """
+    The holder and waiters of a single named lock.
+
+    @ivar fence: fencing token of the current holder, or L{None} if free
+    @ivar owner: opaque identifier of the current holder
+    @ivar lease: L{IDelayedCall} that expires the current holder's lease
+    @ivar waiters: FIFO of C{(Deferred, owner, lease, timeoutCall)}
+    """
+
+    def __init__(self):
+        self.fence = None
+        self.owner = None
+        self.lease = None
+        self.waiters = deque()
+
+
+class LockManager(object):
+    """
+    Grants named locks in FIFO order with fencing tokens and leases.
+
+    @ivar _locks: maps lock names to L{_LockState}
+    """
+
+    def __init__(self, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self._locks = {}
+        self._fences = itertools.count(1)
+
+    def acquire(self, name, owner=None, lease=0, timeout=0):
+        """
+        Acquire the named lock.
+
+        @param name: the lock name
+        @type name: C{str}
+        @param owner: identifies the requester so that its locks can be
+            dropped in bulk via L{releaseAll}
+        @param lease: seconds until the lock is released unless renewed, zero
+            for no expiry
+        @type lease: C{float}
+        @param timeout: maximum seconds to wait for the lock, zero to fail
+            immediately when it is held
+        @type timeout: C{float}
+
+        @return: a L{Deferred} that fires with the fencing token (C{int}) or
+            fails with L{LockTimeoutError}
+        """
+        state = self._locks.setdefault(name, _LockState())
+        if state.fence is None:
+            return succeed(self._grant(name, state, owner, lease))
+
+        if not timeout:
+            return fail(LockTimeoutError("Lock {} is held".format(name)))
+
+        d = Deferred()
+        waiter = [d, owner, lease, None]
+
+        def _timedOut():
+            state.waiters.remove(waiter)
+            log.debug("Timed out waiting for lock {name}", name=name)
+            d.errback(LockTimeoutError("Timed out waiting for lock {}".format(name)))
+        waiter[3] = self._reactor.callLater(timeout, _timedOut)
+        state.waiters.append(waiter)
+        log.debug("Waiting for lock {name}", name=name)
+        return d
+
+    def release(self, name, fence):
+        """
+        Release the named lock if C{fence} identifies the current holder.
+
+        @return: C{True} if the lock was released, C{False} if the caller no
+            longer held it
+        @rtype: C{bool}
+        """
+        state = self._locks.get(name)
+        if state is None or state.fence != fence:
+            return False
+        self._next(name, state)
+        return True
+
+    def renew(self, name, fence, lease):
+        """
+        Extend the lease of the current holder.
+
+        @return: C{True} if renewed, C{False} if C{fence} no longer holds the
+            lock
+        @rtype: C{bool}
+        """
+        state = self._locks.get(name)
+        if state is None or state.fence != fence:
+            return False
+        self._setLease(name, state, lease)
+        return True
+
+    def locked(self, name):
+        """
+        Test if the named lock is currently held.
+        """
+        state = self._locks.get(name)
+        return state is not None and state.fence is not None
+
+    def releaseAll(self, owner):
+        """
+        Drop every lock held, and every wait queued, by C{owner}. Used when a
+        worker's connection goes away.
+        """
+        for name, state in self._locks.items():
+            for waiter in list(state.waiters):
+                if waiter[1] == owner:
+                    state.waiters.remove(waiter)
+                    waiter[3].cancel()
+            if state.owner == owner and state.fence is not None:
+                self._next(name, state)
+
+    def _grant(self, name, state, owner, lease):
+        state.fence = next(self._fences)
+        state.owner = owner
+        self._setLease(name, state, lease)
+        return state.fence
+
+    def _setLease(self, name, state, lease):
+        if state.lease is not None and state.lease.active():
+            state.lease.cancel()
+        state.lease = None
+        if lease:
+            fence = state.fence
+
+            def _expired():
+                log.debug("Lease expired on lock {name}", name=name)
+                state.lease = None
+                self.release(name, fence)
+            state.lease = self._reactor.callLater(lease, _expired)
+
+    def _next(self, name, state):
+        """
+        Hand the lock to the first waiter, or forget it if nobody is waiting.
+        """
+        if state.lease is not None and state.lease.active():
+            state.lease.cancel()
+        state.fence = state.owner = state.lease = None
+
+        if state.waiters:
+            d, owner, lease, timeoutCall = state.waiters.popleft()
+            timeoutCall.cancel()
+            d.callback(self._grant(name, state, owner, lease))
+        else:
+            del self._locks[name]
+
+
+class AcquireLock(amp.Command):
+    arguments = [
+        ("name", amp.String()),
+        ("lease", amp.Float()),
+        ("timeout", amp.Float()),
+    ]
+    response = [
+        ("fence", amp.Integer()),
+    ]
+    errors = {
+        LockTimeoutError: "LOCK_TIMEOUT",
+    }
+
+
+class ReleaseLock(amp.Command):
+    arguments = [
+        ("name", amp.String()),
+        ("fence", amp.Integer()),
+    ]
+    response = [
+        ("released", amp.Boolean()),
+    ]
+
+
+class RenewLock(amp.Command):
+    arguments = [
+        ("name", amp.String()),
+        ("fence", amp.Integer()),
+        ("lease", amp.Float()),
+    ]
+    response = [
+        ("renewed", amp.Boolean()),
+    ]
+
+
+class IsLocked(amp.Command):
+    arguments = [
+        ("name", amp.String()),
+    ]
+    response = [
+        ("locked", amp.Boolean()),
+    ]
+
+
+class AMPLockProtocol(amp.AMP):
+    """
+    Runs in the master, serving lock requests from one worker.
+    """
+
+    def __init__(self, manager):
+        super(AMPLockProtocol, self).__init__()
+        self.manager = manager
+
+    def connectionLost(self, reason):
+        super(AMPLockProtocol, self).connectionLost(reason)
+        self.manager.releaseAll(self)
+
+    @AcquireLock.responder
+    def acquireLock(self, name, lease, timeout):
+        d = self.manager.acquire(name, owner=self, lease=lease, timeout=timeout)
+        d.addCallback(lambda fence: {"fence": fence})
+        return d
+
+    @ReleaseLock.responder
+    def releaseLock(self, name, fence):
+        return {"released": self.manager.release(name, fence)}
+
+    @RenewLock.responder
+    def renewLock(self, name, fence, lease):
+        return {"renewed": self.manager.renew(name, fence, lease)}
+
+    @IsLocked.responder
+    def isLocked(self, name):
+        return {"locked": self.manager.locked(name)}
+
+
+class AMPLockReceiverFactory(Factory):
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def buildProtocol(self, addr):
+        return AMPLockProtocol(self.manager)
+
+
+class AMPLockSendingFactory(Factory):
+
+    def __init__(self, client):
+        self.client = client
+
+    def buildProtocol(self, addr):
+        protocol = amp.AMP()
+        self.client.protocol = protocol
+        return protocol
+
+
+class AMPLockClient(object):
+    """
+    Runs in the workers, forwarding lock requests to the master via AMP.
+    Provides the same methods as L{LockManager}.
+    """
+
+    def __init__(self, controlSocket=None, protocol=None):
+        self.protocol = protocol
+        if controlSocket is not None:
+            controlSocket.addFactory(LockService.LOCK_ROUTE, AMPLockSendingFactory(self))
+
+    def _callRemote(self, command, result, **kwds):
+        """
+        Send a command to the master and return the C{result} item of its
+        response.
+
+        @raise LockServiceUnavailableError: (via the L{Deferred}) if there is
+            no connection to the master
+        """
+        if self.protocol is None:
+            return fail(LockServiceUnavailableError("Not connected to the lock service"))
+        d = self.protocol.callRemote(command, **kwds)
+        d.addCallback(lambda response: response[result])
+        return d
+
+    def acquire(self, name, owner=None, lease=0, timeout=0):
+        return self._callRemote(AcquireLock, "fence", name=name, lease=float(lease), timeout=float(timeout))
+
+    def release(self, name, fence):
+        return self._callRemote(ReleaseLock, "released", name=name, fence=fence)
+
+    def renew(self, name, fence, lease):
+        return self._callRemote(RenewLock, "renewed", name=name, fence=fence, lease=float(lease))
+
+    def locked(self, name):
+        return self._callRemote(IsLocked, "locked", name=name)
+
+
+class LockService(object):
+    """
+    Holds the lock manager for this process. The master calls
+    L{setupForMaster} and workers call L{setupForWorker}; a process that does
+    neither (e.g. a single process server) gets a local L{LockManager}.
+    """
+
+    # Control socket message-routing constant
+    LOCK_ROUTE = "lock"
+
+    _manager = None
+
+    @classmethod
+    def setupForMaster(cls, controlSocket):
+        cls._manager = LockManager()
+        controlSocket.addFactory(cls.LOCK_ROUTE, AMPLockReceiverFactory(cls._manager))
+
+    @classmethod
+    def setupForWorker(cls, controlSocket):
+        cls._manager = AMPLockClient(controlSocket)
+
+    @classmethod
+    def manager(cls):
+        if cls._manager is None:
+            cls._manager = LockManager()
+        return cls._manager
+
+    @classmethod
+    def reset(cls):
+        cls._manager = None
+
+
+class AMPLock(object):
+    """
+    A lock with the same interface as L{MemcacheLock}, backed by the
+    L{LockService}.
+
+    @ivar fence: the fencing token of the current grant, or L{None}
+    """
+
+    log = Logger()
+
+    def __init__(self, namespace, locktoken, timeout=5.0, retry_interval=0.1, expire_time=0, manager=None):
+        """
+        @param namespace: a unique namespace for this lock's tokens
+        @type namespace: C{str}
+        @param locktoken: the name of the locktoken
+        @type locktoken: C{str}
+        @param timeout: the maximum time in seconds that the lock should block
+        @type timeout: C{float}
+        @param retry_interval: unused, accepted for compatibility with
+            L{MemcacheLock}
+        @type retry_interval: C{float}
+        @param expire_time: the lease in seconds, renewable via L{renew}.
+            Zero: no expiration.
+        @type expire_time: C{float}
+        @param manager: the L{LockManager} (or L{AMPLockClient}) to use,
+            defaults to the L{LockService} one
+        """
+
+        self._name = "%s:%s" % (namespace, locktoken)
+        self._locktoken = locktoken
+        self._timeout = timeout
+        self._expire_time = expire_time
+        self._manager = manager
+        self.fence = None
+
+    def _getManager(self):
+        return self._manager if self._manager is not None else LockService.manager()
+
+    @inlineCallbacks
+    def acquire(self):
+
+        assert self.fence is None, "Lock already acquired."
+
+        try:
+            self.fence = (yield self._getManager().acquire(
+                self._name, lease=self._expire_time, timeout=self._timeout
+            ))
+        except LockTimeoutError:
+            self.log.debug("Timed out lock after waiting on {t}", t=self._locktoken)
+            raise
+        returnValue(True)
+
+    @inlineCallbacks
+    def renew(self, expire_time=None):
+        """
+        Extend the lease on a held lock.
+
+        @return: C{True} if the lease was extended, C{False} if the lock was
+            lost because the lease had already expired
+        """
+
+        assert self.fence is not None, "Lock not acquired."
+
+        if expire_time is not None:
+            self._expire_time = expire_time
+        renewed = (yield self._getManager().renew(self._name, self.fence, self._expire_time))
+        if not renewed:
+            self.log.error("Lost lock {t} before renewal", t=self._locktoken)
+            self.fence = None
+        returnValue(renewed)
+
+    @inlineCallbacks
+    def release(self):
+
+        assert self.fence is not None, "Lock not acquired."
+
+        fence, self.fence = self.fence, None
+        result = (yield self._getManager().release(self._name, fence))
+        returnValue(result)
+
+    def clean(self):
+
+        if self.fence is not None:
+            return self.release()
+        else:
+            return succeed(True)
+
+    def locked(self):
+        """
+        Test if the lock is currently being held.
+        """
+
+        return maybeDeferred(self._getManager().locked, self._name)
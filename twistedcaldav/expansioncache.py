@@ -0,0 +1,190 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Cross-request cache of recurrence expansions.
+
+L{Component.cacheExpandedTimeRanges} caches the instances of a component on
+the component itself, which only lasts as long as the request that loaded
+it. Components loaded from the store are given an C{expansionCacheKey} of
+their resource ID, MD5 and per-user variant, and their expansions are also
+kept here, in a compact form, so the next request for the same resource data
+does not expand it again.
+
+There is a bounded, least recently used, per-process tier and, when
+configured, a memcached tier shared by all processes. Entries are looked up
+by resource ID and only used if the MD5 matches, so a stale entry is never
+used; entries are also removed when the resource is written or removed.
+"""
+
+__all__ = [
+    "ExpansionCache",
+    "expansionCache",
+]
+
+from collections import OrderedDict
+
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+
+from twext.python.log import Logger
+
+from twistedcaldav.config import config
+from twistedcaldav.memcacher import Memcacher
+
+
+class ExpansionCache(object):
+    """
+    Cache of the compact form of L{InstanceList}s (see
+    L{InstanceList.toCompact}), per resource. Each entry is a C{tuple} of
+    the resource's MD5 and a C{dict} mapping a variant (the per-user data
+    filtering and invalid instance handling of the expansion) to the compact
+    instances.
+    """
+    log = Logger()
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._memcacher = None
+
+    def _memcache(self):
+        """
+        The memcached tier, if configured.
+
+        @rtype: L{Memcacher} or C{None}
+        """
+        if not (config.ExpansionCache.MemcachedEnabled and config.Memcached.Pools.Default.ClientEnabled):
+            return None
+        if self._memcacher is None:
+            self._memcacher = Memcacher("ExpansionCache", pickle=True)
+        return self._memcacher
+
+    def _store(self, resourceID, entry):
+        self._entries.pop(resourceID, None)
+        self._entries[resourceID] = entry
+        while len(self._entries) > config.ExpansionCache.MaxResources:
+            self._entries.popitem(last=False)
+
+    def get(self, key, variant):
+        """
+        Get a cached expansion from the per-process tier.
+
+        @param key: the resource ID and MD5 of the resource
+        @type key: C{tuple}
+        @param variant: the variant of the expansion
+        @type variant: C{tuple}
+
+        @return: the compact instances, or C{None} if not cached
+        @rtype: C{tuple}
+        """
+        if not config.ExpansionCache.Enabled:
+            return None
+        resourceID, md5 = key
+        entry = self._entries.get(resourceID)
+        if entry is None or entry[0] != md5:
+            return None
+
+        # Most recently used
+        self._store(resourceID, entry)
+        return entry[1].get(variant)
+
+    def set(self, key, variant, compact):
+        """
+        Cache an expansion in the per-process tier and, if configured, the
+        memcached tier.
+
+        @param key: the resource ID and MD5 of the resource
+        @type key: C{tuple}
+        @param variant: the variant of the expansion
+        @type variant: C{tuple}
+        @param compact: the compact instances
+        @type compact: C{tuple}
+
+        @return: a L{Deferred} that fires when the memcached tier is updated
+        """
+        if not config.ExpansionCache.Enabled:
+            return succeed(None)
+        resourceID, md5 = key
+        entry = self._entries.get(resourceID)
+        if entry is None or entry[0] != md5:
+            entry = (md5, {})
+        entry[1][variant] = compact
+        self._store(resourceID, entry)
+
+        memcacher = self._memcache()
+        if memcacher is None:
+            return succeed(None)
+        d = memcacher.set(str(resourceID), entry, expireTime=config.ExpansionCache.ExpireSeconds)
+        d.addErrback(lambda f: self.log.error("Unable to write expansion cache for {id}: {f}", id=resourceID, f=f))
+        return d
+
+    @inlineCallbacks
+    def prefetch(self, key):
+        """
+        Make sure a resource's entry from the memcached tier, if any, is in
+        the per-process tier, so that L{get} (which cannot wait for memcached)
+        finds it.
+
+        @param key: the resource ID and MD5 of the resource
+        @type key: C{tuple}
+
+        @return: a L{Deferred} that fires with C{True} if the per-process
+            tier has an entry for the resource
+        """
+        if not config.ExpansionCache.Enabled:
+            returnValue(False)
+        resourceID, md5 = key
+        entry = self._entries.get(resourceID)
+        if entry is not None and entry[0] == md5:
+            returnValue(True)
+
+        memcacher = self._memcache()
+        if memcacher is None:
+            returnValue(False)
+        try:
+            entry = yield memcacher.get(str(resourceID))
+        except Exception as e:
+            self.log.error("Unable to read expansion cache for {id}: {ex}", id=resourceID, ex=e)
+            entry = None
+        if entry is None or entry[0] != md5:
+            returnValue(False)
+        self._store(resourceID, entry)
+        returnValue(True)
+
+    def invalidate(self, resourceID):
+        """
+        Remove the cached expansions of a resource that is being written or
+        removed.
+
+        @param resourceID: the resource ID
+        @type resourceID: C{int}
+
+        @return: a L{Deferred} that fires when the memcached tier is updated
+        """
+        self._entries.pop(resourceID, None)
+        memcacher = self._memcache()
+        if memcacher is None:
+            return succeed(None)
+        return memcacher.delete(str(resourceID))
+
+    def clear(self):
+        """
+        Empty the per-process tier.
+        """
+        self._entries.clear()
+
+
+# The cache for this process
+expansionCache = ExpansionCache()
@@ -21,10 +21,13 @@ iCalendar Utilities
 
 __all__ = [
     "InvalidICalendarDataError",
+    "TooBigICalendarDataError",
     "iCalendarProductID",
     "allowedComponents",
     "Property",
     "Component",
+    "ComponentParser",
+    "LazyComponent",
     "tzexpand",
 ]
 
@@ -37,14 +40,14 @@ import uuid
 
 from twisted.internet.defer import inlineCallbacks, returnValue
 from twext.python.log import Logger
-from txweb2.stream import IStream
-from txweb2.dav.util import allDataFromStream
+from txweb2.stream import IStream, readStream
 
 from twistedcaldav.accounting import accountingEnabledForCategory, \
     emitAccounting
 from twistedcaldav.config import config
 from twistedcaldav.dateops import timeRangesOverlap, normalizeForIndex, differenceDateTime, \
     normalizeForExpand
+from twistedcaldav.expansioncache import expansionCache
 from twistedcaldav.instance import InstanceList, InvalidOverriddenInstanceError
 from twistedcaldav.timezones import hasTZ
 
@@ -175,6 +178,12 @@ class InvalidICalendarDataError(ValueError):
     pass
 
 
+class TooBigICalendarDataError(InvalidICalendarDataError):
+    """
+    Calendar data exceeds a size or component count limit.
+    """
+
+
 class Property (object):
     """
     iCalendar Property
@@ -387,6 +396,11 @@ class Component (object):
 
     allowedTypesList = None
 
+    # Set on components loaded from the store to the resource ID, MD5 and
+    # per-user variant of the stored data, to share expansions across requests
+    # via the expansion cache. Cleared when the component is changed.
+    expansionCacheKey = None
+
     @classmethod
     def allowedTypes(cls):
         if cls.allowedTypesList is None:
@@ -466,22 +480,24 @@ class Component (object):
         return clazz(None, pycalendar=result)
 
     @classmethod
-    def fromIStream(clazz, stream, format=None):
+    def fromIStream(clazz, stream, format=None, maxSize=None, maxComponents=None):
         """
-        Construct a L{Component} from a stream.
+        Construct a L{Component} from a stream, parsing the data as it
+        arrives with a L{ComponentParser}.
         @param stream: an L{IStream} containing iCalendar data.
+        @param maxSize: maximum size of the calendar data, or C{None}
+        @param maxComponents: maximum number of components, or C{None}
         @return: a deferred returning a L{Component} representing the first
             component described by C{stream}.
         """
-        #
-        # FIXME:
-        #   This reads the request body into a string and then parses it.
-        #   A better solution would parse directly and incrementally from the
-        #   request stream.
-        #
-        def parse(data):
-            return clazz.fromString(data, format)
-        return allDataFromStream(IStream(stream), parse)
+        parser = ComponentParser(format, maxSize=maxSize, maxComponents=maxComponents)
+
+        def finish(_ignore):
+            result = parser.finish()
+            if result is None:
+                raise InvalidICalendarDataError("No calendar data")
+            return result
+        return readStream(IStream(stream), parser.feed).addCallback(finish)
 
     @classmethod
     def componentsFromData(cls, data, format):
@@ -607,6 +623,7 @@ class Component (object):
         Invalidate the cached copy of serialized icalendar data
         """
         self._cachedCopy = None
+        self.expansionCacheKey = None
         parent = getattr(self, "_parent", None)
         if parent is not None:
             parent._markAsDirty()
@@ -1425,11 +1442,29 @@ class Component (object):
                 # so return cached instances
                 return self.cachedInstances
 
+        # Then for an expansion of the same stored data by an earlier request
+        key = self.expansionCacheKey
+        if key is not None:
+            resourceID, md5, user = key
+            variant = (user, ignoreInvalidInstances,)
+            compact = expansionCache.get((resourceID, md5,), variant)
+            if compact is not None:
+                cachedLimit = compact[0]
+                if cachedLimit is None or DateTime.parseText(cachedLimit) > limit:
+                    instances = InstanceList.fromCompact(compact, self.subcomponents(), ignoreInvalidInstances)
+                    if instances is not None:
+                        self.cachedInstances = instances
+                        return self.cachedInstances
+
         lookAheadLimit = limit + Duration(days=365)
         self.cachedInstances = self.expandTimeRanges(
             lookAheadLimit,
             ignoreInvalidInstances=ignoreInvalidInstances
         )
+
+        # Only share the expansion if it did not change this component
+        if key is not None and self.expansionCacheKey == key and self.mainType() in ("VEVENT", "VTODO",):
+            expansionCache.set((resourceID, md5,), variant, self.cachedInstances.toCompact())
         return self.cachedInstances
 
     def expandTimeRanges(self, limit, lowerLimit=None, ignoreInvalidInstances=False, normalizeFunction=normalizeForIndex):
@@ -1577,6 +1612,7 @@ class Component (object):
                         didCancel = True
 
                         # We changed the instance set so remove any instance cache
+                        self._markAsDirty()
                         if hasattr(self, "cachedInstances"):
                             delattr(self, "cachedInstances")
                         break
@@ -3665,6 +3701,396 @@ END:VCALENDAR
         else:
             return len(tuple(self.properties("ATTACH")))
 
+
+class ComponentParser(object):
+    """
+    Builds a L{Component} from calendar data that arrives in chunks, e.g.
+    from a request stream, without first joining all the data into one
+    string.
+
+    iCalendar data is unfolded as it arrives, and each top-level component
+    (e.g. a VEVENT) is parsed as soon as it is complete, so only the parsed
+    components and the text of the current one are held in memory. Size and
+    component count limits are checked as the data arrives, so an oversized
+    body is rejected before all of it has been read.
+
+    Other formats (jCal) are buffered and parsed when complete.
+
+    @ivar length: the number of bytes fed to the parser
+    @type length: L{int}
+    """
+
+    # VCALENDAR properties used to parse each top-level component on its own
+    _wrapperHeader = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:" + iCalendarProductID]
+
+    def __init__(self, format=None, maxSize=None, maxComponents=None):
+        """
+        @param format: the MIME type of the data, C{None} for iCalendar
+        @type format: L{str}
+        @param maxSize: maximum size of the calendar data, not counting
+            VTIMEZONEs (which the store may remove), or C{None} for no limit
+        @type maxSize: L{int}
+        @param maxComponents: maximum number of components within the
+            VCALENDAR, at any depth, or C{None} for no limit
+        @type maxComponents: L{int}
+        """
+        self.format = format
+        self.incremental = format in (None, "text/calendar",)
+        self.maxSize = maxSize
+        self.maxComponents = maxComponents
+
+        self.length = 0
+        self.size = 0
+        self.componentCount = 0
+
+        self._chunks = []
+        self._remainder = ""
+        self._line = None
+        self._depth = 0
+        self._ended = False
+        self._header = []
+        self._block = []
+        self._blockName = None
+        self._components = []
+
+    def feed(self, data):
+        """
+        Parse the next chunk of data.
+
+        @param data: the data
+        @type data: L{str}
+
+        @raise InvalidICalendarDataError: if the data is not valid
+        @raise TooBigICalendarDataError: if the data exceeds a limit
+        """
+        data = str(data)
+        if not data:
+            return
+        if self.length == 0 and data[:3] == codecs.BOM_UTF8:
+            # No BOMs please
+            data = data[3:]
+        self.length += len(data)
+
+        if not self.incremental:
+            self._chunks.append(data)
+            return
+
+        lines = (self._remainder + data).split("\n")
+        self._remainder = lines.pop()
+        for line in lines:
+            self._physicalLine(line)
+
+    def finish(self):
+        """
+        Complete the parse once all the data has been fed.
+
+        @return: the VCALENDAR, or C{None} if no data was fed
+        @rtype: L{Component}
+
+        @raise InvalidICalendarDataError: if the data is not valid
+        """
+        if self.length == 0:
+            return None
+
+        if not self.incremental:
+            data = "".join(self._chunks)
+            self._chunks = []
+            return Component.fromString(data, self.format)
+
+        if self._remainder:
+            self._physicalLine(self._remainder)
+            self._remainder = ""
+        if self._line is not None:
+            self._logicalLine("".join(self._line))
+            self._line = None
+        if not self._ended:
+            raise InvalidICalendarDataError("Missing END:VCALENDAR")
+
+        calendar = self._parse(self._header + ["END:VCALENDAR"], wrap=False)
+        for component in self._components:
+            calendar.addComponent(component)
+        self._components = []
+        return calendar
+
+    def _physicalLine(self, line):
+        """
+        Unfold one line of data.
+        """
+        if line.endswith("\r"):
+            line = line[:-1]
+        if line[:1] in (" ", "\t",):
+            if self._line is None:
+                raise InvalidICalendarDataError("Continuation line without a property")
+            self._line.append(line[1:])
+        else:
+            if self._line is not None:
+                self._logicalLine("".join(self._line))
+            self._line = [line] if line else None
+
+    def _logicalLine(self, line):
+        """
+        Process one unfolded line.
+        """
+        if self._ended:
+            raise InvalidICalendarDataError("Data after END:VCALENDAR")
+
+        counted = self._blockName != "VTIMEZONE"
+        name = line.split(":", 1)[0].upper()
+        if name == "BEGIN":
+            componentName = line[6:].strip().upper()
+            if self._depth == 0:
+                if componentName != "VCALENDAR":
+                    raise InvalidICalendarDataError("Not a VCALENDAR: {}".format(componentName))
+                self._header.append(line)
+            else:
+                self.componentCount += 1
+                if self.maxComponents and self.componentCount > self.maxComponents:
+                    raise TooBigICalendarDataError("More than {} components".format(self.maxComponents))
+                if self._depth == 1:
+                    self._blockName = componentName
+                    self._block = []
+                self._block.append(line)
+            self._depth += 1
+
+        elif name == "END":
+            self._depth -= 1
+            if self._depth == 0:
+                self._ended = True
+            elif self._depth < 0:
+                raise InvalidICalendarDataError("Unexpected END")
+            else:
+                self._block.append(line)
+                if self._depth == 1:
+                    self._components.extend(self._parse(self._block, wrap=True).subcomponents())
+                    self._block = []
+                    self._blockName = None
+
+        elif self._depth == 0:
+            raise InvalidICalendarDataError("Data outside VCALENDAR")
+
+        elif self._depth == 1:
+            self._header.append(line)
+
+        else:
+            self._block.append(line)
+
+        if counted:
+            self.size += len(line) + 2
+            if self.maxSize and self.size > self.maxSize:
+                raise TooBigICalendarDataError("Calendar data larger than {} bytes".format(self.maxSize))
+
+    def _parse(self, lines, wrap):
+        """
+        Parse the VCALENDAR header, or one top-level component wrapped in its
+        own VCALENDAR.
+        """
+        if wrap:
+            lines = self._wrapperHeader + lines + ["END:VCALENDAR"]
+        return Component.fromString("\r\n".join(lines) + "\r\n")
+
+
+class LazyComponent(Component):
+    """
+    A VCALENDAR L{Component} created from iCalendar text that is only parsed
+    when it is actually needed.
+
+    Creating one scans nothing; the first call that can be answered from a
+    summary of the text (the UID, type, organizer and recurrence of the
+    resource) scans the text once, recording a few properties of each
+    top-level component. Any other use parses the text in full, after which
+    it behaves exactly like a L{Component}. Bulk operations that only need
+    the summary of most resources (e.g. purge) can then skip full parsing.
+
+    Note that invalid data is only detected when the text is parsed, not
+    when the L{LazyComponent} is created.
+    """
+
+    # Properties of each top-level component recorded by the summary scan
+    summaryProperties = frozenset((
+        "UID", "ORGANIZER", "RRULE", "RDATE", "EXDATE", "RECURRENCE-ID",
+    ))
+
+    _lazyText = None
+    _lazyComponent = None
+    _summary = None
+
+    @classmethod
+    def fromString(clazz, string, format=None):
+        """
+        Construct a L{LazyComponent} from a string, or a L{Component} for a
+        format other than iCalendar.
+
+        @param string: a string containing iCalendar data.
+        @return: a L{Component} representing the VCALENDAR described by
+            C{string}.
+        """
+        if format not in (None, "text/calendar",):
+            return Component.fromString(string, format)
+        if type(string) is unicode:
+            string = string.encode("utf-8")
+        self = clazz.__new__(clazz)
+        self._lazyText = string
+        self._parent = None
+        return self
+
+    @property
+    def _pycalendar(self):
+        if self._lazyComponent is None:
+            self._lazyComponent = Component.fromString(self._lazyText)._pycalendar
+            self._lazyText = None
+        return self._lazyComponent
+
+    @_pycalendar.setter
+    def _pycalendar(self, value):
+        self._lazyComponent = value
+        self._lazyText = None
+
+    def parsed(self):
+        """
+        @return: whether the text has been parsed
+        @rtype: L{bool}
+        """
+        return self._lazyComponent is not None
+
+    def _components(self):
+        """
+        Scan the text once for the top-level components and their summary
+        properties.
+
+        @return: the name and a L{dict} mapping property name to a C{list}
+            of values, for each non-ignored top-level component
+        @rtype: C{list} of C{tuple} of (L{str}, L{dict})
+        """
+        if self._summary is None:
+            text = self._lazyText
+            if text[:3] == codecs.BOM_UTF8:
+                text = text[3:]
+            summary = []
+            depth = 0
+            properties = None
+            for line in text.replace("\r\n", "\n").replace("\n ", "").replace("\n\t", "").split("\n"):
+                name, valueStart = _splitContentLine(line)
+                if name == "BEGIN":
+                    depth += 1
+                    if depth == 2:
+                        componentName = line[valueStart:].strip().upper()
+                        properties = {}
+                        if componentName not in ignoredComponents:
+                            summary.append((componentName, properties,))
+                elif name == "END":
+                    depth -= 1
+                elif depth == 2 and name in self.summaryProperties:
+                    properties.setdefault(name, []).append(line[valueStart:])
+            self._summary = summary
+        return self._summary
+
+    def name(self):
+        if not self.parsed():
+            return "VCALENDAR"
+        return super(LazyComponent, self).name()
+
+    def mainType(self):
+        if self.parsed():
+            return super(LazyComponent, self).mainType()
+
+        mtype = None
+        for name, _ignore_properties in self._components():
+            if mtype and (mtype != name):
+                raise InvalidICalendarDataError("Component contains more than one type of primary type: {0!r}".format(self,))
+            mtype = name
+        return mtype
+
+    def resourceUID(self):
+        if self.parsed() or hasattr(self, "_resource_uid"):
+            return super(LazyComponent, self).resourceUID()
+
+        for _ignore_name, properties in self._components():
+            uids = properties.get("UID", ())
+            if len(uids) > 1:
+                raise InvalidICalendarDataError("More than one UID property in component {0!r}".format(self))
+            self._resource_uid = _unescapeText(uids[0]) if uids else None
+            break
+        else:
+            self._resource_uid = None
+        return self._resource_uid
+
+    def getOrganizer(self):
+        if self.parsed():
+            return super(LazyComponent, self).getOrganizer()
+
+        for _ignore_name, properties in self._components():
+            organizers = properties.get("ORGANIZER", ())
+            return organizers[0] if len(organizers) == 1 else None
+        return None
+
+    def isRecurring(self):
+        if self.parsed():
+            return super(LazyComponent, self).isRecurring()
+
+        for _ignore_name, properties in self._components():
+            for propname in ("RRULE", "RDATE", "EXDATE", "RECURRENCE-ID",):
+                if propname in properties:
+                    return True
+        return False
+
+    def isRecurringUnbounded(self):
+        if self.parsed():
+            return super(LazyComponent, self).isRecurringUnbounded()
+
+        for _ignore_name, properties in self._components():
+            if "RECURRENCE-ID" not in properties:
+                # The master component
+                for rrule in properties.get("RRULE", ()):
+                    parts = set([part.split("=", 1)[0].strip().upper() for part in rrule.split(";")])
+                    if "COUNT" not in parts and "UNTIL" not in parts:
+                        return True
+                break
+        return False
+
+
+def _splitContentLine(line):
+    """
+    Split an unfolded iCalendar content line into its name (in upper case)
+    and the start of its value, skipping over any parameters (which may
+    contain quoted colons).
+
+    @return: the name and the index of the value, or C{(None, None)} for a
+        line without a value
+    @rtype: L{tuple} of (L{str}, L{int})
+    """
+    colon = line.find(":")
+    if colon == -1:
+        return None, None
+    semicolon = line.find(";", 0, colon)
+    if semicolon == -1:
+        return line[:colon].upper(), colon + 1
+
+    quoted = False
+    for index in xrange(semicolon, len(line)):
+        char = line[index]
+        if char == '"':
+            quoted = not quoted
+        elif char == ":" and not quoted:
+            return line[:semicolon].upper(), index + 1
+    return None, None
+
+
+def _unescapeText(value):
+    """
+    Unescape an iCalendar TEXT value.
+    """
+    if "\\" not in value:
+        return value
+    result = []
+    chars = iter(value)
+    for char in chars:
+        if char == "\\":
+            char = next(chars, "")
+            result.append("\n" if char in ("n", "N",) else char)
+        else:
+            result.append(char)
+    return "".join(result)
+
 # #
 # Timezones
 # #
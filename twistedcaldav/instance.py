@@ -18,6 +18,9 @@
 iCalendar Recurrence Expansion Utilities
 """
 
+from calendar import monthrange
+from datetime import date
+
 from twistedcaldav.config import config
 from twistedcaldav.dateops import normalizeForIndex, differenceDateTime
 
@@ -95,6 +98,266 @@ class Instance(object):
         return not self.overridden and self.start == self.component.getStartDateUTC()
 
 
+class SimpleRecurrence(object):
+    """
+    The recurrence set of a master component with a single RRULE of a common
+    shape: FREQ=DAILY, WEEKLY or MONTHLY, with INTERVAL, COUNT or UNTIL,
+    plain weekdays in BYDAY (DAILY and WEEKLY only), BYMONTHDAY (MONTHLY
+    only) and EXDATEs. The instances of such a rule can be computed directly,
+    so expansion can jump straight to the first instance that may be inside
+    a lower limit instead of iterating from DTSTART, and instances are
+    generated one at a time.
+
+    The instances generated are the same as those of the full recurrence
+    set expansion, which is used for any other kind of rule. Rules where
+    month lengths matter (a MONTHLY DTSTART or BYMONTHDAY past the 28th) are
+    left to the full expansion too.
+    """
+
+    # Weekday numbers as returned by L{DateTime.getDayOfWeek}
+    weekdays = {"SU": 0, "MO": 1, "TU": 2, "WE": 3, "TH": 4, "FR": 5, "SA": 6, }
+
+    supportedFreqs = ("DAILY", "WEEKLY", "MONTHLY",)
+    supportedParts = frozenset(("FREQ", "INTERVAL", "COUNT", "UNTIL", "BYDAY", "BYMONTHDAY", "WKST",))
+
+    def __init__(self, rulestart, freq, interval=1, count=None, until=None, byday=None, bymonthday=None, wkst=1, exdates=()):
+        self.rulestart = rulestart
+        self.freq = freq
+        self.interval = interval
+        self.count = count
+        self.until = until
+        self.byday = byday
+        self.bymonthday = bymonthday
+        self.wkst = wkst
+        self.exdates = exdates
+
+        # Set by L{instances}
+        self.limited = False
+        self.skipped = False
+
+    @classmethod
+    def fromComponent(cls, component, rulestart):
+        """
+        Create a L{SimpleRecurrence} for a master component, if its recurrence
+        set has a supported shape.
+
+        @param component: the master component
+        @type component: L{twistedcaldav.ical.Component}
+        @param rulestart: the start of the recurrence set (DTSTART or DUE)
+        @type rulestart: L{DateTime}
+
+        @return: the recurrence, or C{None} if the full recurrence set
+            expansion needs to be used
+        @rtype: L{SimpleRecurrence} or C{None}
+        """
+
+        # Full expansion starts in 1900
+        if rulestart.getYear() < 1900:
+            return None
+        if component.hasProperty("RDATE") or component.hasProperty("EXRULE"):
+            return None
+        rrules = tuple(component.properties("RRULE"))
+        if len(rrules) != 1:
+            return None
+
+        parts = {}
+        for part in rrules[0].strvalue().upper().split(";"):
+            name, _ignore_sep, value = part.partition("=")
+            if name not in cls.supportedParts or name in parts:
+                return None
+            parts[name] = value
+
+        freq = parts.get("FREQ")
+        if freq not in cls.supportedFreqs or "COUNT" in parts and "UNTIL" in parts:
+            return None
+        try:
+            interval = int(parts.get("INTERVAL", "1"))
+            count = int(parts["COUNT"]) if "COUNT" in parts else None
+            byday = [cls.weekdays[day] for day in parts["BYDAY"].split(",")] if "BYDAY" in parts else None
+            bymonthday = [int(day) for day in parts["BYMONTHDAY"].split(",")] if "BYMONTHDAY" in parts else None
+            wkst = cls.weekdays[parts.get("WKST", "MO")]
+        except (KeyError, ValueError):
+            return None
+        if interval < 1 or count is not None and count < 1:
+            return None
+        if byday is not None and freq == "MONTHLY":
+            return None
+        if bymonthday is not None and (freq != "MONTHLY" or not all([0 < abs(day) <= 28 for day in bymonthday])):
+            return None
+        if freq == "MONTHLY" and rulestart.getDay() > 28:
+            return None
+
+        until = None
+        if "UNTIL" in parts:
+            until = rrules[0].value().getUntil()
+            # Full expansion converts a UTC UNTIL for floating instances
+            if rulestart.floating() and not until.floating():
+                return None
+
+        return cls(
+            rulestart, freq,
+            interval=interval, count=count, until=until,
+            byday=byday, bymonthday=bymonthday, wkst=wkst,
+            exdates=tuple(component.getExdates()),
+        )
+
+    def instances(self, lowerLimit, upperLimit, duration):
+        """
+        Generate the start of each instance of the recurrence set, in order,
+        that is before C{upperLimit} and may end on or after C{lowerLimit}.
+        Whole periods of the rule before C{lowerLimit} are skipped without
+        generating their instances, so some instances that do not end after
+        C{lowerLimit} may still be generated for the caller to filter out.
+
+        Once exhausted, L{limited} is set if the recurrence set has
+        instances on or after C{upperLimit}, and L{skipped} is set if
+        instances before C{lowerLimit} were skipped.
+
+        @param lowerLimit: the lower limit, or C{None} for no limit
+        @type lowerLimit: L{DateTime}
+        @param upperLimit: the upper limit
+        @type upperLimit: L{DateTime}
+        @param duration: the duration of each instance
+        @type duration: L{Duration}
+        """
+        self.limited = False
+        self.skipped = False
+
+        period = self._firstPeriod(lowerLimit, duration)
+        if period == 0:
+            if self.rulestart >= upperLimit:
+                self.limited = True
+                return
+            total = 1
+            if not self._excluded(self.rulestart):
+                yield self.rulestart.duplicate()
+        else:
+            total = self._countBefore(period)
+            self.skipped = True
+
+        while self.count is None or total < self.count:
+            start = self._periodStart(period)
+            for offset in self._offsets(start):
+                instance = start.duplicate()
+                if offset:
+                    instance.offsetDay(offset)
+                if period == 0 and instance <= self.rulestart:
+                    continue
+                if self.until is not None and instance > self.until:
+                    return
+                if instance >= upperLimit:
+                    self.limited = True
+                    return
+
+                total += 1
+                if not self._excluded(instance):
+                    yield instance
+                if self.count is not None and total >= self.count:
+                    return
+
+            # Instances of later periods are all after this period's start
+            if self.until is not None and start > self.until:
+                return
+            if start >= upperLimit:
+                self.limited = True
+                return
+            period += 1
+
+    def _excluded(self, instance):
+        for exdate in self.exdates:
+            if instance == exdate:
+                return True
+        return False
+
+    def _firstPeriod(self, lowerLimit, duration):
+        """
+        Determine the first period of the rule that may have instances that
+        end on or after the lower limit. This is conservative: it allows for
+        time zone offsets and for weekly instances before their period start.
+        """
+        if lowerLimit is None:
+            return 0
+        target = lowerLimit - duration
+        if self.freq == "MONTHLY":
+            months = (target.getYear() - self.rulestart.getYear()) * 12 + target.getMonth() - self.rulestart.getMonth()
+            return max(0, (months - 1) // self.interval)
+        else:
+            days = _ordinal(target) - _ordinal(self.rulestart)
+            length = self.interval * (7 if self.freq == "WEEKLY" else 1)
+            return max(0, (days - 8) // length)
+
+    def _periodStart(self, period):
+        start = self.rulestart.duplicate()
+        if self.freq == "MONTHLY":
+            start.offsetMonth(period * self.interval)
+        else:
+            start.offsetDay(period * self.interval * (7 if self.freq == "WEEKLY" else 1))
+        return start
+
+    def _offsets(self, start):
+        """
+        The offsets in days from a period start to each instance in that
+        period, in order.
+        """
+        if self.byday is not None:
+            dayOfWeek = start.getDayOfWeek()
+            if self.freq == "DAILY":
+                return [0] if dayOfWeek in self.byday else []
+            weekStart = self.wkst - dayOfWeek
+            if weekStart > 0:
+                weekStart -= 7
+            return sorted([weekStart + (day - self.wkst) % 7 for day in self.byday])
+        elif self.bymonthday is not None:
+            return [day - start.getDay() for day in self._monthDays(start.getYear(), start.getMonth())]
+        else:
+            return [0]
+
+    def _monthDays(self, year, month):
+        days = monthrange(year, month)[1]
+        return sorted([day if day > 0 else days + day + 1 for day in self.bymonthday])
+
+    def _countBefore(self, period):
+        """
+        Count the instances in the periods before a (non-zero) period,
+        including DTSTART, as COUNT does.
+        """
+        if self.byday is None and self.bymonthday is None:
+            # One instance per period, the first one being DTSTART
+            return period
+
+        elif self.freq == "WEEKLY":
+            first = [offset for offset in self._offsets(self.rulestart) if offset > 0]
+            return 1 + len(first) + (period - 1) * len(self.byday)
+
+        elif self.freq == "DAILY":
+            # The days of the week of period starts repeat every seven periods
+            dayOfWeek = self.rulestart.getDayOfWeek()
+            matches = [(dayOfWeek + index * self.interval) % 7 in self.byday for index in range(7)]
+            cycles, remainder = divmod(period, 7)
+            count = cycles * sum(matches) + sum(matches[:remainder])
+
+            # DTSTART is counted once whether or not it matches BYDAY
+            return count - matches[0] + 1
+
+        else:
+            year = self.rulestart.getYear()
+            month = self.rulestart.getMonth() - 1
+            day = self.rulestart.getDay()
+            count = 1
+            for index in range(period):
+                months = month + index * self.interval
+                days = self._monthDays(year + months // 12, months % 12 + 1)
+                count += len([monthday for monthday in days if index or monthday > day])
+            return count
+
+
+def _ordinal(dt):
+    """
+    The proleptic Gregorian ordinal of the date of a L{DateTime}.
+    """
+    return date(dt.getYear(), dt.getMonth(), dt.getDay()).toordinal()
+
+
 class InstanceList(object):
 
     def __init__(self, ignoreInvalidInstances=False, normalizeFunction=normalizeForIndex):
@@ -115,6 +378,72 @@ class InstanceList(object):
     def __getitem__(self, key):
         return self.instances[key]
 
+    def toCompact(self):
+        """
+        Return a compact, picklable form of this list, for caching. This is
+        only valid for the instances of a VEVENT or VTODO master and its
+        overrides, and does not include the lower limit.
+
+        @return: the text of the limit (or C{None}) and a C{tuple} for each
+            instance of its key, start, end, recurrence-id, flags and the
+            text of the recurrence-id of its component (or C{None} for the
+            master)
+        @rtype: C{tuple}
+        """
+        compact = []
+        for key, instance in self.instances.iteritems():
+            flags = (1 if instance.overridden else 0) | (2 if instance.future else 0)
+            componentRid = instance.component.getRecurrenceIDUTC()
+            compact.append((
+                key,
+                instance.start.getText(),
+                instance.end.getText(),
+                instance.rid.getText(),
+                flags,
+                self.normalizeFunction(componentRid).getText() if componentRid is not None else None,
+            ))
+        return (
+            self.limit.getText() if self.limit is not None else None,
+            tuple(compact),
+        )
+
+    @classmethod
+    def fromCompact(cls, compact, componentSet, ignoreInvalidInstances=False, normalizeFunction=normalizeForIndex):
+        """
+        Re-create an L{InstanceList} from its compact form (see
+        L{toCompact}), for the components it was created from.
+
+        @param compact: the compact form
+        @type compact: C{tuple}
+        @param componentSet: the master and override components
+        @type componentSet: C{list}
+
+        @return: the instances, or C{None} if the components do not match
+        @rtype: L{InstanceList}
+        """
+        components = {}
+        for component in componentSet:
+            if component.name() in ("VEVENT", "VTODO",):
+                rid = component.getRecurrenceIDUTC()
+                components[normalizeFunction(rid).getText() if rid is not None else None] = component
+
+        limit, compactInstances = compact
+        instances = cls(ignoreInvalidInstances=ignoreInvalidInstances, normalizeFunction=normalizeFunction)
+        instances.limit = DateTime.parseText(limit) if limit is not None else None
+        for key, start, end, rid, flags, componentRid in compactInstances:
+            component = components.get(componentRid)
+            if component is None:
+                return None
+            instances.instances[key] = Instance(
+                component,
+                DateTime.parseText(start),
+                DateTime.parseText(end),
+                DateTime.parseText(rid),
+                bool(flags & 1),
+                bool(flags & 2),
+            )
+        return instances
+
     def expandTimeRanges(self, componentSet, limit, lowerLimit=None):
         """
         Expand the set of recurrence instances up to the specified date limit.
@@ -344,16 +673,21 @@ class InstanceList(object):
 
         rrules = component.getRecurrenceSet()
         if rrules is not None and rulestart is not None:
-            # Do recurrence set expansion
-            expanded = []
-            # Begin expansion far in the past because there may be RDATEs earlier
-            # than the master DTSTART, and if we exclude those, the associated
-            # overridden instances will cause an InvalidOverriddenInstance.
-            limited = rrules.expand(
-                rulestart,
-                Period(DateTime(1900, 1, 1), upperlimit),
-                expanded
-            )
+            # Do recurrence set expansion, directly from the first instances
+            # that may be in range for common rules
+            recurrence = SimpleRecurrence.fromComponent(component, rulestart)
+            if recurrence is not None:
+                expanded = recurrence.instances(lowerLimit, upperlimit, duration)
+            else:
+                expanded = []
+                # Begin expansion far in the past because there may be RDATEs earlier
+                # than the master DTSTART, and if we exclude those, the associated
+                # overridden instances will cause an InvalidOverriddenInstance.
+                limited = rrules.expand(
+                    rulestart,
+                    Period(DateTime(1900, 1, 1), upperlimit),
+                    expanded
+                )
             for startDate in expanded:
                 startDate = self.normalizeFunction(startDate)
                 endDate = startDate + duration
@@ -361,6 +695,10 @@ class InstanceList(object):
                     self.addInstance(Instance(component, startDate, endDate))
                 else:
                     self.lowerLimit = lowerLimit
+            if recurrence is not None:
+                limited = recurrence.limited
+                if recurrence.skipped:
+                    self.lowerLimit = lowerLimit
             if limited:
                 self.limit = upperlimit
         else:
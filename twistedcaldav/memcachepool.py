@@ -16,7 +16,7 @@
 
 from twisted.python.failure import Failure
 
-from twisted.internet.defer import Deferred, fail
+from twisted.internet.defer import Deferred, fail, gatherResults
 from twisted.internet.protocol import ReconnectingClientFactory
 from twisted.protocols.memcache import MemCacheProtocol, NoSuchCommand
 
@@ -45,6 +45,23 @@ class PooledMemCacheProtocol(MemCacheProtocol):
             self.factory.deferred.callback(self)
             self.factory.deferred = None
 
+    def setMultiple(self, values, flags=0, expireTime=0):
+        """
+        Pipeline a C{set} for each of the given values on this connection.
+
+        @param values: the values to store, keyed by memcache key
+        @type values: C{dict}
+
+        @return: a L{Deferred} that fires with C{True} if every value was
+            stored
+        """
+        d = gatherResults([
+            self.set(key, value, flags=flags, expireTime=expireTime)
+            for key, value in values.iteritems()
+        ], consumeErrors=True)
+        d.addCallback(all)
+        return d
+
 
 class MemCacheClientFactory(ReconnectingClientFactory):
     """
@@ -237,7 +254,9 @@ class MemCachePool(object):
                 "Memcache error: {ex}; request: {cmd} {args}",
                 ex=failure.value,
                 cmd=command,
-                args=" ".join(args)[:self.REQUEST_LOGGING_SIZE],
+                args=" ".join([
+                    arg if isinstance(arg, str) else repr(arg) for arg in args
+                ])[:self.REQUEST_LOGGING_SIZE],
             )
             self.clientFree(client)
 
@@ -374,6 +393,12 @@ class MemCachePool(object):
     def set(self, *args, **kwargs):
         return self.performRequest('set', *args, **kwargs)
 
+    def getMultiple(self, *args, **kwargs):
+        return self.performRequest('getMultiple', *args, **kwargs)
+
+    def setMultiple(self, *args, **kwargs):
+        return self.performRequest('setMultiple', *args, **kwargs)
+
     def checkAndSet(self, *args, **kwargs):
         return self.performRequest('checkAndSet', *args, **kwargs)
 
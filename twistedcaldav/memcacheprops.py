@@ -32,6 +32,8 @@ try:
 except ImportError:
     from md5 import new as md5
 
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+
 from twext.python.log import Logger
 from twext.python.filepath import CachingFilePath as FilePath
 from txweb2 import responsecode
@@ -39,17 +41,24 @@ from txweb2.http import HTTPError, StatusResponse
 
 from txdav.xml.base import encodeXMLName
 
-from twistedcaldav.config import config
-from twistedcaldav.memcacheclient import ClientFactory
-from twistedcaldav.memcacheclient import MemcacheError, TokenMismatchError
+from twistedcaldav.memcacher import Memcacher
 
 
 NoValue = ""
 
 
+class MemcacheError(Exception):
+    """
+    Error communicating with memcached.
+    """
+
+
 class MemcachePropertyCollection (object):
     """
     Manages a single property store for all resources in a collection.
+
+    All memcache traffic goes through the reactor-based L{Memcacher}, so every
+    operation that may touch the cache returns a L{Deferred}.
     """
     log = Logger()
 
@@ -57,22 +66,13 @@ class MemcachePropertyCollection (object):
         self.collection = collection
         self.cacheTimeout = cacheTimeout
 
-    @classmethod
-    def memcacheClient(cls, refresh=False):
-        if not hasattr(MemcachePropertyCollection, "_memcacheClient"):
-
-            cls.log.info("Instantiating memcache connection for MemcachePropertyCollection")
-
-            MemcachePropertyCollection._memcacheClient = ClientFactory.getClient(
-                [
-                    "%s:%s" % (config.Memcached.Pools.Default.BindAddress, config.Memcached.Pools.Default.Port)
-                ],
-                debug=0,
-                pickleProtocol=2,
+    def memcacheClient(self):
+        if not hasattr(self, "_memcacheClient"):
+            self._memcacheClient = Memcacher(
+                "MemcacheProps", pickle=True, key_normalization=False
             )
-            assert MemcachePropertyCollection._memcacheClient is not None
 
-        return MemcachePropertyCollection._memcacheClient
+        return self._memcacheClient
 
     def propertyCache(self):
         # The property cache has this format:
@@ -87,14 +87,19 @@ class MemcachePropertyCollection (object):
         #      ),
         #    ...,
         #  }
-        if not hasattr(self, "_propertyCache"):
-            self._propertyCache = self._loadCache()
-        return self._propertyCache
+        if hasattr(self, "_propertyCache"):
+            return succeed(self._propertyCache)
+
+        def _loaded(cache):
+            self._propertyCache = cache
+            return cache
+        return self._loadCache().addCallback(_loaded)
 
+    @inlineCallbacks
     def childCache(self, child):
         path = child.fp.path
         key = self._keyForPath(path)
-        propertyCache = self.propertyCache()
+        propertyCache = yield self.propertyCache()
 
         try:
             childCache, token = propertyCache[key]
@@ -102,11 +107,7 @@ class MemcachePropertyCollection (object):
             self.log.debug("No child property cache for {c!r}", c=child)
             childCache, token = ({}, None)
 
-            # message = "No child property cache for %s" % (child,)
-            # self.log.error(message)
-            # raise AssertionError(message)
-
-        return propertyCache, key, childCache, token
+        returnValue((propertyCache, key, childCache, token))
 
     def _keyForPath(self, path):
         key = "|".join((
@@ -115,6 +116,7 @@ class MemcachePropertyCollection (object):
         ))
         return md5(key).hexdigest()
 
+    @inlineCallbacks
     def _loadCache(self, childNames=None):
         if childNames is None:
             abortIfMissing = False
@@ -123,23 +125,20 @@ class MemcachePropertyCollection (object):
             if childNames:
                 abortIfMissing = True
             else:
-                return {}
+                returnValue({})
 
         self.log.debug("Loading cache for {c}", c=self.collection)
 
         client = self.memcacheClient()
-        assert client is not None, "OMG no cache!"
-        if client is None:
-            return None
 
         keys = tuple((
             (self._keyForPath(self.collection.fp.child(childName).path), childName)
             for childName in childNames
         ))
 
-        result = self._split_gets_multi(
+        result = yield self._split_gets_multi(
             (key for key, _ignore_name in keys),
-            client.gets_multi
+            lambda subset: client.getMultiple(subset, withIdentifier=True)
         )
 
         if abortIfMissing:
@@ -161,16 +160,17 @@ class MemcachePropertyCollection (object):
             if abortIfMissing:
                 raise MemcacheError("Unable to fully load cache for %s" % (self.collection,))
 
-            loaded = self._buildCache(childNames=missing)
-            loaded = self._loadCache(childNames=(FilePath(name).basename() for name in loaded.iterkeys()))
+            loaded = yield self._buildCache(childNames=missing)
+            loaded = yield self._loadCache(childNames=(FilePath(name).basename() for name in loaded.iterkeys()))
 
             result.update(loaded.iteritems())
 
-        return result
+        returnValue(result)
 
+    @inlineCallbacks
     def _split_gets_multi(self, keys, func, chunksize=250):
         """
-        Splits gets_multi into chunks to avoid a memcacheclient timeout due
+        Splits gets_multi into chunks to avoid a memcache timeout due
         of a large number of keys.  Consolidates and returns results.
         Takes a function parameter for easier unit testing.
         """
@@ -184,15 +184,16 @@ class MemcachePropertyCollection (object):
             subset.append(key)
             count += 1
             if count == chunksize:
-                results.update(func(subset))
+                results.update((yield func(subset)))
                 count = 0
         if count:
-            results.update(func(subset))
-        return results
+            results.update((yield func(subset)))
+        returnValue(results)
 
+    @inlineCallbacks
     def _split_set_multi(self, values, func, time=0, chunksize=250):
         """
-        Splits set_multi into chunks to avoid a memcacheclient timeout due
+        Splits set_multi into chunks to avoid a memcache timeout due
         of a large number of keys.
         Takes a function parameter for easier unit testing.
         """
@@ -200,14 +201,16 @@ class MemcachePropertyCollection (object):
         subset = {}
         for key, value in values.iteritems():
             if count == 0:
-                subset.clear()
+                # The previous chunk may still be referenced by a queued
+                # request, so always start a fresh one
+                subset = {}
             subset[key] = value
             count += 1
             if count == chunksize:
-                func(subset, time=time)
+                yield func(subset, time=time)
                 count = 0
         if count:
-            func(subset, time=time)
+            yield func(subset, time=time)
 
     def _storeCache(self, cache):
         self.log.debug("Storing cache for {c}", c=self.collection)
@@ -219,17 +222,18 @@ class MemcachePropertyCollection (object):
         ))
 
         client = self.memcacheClient()
-        if client is not None:
-            self._split_set_multi(
-                values, client.set_multi,
-                time=self.cacheTimeout
-            )
+        return self._split_set_multi(
+            values,
+            lambda subset, time: client.setMultiple(subset, expireTime=time),
+            time=self.cacheTimeout
+        )
 
+    @inlineCallbacks
     def _buildCache(self, childNames=None):
         if childNames is None:
             childNames = self.collection.listChildren()
         elif not childNames:
-            return {}
+            returnValue({})
 
         self.log.debug("Building cache for {c}", c=self.collection)
 
@@ -242,17 +246,18 @@ class MemcachePropertyCollection (object):
 
             propertyStore = child.deadProperties()
             props = {}
-            for pnamespace, pname, puid in propertyStore.list(filterByUID=False, cache=False):
-                props[(pnamespace, pname, puid,)] = propertyStore.get((pnamespace, pname,), uid=puid, cache=False)
+            for pnamespace, pname, puid in (yield propertyStore.list(filterByUID=False, cache=False)):
+                props[(pnamespace, pname, puid,)] = (yield propertyStore.get((pnamespace, pname,), uid=puid, cache=False))
 
             cache[child.fp.path] = props
 
-        self._storeCache(cache)
+        yield self._storeCache(cache)
 
-        return cache
+        returnValue(cache)
 
+    @inlineCallbacks
     def setProperty(self, child, property, uid, delete=False):
-        propertyCache, key, childCache, token = self.childCache(child)
+        propertyCache, key, childCache, token = yield self.childCache(child)
 
         if delete:
             qname = property
@@ -266,63 +271,61 @@ class MemcachePropertyCollection (object):
 
         client = self.memcacheClient()
 
-        if client is not None:
-            retries = 10
-            while retries:
-                try:
-                    if client.set(
-                        key, childCache, time=self.cacheTimeout,
-                        token=token
-                    ):
-                        # Success
-                        break
-
-                except TokenMismatchError:
-                    # The value in memcache has changed since we last
-                    # fetched it
-                    self.log.debug("memcacheprops setProperty TokenMismatchError; retrying...")
-
-                finally:
-                    # Re-fetch the properties for this child
-                    loaded = self._loadCache(childNames=(child.fp.basename(),))
-                    propertyCache.update(loaded.iteritems())
-
-                retries -= 1
-
-                propertyCache, key, childCache, token = self.childCache(child)
-
-                if delete:
-                    if qnameuid in childCache:
-                        del childCache[qnameuid]
-                else:
-                    childCache[qnameuid] = property
+        retries = 10
+        while retries:
+            if token is None:
+                result = yield client.set(key, childCache, expireTime=self.cacheTimeout)
+            else:
+                result = yield client.checkAndSet(key, childCache, token, expireTime=self.cacheTimeout)
+            if not result:
+                # The value in memcache has changed since we last
+                # fetched it
+                self.log.debug("memcacheprops setProperty token mismatch; retrying...")
+
+            # Re-fetch the properties for this child
+            loaded = yield self._loadCache(childNames=(child.fp.basename(),))
+            propertyCache.update(loaded.iteritems())
+
+            if result:
+                # Success
+                break
 
+            retries -= 1
+
+            propertyCache, key, childCache, token = yield self.childCache(child)
+
+            if delete:
+                if qnameuid in childCache:
+                    del childCache[qnameuid]
             else:
-                self.log.error("memcacheprops setProperty had too many failures")
-                delattr(self, "_propertyCache")
-                raise MemcacheError("Unable to %s property %s%s on %s" % (
-                    "delete" if delete else "set",
-                    uid if uid else "",
-                    encodeXMLName(*qname),
-                    child
-                ))
+                childCache[qnameuid] = property
+
+        else:
+            self.log.error("memcacheprops setProperty had too many failures")
+            delattr(self, "_propertyCache")
+            raise MemcacheError("Unable to %s property %s%s on %s" % (
+                "delete" if delete else "set",
+                uid if uid else "",
+                encodeXMLName(*qname),
+                child
+            ))
 
     def deleteProperty(self, child, qname, uid):
         return self.setProperty(child, qname, uid, delete=True)
 
+    @inlineCallbacks
     def flushCache(self, child):
         path = child.fp.path
         key = self._keyForPath(path)
-        propertyCache = self.propertyCache()
+        propertyCache = yield self.propertyCache()
 
         if key in propertyCache:
             del propertyCache[key]
 
         client = self.memcacheClient()
-        if client is not None:
-            result = client.delete(key)
-            if not result:
-                raise MemcacheError("Unable to flush cache on %s" % (child,))
+        result = yield client.delete(key)
+        if not result:
+            raise MemcacheError("Unable to flush cache on %s" % (child,))
 
     def propertyStoreForChild(self, child, childPropertyStore):
         return self.ChildPropertyStore(self, child, childPropertyStore)
@@ -335,21 +338,23 @@ class MemcachePropertyCollection (object):
             self.child = child
             self.childPropertyStore = childPropertyStore
 
+        @inlineCallbacks
         def propertyCache(self):
             path = self.child.fp.path
             key = self.parentPropertyCollection._keyForPath(path)
-            parentPropertyCache = self.parentPropertyCollection.propertyCache()
-            return parentPropertyCache.get(key, ({}, None))[0]
+            parentPropertyCache = yield self.parentPropertyCollection.propertyCache()
+            returnValue(parentPropertyCache.get(key, ({}, None))[0])
 
         def flushCache(self):
-            self.parentPropertyCollection.flushCache(self.child)
+            return self.parentPropertyCollection.flushCache(self.child)
 
+        @inlineCallbacks
         def get(self, qname, uid=None, cache=True):
             if cache:
-                propertyCache = self.propertyCache()
+                propertyCache = yield self.propertyCache()
                 qnameuid = qname + (uid,)
                 if qnameuid in propertyCache:
-                    return propertyCache[qnameuid]
+                    returnValue(propertyCache[qnameuid])
                 else:
                     raise HTTPError(StatusResponse(
                         responsecode.NOT_FOUND,
@@ -362,8 +367,9 @@ class MemcachePropertyCollection (object):
                 q=qname,
                 p=self.childPropertyStore.resource.fp.path
             )
-            return self.childPropertyStore.get(qname, uid=uid)
+            returnValue(self.childPropertyStore.get(qname, uid=uid))
 
+        @inlineCallbacks
         def set(self, property, uid=None):
             self.log.debug(
                 "Write for {u}{q} on {p}",
@@ -372,9 +378,10 @@ class MemcachePropertyCollection (object):
                 p=self.childPropertyStore.resource.fp.path
             )
 
-            self.parentPropertyCollection.setProperty(self.child, property, uid)
+            yield self.parentPropertyCollection.setProperty(self.child, property, uid)
             self.childPropertyStore.set(property, uid=uid)
 
+        @inlineCallbacks
         def delete(self, qname, uid=None):
             self.log.debug(
                 "Delete for {u}{q} on {p}",
@@ -383,14 +390,15 @@ class MemcachePropertyCollection (object):
                 p=self.childPropertyStore.resource.fp.path,
             )
 
-            self.parentPropertyCollection.deleteProperty(self.child, qname, uid)
+            yield self.parentPropertyCollection.deleteProperty(self.child, qname, uid)
             self.childPropertyStore.delete(qname, uid=uid)
 
+        @inlineCallbacks
         def contains(self, qname, uid=None, cache=True):
             if cache:
-                propertyCache = self.propertyCache()
+                propertyCache = yield self.propertyCache()
                 qnameuid = qname + (uid,)
-                return qnameuid in propertyCache
+                returnValue(qnameuid in propertyCache)
 
             self.log.debug(
                 "Contains for {u}{q} on {p}",
@@ -398,22 +406,23 @@ class MemcachePropertyCollection (object):
                 q=qname,
                 p=self.childPropertyStore.resource.fp.path,
             )
-            return self.childPropertyStore.contains(qname, uid=uid)
+            returnValue(self.childPropertyStore.contains(qname, uid=uid))
 
+        @inlineCallbacks
         def list(self, uid=None, filterByUID=True, cache=True):
             if cache:
-                propertyCache = self.propertyCache()
+                propertyCache = yield self.propertyCache()
                 results = propertyCache.keys()
                 if filterByUID:
-                    return [
+                    returnValue([
                         (namespace, name)
                         for namespace, name, propuid in results
                         if propuid == uid
-                    ]
+                    ])
                 else:
-                    return results
+                    returnValue(results)
 
             self.log.debug(
                 "List for{p}", p=self.childPropertyStore.resource.fp.path
             )
-            return self.childPropertyStore.list(uid=uid, filterByUID=filterByUID)
+            returnValue(self.childPropertyStore.list(uid=uid, filterByUID=filterByUID))
@@ -18,7 +18,7 @@ import hashlib
 import cPickle
 import string
 
-from twisted.internet.defer import succeed
+from twisted.internet.defer import succeed, gatherResults
 
 from twext.python.log import Logger
 
@@ -129,6 +129,34 @@ class Memcacher(CachePoolUserMixIn):
             else:
                 return succeed((0, value,))
 
+        def getMultiple(self, keys, withIdentifier=False):
+            # Results use the same layout as MemCacheProtocol.getMultiple
+            results = {}
+            for key in keys:
+                self._check_key(key)
+
+                if len(key) > Memcacher.MEMCACHE_KEY_LIMIT:
+                    value, expires, identifier = (None, 0, "")
+                else:
+                    value, expires, identifier = self._cache.get(key, (None, 0, ""))
+                    if self._clock >= expires:
+                        value = None
+                        identifier = ""
+
+                if withIdentifier:
+                    results[key] = (0, str(identifier), value)
+                else:
+                    results[key] = (0, value)
+            return succeed(results)
+
+        def setMultiple(self, values, expireTime=0):
+            d = gatherResults([
+                self.set(key, value, expireTime=expireTime)
+                for key, value in values.iteritems()
+            ])
+            d.addCallback(all)
+            return d
+
         def delete(self, key):
             self._check_key(key)
 
@@ -206,6 +234,12 @@ class Memcacher(CachePoolUserMixIn):
         def get(self, key, withIdentifier=False):
             return succeed((0, None,))
 
+        def getMultiple(self, keys, withIdentifier=False):
+            return succeed({})
+
+        def setMultiple(self, values, expireTime=0):
+            return succeed(True)
+
         def delete(self, key):
             return succeed(True)
 
@@ -309,6 +343,9 @@ class Memcacher(CachePoolUserMixIn):
 
     def get(self, key, withIdentifier=False):
         def _gotit(result, withIdentifier):
+            if result is None:
+                # The pool logs and swallows protocol errors
+                return None
             if withIdentifier:
                 _ignore_flags, identifier, value = result
             else:
@@ -324,6 +361,71 @@ class Memcacher(CachePoolUserMixIn):
         d.addCallback(_gotit, withIdentifier)
         return d
 
+    def setMultiple(self, values, expireTime=0):
+        """
+        Store several values with a single pipelined request.
+
+        @param values: the values to store, keyed by cache key
+        @type values: C{dict}
+
+        @return: a L{Deferred} that fires with C{True} if all the values were
+            stored
+        """
+
+        proto = self._getMemcacheProtocol()
+
+        my_values = {}
+        for key, value in values.iteritems():
+            if self._pickle:
+                value = cPickle.dumps(value)
+            my_values['%s:%s' % (self._namespace, self._normalizeKey(key))] = value
+        self.log.debug("Setting {n} Cache Tokens", n=len(my_values))
+        d = proto.setMultiple(my_values, expireTime=expireTime)
+        d.addCallback(lambda result: bool(result))
+        return d
+
+    def getMultiple(self, keys, withIdentifier=False):
+        """
+        Fetch several values with a single request. Keys that are not present
+        in the cache are omitted from the result.
+
+        @param keys: the keys to fetch
+        @type keys: iterable of C{str}
+        @param withIdentifier: if C{True} each value is returned as a
+            C{tuple} of (value, cas identifier)
+        @type withIdentifier: C{bool}
+
+        @return: a L{Deferred} that fires with a C{dict} mapping the requested
+            keys to their values
+        """
+        keyMap = dict([
+            ('%s:%s' % (self._namespace, self._normalizeKey(key)), key)
+            for key in keys
+        ])
+
+        def _gotthem(results):
+            values = {}
+            for cacheKey, result in (results or {}).iteritems():
+                if withIdentifier:
+                    _ignore_flags, identifier, value = result
+                else:
+                    _ignore_flags, value = result
+                if value is None:
+                    continue
+                if self._pickle:
+                    value = cPickle.loads(value)
+                if withIdentifier:
+                    value = (value, identifier)
+                values[keyMap[cacheKey]] = value
+            return values
+
+        if not keyMap:
+            return succeed({})
+        self.log.debug("Getting {n} Cache Tokens", n=len(keyMap))
+        d = self._getMemcacheProtocol().getMultiple(keyMap.keys(), withIdentifier=withIdentifier)
+        d.addCallback(_gotthem)
+        return d
+
     def delete(self, key):
         self.log.debug("Deleting Cache Token for {k!r}", k=key)
         return self._getMemcacheProtocol().delete('%s:%s' % (self._namespace, self._normalizeKey(key)))
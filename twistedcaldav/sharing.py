@@ -571,6 +571,64 @@ class SharedResourceMixin(object):
 
         returnValue(result)
 
+    @inlineCallbacks
+    def inviteUIDsToShare(self, userids, ace, summary, request):
+        """
+        Invite many users with the same access and summary. Individual users
+        are passed to the store together so it can invite them in bulk,
+        anything else (e.g. groups) is invited one at a time. If the bulk
+        invite fails the users are invited one at a time too, so that each
+        gets its own result.
+
+        @return: the result for each userid, in the same order as C{userids}
+        @rtype: C{list}
+        """
+        results = {}
+        shareeUIDs = {}
+        for userid in userids:
+            sharee = yield self.principalForCalendarUserAddress(userid)
+            if sharee is None:
+                results[userid] = yield self.inviteSingleUserToShare(userid, None, ace, summary, request)
+            else:
+                shareeUIDs[userid] = sharee.principalUID()
+
+        if shareeUIDs:
+            try:
+                yield self._newStoreObject.inviteUIDsToShare(
+                    shareeUIDs.values(),
+                    invitationBindModeFromXMLMap[type(ace)],
+                    summary,
+                )
+            except Exception as e:
+                self.log.error("Could not send sharing invites '{userids}', inviting one at a time: {ex}", userids=sorted(shareeUIDs.keys()), ex=e)
+                for userid in shareeUIDs:
+                    results[userid] = yield self.inviteSingleUserToShare(userid, None, ace, summary, request)
+            else:
+                for userid in shareeUIDs:
+                    results[userid] = True
+
+        returnValue([results[userid] for userid in userids])
+
+    @inlineCallbacks
+    def uninviteUIDsFromShare(self, userids, request):
+        """
+        Remove many users from the share, with the store removing them in
+        bulk. Userids are resolved the same way as in
+        L{uninviteSingleUserFromShare}.
+        """
+        uids = []
+        for userid in userids:
+            sharee = yield self.principalForCalendarUserAddress(userid)
+            if sharee is not None:
+                uids.append(sharee.principalUID())
+            elif userid.startswith("urn:x-uid:"):
+                uids.append(userid[10:])
+
+        try:
+            yield self._newStoreObject.uninviteUIDsFromShare(uids)
+        except Exception as e:
+            self.log.error("Could not send sharing uninvites '{userids}': {ex}", userids=sorted(userids), ex=e)
+
     @inlineCallbacks
     def uninviteFromShare(self, invitation, request):
 
@@ -685,14 +743,21 @@ class SharedResourceMixin(object):
                 updateinviteDict[u] = (cn, removeACL, newACL, summary)
                 del removeDict[u]
                 del setDict[u]
-            for userid, access in removeDict.iteritems():
-                result = (yield self.uninviteUIDFromShare(userid, access, request))
-                # If result is False that means the user being removed was not
-                # actually invited, but let's not return an error in this case.
-                okusers.add(userid)
+            # Removals and invites are done in bulk, so that sharing with a
+            # large number of users does not take a round trip per user
+            if removeDict:
+                yield self.uninviteUIDsFromShare(sorted(removeDict.keys()), request)
+                # Users being removed that were not actually invited are not
+                # treated as an error.
+                okusers.update(removeDict.keys())
+            invitesByAccess = {}
             for userid, (cn, access, summary) in setDict.iteritems():
-                result = (yield self.inviteUIDToShare(userid, cn, access, summary, request))
-                (okusers if result else badusers).add(userid)
+                invitesByAccess.setdefault((type(access), summary), []).append(userid)
+            for (_ignore_accessType, summary), userids in invitesByAccess.items():
+                userids.sort()
+                results = (yield self.inviteUIDsToShare(userids, setDict[userids[0]][1], summary, request))
+                for userid, result in zip(userids, results):
+                    (okusers if result else badusers).add(userid)
             for userid, (cn, removeACL, newACL, summary) in updateinviteDict.iteritems():
                 result = (yield self.inviteUserUpdateToShare(userid, cn, removeACL, newACL, summary, request))
                 (okusers if result else badusers).add(userid)
@@ -329,6 +329,7 @@ DEFAULT_CONFIG = {
     "MaxCollectionsPerHome": 50,  # Maximum number of calendars/address books allowed in a home
     "MaxResourcesPerCollection": 10000,  # Maximum number of resources in a calendar/address book
     "MaxResourceSize": 1048576,  # Maximum resource size (in bytes)
+    "MaxComponentsPerResource": 0,  # Maximum number of components in a calendar resource (0 = no limit)
     "MaxAttendeesPerInstance": 100,  # Maximum number of unique attendees
     "MaxAllowedInstances": 3000,  # Maximum number of instances the server will index
 
@@ -476,6 +477,7 @@ DEFAULT_CONFIG = {
         "UnixStatsSocket": "caldavd-stats.sock",
         "EnableTCPStatsSocket": False,
         "TCPStatsPort": 8100,
+        "BatchIntervalMS": 500,  # Workers send access log lines and stats to the master in batches this often (0 to send each request)
     },
 
     "LogDatabase": {
@@ -523,6 +525,9 @@ DEFAULT_CONFIG = {
         "Seconds": 60,  # How often to check memory sizes (in seconds)
         "Bytes": 2 * 1024 * 1024 * 1024,  # Memory limit (RSS in bytes)
         "ResidentOnly": True,  # True: only take into account resident memory; False: include virtual memory
+        "SoftBytes": 3 * 512 * 1024 * 1024,  # Soft memory limit: processes over this are recycled a few at a time (0 to disable)
+        "DrainSeconds": 60,  # How long a recycled process has to finish its outstanding requests (0 to stop it immediately)
+        "MaxConcurrentRecycles": 1,  # How many processes over the soft limit can be recycled at the same time
     },
 
     "EnableSACLs": False,  # If enabled, will honor macOS Server ACLs to control access
@@ -672,6 +677,8 @@ DEFAULT_CONFIG = {
         "Enabled": True,
         "SyncTokenLifetimeDays": 14.0,     # Number of days that a client sync report token is valid
         "CleanupPeriodDays": 2.0,  # Number of days between revision cleanups
+        "ChunkSize": 10000,        # Number of revisions removed by each DELETE
+        "TimeBudgetSeconds": 2.0,  # Maximum time spent deleting in one transaction
     },
 
     "InboxCleanup": {
@@ -682,6 +689,8 @@ DEFAULT_CONFIG = {
         "StaggerSeconds": 0.5,                  # Number of seconds between each CleanupOneInboxWork (fractional)
         "InboxRemoveWorkThreshold": 5,          # Number of items above which inbox removals will be deferred to a work item
         "RemovalStaggerSeconds": 0.5,           # Number of seconds between each InboxRemoveWork
+        "BulkHomeBatchSize": 500,               # Number of homes cleaned by each CleanupOneInboxWork using bulk deletes (0 for one work item per home and item)
+        "BulkRemoveBatchSize": 1000,            # Maximum number of inbox items removed by each bulk delete
     },
 
     # CardDAV Features
@@ -904,6 +913,7 @@ DEFAULT_CONFIG = {
         "Enabled": False,
         "SocketPath": "directory-proxy.sock",
         "InSidecarCachingSeconds": 120,
+        "ClientConnections": 4,  # Connections from each process to the directory proxy
     },
 
     "DirectoryCaching": {
@@ -931,6 +941,14 @@ DEFAULT_CONFIG = {
     "MaxRequests": 3,
     "MaxAccepts": 1,
 
+    # Send connections from the same client address to the same worker
+    # process (when UseMetaFD is set), so per-process caches are reused.
+    # Only useful when clients connect directly rather than via a proxy.
+    "ConnectionAffinity": {
+        "Enabled": False,
+        "LoadFactor": 1.25,  # Spill over to other workers above this multiple of the average load
+    },
+
     "MaxDBConnectionsPerPool": 10,  # The maximum number of outstanding database
     # connections per database connection pool.
     # When SharedConnectionPool (see above) is
@@ -941,6 +959,14 @@ DEFAULT_CONFIG = {
     # default - this is the number of database
     # connections used per worker process.
 
+    # SQL pool wait, statement and transaction hold times, read via the stats socket
+    "SQLStats": {
+        "Enabled": True,
+        "WindowSeconds": 60,  # Statistics cover the last one to two windows
+        "LongTransactionSeconds": 10,  # Report transactions holding a connection for longer than this
+        "MaxStatementShapes": 200,  # Distinct statement shapes recorded per window
+    },
+
     "ListenBacklog": 2024,
 
     "IncomingDataTimeOut": 60,          # Max. time between request lines
@@ -1014,6 +1040,12 @@ DEFAULT_CONFIG = {
     "Profiling": {
         "Enabled": False,
         "BaseDirectory": "/tmp/stats",
+        # Always-on sampling profiler in each worker, read via the stats socket
+        "Sampling": {
+            "Enabled": True,
+            "Interval": 0.02,  # Seconds between stack samples
+            "WindowSeconds": 60,  # Continuous samples cover the last one to two windows
+        },
     },
 
     "Memcached": {
@@ -1093,6 +1125,21 @@ DEFAULT_CONFIG = {
         "ExpireSeconds": 3600,
     },
 
+    # Recurrence expansions shared between requests for unchanged resources
+    "ExpansionCache": {
+        "Enabled": True,
+        "MaxResources": 1000,  # Resources cached in each process
+        "MemcachedEnabled": False,  # Also share expansions between processes via memcached
+        "ExpireSeconds": 86400,  # Lifetime of memcached entries
+    },
+
+    # Per-process cache of delegate assignments in front of memcached
+    "DelegateCaching": {
+        "Enabled": True,
+        "MaxEntries": 10000,  # Delegate lists cached in each process
+        "CheckSeconds": 1,  # How often each process looks for changes made by other processes
+    },
+
     "GroupCaching": {
         "Enabled": True,
         "UpdateSeconds": 300,
@@ -35,7 +35,7 @@ from twistedcaldav.config import config
 from twistedcaldav.customxml import calendarserver_namespace
 from twistedcaldav.ical import (
     Component as VCalendar, Property as VProperty,
-    iCalendarProductID, Component
+    iCalendarProductID, Component, ComponentParser, TooBigICalendarDataError
 )
 from twistedcaldav.instance import (
     InvalidOverriddenInstanceError, TooManyInstancesError
@@ -2717,24 +2717,24 @@ class CalendarObjectResource(_CalendarObjectMetaDataMixin, _CommonObjectResource
             else:
                 raise
 
-        # Read the calendar component from the stream
+        # Read the calendar component from the stream, parsing it as it
+        # arrives so that oversized data is rejected early
         try:
-            calendardata = (yield allDataFromStream(request.stream))
-            if not hasattr(request, "extendedLogItems"):
-                request.extendedLogItems = {}
-            request.extendedLogItems["cl"] = str(len(calendardata)) if calendardata else "0"
-
-            # We must have some data at this point
-            if calendardata is None:
-                # Use correct DAV:error response
+            parser = ComponentParser(
+                format,
+                maxSize=config.MaxResourceSize,
+                maxComponents=config.MaxComponentsPerResource,
+            )
+            try:
+                yield readStream(request.stream, parser.feed)
+                component = parser.finish()
+            except TooBigICalendarDataError, e:
+                log.error(str(e))
                 raise HTTPError(ErrorResponse(
                     responsecode.FORBIDDEN,
-                    (caldav_namespace, "valid-calendar-data"),
-                    description="No calendar data"
+                    (caldav_namespace, "max-resource-size"),
+                    str(e),
                 ))
-
-            try:
-                component = Component.fromString(calendardata, format)
             except ValueError, e:
                 log.error(str(e))
                 raise HTTPError(ErrorResponse(
@@ -2742,6 +2742,19 @@ class CalendarObjectResource(_CalendarObjectMetaDataMixin, _CommonObjectResource
                     (caldav_namespace, "valid-calendar-data"),
                     "Can't parse calendar data: %s" % (str(e),)
                 ))
+            finally:
+                if not hasattr(request, "extendedLogItems"):
+                    request.extendedLogItems = {}
+                request.extendedLogItems["cl"] = str(parser.length)
+
+            # We must have some data at this point
+            if component is None:
+                # Use correct DAV:error response
+                raise HTTPError(ErrorResponse(
+                    responsecode.FORBIDDEN,
+                    (caldav_namespace, "valid-calendar-data"),
+                    description="No calendar data"
+                ))
 
             # Look for client fixes
             ua = request.headers.getHeader("User-Agent")
@@ -0,0 +1,226 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Tests for L{twistedcaldav.amplock}.
+"""
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
+from twisted.protocols import amp
+from twisted.test.iosim import connectedServerAndClient
+
+from twistedcaldav.amplock import (
+    LockManager, AMPLock, AMPLockClient, AMPLockProtocol, LockTimeoutError,
+    LockServiceUnavailableError,
+)
+from twistedcaldav.memcachelock import MemcacheLockTimeoutError
+from twistedcaldav.test.util import TestCase
+
+
+class LockManagerTests(TestCase):
+    """
+    Tests for L{LockManager}.
+    """
+
+    def setUp(self):
+        super(LockManagerTests, self).setUp()
+        self.clock = Clock()
+        self.manager = LockManager(reactor=self.clock)
+
+    def test_acquireFree(self):
+        """
+        A free lock is granted immediately with increasing fencing tokens.
+        """
+        fence1 = self.successResultOf(self.manager.acquire("a"))
+        fence2 = self.successResultOf(self.manager.acquire("b"))
+        self.assertTrue(fence2 > fence1)
+        self.assertTrue(self.manager.locked("a"))
+        self.assertFalse(self.manager.locked("c"))
+
+    def test_noWait(self):
+        """
+        A zero timeout fails at once when the lock is held.
+        """
+        self.manager.acquire("a")
+        self.failureResultOf(self.manager.acquire("a"), LockTimeoutError)
+
+    def test_fifoWakeup(self):
+        """
+        Waiters are granted the lock in arrival order, as soon as it is
+        released and without any clock advance.
+        """
+        fence = self.successResultOf(self.manager.acquire("a"))
+        granted = []
+        for waiter in range(3):
+            d = self.manager.acquire("a", timeout=10)
+            d.addCallback(lambda f, waiter=waiter: granted.append((waiter, f)))
+        self.assertEqual(granted, [])
+
+        self.assertTrue(self.manager.release("a", fence))
+        self.assertEqual([w for w, _ignore_f in granted], [0])
+        self.assertTrue(self.manager.release("a", granted[-1][1]))
+        self.assertTrue(self.manager.release("a", granted[-1][1]))
+        self.assertEqual([w for w, _ignore_f in granted], [0, 1, 2])
+        self.assertTrue(self.manager.release("a", granted[-1][1]))
+        self.assertFalse(self.manager.locked("a"))
+
+    def test_waitTimeout(self):
+        """
+        A waiter that is not granted the lock within its timeout fails, and
+        is removed from the queue.
+        """
+        fence = self.successResultOf(self.manager.acquire("a"))
+        d = self.manager.acquire("a", timeout=5)
+        self.clock.advance(5)
+        self.failureResultOf(d, LockTimeoutError)
+        self.assertTrue(self.manager.release("a", fence))
+        self.assertFalse(self.manager.locked("a"))
+
+    def test_leaseExpiry(self):
+        """
+        An expired lease passes the lock to the next waiter, and the stale
+        fencing token can no longer release or renew it.
+        """
+        fence = self.successResultOf(self.manager.acquire("a", lease=5))
+        d = self.manager.acquire("a", timeout=10)
+        self.clock.advance(5)
+        fence2 = self.successResultOf(d)
+        self.assertTrue(fence2 > fence)
+        self.assertFalse(self.manager.release("a", fence))
+        self.assertFalse(self.manager.renew("a", fence, 5))
+        self.assertTrue(self.manager.locked("a"))
+
+    def test_renew(self):
+        """
+        Renewing a lease keeps the lock past the original expiry.
+        """
+        fence = self.successResultOf(self.manager.acquire("a", lease=5))
+        self.clock.advance(4)
+        self.assertTrue(self.manager.renew("a", fence, 5))
+        self.clock.advance(4)
+        self.assertTrue(self.manager.locked("a"))
+        self.clock.advance(1)
+        self.assertFalse(self.manager.locked("a"))
+
+    def test_releaseAll(self):
+        """
+        Dropping an owner releases its locks and cancels its waits.
+        """
+        self.manager.acquire("a", owner="w1")
+        self.manager.acquire("b", owner="w2")
+        d = self.manager.acquire("b", owner="w1", timeout=10)
+        d2 = self.manager.acquire("a", owner="w2", timeout=10)
+
+        self.manager.releaseAll("w1")
+        self.successResultOf(d2)
+        self.assertNoResult(d)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+class AMPLockTests(TestCase):
+    """
+    Tests for L{AMPLock}, both in-process and over AMP.
+    """
+
+    def setUp(self):
+        super(AMPLockTests, self).setUp()
+        self.clock = Clock()
+        self.manager = LockManager(reactor=self.clock)
+
+    @inlineCallbacks
+    def test_acquireRelease(self):
+        lock1 = AMPLock("test", "token", timeout=5, manager=self.manager)
+        lock2 = AMPLock("test", "token", timeout=5, manager=self.manager)
+
+        yield lock1.acquire()
+        fence1 = lock1.fence
+        self.assertTrue((yield lock2.locked()))
+
+        d = lock2.acquire()
+        self.assertNoResult(d)
+        yield lock1.release()
+        yield d
+        self.assertTrue(lock2.fence > fence1)
+        yield lock2.clean()
+        self.assertFalse((yield lock1.locked()))
+
+    @inlineCallbacks
+    def test_timeoutCompatible(self):
+        """
+        Timeouts raise an error that existing L{MemcacheLock} callers catch.
+        """
+        lock1 = AMPLock("test", "token", timeout=0, manager=self.manager)
+        lock2 = AMPLock("test", "token", timeout=0, manager=self.manager)
+        yield lock1.acquire()
+        yield self.assertFailure(lock2.acquire(), MemcacheLockTimeoutError)
+
+    @inlineCallbacks
+    def test_lostLease(self):
+        lock = AMPLock("test", "token", expire_time=5, manager=self.manager)
+        yield lock.acquire()
+        self.clock.advance(6)
+        self.assertFalse((yield lock.renew()))
+        self.assertEqual(lock.fence, None)
+
+    def test_overAMP(self):
+        """
+        Lock requests from a worker are served by the master's manager, and a
+        lost worker connection releases its locks.
+        """
+        client, server, pump = connectedServerAndClient(
+            lambda: AMPLockProtocol(self.manager), amp.AMP
+        )
+        lockClient = AMPLockClient(protocol=client)
+
+        lock1 = AMPLock("test", "token", timeout=5, manager=lockClient)
+        lock2 = AMPLock("test", "token", timeout=5, manager=lockClient)
+
+        d1 = lock1.acquire()
+        pump.flush()
+        self.successResultOf(d1)
+
+        d2 = lock2.acquire()
+        pump.flush()
+        self.assertNoResult(d2)
+
+        d3 = lock1.release()
+        pump.flush()
+        self.assertTrue(self.successResultOf(d3))
+        pump.flush()
+        self.successResultOf(d2)
+        self.assertTrue(lock2.fence > 0)
+
+        d4 = AMPLock("test", "token", timeout=0, manager=lockClient).acquire()
+        pump.flush()
+        self.failureResultOf(d4, LockTimeoutError)
+
+        client.transport.loseConnection()
+        pump.flush()
+        self.assertFalse(self.manager.locked("test:token"))
+
+    def test_notConnected(self):
+        """
+        Lock requests from a worker that is not connected to the master fail
+        with L{LockServiceUnavailableError}.
+        """
+        lockClient = AMPLockClient()
+        lock = AMPLock("test", "token", timeout=5, manager=lockClient)
+        self.failureResultOf(lock.acquire(), LockServiceUnavailableError)
+        self.assertEqual(lock.fence, None)
+        self.failureResultOf(lock.locked(), LockServiceUnavailableError)
+        self.failureResultOf(lockClient.release("test:token", 1), LockServiceUnavailableError)
+        self.failureResultOf(lockClient.renew("test:token", 1, 5), LockServiceUnavailableError)
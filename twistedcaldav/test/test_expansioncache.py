@@ -0,0 +1,181 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Tests for L{twistedcaldav.expansioncache}.
+"""
+
+from pycalendar.datetime import DateTime
+from pycalendar.timezone import Timezone
+
+from twistedcaldav.config import config
+from twistedcaldav.expansioncache import ExpansionCache, expansionCache
+from twistedcaldav.ical import Component, Property
+from twistedcaldav.instance import InstanceList
+import twistedcaldav.test.util
+
+
+data = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:12345-67890
+DTSTART:20170101T100000Z
+DURATION:PT1H
+DTSTAMP:20170101T000000Z
+RRULE:FREQ=DAILY
+END:VEVENT
+BEGIN:VEVENT
+UID:12345-67890
+RECURRENCE-ID:20170103T100000Z
+DTSTART:20170103T120000Z
+DURATION:PT1H
+DTSTAMP:20170101T000000Z
+END:VEVENT
+END:VCALENDAR
+"""
+
+
+class ExpansionCacheTests(twistedcaldav.test.util.TestCase):
+    """
+    Tests for L{ExpansionCache}.
+    """
+
+    def setUp(self):
+        super(ExpansionCacheTests, self).setUp()
+        expansionCache.clear()
+        self.addCleanup(expansionCache.clear)
+
+    def test_getSet(self):
+        """
+        Expansions are only returned for the same MD5 and variant.
+        """
+        cache = ExpansionCache()
+        cache.set((1, "md5",), (None, False,), "compact")
+        self.assertEqual(cache.get((1, "md5",), (None, False,)), "compact")
+        self.assertEqual(cache.get((1, "md5",), ("user01", False,)), None)
+        self.assertEqual(cache.get((1, "other",), (None, False,)), None)
+        self.assertEqual(cache.get((2, "md5",), (None, False,)), None)
+
+        # A new MD5 replaces all the variants
+        cache.set((1, "md5",), ("user01", False,), "compact01")
+        cache.set((1, "other",), (None, False,), "compact2")
+        self.assertEqual(cache.get((1, "md5",), ("user01", False,)), None)
+        self.assertEqual(cache.get((1, "other",), (None, False,)), "compact2")
+
+    def test_maxResources(self):
+        """
+        The least recently used resources are dropped.
+        """
+        self.patch(config.ExpansionCache, "MaxResources", 2)
+        cache = ExpansionCache()
+        cache.set((1, "md5",), (None, False,), "compact1")
+        cache.set((2, "md5",), (None, False,), "compact2")
+        self.assertEqual(cache.get((1, "md5",), (None, False,)), "compact1")
+        cache.set((3, "md5",), (None, False,), "compact3")
+        self.assertEqual(cache.get((1, "md5",), (None, False,)), "compact1")
+        self.assertEqual(cache.get((2, "md5",), (None, False,)), None)
+        self.assertEqual(cache.get((3, "md5",), (None, False,)), "compact3")
+
+    def test_invalidate(self):
+        """
+        L{ExpansionCache.invalidate} removes a resource's expansions.
+        """
+        cache = ExpansionCache()
+        cache.set((1, "md5",), (None, False,), "compact1")
+        cache.set((2, "md5",), (None, False,), "compact2")
+        cache.invalidate(1)
+        self.assertEqual(cache.get((1, "md5",), (None, False,)), None)
+        self.assertEqual(cache.get((2, "md5",), (None, False,)), "compact2")
+
+    def test_disabled(self):
+        """
+        Nothing is cached when disabled.
+        """
+        self.patch(config.ExpansionCache, "Enabled", False)
+        cache = ExpansionCache()
+        cache.set((1, "md5",), (None, False,), "compact1")
+        self.assertEqual(cache.get((1, "md5",), (None, False,)), None)
+
+    def test_compact(self):
+        """
+        L{InstanceList.fromCompact} re-creates the instances of
+        L{InstanceList.toCompact}.
+        """
+        component = Component.fromString(data)
+        limit = DateTime(2017, 2, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
+        instances = component.expandTimeRanges(limit)
+        restored = InstanceList.fromCompact(instances.toCompact(), component.subcomponents())
+
+        self.assertEqual(restored.limit, instances.limit)
+        self.assertEqual(sorted(restored.instances.keys()), sorted(instances.instances.keys()))
+        for key, instance in instances.instances.items():
+            other = restored[key]
+            self.assertTrue(other.component is instance.component)
+            self.assertEqual(
+                (other.start, other.end, other.rid, other.overridden, other.future,),
+                (instance.start, instance.end, instance.rid, instance.overridden, instance.future,),
+            )
+
+        # Components that do not match
+        other = Component.fromString(data.replace("RECURRENCE-ID:20170103", "RECURRENCE-ID:20170104"))
+        self.assertEqual(InstanceList.fromCompact(instances.toCompact(), other.subcomponents()), None)
+
+    def test_cacheExpandedTimeRanges(self):
+        """
+        L{Component.cacheExpandedTimeRanges} shares the expansion between
+        components with the same cache key, as long as they are not modified.
+        """
+        limit = DateTime(2017, 2, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
+        component = Component.fromString(data)
+        component.expansionCacheKey = (1, "md5", None,)
+        instances = component.cacheExpandedTimeRanges(limit)
+        self.assertNotEqual(expansionCache.get((1, "md5",), (None, False,)), None)
+
+        # Another request for the same data does not expand it
+        calls = []
+        expandTimeRanges = Component.expandTimeRanges
+
+        def _expandTimeRanges(self, *args, **kwargs):
+            calls.append(args)
+            return expandTimeRanges(self, *args, **kwargs)
+        self.patch(Component, "expandTimeRanges", _expandTimeRanges)
+        component = Component.fromString(data)
+        component.expansionCacheKey = (1, "md5", None,)
+        cached = component.cacheExpandedTimeRanges(limit)
+        self.assertEqual(calls, [])
+        self.assertEqual(sorted(cached.instances.keys()), sorted(instances.instances.keys()))
+
+        # Nor does a nearer limit, but a later one or another variant does
+        component = Component.fromString(data)
+        component.expansionCacheKey = (1, "md5", None,)
+        component.cacheExpandedTimeRanges(DateTime(2017, 1, 15, 0, 0, 0, tzid=Timezone.UTCTimezone))
+        self.assertEqual(calls, [])
+        component.cacheExpandedTimeRanges(DateTime(2019, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone))
+        self.assertEqual(len(calls), 1)
+
+        component = Component.fromString(data)
+        component.expansionCacheKey = (1, "md5", "user01",)
+        component.cacheExpandedTimeRanges(limit)
+        self.assertEqual(len(calls), 2)
+
+        # Modifying the component drops its key
+        component = Component.fromString(data)
+        component.expansionCacheKey = (1, "md5", None,)
+        component.masterComponent().addProperty(Property("EXDATE", DateTime(2017, 1, 2, 10, 0, 0, tzid=Timezone.UTCTimezone)))
+        self.assertEqual(component.expansionCacheKey, None)
+        component.cacheExpandedTimeRanges(limit)
+        self.assertEqual(len(calls), 3)
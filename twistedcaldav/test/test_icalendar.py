@@ -24,9 +24,10 @@ from twisted.internet.defer import inlineCallbacks, succeed
 from twistedcaldav.config import config
 from twistedcaldav.dateops import normalizeForExpand
 from twistedcaldav.ical import Component, Property, InvalidICalendarDataError, \
-    normalizeCUAddress, normalize_iCalStr, diff_iCalStrs
+    normalizeCUAddress, normalize_iCalStr, diff_iCalStrs, ComponentParser, \
+    TooBigICalendarDataError, LazyComponent
 from twistedcaldav.ical import iCalendarProductID
-from twistedcaldav.instance import InvalidOverriddenInstanceError
+from twistedcaldav.instance import InvalidOverriddenInstanceError, SimpleRecurrence
 import twistedcaldav.test.util
 from twistedcaldav.timezones import TimezoneException
 
@@ -3273,6 +3274,142 @@ END:VCALENDAR
                 self.assertEqual(end.isDateOnly(), results[0][1].isDateOnly(), "%s: %s wrong date/time end state" % (description, end,))
             self.assertEqual(instances.lowerLimit, limited)
 
+    def test_expand_instances_skipping(self):
+        """
+        Expansion of common recurrence rules, which skips to the first
+        instances in range, gives the same results as the full expansion.
+        """
+
+        timezone = """BEGIN:VTIMEZONE
+TZID:US/Eastern
+BEGIN:DAYLIGHT
+DTSTART:20070311T020000
+RRULE:FREQ=YEARLY;BYDAY=2SU;BYMONTH=3
+TZNAME:EDT
+TZOFFSETFROM:-0500
+TZOFFSETTO:-0400
+END:DAYLIGHT
+BEGIN:STANDARD
+DTSTART:20071104T020000
+RRULE:FREQ=YEARLY;BYDAY=1SU;BYMONTH=11
+TZNAME:EST
+TZOFFSETFROM:-0400
+TZOFFSETTO:-0500
+END:STANDARD
+END:VTIMEZONE
+"""
+
+        data = (
+            (
+                "Daily with override",
+                """DTSTART;TZID=US/Eastern:20090101T090000
+DURATION:PT1H
+RRULE:FREQ=DAILY
+EXDATE;TZID=US/Eastern:20160602T090000
+""",
+                "RECURRENCE-ID;TZID=US/Eastern:20160603T090000\nDTSTART;TZID=US/Eastern:20160603T100000\nDURATION:PT1H\n",
+            ),
+            (
+                "Weekdays with count",
+                """DTSTART;TZID=US/Eastern:20090104T220000
+DURATION:PT3H
+RRULE:FREQ=WEEKLY;INTERVAL=2;COUNT=2000;BYDAY=MO,TU,WE,TH,FR;WKST=SU
+""",
+                None,
+            ),
+            (
+                "Daily by day with until",
+                """DTSTART:20090101T090000Z
+DURATION:PT1H
+RRULE:FREQ=DAILY;INTERVAL=3;BYDAY=SA,SU;UNTIL=20160705T090000Z
+""",
+                None,
+            ),
+            (
+                "All-day monthly",
+                """DTSTART;VALUE=DATE:20090115
+DTEND;VALUE=DATE:20090116
+RRULE:FREQ=MONTHLY;COUNT=200;BYMONTHDAY=15,-1
+""",
+                None,
+            ),
+            (
+                "Floating weekly",
+                """DTSTART:20090105T120000
+DURATION:PT1H
+RRULE:FREQ=WEEKLY;INTERVAL=5
+""",
+                "RECURRENCE-ID:20160523T120000\nDTSTART:20160523T130000\nDURATION:PT1H\n",
+            ),
+        )
+
+        lowerLimits = (
+            None,
+            DateTime(2009, 3, 1, 0, 0, 0, tzid=Timezone.UTCTimezone),
+            DateTime(2016, 6, 1, 12, 0, 0, tzid=Timezone.UTCTimezone),
+            DateTime(2020, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone),
+        )
+
+        def _expand(original, lowerLimit):
+            component = Component.fromString(original)
+            instances = component.expandTimeRanges(DateTime(2018, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone), lowerLimit=lowerLimit)
+            return (
+                [(key, instances[key].start, instances[key].end, instances[key].overridden) for key in instances],
+                instances.limit,
+                instances.lowerLimit,
+            )
+
+        for description, master, override in data:
+            original = "BEGIN:VCALENDAR\nVERSION:2.0\nPRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN\n" + timezone
+            original += "BEGIN:VEVENT\nUID:12345-67890\nDTSTAMP:20080601T120000Z\n" + master + "END:VEVENT\n"
+            if override:
+                original += "BEGIN:VEVENT\nUID:12345-67890\nDTSTAMP:20080601T120000Z\n" + override + "END:VEVENT\n"
+            original += "END:VCALENDAR\n"
+            original = original.replace("\n", "\r\n")
+
+            component = Component.fromString(original).masterComponent()
+            self.assertTrue(SimpleRecurrence.fromComponent(component, component.propertyValue("DTSTART")) is not None, description)
+
+            results = [_expand(original, lowerLimit) for lowerLimit in lowerLimits]
+            patcher = self.patch(SimpleRecurrence, "fromComponent", classmethod(lambda cls, component, rulestart: None))
+            expected = [_expand(original, lowerLimit) for lowerLimit in lowerLimits]
+            patcher.restore()
+
+            for lowerLimit, result, expect in zip(lowerLimits, results, expected):
+                self.assertEqual(result, expect, "{}: {}".format(description, lowerLimit))
+
+    def test_expand_instances_not_skipping(self):
+        """
+        Less common recurrence rules are not handled by L{SimpleRecurrence}.
+        """
+
+        data = (
+            "RRULE:FREQ=YEARLY",
+            "RRULE:FREQ=HOURLY",
+            "RRULE:FREQ=MONTHLY;BYDAY=1MO",
+            "RRULE:FREQ=MONTHLY;BYMONTHDAY=31",
+            "RRULE:FREQ=WEEKLY;BYDAY=MO;BYSETPOS=1",
+            "RRULE:FREQ=WEEKLY;BYDAY=1MO",
+            "RRULE:FREQ=DAILY\nRDATE:20160101T090000Z",
+            "RRULE:FREQ=DAILY\nRRULE:FREQ=WEEKLY",
+        )
+
+        for rrule in data:
+            component = Component.fromString("""BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:12345-67890
+DTSTAMP:20080601T120000Z
+DTSTART:20090101T090000Z
+DURATION:PT1H
+{}
+END:VEVENT
+END:VCALENDAR
+""".format(rrule).replace("\n", "\r\n"))
+            master = component.masterComponent()
+            self.assertTrue(SimpleRecurrence.fromComponent(master, master.propertyValue("DTSTART")) is None, rrule)
+
     def test_has_property_in_any_component(self):
 
         data = (
@@ -12211,3 +12348,247 @@ END:VCALENDAR
             cal = Component.fromString(caldata)
             result = cal.maxAttachmentsPerInstance()
             self.assertEqual(result, count, msg=description)
+
+
+class ComponentParserTests(twistedcaldav.test.util.TestCase):
+    """
+    Tests for L{ComponentParser}.
+    """
+
+    data = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VTIMEZONE
+TZID:US/Eastern
+BEGIN:STANDARD
+DTSTART:20071104T020000
+RRULE:FREQ=YEARLY;BYDAY=1SU;BYMONTH=11
+TZNAME:EST
+TZOFFSETFROM:-0400
+TZOFFSETTO:-0500
+END:STANDARD
+END:VTIMEZONE
+BEGIN:VEVENT
+UID:12345-67890
+DTSTART;TZID=US/Eastern:20080601T120000
+DURATION:PT1H
+DTSTAMP:20080601T120000Z
+RRULE:FREQ=DAILY
+SUMMARY:A long summary that is folded across several lines so that the
+  parser has to unfold it again
+BEGIN:VALARM
+ACTION:DISPLAY
+DESCRIPTION:Test
+TRIGGER:-PT10M
+END:VALARM
+END:VEVENT
+BEGIN:VEVENT
+UID:12345-67890
+RECURRENCE-ID;TZID=US/Eastern:20080602T120000
+DTSTART;TZID=US/Eastern:20080602T140000
+DURATION:PT1H
+DTSTAMP:20080601T120000Z
+SUMMARY:Override
+END:VEVENT
+END:VCALENDAR
+""".replace("\n", "\r\n")
+
+    def parse(self, data, chunkSize, **kwargs):
+        parser = ComponentParser(**kwargs)
+        for start in range(0, len(data), chunkSize):
+            parser.feed(data[start:start + chunkSize])
+        return parser.finish()
+
+    def test_chunks(self):
+        """
+        Data fed in chunks of any size, splitting lines, folds and line
+        endings, is parsed the same as the whole data.
+        """
+        expected = str(Component.fromString(self.data))
+        for chunkSize in (1, 2, 7, 75, len(self.data)):
+            self.assertEqual(str(self.parse(self.data, chunkSize)), expected, msg=chunkSize)
+        self.assertEqual(
+            str(self.parse(self.data.replace("\r\n", "\n"), 3)),
+            str(Component.fromString(self.data.replace("\r\n", "\n")))
+        )
+
+    def test_empty(self):
+        """
+        No data results in C{None}.
+        """
+        parser = ComponentParser()
+        parser.feed("")
+        self.assertEqual(parser.finish(), None)
+
+    def test_invalid(self):
+        """
+        Data that is not a complete VCALENDAR is rejected.
+        """
+        for data in (
+            self.data[:-len("END:VCALENDAR\r\n")],
+            "BEGIN:VEVENT\r\nUID:1\r\nEND:VEVENT\r\n",
+            self.data + self.data,
+            " folded\r\n" + self.data,
+        ):
+            self.assertRaises(InvalidICalendarDataError, self.parse, data, 10)
+
+    def test_maxSize(self):
+        """
+        Data over the size limit is rejected as soon as the limit is passed,
+        not counting VTIMEZONEs.
+        """
+        size = ComponentParser()
+        size.feed(self.data)
+        size.finish()
+        self.assertTrue(size.size < len(self.data))
+        self.parse(self.data, 10, maxSize=size.size)
+
+        parser = ComponentParser(maxSize=100)
+        self.assertRaises(TooBigICalendarDataError, parser.feed, self.data)
+        self.assertRaises(TooBigICalendarDataError, self.parse, self.data, 10, maxSize=size.size - 1)
+
+    def test_maxComponents(self):
+        """
+        Data with more components than the limit is rejected.
+        """
+        self.parse(self.data, 10, maxComponents=5)
+        self.assertRaises(TooBigICalendarDataError, self.parse, self.data, 10, maxComponents=4)
+
+    def test_jcal(self):
+        """
+        jCal data is parsed once complete.
+        """
+        jcal = Component.fromString(self.data).getText(format="application/calendar+json")
+        result = self.parse(jcal, 10, format="application/calendar+json")
+        self.assertEqual(str(result), str(Component.fromString(jcal, format="application/calendar+json")))
+
+    @inlineCallbacks
+    def test_fromIStream(self):
+        """
+        L{Component.fromIStream} parses a stream and enforces limits.
+        """
+        from txweb2.stream import MemoryStream
+        result = yield Component.fromIStream(MemoryStream(self.data))
+        self.assertEqual(str(result), str(Component.fromString(self.data)))
+
+        yield self.assertFailure(
+            Component.fromIStream(MemoryStream(self.data), maxSize=100),
+            TooBigICalendarDataError
+        )
+        yield self.assertFailure(
+            Component.fromIStream(MemoryStream("")),
+            InvalidICalendarDataError
+        )
+
+
+class LazyComponentTests(twistedcaldav.test.util.TestCase):
+    """
+    Tests for L{LazyComponent}.
+    """
+
+    data = (
+        (
+            "Simple",
+            """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:12345\\,67890
+DTSTART:20080601T120000Z
+DURATION:PT1H
+DTSTAMP:20080601T120000Z
+ORGANIZER;CN="User: 01":mailto:user01@example.com
+ATTENDEE:mailto:user01@example.com
+END:VEVENT
+END:VCALENDAR
+""",
+        ),
+        (
+            "Unbounded with override",
+            """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VTIMEZONE
+TZID:US/Eastern
+BEGIN:STANDARD
+DTSTART:20071104T020000
+RRULE:FREQ=YEARLY;BYDAY=1SU;BYMONTH=11
+TZNAME:EST
+TZOFFSETFROM:-0400
+TZOFFSETTO:-0500
+END:STANDARD
+END:VTIMEZONE
+BEGIN:VTODO
+UID:abcde
+DTSTART;TZID=US/Eastern:20080601T120000
+DTSTAMP:20080601T120000Z
+RRULE:FREQ=DAILY
+END:VTODO
+BEGIN:VTODO
+UID:abcde
+RECURRENCE-ID;TZID=US/Eastern:20080602T120000
+DTSTART;TZID=US/Eastern:20080602T140000
+DTSTAMP:20080601T120000Z
+END:VTODO
+END:VCALENDAR
+""",
+        ),
+        (
+            "Bounded, folded",
+            """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:fghij
+DTSTART:20080601T120000Z
+DURATION:PT1H
+DTSTAMP:20080601T120000Z
+ORGANIZER;CN="A very long name that has to be folded onto a second line":mail
+ to:user01@example.com
+RRULE:FREQ=DAILY;CO
+ UNT=10
+END:VEVENT
+END:VCALENDAR
+""",
+        ),
+    )
+
+    def test_summary(self):
+        """
+        The summary methods give the same results as a L{Component}, without
+        parsing the data.
+        """
+        for title, data in self.data:
+            data = data.replace("\n", "\r\n")
+            component = Component.fromString(data)
+            lazy = LazyComponent.fromString(data)
+            for method in ("name", "mainType", "resourceUID", "getOrganizer", "isRecurring", "isRecurringUnbounded",):
+                self.assertEqual(
+                    getattr(lazy, method)(), getattr(component, method)(),
+                    msg="{}: {}".format(title, method)
+                )
+            self.assertFalse(lazy.parsed(), msg=title)
+
+    def test_parse(self):
+        """
+        Anything else parses the data, after which a L{LazyComponent}
+        behaves like a L{Component}.
+        """
+        data = self.data[1][1]
+        lazy = LazyComponent.fromString(data)
+        self.assertEqual(lazy.masterComponent().name(), "VTODO")
+        self.assertTrue(lazy.parsed())
+        self.assertEqual(str(lazy), str(Component.fromString(data)))
+        self.assertTrue(lazy.isRecurringUnbounded())
+
+        lazy = LazyComponent.fromString(data)
+        lazy.masterComponent().removeProperty(lazy.masterComponent().getProperty("RRULE"))
+        self.assertFalse(lazy.isRecurringUnbounded())
+
+    def test_invalid(self):
+        """
+        Invalid data is detected when the data is parsed.
+        """
+        lazy = LazyComponent.fromString("BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nUID:1\r\n")
+        self.assertEqual(lazy.resourceUID(), "1")
+        self.assertRaises(InvalidICalendarDataError, lazy.duplicate)
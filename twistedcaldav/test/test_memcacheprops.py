@@ -26,11 +26,15 @@ Test memcacheprops.
 
 import os
 
+from twisted.internet.defer import inlineCallbacks, succeed
+
 from txweb2.http import HTTPError
 
 from txdav.xml.base import encodeXMLName
 
+from twistedcaldav.memcacher import Memcacher
 from twistedcaldav.memcacheprops import MemcachePropertyCollection
+from twistedcaldav.test.util import FakeMemcacheServerMixin
 from twistedcaldav.test.util import InMemoryPropertyStore
 from twistedcaldav.test.util import TestCase
 
@@ -107,217 +111,223 @@ class MemcachePropertyCollectionTestCase(TestCase):
     def getColl(self):
         return StubCollection("calendars", ["a", "b", "c"])
 
+    @inlineCallbacks
     def test_setget(self):
 
         child1 = self.getColl().getChild("a")
-        child1.deadProperties().set(StubProperty("ns1:", "prop1", value="val1"))
+        yield child1.deadProperties().set(StubProperty("ns1:", "prop1", value="val1"))
 
         child2 = self.getColl().getChild("a")
         self.assertEquals(
-            child2.deadProperties().get(("ns1:", "prop1")).value,
+            (yield child2.deadProperties().get(("ns1:", "prop1"))).value,
             "val1")
 
-        child2.deadProperties().set(StubProperty("ns1:", "prop1", value="val2"))
+        yield child2.deadProperties().set(StubProperty("ns1:", "prop1", value="val2"))
 
         # force memcache to be consulted (once per collection per request)
         child1 = self.getColl().getChild("a")
 
         self.assertEquals(
-            child1.deadProperties().get(("ns1:", "prop1")).value,
+            (yield child1.deadProperties().get(("ns1:", "prop1"))).value,
             "val2")
 
+    @inlineCallbacks
     def test_merge(self):
         child1 = self.getColl().getChild("a")
         child2 = self.getColl().getChild("a")
-        child1.deadProperties().set(StubProperty("ns1:", "prop1", value="val0"))
-        child1.deadProperties().set(StubProperty("ns1:", "prop2", value="val0"))
-        child1.deadProperties().set(StubProperty("ns1:", "prop3", value="val0"))
+        yield child1.deadProperties().set(StubProperty("ns1:", "prop1", value="val0"))
+        yield child1.deadProperties().set(StubProperty("ns1:", "prop2", value="val0"))
+        yield child1.deadProperties().set(StubProperty("ns1:", "prop3", value="val0"))
 
         self.assertEquals(
-            child2.deadProperties().get(("ns1:", "prop1")).value,
+            (yield child2.deadProperties().get(("ns1:", "prop1"))).value,
             "val0")
         self.assertEquals(
-            child1.deadProperties().get(("ns1:", "prop2")).value,
+            (yield child1.deadProperties().get(("ns1:", "prop2"))).value,
             "val0")
         self.assertEquals(
-            child1.deadProperties().get(("ns1:", "prop3")).value,
+            (yield child1.deadProperties().get(("ns1:", "prop3"))).value,
             "val0")
 
-        child2.deadProperties().set(StubProperty("ns1:", "prop1", value="val1"))
-        child1.deadProperties().set(StubProperty("ns1:", "prop3", value="val3"))
+        yield child2.deadProperties().set(StubProperty("ns1:", "prop1", value="val1"))
+        yield child1.deadProperties().set(StubProperty("ns1:", "prop3", value="val3"))
 
         # force memcache to be consulted (once per collection per request)
         child2 = self.getColl().getChild("a")
 
         # verify properties
         self.assertEquals(
-            child2.deadProperties().get(("ns1:", "prop1")).value,
+            (yield child2.deadProperties().get(("ns1:", "prop1"))).value,
             "val1")
         self.assertEquals(
-            child2.deadProperties().get(("ns1:", "prop2")).value,
+            (yield child2.deadProperties().get(("ns1:", "prop2"))).value,
             "val0")
         self.assertEquals(
-            child2.deadProperties().get(("ns1:", "prop3")).value,
+            (yield child2.deadProperties().get(("ns1:", "prop3"))).value,
             "val3")
 
         self.assertEquals(
-            child1.deadProperties().get(("ns1:", "prop1")).value,
+            (yield child1.deadProperties().get(("ns1:", "prop1"))).value,
             "val1")
         self.assertEquals(
-            child1.deadProperties().get(("ns1:", "prop2")).value,
+            (yield child1.deadProperties().get(("ns1:", "prop2"))).value,
             "val0")
         self.assertEquals(
-            child1.deadProperties().get(("ns1:", "prop3")).value,
+            (yield child1.deadProperties().get(("ns1:", "prop3"))).value,
             "val3")
 
+    @inlineCallbacks
     def test_delete(self):
         child1 = self.getColl().getChild("a")
         child2 = self.getColl().getChild("a")
-        child1.deadProperties().set(StubProperty("ns1:", "prop1", value="val0"))
-        child1.deadProperties().set(StubProperty("ns1:", "prop2", value="val0"))
-        child1.deadProperties().set(StubProperty("ns1:", "prop3", value="val0"))
+        yield child1.deadProperties().set(StubProperty("ns1:", "prop1", value="val0"))
+        yield child1.deadProperties().set(StubProperty("ns1:", "prop2", value="val0"))
+        yield child1.deadProperties().set(StubProperty("ns1:", "prop3", value="val0"))
 
         self.assertEquals(
-            child2.deadProperties().get(("ns1:", "prop1")).value,
+            (yield child2.deadProperties().get(("ns1:", "prop1"))).value,
             "val0")
         self.assertEquals(
-            child1.deadProperties().get(("ns1:", "prop2")).value,
+            (yield child1.deadProperties().get(("ns1:", "prop2"))).value,
             "val0")
         self.assertEquals(
-            child1.deadProperties().get(("ns1:", "prop3")).value,
+            (yield child1.deadProperties().get(("ns1:", "prop3"))).value,
             "val0")
 
-        child2.deadProperties().set(StubProperty("ns1:", "prop1", value="val1"))
-        child1.deadProperties().delete(("ns1:", "prop1"))
-        self.assertRaises(HTTPError, child1.deadProperties().get, ("ns1:", "prop1"))
+        yield child2.deadProperties().set(StubProperty("ns1:", "prop1", value="val1"))
+        yield child1.deadProperties().delete(("ns1:", "prop1"))
+        yield self.assertFailure(child1.deadProperties().get(("ns1:", "prop1")), HTTPError)
 
-        self.assertFalse(child1.deadProperties().contains(("ns1:", "prop1")))
+        self.assertFalse((yield child1.deadProperties().contains(("ns1:", "prop1"))))
         self.assertEquals(
-            child1.deadProperties().get(("ns1:", "prop2")).value,
+            (yield child1.deadProperties().get(("ns1:", "prop2"))).value,
             "val0")
         self.assertEquals(
-            child1.deadProperties().get(("ns1:", "prop3")).value,
+            (yield child1.deadProperties().get(("ns1:", "prop3"))).value,
             "val0")
 
         # force memcache to be consulted (once per collection per request)
         child2 = self.getColl().getChild("a")
 
         # verify properties
-        self.assertFalse(child2.deadProperties().contains(("ns1:", "prop1")))
+        self.assertFalse((yield child2.deadProperties().contains(("ns1:", "prop1"))))
         self.assertEquals(
-            child2.deadProperties().get(("ns1:", "prop2")).value,
+            (yield child2.deadProperties().get(("ns1:", "prop2"))).value,
             "val0")
         self.assertEquals(
-            child2.deadProperties().get(("ns1:", "prop3")).value,
+            (yield child2.deadProperties().get(("ns1:", "prop3"))).value,
             "val0")
 
+    @inlineCallbacks
     def test_setget_uids(self):
 
         for uid in (None, "123", "456"):
             child1 = self.getColl().getChild("a")
-            child1.deadProperties().set(StubProperty("ns1:", "prop1", value="val1%s" % (uid if uid else "",)), uid=uid)
+            yield child1.deadProperties().set(StubProperty("ns1:", "prop1", value="val1%s" % (uid if uid else "",)), uid=uid)
 
             child2 = self.getColl().getChild("a")
             self.assertEquals(
-                child2.deadProperties().get(("ns1:", "prop1"), uid=uid).value,
+                (yield child2.deadProperties().get(("ns1:", "prop1"), uid=uid)).value,
                 "val1%s" % (uid if uid else "",))
 
-            child2.deadProperties().set(StubProperty("ns1:", "prop1", value="val2%s" % (uid if uid else "",)), uid=uid)
+            yield child2.deadProperties().set(StubProperty("ns1:", "prop1", value="val2%s" % (uid if uid else "",)), uid=uid)
 
             # force memcache to be consulted (once per collection per request)
             child1 = self.getColl().getChild("a")
 
             self.assertEquals(
-                child1.deadProperties().get(("ns1:", "prop1"), uid=uid).value,
+                (yield child1.deadProperties().get(("ns1:", "prop1"), uid=uid)).value,
                 "val2%s" % (uid if uid else "",))
 
+    @inlineCallbacks
     def test_merge_uids(self):
 
         for uid in (None, "123", "456"):
             child1 = self.getColl().getChild("a")
             child2 = self.getColl().getChild("a")
-            child1.deadProperties().set(StubProperty("ns1:", "prop1", value="val0%s" % (uid if uid else "",)), uid=uid)
-            child1.deadProperties().set(StubProperty("ns1:", "prop2", value="val0%s" % (uid if uid else "",)), uid=uid)
-            child1.deadProperties().set(StubProperty("ns1:", "prop3", value="val0%s" % (uid if uid else "",)), uid=uid)
+            yield child1.deadProperties().set(StubProperty("ns1:", "prop1", value="val0%s" % (uid if uid else "",)), uid=uid)
+            yield child1.deadProperties().set(StubProperty("ns1:", "prop2", value="val0%s" % (uid if uid else "",)), uid=uid)
+            yield child1.deadProperties().set(StubProperty("ns1:", "prop3", value="val0%s" % (uid if uid else "",)), uid=uid)
 
             self.assertEquals(
-                child2.deadProperties().get(("ns1:", "prop1"), uid=uid).value,
+                (yield child2.deadProperties().get(("ns1:", "prop1"), uid=uid)).value,
                 "val0%s" % (uid if uid else "",))
             self.assertEquals(
-                child1.deadProperties().get(("ns1:", "prop2"), uid=uid).value,
+                (yield child1.deadProperties().get(("ns1:", "prop2"), uid=uid)).value,
                 "val0%s" % (uid if uid else "",))
             self.assertEquals(
-                child1.deadProperties().get(("ns1:", "prop3"), uid=uid).value,
+                (yield child1.deadProperties().get(("ns1:", "prop3"), uid=uid)).value,
                 "val0%s" % (uid if uid else "",))
 
-            child2.deadProperties().set(StubProperty("ns1:", "prop1", value="val1%s" % (uid if uid else "",)), uid=uid)
-            child1.deadProperties().set(StubProperty("ns1:", "prop3", value="val3%s" % (uid if uid else "",)), uid=uid)
+            yield child2.deadProperties().set(StubProperty("ns1:", "prop1", value="val1%s" % (uid if uid else "",)), uid=uid)
+            yield child1.deadProperties().set(StubProperty("ns1:", "prop3", value="val3%s" % (uid if uid else "",)), uid=uid)
 
             # force memcache to be consulted (once per collection per request)
             child2 = self.getColl().getChild("a")
 
             # verify properties
             self.assertEquals(
-                child2.deadProperties().get(("ns1:", "prop1"), uid=uid).value,
+                (yield child2.deadProperties().get(("ns1:", "prop1"), uid=uid)).value,
                 "val1%s" % (uid if uid else "",))
             self.assertEquals(
-                child2.deadProperties().get(("ns1:", "prop2"), uid=uid).value,
+                (yield child2.deadProperties().get(("ns1:", "prop2"), uid=uid)).value,
                 "val0%s" % (uid if uid else "",))
             self.assertEquals(
-                child2.deadProperties().get(("ns1:", "prop3"), uid=uid).value,
+                (yield child2.deadProperties().get(("ns1:", "prop3"), uid=uid)).value,
                 "val3%s" % (uid if uid else "",))
 
             self.assertEquals(
-                child1.deadProperties().get(("ns1:", "prop1"), uid=uid).value,
+                (yield child1.deadProperties().get(("ns1:", "prop1"), uid=uid)).value,
                 "val1%s" % (uid if uid else "",))
             self.assertEquals(
-                child1.deadProperties().get(("ns1:", "prop2"), uid=uid).value,
+                (yield child1.deadProperties().get(("ns1:", "prop2"), uid=uid)).value,
                 "val0%s" % (uid if uid else "",))
             self.assertEquals(
-                child1.deadProperties().get(("ns1:", "prop3"), uid=uid).value,
+                (yield child1.deadProperties().get(("ns1:", "prop3"), uid=uid)).value,
                 "val3%s" % (uid if uid else "",))
 
+    @inlineCallbacks
     def test_delete_uids(self):
 
         for uid in (None, "123", "456"):
             child1 = self.getColl().getChild("a")
             child2 = self.getColl().getChild("a")
-            child1.deadProperties().set(StubProperty("ns1:", "prop1", value="val0%s" % (uid if uid else "",)), uid=uid)
-            child1.deadProperties().set(StubProperty("ns1:", "prop2", value="val0%s" % (uid if uid else "",)), uid=uid)
-            child1.deadProperties().set(StubProperty("ns1:", "prop3", value="val0%s" % (uid if uid else "",)), uid=uid)
+            yield child1.deadProperties().set(StubProperty("ns1:", "prop1", value="val0%s" % (uid if uid else "",)), uid=uid)
+            yield child1.deadProperties().set(StubProperty("ns1:", "prop2", value="val0%s" % (uid if uid else "",)), uid=uid)
+            yield child1.deadProperties().set(StubProperty("ns1:", "prop3", value="val0%s" % (uid if uid else "",)), uid=uid)
 
             self.assertEquals(
-                child2.deadProperties().get(("ns1:", "prop1"), uid=uid).value,
+                (yield child2.deadProperties().get(("ns1:", "prop1"), uid=uid)).value,
                 "val0%s" % (uid if uid else "",))
             self.assertEquals(
-                child1.deadProperties().get(("ns1:", "prop2"), uid=uid).value,
+                (yield child1.deadProperties().get(("ns1:", "prop2"), uid=uid)).value,
                 "val0%s" % (uid if uid else "",))
             self.assertEquals(
-                child1.deadProperties().get(("ns1:", "prop3"), uid=uid).value,
+                (yield child1.deadProperties().get(("ns1:", "prop3"), uid=uid)).value,
                 "val0%s" % (uid if uid else "",))
 
-            child2.deadProperties().set(StubProperty("ns1:", "prop1", value="val1%s" % (uid if uid else "",)), uid=uid)
-            child1.deadProperties().delete(("ns1:", "prop1"), uid=uid)
-            self.assertRaises(HTTPError, child1.deadProperties().get, ("ns1:", "prop1"), uid=uid)
+            yield child2.deadProperties().set(StubProperty("ns1:", "prop1", value="val1%s" % (uid if uid else "",)), uid=uid)
+            yield child1.deadProperties().delete(("ns1:", "prop1"), uid=uid)
+            yield self.assertFailure(child1.deadProperties().get(("ns1:", "prop1"), uid=uid), HTTPError)
 
-            self.assertFalse(child1.deadProperties().contains(("ns1:", "prop1"), uid=uid))
+            self.assertFalse((yield child1.deadProperties().contains(("ns1:", "prop1"), uid=uid)))
             self.assertEquals(
-                child1.deadProperties().get(("ns1:", "prop2"), uid=uid).value,
+                (yield child1.deadProperties().get(("ns1:", "prop2"), uid=uid)).value,
                 "val0%s" % (uid if uid else "",))
             self.assertEquals(
-                child1.deadProperties().get(("ns1:", "prop3"), uid=uid).value,
+                (yield child1.deadProperties().get(("ns1:", "prop3"), uid=uid)).value,
                 "val0%s" % (uid if uid else "",))
 
             # force memcache to be consulted (once per collection per request)
             child2 = self.getColl().getChild("a")
 
             # verify properties
-            self.assertFalse(child2.deadProperties().contains(("ns1:", "prop1"), uid=uid))
+            self.assertFalse((yield child2.deadProperties().contains(("ns1:", "prop1"), uid=uid)))
             self.assertEquals(
-                child2.deadProperties().get(("ns1:", "prop2"), uid=uid).value,
+                (yield child2.deadProperties().get(("ns1:", "prop2"), uid=uid)).value,
                 "val0%s" % (uid if uid else "",))
             self.assertEquals(
-                child2.deadProperties().get(("ns1:", "prop3"), uid=uid).value,
+                (yield child2.deadProperties().get(("ns1:", "prop3"), uid=uid)).value,
                 "val0%s" % (uid if uid else "",))
 
     def _stub_set_multi(self, values, time=None):
@@ -325,7 +335,9 @@ class MemcachePropertyCollectionTestCase(TestCase):
         self.callCount += 1
         for key, value in values.iteritems():
             self.results[key] = value
+        return succeed(True)
 
+    @inlineCallbacks
     def test_splitSetMulti(self):
 
         self.callCount = 0
@@ -336,11 +348,12 @@ class MemcachePropertyCollectionTestCase(TestCase):
         for i in xrange(600):
             values["key%d" % (i,)] = "value%d" % (i,)
 
-        mpc._split_set_multi(values, self._stub_set_multi)
+        yield mpc._split_set_multi(values, self._stub_set_multi)
 
         self.assertEquals(self.callCount, 3)
         self.assertEquals(self.results, values)
 
+    @inlineCallbacks
     def test_splitSetMultiWithChunksize(self):
 
         self.callCount = 0
@@ -351,7 +364,7 @@ class MemcachePropertyCollectionTestCase(TestCase):
         for i in xrange(13):
             values["key%d" % (i,)] = "value%d" % (i,)
 
-        mpc._split_set_multi(values, self._stub_set_multi, chunksize=3)
+        yield mpc._split_set_multi(values, self._stub_set_multi, chunksize=3)
 
         self.assertEquals(self.callCount, 5)
         self.assertEquals(self.results, values)
@@ -362,8 +375,9 @@ class MemcachePropertyCollectionTestCase(TestCase):
         result = {}
         for key in keys:
             result[key] = self.expected[key]
-        return result
+        return succeed(result)
 
+    @inlineCallbacks
     def test_splitGetsMulti(self):
 
         self.callCount = 0
@@ -374,11 +388,12 @@ class MemcachePropertyCollectionTestCase(TestCase):
             self.expected["key%d" % (i,)] = "value%d" % (i,)
 
         mpc = MemcachePropertyCollection(None)
-        result = mpc._split_gets_multi(keys, self._stub_gets_multi)
+        result = yield mpc._split_gets_multi(keys, self._stub_gets_multi)
 
         self.assertEquals(self.callCount, 3)
         self.assertEquals(self.expected, result)
 
+    @inlineCallbacks
     def test_splitGetsMultiWithChunksize(self):
 
         self.callCount = 0
@@ -389,7 +404,18 @@ class MemcachePropertyCollectionTestCase(TestCase):
             self.expected["key%d" % (i,)] = "value%d" % (i,)
 
         mpc = MemcachePropertyCollection(None)
-        result = mpc._split_gets_multi(keys, self._stub_gets_multi, chunksize=12)
+        result = yield mpc._split_gets_multi(keys, self._stub_gets_multi, chunksize=12)
 
         self.assertEquals(self.callCount, 50)
         self.assertEquals(self.expected, result)
+
+
+class MemcachePropertyCollectionNetworkTestCase(FakeMemcacheServerMixin, MemcachePropertyCollectionTestCase):
+    """
+    Run the MemcachePropertyCollection tests against a fake memcached server.
+    """
+
+    def setUp(self):
+        super(MemcachePropertyCollectionNetworkTestCase, self).setUp()
+        pool = self.startFakeMemcacheServer()
+        self.patch(Memcacher, "_getMemcacheProtocol", lambda self: pool)
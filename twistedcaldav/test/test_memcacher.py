@@ -9,7 +9,7 @@ from twisted.internet.defer import inlineCallbacks
 
 from twistedcaldav.config import config
 from twistedcaldav.memcacher import Memcacher
-from twistedcaldav.test.util import TestCase
+from twistedcaldav.test.util import FakeMemcacheServerMixin, TestCase
 
 
 class MemcacherTestCase(TestCase):
@@ -203,3 +203,80 @@ class MemcacherTestCase(TestCase):
         # Value limits
         result = yield cacher.set("*", "*" * (Memcacher.MEMCACHE_VALUE_LIMIT + 10))
         self.assertFalse(result)
+
+    @inlineCallbacks
+    def test_multiple(self):
+
+        for processType in ("Single", "Combined",):
+            config.ProcessType = processType
+
+            cacher = Memcacher("testing", pickle=True)
+
+            result = yield cacher.setMultiple({"akey": ["1", "2"], "bkey": "bvalue"})
+            self.assertTrue(result)
+
+            result = yield cacher.getMultiple(("akey", "bkey", "ckey",))
+            if isinstance(cacher._memcacheProtocol, Memcacher.nullCacher):
+                self.assertEquals({}, result)
+            else:
+                self.assertEquals({"akey": ["1", "2"], "bkey": "bvalue"}, result)
+
+
+class MemcacherNetworkTestCase(FakeMemcacheServerMixin, TestCase):
+    """
+    Test Memcacher against a fake memcached server through a real
+    L{MemCachePool} connection.
+    """
+
+    def setUp(self):
+        super(MemcacherNetworkTestCase, self).setUp()
+        self.pool = self.startFakeMemcacheServer()
+
+    def cacher(self, **kwargs):
+        cacher = Memcacher("testing", **kwargs)
+        cacher._memcacheProtocol = self.pool
+        return cacher
+
+    @inlineCallbacks
+    def test_setget(self):
+
+        cacher = self.cacher()
+
+        result = yield cacher.set("akey", "avalue")
+        self.assertTrue(result)
+
+        result = yield cacher.get("akey")
+        self.assertEquals("avalue", result)
+
+        result = yield cacher.get("bkey")
+        self.assertEquals(None, result)
+
+    @inlineCallbacks
+    def test_multiple(self):
+
+        cacher = self.cacher(pickle=True)
+
+        values = dict([("key%d" % (i,), ["value", i]) for i in range(20)])
+        result = yield cacher.setMultiple(values)
+        self.assertTrue(result)
+        self.assertEquals(len(self.memcacheServer.cache), 20)
+
+        result = yield cacher.getMultiple(values.keys() + ["missing"])
+        self.assertEquals(values, result)
+
+    @inlineCallbacks
+    def test_multipleWithIdentifier(self):
+
+        cacher = self.cacher(pickle=True)
+
+        yield cacher.setMultiple({"akey": "avalue", "bkey": "bvalue"})
+        result = yield cacher.getMultiple(("akey", "bkey",), withIdentifier=True)
+        self.assertEquals(result["akey"][0], "avalue")
+        self.assertEquals(result["bkey"][0], "bvalue")
+
+        # Identifier must match for the update to take effect
+        token = result["akey"][1]
+        self.assertTrue((yield cacher.checkAndSet("akey", "newvalue", token)))
+        self.assertFalse((yield cacher.checkAndSet("akey", "othervalue", token)))
+        result = yield cacher.getMultiple(("akey",))
+        self.assertEquals(result, {"akey": "newvalue"})
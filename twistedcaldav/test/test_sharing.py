@@ -20,7 +20,7 @@ from txweb2.http_headers import MimeType
 from txweb2.iweb import IResponse
 from txweb2.stream import MemoryStream
 
-from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+from twisted.internet.defer import fail, inlineCallbacks, returnValue, succeed
 
 from twistedcaldav import customxml
 from twistedcaldav.config import config
@@ -450,6 +450,35 @@ class SharingTests(BaseSharingTests):
             ),
         ))
 
+    @inlineCallbacks
+    def test_inviteUIDsFallback(self):
+        """
+        When the bulk invite fails, the sharees are invited one at a time and
+        each gets its own result.
+        """
+        yield self.resource.upgradeToShare()
+
+        storeObject = self.resource._newStoreObject
+        inviteUIDToShare = storeObject.inviteUIDToShare
+
+        def _inviteUIDToShare(uid, mode, summary):
+            if uid == "user04":
+                return fail(RuntimeError("Invite failed"))
+            return inviteUIDToShare(uid, mode, summary)
+
+        self.patch(storeObject, "inviteUIDsToShare", lambda *args: fail(RuntimeError("Bulk invite failed")))
+        self.patch(storeObject, "inviteUIDToShare", _inviteUIDToShare)
+
+        results = yield self.resource.inviteUIDsToShare(
+            ["mailto:user03@example.com", "mailto:user04@example.com"],
+            customxml.ReadWriteAccess(), "Your Shared Calendar", None,
+        )
+        self.assertNotEqual(results[0], None)
+        self.assertEqual(results[1], None)
+
+        invitations = yield storeObject.sharingInvites()
+        self.assertEqual([invitation.shareeUID for invitation in invitations], ["user03"])
+
     @inlineCallbacks
     def test_POSTaddRemoveInvitees(self):
 
@@ -23,8 +23,10 @@ from calendarserver.tap.util import getRootResource
 from twext.python.filepath import CachingFilePath as FilePath
 from twext.python.log import Logger
 from twisted.internet.base import DelayedCall
-from twisted.internet.defer import succeed, fail, inlineCallbacks, returnValue
-from twisted.internet.protocol import ProcessProtocol
+from twisted.internet.defer import Deferred, gatherResults, succeed, fail, inlineCallbacks, returnValue
+from twisted.internet.endpoints import TCP4ClientEndpoint
+from twisted.internet.protocol import Factory, ProcessProtocol
+from twisted.protocols.basic import LineReceiver
 from twisted.python.failure import Failure
 from twistedcaldav import memcacher
 from twistedcaldav.bind import doBind
@@ -32,6 +34,7 @@ from twistedcaldav.directory.addressbook import DirectoryAddressBookHomeProvisio
 from twistedcaldav.directory.calendar import DirectoryCalendarHomeProvisioningResource
 from twistedcaldav.directory.util import transactionFromRequest
 from twistedcaldav.memcacheclient import ClientFactory
+from twistedcaldav.memcachepool import MemCachePool
 from twistedcaldav.stdconfig import config
 from txdav.common.datastore.file import CommonDataStore
 from txdav.common.datastore.test.util import deriveQuota, CommonCommonTests
@@ -488,6 +491,182 @@ class InMemoryMemcacheProtocol(object):
             return succeed(False)
 
 
+class FakeMemcacheServerProtocol(LineReceiver):
+    """
+    A minimal memcached server speaking the text protocol, good enough to
+    exercise L{MemCachePool} and L{Memcacher} over a real connection. Items
+    never expire and all data lives in the factory's C{cache} C{dict}.
+    """
+
+    delimiter = "\r\n"
+
+    def connectionMade(self):
+        self._storage = None
+        self._buffer = ""
+        self.factory.connections.add(self)
+
+    def connectionLost(self, reason):
+        self.factory.connections.discard(self)
+        for d in self.factory.waiting.pop(self, []):
+            d.callback(None)
+
+    def lineReceived(self, line):
+        parts = line.split()
+        if not parts:
+            self.sendLine("ERROR")
+            return
+        handler = getattr(self, "cmd_{}".format(parts[0].lower()), None)
+        if handler is None:
+            self.sendLine("ERROR")
+        else:
+            handler(*parts[1:])
+
+    def rawDataReceived(self, data):
+        self._buffer += data
+        command, key, flags, length, cas = self._storage
+        if len(self._buffer) < length + 2:
+            return
+        value = self._buffer[:length]
+        rest = self._buffer[length + 2:]
+        self._buffer = ""
+        self._storage = None
+        self.sendLine(self._store(command, key, flags, value, cas))
+        self.setLineMode(rest)
+
+    def _startStorage(self, command, key, flags, _ignore_exptime, length, cas=None):
+        self._storage = (command, key, int(flags), int(length), cas)
+        self.setRawMode()
+
+    def _store(self, command, key, flags, value, cas):
+        cache = self.factory.cache
+        if command == "add" and key in cache:
+            return "NOT_STORED"
+        if command == "cas":
+            if key not in cache:
+                return "NOT_FOUND"
+            if cache[key][2] != cas:
+                return "EXISTS"
+        self.factory.casCounter += 1
+        cache[key] = (flags, value, str(self.factory.casCounter))
+        return "STORED"
+
+    def cmd_set(self, *args):
+        self._startStorage("set", *args)
+
+    def cmd_add(self, *args):
+        self._startStorage("add", *args)
+
+    def cmd_cas(self, *args):
+        self._startStorage("cas", *args)
+
+    def _retrieve(self, keys, withCAS):
+        for key in keys:
+            if key in self.factory.cache:
+                flags, value, cas = self.factory.cache[key]
+                header = "VALUE {} {} {}".format(key, flags, len(value))
+                if withCAS:
+                    header += " {}".format(cas)
+                self.sendLine(header)
+                self.sendLine(value)
+        self.sendLine("END")
+
+    def cmd_get(self, *keys):
+        self._retrieve(keys, False)
+
+    def cmd_gets(self, *keys):
+        self._retrieve(keys, True)
+
+    def cmd_delete(self, key, *args):
+        if self.factory.cache.pop(key, None) is None:
+            self.sendLine("NOT_FOUND")
+        else:
+            self.sendLine("DELETED")
+
+    def _adjust(self, key, delta):
+        if key not in self.factory.cache:
+            self.sendLine("NOT_FOUND")
+            return
+        flags, value, _ignore_cas = self.factory.cache[key]
+        value = str(max(int(value) + delta, 0))
+        self.factory.casCounter += 1
+        self.factory.cache[key] = (flags, value, str(self.factory.casCounter))
+        self.sendLine(value)
+
+    def cmd_incr(self, key, delta):
+        self._adjust(key, int(delta))
+
+    def cmd_decr(self, key, delta):
+        self._adjust(key, -int(delta))
+
+    def cmd_flush_all(self, *args):
+        self.factory.cache.clear()
+        self.sendLine("OK")
+
+    def cmd_version(self):
+        self.sendLine("VERSION fake")
+
+
+class FakeMemcacheServerFactory(Factory):
+    """
+    Factory for L{FakeMemcacheServerProtocol}, holding the shared cache.
+    """
+
+    protocol = FakeMemcacheServerProtocol
+
+    def __init__(self):
+        self.cache = {}
+        self.casCounter = 0
+        self.connections = set()
+        self.waiting = {}
+
+    def disconnectAll(self):
+        """
+        Drop every client connection.
+
+        @return: a L{Deferred} that fires when all connections are closed.
+        """
+        ds = []
+        for connection in list(self.connections):
+            d = Deferred()
+            self.waiting.setdefault(connection, []).append(d)
+            ds.append(d)
+            connection.transport.loseConnection()
+        return gatherResults(ds)
+
+
+class FakeMemcacheServerMixin(object):
+    """
+    Test case mixin that runs a L{FakeMemcacheServerFactory} on the loopback
+    interface for the duration of a test.
+    """
+
+    def startFakeMemcacheServer(self, maxClients=5):
+        """
+        Start a fake memcached server and a L{MemCachePool} connected to it.
+
+        @return: the L{MemCachePool}
+        """
+        from twisted.internet import reactor
+
+        self.memcacheServer = FakeMemcacheServerFactory()
+        port = reactor.listenTCP(0, self.memcacheServer, interface="127.0.0.1")
+        pool = MemCachePool(
+            TCP4ClientEndpoint(reactor, "127.0.0.1", port.getHost().port),
+            maxClients=maxClients,
+        )
+
+        @inlineCallbacks
+        def _cleanup():
+            pool.shutdown_requested = True
+            for client in pool._freeClients | pool._busyClients:
+                client.transport.loseConnection()
+            yield self.memcacheServer.disconnectAll()
+            yield port.stopListening()
+        self.addCleanup(_cleanup)
+
+        return pool
+
+
 class ErrorOutput(Exception):
     """
     The process produced some error output and exited with a non-zero exit
@@ -135,9 +135,9 @@ class Filter(FilterBase):
                     instances = None
                 else:
                     # Expand the instances up to infinity
-                    instances = component.expandTimeRanges(DateTime(2100, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone), ignoreInvalidInstances=True)
+                    instances = component.cacheExpandedTimeRanges(DateTime(2100, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone), ignoreInvalidInstances=True)
             else:
-                instances = component.expandTimeRanges(maxend, ignoreInvalidInstances=True)
+                instances = component.cacheExpandedTimeRanges(maxend, ignoreInvalidInstances=True)
         else:
             instances = None
         self.child.setInstances(instances)
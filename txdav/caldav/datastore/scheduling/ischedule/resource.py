@@ -325,7 +325,9 @@ class IScheduleInboxResource (ReadOnlyNoCopyResourceMixIn, DAVResourceWithoutChi
 
         # Parse the calendar object from the HTTP request stream
         try:
-            calendar = (yield Component.fromIStream(request.stream))
+            calendar = (yield Component.fromIStream(
+                request.stream, maxSize=config.MaxResourceSize,
+            ))
         except:
             # FIXME: Bare except
             self.log.error(
@@ -26,7 +26,7 @@ from twisted.internet.defer import inlineCallbacks, returnValue, Deferred, \
     succeed
 
 from twistedcaldav.config import config
-from twistedcaldav.ical import Component
+from twistedcaldav.ical import Component, LazyComponent
 
 from txdav.caldav.datastore.scheduling.cuaddress import calendarUserFromCalendarUserUID
 from txdav.caldav.datastore.scheduling.itip import iTIPRequestStatus
@@ -395,12 +395,11 @@ class ScheduleOrganizerWork(ScheduleWorkMixin, fromTable(schema.SCHEDULE_ORGANIZ
         if self.resourceID is not None and new_resource is None:
             returnValue(False)
 
+        # Only the UID is needed, so avoid parsing all the data
         if self.icalendarTextOld:
-            calendar_old = Component.fromString(self.icalendarTextOld)
-            uid = calendar_old.resourceUID()
+            uid = LazyComponent.fromString(self.icalendarTextOld).resourceUID()
         else:
-            calendar_new = Component.fromString(self.icalendarTextNew)
-            uid = calendar_new.resourceUID()
+            uid = LazyComponent.fromString(self.icalendarTextNew).resourceUID()
 
         # Insert new work - in paused state
         yield ScheduleOrganizerWork.schedule(
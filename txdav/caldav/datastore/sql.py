@@ -48,7 +48,9 @@ from twistedcaldav.stdconfig import config
 from twistedcaldav.datafilters.peruserdata import PerUserDataFilter
 from twistedcaldav.dateops import normalizeForIndex, \
     pyCalendarToSQLTimestamp, parseSQLDateToPyCalendar
-from twistedcaldav.ical import Component, InvalidICalendarDataError, Property, ATTENDEE_COMMENT
+from twistedcaldav.expansioncache import expansionCache
+from twistedcaldav.ical import Component, InvalidICalendarDataError, Property, ATTENDEE_COMMENT, \
+    LazyComponent
 from twistedcaldav.instance import InvalidOverriddenInstanceError
 from twistedcaldav.timezones import TimezoneException, readVTZ, hasTZ
 
@@ -84,6 +86,7 @@ from txdav.common.datastore.sql import CommonHome, CommonHomeChild, \
     CommonObjectResource, ECALENDARTYPE
 from txdav.common.datastore.sql_directory import GroupsRecord, \
     GroupMembershipRecord
+from txdav.common.datastore.sql_prepared import preparedQuery
 from txdav.common.datastore.sql_tables import _ATTACHMENTS_MODE_NONE, \
     _ATTACHMENTS_MODE_READ, _ATTACHMENTS_MODE_WRITE, _BIND_MODE_DIRECT, \
     _BIND_MODE_GROUP, _BIND_MODE_GROUP_READ, _BIND_MODE_GROUP_WRITE, \
@@ -1577,6 +1580,62 @@ class Calendar(CommonHomeChild):
         yield self.invalidateQueryCache()
         yield self.notifyPropertyChanged()
 
+    @inlineCallbacks
+    def removeObjectResourcesWithIDs(self, resourceIDs, category=None):
+        """
+        Remove several calendar object resources in bulk, bypassing the trash and
+        implicit scheduling. Resources with dropbox or managed attachments are
+        removed one at a time so that attachment references and quota are
+        maintained.
+
+        @param resourceIDs: the resource-ids of the object resources to remove
+        @type resourceIDs: L{list} of L{int}
+        @param category: the category of the change notification, or L{None} to
+            use the inbox category for the inbox
+        @type category: L{ChangeCategory}
+
+        @return: the names of the removed resources
+        @rtype: L{list} of L{str}
+        """
+        if not resourceIDs:
+            returnValue([])
+
+        if category is None:
+            category = ChangeCategory.inbox if self.isInbox() else ChangeCategory.default
+
+        co = self._objectSchema
+        att = schema.ATTACHMENT_CALENDAR_OBJECT
+        kwds = {"resourceIDs": resourceIDs}
+        rows = yield Select(
+            [co.RESOURCE_ID, co.ICALENDAR_UID, co.DROPBOX_ID],
+            From=co,
+            Where=co.RESOURCE_ID.In(Parameter("resourceIDs", len(resourceIDs))),
+        ).on(self._txn, **kwds)
+        uids = dict([(resourceID, uid) for resourceID, uid, _ignore_dropboxID in rows])
+        withAttachments = set([resourceID for resourceID, _ignore_uid, dropboxID in rows if dropboxID is not None])
+        withAttachments.update([row[0] for row in (yield Select(
+            [att.CALENDAR_OBJECT_RESOURCE_ID],
+            From=att,
+            Where=att.CALENDAR_OBJECT_RESOURCE_ID.In(Parameter("resourceIDs", len(resourceIDs))),
+        ).on(self._txn, **kwds))])
+
+        removed = []
+        for resourceID in sorted(withAttachments):
+            resource = yield self.objectResourceWithID(resourceID)
+            if resource is not None:
+                removed.append(resource.name())
+                yield resource.purge(implicitly=False)
+
+        remaining = [resourceID for resourceID in resourceIDs if resourceID not in withAttachments]
+        removed.extend((yield super(Calendar, self).removeObjectResourcesWithIDs(remaining, category)))
+
+        # As removedObjectResource does for the ones purged above
+        viewerHome = self.viewerHome()
+        for resourceID in remaining:
+            if resourceID in uids:
+                viewerHome.removedCalendarResource(uids[resourceID])
+        returnValue(removed)
+
     def isInbox(self):
         """
         Indicates whether this calendar is an "inbox".
@@ -2364,11 +2423,7 @@ class Calendar(CommonHomeChild):
         """
 
         # Go direct to individual sharing API if groups are disabled
-        if not (
-                config.Sharing.Enabled and
-                config.Sharing.Calendars.Enabled and
-                config.Sharing.Calendars.Groups.Enabled
-        ):
+        if not self._groupSharingEnabled():
             returnValue((yield super(Calendar, self).inviteUIDToShare(shareeUID, mode, summary, shareName)))
 
         record = yield self._txn.directoryService().recordWithUID(shareeUID.decode("utf-8"))
@@ -2383,24 +2438,62 @@ class Calendar(CommonHomeChild):
 
         yield self.updateShareeGroupLink(shareeUID, mode=mode)
 
-        # invite every member of group
+        # invite every member of group, members not yet invited are done in bulk
         shareeViews = []
         group = yield self._txn.groupByUID(shareeUID)
-        memberUIDs = yield self._txn.groupMemberUIDs(group.groupID)
+        memberUIDs = self._uniqueShareeUIDs((yield self._txn.groupMemberUIDs(group.groupID)))
+        existingViews = yield self.shareeViews(memberUIDs)
+        newUIDs = []
         for memberUID in memberUIDs:
-            if memberUID != self._home.uid():
-                shareeView = yield self.shareeView(memberUID)
-                newMode = _BIND_MODE_GROUP if shareeView is None else shareeView._groupModeAfterAddingOneGroupSharee()
+            shareeView = existingViews.get(memberUID)
+            if shareeView is None:
+                newUIDs.append(memberUID)
+            else:
+                newMode = shareeView._groupModeAfterAddingOneGroupSharee()
                 if newMode is not None:
                     # everything but direct
                     shareeView = yield super(Calendar, self).inviteUIDToShare(memberUID, newMode, summary)
                     shareeViews.append(shareeView)
+        shareeViews.extend((yield self._createShares(newUIDs, _BIND_MODE_GROUP, summary)))
 
         # shared even if no group members
         yield self.setShared(True)
 
         returnValue(tuple(shareeViews))
 
+    def _groupSharingEnabled(self):
+        return (
+            config.Sharing.Enabled and
+            config.Sharing.Calendars.Enabled and
+            config.Sharing.Calendars.Groups.Enabled
+        )
+
+    @inlineCallbacks
+    def _bulkInviteUIDs(self, shareeUIDs):
+        """
+        Groups, and UIDs without a directory record, are left to
+        L{inviteUIDToShare} which expands groups into their members.
+        """
+        if not self._groupSharingEnabled():
+            returnValue(set(shareeUIDs))
+
+        records = yield self._shareeRecords(shareeUIDs)
+        returnValue(set([
+            shareeUID for shareeUID, record in records.items()
+            if record.recordType != RecordType.group
+        ]))
+
+    @inlineCallbacks
+    def _bulkUninviteView(self, shareeView):
+        """
+        Sharees that are also in a shared group need their mode adjusted
+        rather than removed, so those are left to L{uninviteUIDFromShare}.
+        """
+        result = yield super(Calendar, self)._bulkUninviteView(shareeView)
+        if result and self._groupSharingEnabled():
+            result = shareeView._bindMode in (_BIND_MODE_READ, _BIND_MODE_WRITE,)
+        returnValue(result)
+
     @inlineCallbacks
     def directShareWithUser(self, shareeUID, shareName=None, displayName=None):
         """
@@ -2431,11 +2524,7 @@ class Calendar(CommonHomeChild):
         """
 
         # Go direct to individual sharing API if groups are disabled
-        if not (
-                config.Sharing.Enabled and
-                config.Sharing.Calendars.Enabled and
-                config.Sharing.Calendars.Groups.Enabled
-        ):
+        if not self._groupSharingEnabled():
             returnValue((yield super(Calendar, self).uninviteUIDFromShare(shareeUID)))
 
         # Check if the sharee is a group
@@ -2451,20 +2540,25 @@ class Calendar(CommonHomeChild):
             groupID = rows[0][0]
             reinvites = []
 
-            # Uninvite each member of group
-            memberUIDs = yield self._txn.groupMemberUIDs(groupID)
+            # Uninvite each member of group, local sharees are removed in bulk
+            memberUIDs = self._uniqueShareeUIDs((yield self._txn.groupMemberUIDs(groupID)))
+            shareeViews = yield self.shareeViews(memberUIDs)
+            removeViews = []
             for memberUID in memberUIDs:
-                if memberUID != self._home.uid():
-                    shareeView = yield self.shareeView(memberUID)
-                    if shareeView is not None:
-                        newMode = yield shareeView._groupModeAfterRemovingOneGroupSharee()
-                        if newMode is None:
-                            if shareeView._bindMode != _BIND_MODE_DIRECT:
-                                # one group or individual share: delete share
+                shareeView = shareeViews.get(memberUID)
+                if shareeView is not None:
+                    newMode = yield shareeView._groupModeAfterRemovingOneGroupSharee()
+                    if newMode is None:
+                        if shareeView._bindMode != _BIND_MODE_DIRECT:
+                            # one group or individual share: delete share
+                            if shareeView.viewerHome().external():
                                 yield super(Calendar, self).uninviteUIDFromShare(memberUID)
-                        else:
-                            # multiple groups or group and individual was shared add to reinvite list to update
-                            reinvites.append((memberUID, newMode))
+                            else:
+                                removeViews.append(shareeView)
+                    else:
+                        # multiple groups or group and individual was shared add to reinvite list to update
+                        reinvites.append((memberUID, newMode))
+            yield self._removeShares(removeViews)
 
             # Delete before super.inviteUIDTOShare() and after super.inviteUIDToShare() so notification has correct access mode
             yield Delete(
@@ -3970,6 +4064,10 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
             if txn._migrating and hasattr(component, "md5"):
                 self._md5 = component.md5
 
+            # Expansions of the old data are no longer needed
+            if not inserting:
+                yield expansionCache.invalidate(self._resourceID)
+
             # Determine attachment mode (ignore inbox's) - NB we have to do this
             # after setting up other properties as UID at least is needed
             self._attachment = _ATTACHMENTS_MODE_NONE
@@ -4215,6 +4313,13 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
             if self._dataversion < self._currentDataVersion:
                 yield self.upgradeData(component, doUpdate)
 
+            # Expansions can be shared with other requests only when the
+            # component is exactly the stored data
+            elif not fixed:
+                component.expansionCacheKey = (self._resourceID, self._md5, None,)
+                if component.isRecurring():
+                    yield expansionCache.prefetch((self._resourceID, self._md5,))
+
             self._cachedComponent = component
             self._cachedCommponentPerUser = {}
 
@@ -4238,6 +4343,8 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
         if user_uuid not in self._cachedCommponentPerUser:
             caldata = yield self.component()
             filtered = PerUserDataFilter(user_uuid).filter(caldata.duplicate())
+            if caldata.expansionCacheKey is not None:
+                filtered.expansionCacheKey = caldata.expansionCacheKey[:2] + (user_uuid,)
             self._cachedCommponentPerUser[user_uuid] = filtered
         returnValue(self._cachedCommponentPerUser[user_uuid])
 
@@ -4399,6 +4506,7 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
                 yield ManagedAttachment.resourceRemoved(self._txn, self._resourceID)
 
             yield super(CalendarObject, self)._reallyRemove()
+            yield expansionCache.invalidate(self._resourceID)
 
         # Do scheduling
         if scheduler is not None:
@@ -4417,6 +4525,7 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
                 ChangeCategory.default)
 
     @classproperty
+    @preparedQuery
     def _recurrenceMinMaxByIDQuery(cls):  # @NoSelf
         """
         DAL query to load RECURRANCE_MIN, RECURRANCE_MAX via an object's resource ID.
@@ -4448,6 +4557,7 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
         ))
 
     @classproperty
+    @preparedQuery
     def _instanceQuery(cls):  # @NoSelf
         """
         DAL query to load TIME_RANGE data via an object's resource ID.
@@ -4481,6 +4591,11 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
 
     @inlineCallbacks
     def organizer(self):
+        # Avoid parsing all the data just to get the organizer, unless it is
+        # already parsed or needs an upgrade (which might change it)
+        if self._cachedComponent is None and self._dataversion >= self._currentDataVersion:
+            text = yield self._text()
+            returnValue(LazyComponent.fromString(text).getOrganizer())
         returnValue((yield self.component()).getOrganizer())
 
     def getMetadata(self):
@@ -947,6 +947,24 @@ END:VCALENDAR
         self.assertEquals(ChangeCategory.default, nonInboxItem.removeNotifyCategory())
         yield self.commit()
 
+    @inlineCallbacks
+    def test_removeObjectResourcesWithIDs(self):
+        """
+        L{Calendar.removeObjectResourcesWithIDs} removes the resources and
+        clears the home's cache of resources by UID.
+        """
+        home = yield self.homeUnderTest()
+        calendar = yield home.createCalendarWithName("bulk")
+        component = Component.fromString(test_event_text)
+        resource = yield calendar.createCalendarObjectWithName("bulk.ics", component)
+        uid = resource.uid()
+        self.assertEqual(len((yield home.getCalendarResourcesForUID(uid))), 1)
+
+        removed = yield calendar.removeObjectResourcesWithIDs([resource.id()])
+        self.assertEqual(removed, ["bulk.ics"])
+        self.assertEqual((yield home.getCalendarResourcesForUID(uid)), [])
+        yield self.commit()
+
     @inlineCallbacks
     def test_directShareCreateConcurrency(self):
         """
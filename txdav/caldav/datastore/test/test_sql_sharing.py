@@ -188,6 +188,76 @@ class CalendarSharing(BaseSharingTests):
         yield calendar.setShared(False)
         self.assertFalse(calendar.isSharedByOwner())
 
+    @inlineCallbacks
+    def test_invite_many_sharees(self):
+        """
+        Test bulk invite/uninvite creates/removes shares and notifications for
+        each sharee, including sharees without a home.
+        """
+
+        # Invite, the owner and duplicates are ignored
+        calendar = yield self.calendarUnderTest(home="user01", name="calendar")
+        shareeViews = yield calendar.inviteUIDsToShare(
+            ["user02", "user03", "user04", "user01", "user03"], _BIND_MODE_READ, "summary"
+        )
+        self.assertEqual(len(shareeViews), 3)
+        inviteUIDs = dict([(shareeView.viewerHome().uid(), shareeView.shareUID()) for shareeView in shareeViews])
+        self.assertEqual(sorted(inviteUIDs.keys()), ["user02", "user03", "user04"])
+
+        invites = yield calendar.sharingInvites()
+        self.assertEqual(len(invites), 3)
+        for invite in invites:
+            self.assertEqual(invite.uid, inviteUIDs[invite.shareeUID])
+            self.assertEqual(invite.ownerUID, "user01")
+            self.assertEqual(invite.mode, _BIND_MODE_READ)
+            self.assertEqual(invite.status, _BIND_STATUS_INVITED)
+            self.assertEqual(invite.summary, "summary")
+        self.assertTrue(calendar.isSharedByOwner())
+
+        for shareeUID, inviteUID in inviteUIDs.items():
+            notifyHome = yield self.transactionUnderTest().notificationsWithUID(shareeUID)
+            notifications = yield notifyHome.listNotificationObjects()
+            self.assertEqual(notifications, [inviteUID + ".xml", ])
+
+        # Inviting again updates the existing shares
+        shareeViews = yield calendar.inviteUIDsToShare(["user02", "user03"], _BIND_MODE_WRITE, "summary")
+        self.assertEqual(len(shareeViews), 2)
+        invites = yield calendar.sharingInvites()
+        self.assertEqual(len(invites), 3)
+        self.assertEqual(
+            sorted([(invite.shareeUID, invite.mode) for invite in invites]),
+            [("user02", _BIND_MODE_WRITE), ("user03", _BIND_MODE_WRITE), ("user04", _BIND_MODE_READ)],
+        )
+
+        yield self.commit()
+
+        # Accept one
+        shareeHome = yield self.homeUnderTest(name="user02")
+        shareeView = yield shareeHome.acceptShare(inviteUIDs["user02"])
+        sharedName = shareeView.name()
+        yield self.commit()
+
+        # Uninvite
+        calendar = yield self.calendarUnderTest(home="user01", name="calendar")
+        yield calendar.uninviteUIDsFromShare(["user02", "user03", "user04"])
+        invites = yield calendar.sharingInvites()
+        self.assertEqual(len(invites), 0)
+        yield self.commit()
+
+        shared = yield self.calendarUnderTest(home="user02", name=sharedName)
+        self.assertTrue(shared is None)
+
+        # The accepted sharee is told the share was removed, the others have
+        # their invite withdrawn
+        for shareeUID, expected in (
+            ("user02", [inviteUIDs["user02"] + ".xml"]),
+            ("user03", []),
+            ("user04", []),
+        ):
+            notifyHome = yield self.transactionUnderTest().notificationsWithUID(shareeUID)
+            notifications = yield notifyHome.listNotificationObjects()
+            self.assertEqual(notifications, expected)
+
     @inlineCallbacks
     def test_accept_share(self):
         """
@@ -335,6 +335,10 @@ class AddressBookSharingMixIn(SharingMixIn):
         Sharing code shared between AddressBook and AddressBookObject
     """
 
+    # Address book shares can be indirect (via shared groups), which the bulk
+    # sharing code does not handle
+    _bulkShareSupported = False
+
     def sharedResourceType(self):
         """
         The sharing resource type
@@ -1465,6 +1469,8 @@ class AddressBookObjectSharingMixIn(SharingMixIn):
     Sharing code for AddressBookObject
     """
 
+    _bulkShareSupported = False
+
     def sharedResourceType(self):
         """
         The sharing resource type
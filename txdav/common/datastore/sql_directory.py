@@ -16,10 +16,12 @@
 ##
 
 from twext.enterprise.dal.record import SerializableRecord, fromTable
-from twext.enterprise.dal.syntax import SavepointAction, Select
+from twext.enterprise.dal.syntax import SavepointAction, Select, Delete, \
+    Parameter
 from twext.python.log import Logger
 from twisted.internet.defer import inlineCallbacks, returnValue
 from txdav.common.datastore.sql_tables import schema
+from txdav.common.datastore.sql_util import insertManyStatement
 from txdav.common.icommondatastore import AllRetriesFailed, NotFoundError
 from txdav.who.delegates import Delegates
 import datetime
@@ -298,6 +300,10 @@ class GroupCacherAPIMixin(object):
     A mixin for L{CommonStoreTransaction} that covers the group cacher API.
     """
 
+    # Maximum number of members added or removed by each statement in
+    # synchronizeMembers()
+    groupMembershipBatchSize = 500
+
     def addMemberToGroup(self, memberUID, groupID):
         return GroupMembershipRecord.create(self, groupID=groupID, memberUID=memberUID.encode("utf-8"))
 
@@ -387,13 +393,31 @@ class GroupCacherAPIMixin(object):
         """
         cachedMemberUIDs = yield self.groupMemberUIDs(groupID)
 
+        # Large groups can change by thousands of members at a time, so apply
+        # the differences in batches rather than one statement per member
+        gm = schema.GROUP_MEMBERSHIP
+        batchSize = self.groupMembershipBatchSize
+
         removed = cachedMemberUIDs - newMemberUIDs
-        for memberUID in removed:
-            yield self.removeMemberFromGroup(memberUID, groupID)
+        removedUIDs = sorted([memberUID.encode("utf-8") for memberUID in removed])
+        for offset in range(0, len(removedUIDs), batchSize):
+            batch = removedUIDs[offset:offset + batchSize]
+            yield Delete(
+                From=gm,
+                Where=(gm.GROUP_ID == groupID).And(
+                    gm.MEMBER_UID.In(Parameter("memberUIDs", len(batch)))
+                ),
+            ).on(self, memberUIDs=batch)
 
         added = newMemberUIDs - cachedMemberUIDs
-        for memberUID in added:
-            yield self.addMemberToGroup(memberUID, groupID)
+        addedUIDs = sorted([memberUID.encode("utf-8") for memberUID in added])
+        for offset in range(0, len(addedUIDs), batchSize):
+            statement, args = insertManyStatement(
+                self,
+                (gm.GROUP_ID, gm.MEMBER_UID,),
+                [(groupID, memberUID,) for memberUID in addedUIDs[offset:offset + batchSize]],
+            )
+            yield self.execSQL(statement, args)
 
         yield self.groupChanged(groupID, added, removed)
 
@@ -17,12 +17,12 @@
 
 from twext.enterprise.dal.record import SerializableRecord, fromTable
 from twext.enterprise.dal.syntax import Select, Parameter, Insert, \
-    SavepointAction, Delete, Max, Len, Update
+    SavepointAction, Delete, Max, Len, Update, utcNowSQL
 from twext.enterprise.util import parseSQLTimestamp
 from twext.internet.decorate import memoizedKey
 from twext.python.clsprop import classproperty
 from twext.python.log import Logger
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, gatherResults
 from twisted.python.util import FancyEqMixin
 from twistedcaldav.dateops import datetimeMktime
 from txdav.base.propertystore.sql import PropertyStore
@@ -60,6 +60,10 @@ class NotificationCollection(FancyEqMixin, _SharedSyncLogic):
 
     _externalClass = None
 
+    # Number of homes or notifications handled by each statement in the bulk
+    # APIs
+    bulkBatchSize = 100
+
     @classmethod
     def makeClass(cls, transaction, homeData):
         """
@@ -259,6 +263,221 @@ class NotificationCollection(FancyEqMixin, _SharedSyncLogic):
                     yield homeObject.notifyChanged()
                 returnValue(homeObject)
 
+    @classmethod
+    @inlineCallbacks
+    def notificationsWithUIDs(cls, txn, uids, create=False):
+        """
+        Bulk version of L{notificationsWithUID}: look up the notification
+        collections of many owners with one query per batch of UIDs.
+
+        @param txn: transaction
+        @type txn: L{CommonStoreTransaction}
+        @param uids: owner UIDs, utf-8 encoded
+        @type uids: iterable of C{str}
+        @param create: whether to create missing collections
+        @type create: C{bool}
+
+        @return: the collections keyed by owner UID, UIDs with no collection
+            are left out
+        @rtype: C{dict}
+        """
+        statusIndex = cls.homeColumns().index(cls._homeSchema.STATUS)
+        uidIndex = cls.homeColumns().index(cls._homeSchema.OWNER_UID)
+
+        # Order of preference when an owner has more than one home
+        preference = (_HOME_STATUS_NORMAL, _HOME_STATUS_DISABLED, _HOME_STATUS_EXTERNAL,)
+        statusSet = (_HOME_STATUS_NORMAL, _HOME_STATUS_EXTERNAL,)
+        if txn._allowDisabled:
+            statusSet += (_HOME_STATUS_DISABLED,)
+
+        uids = sorted(set(uids))
+        results = {}
+        for offset in range(0, len(uids), cls.bulkBatchSize):
+            batch = uids[offset:offset + cls.bulkBatchSize]
+            rows = yield Select(
+                cls.homeColumns(),
+                From=cls._homeSchema,
+                Where=cls._homeSchema.OWNER_UID.In(Parameter("uids", len(batch))).And(
+                    cls._homeSchema.STATUS.In(statusSet)
+                ),
+            ).on(txn, uids=batch)
+
+            best = {}
+            for row in rows:
+                current = best.get(row[uidIndex])
+                if current is None or preference.index(row[statusIndex]) < preference.index(current[statusIndex]):
+                    best[row[uidIndex]] = row
+
+            homes = yield gatherResults([cls.makeClass(txn, row) for row in best.values()], consumeErrors=True)
+            for home in homes:
+                results[home.uid()] = home
+
+        if create:
+            for uid in uids:
+                if uid not in results:
+                    home = yield cls.notificationsWith(txn, None, uid, create=True)
+                    if home is not None:
+                        results[uid] = home
+
+        returnValue(results)
+
+    @classmethod
+    def _existingNotificationsQuery(cls, count):
+        no = schema.NOTIFICATION
+        return Select(
+            [no.NOTIFICATION_HOME_RESOURCE_ID, no.NOTIFICATION_UID, no.RESOURCE_ID],
+            From=no,
+            Where=no.NOTIFICATION_HOME_RESOURCE_ID.In(Parameter("homeIDs", count)).And(
+                no.NOTIFICATION_UID.In(Parameter("uids", count))
+            ),
+        )
+
+    @classmethod
+    def _existingRevisionsQuery(cls, count):
+        rev = cls._revisionsSchema
+        return Select(
+            [rev.HOME_RESOURCE_ID, rev.RESOURCE_NAME],
+            From=rev,
+            Where=rev.HOME_RESOURCE_ID.In(Parameter("homeIDs", count)).And(
+                rev.RESOURCE_NAME.In(Parameter("names", count))
+            ),
+        )
+
+    @classmethod
+    def _bumpRevisionsQuery(cls, pairs):
+        """
+        Revision update for a set of (home id, resource name) pairs. The pairs
+        are matched exactly rather than as two C{IN} lists, so that other
+        resources in the same homes are not touched.
+        """
+        rev = cls._revisionsSchema
+        where = None
+        for homeID, name in pairs:
+            match = (rev.HOME_RESOURCE_ID == homeID).And(rev.RESOURCE_NAME == name)
+            where = match if where is None else where.Or(match)
+        return Update(
+            {
+                rev.REVISION: schema.REVISION_SEQ,
+                rev.DELETED: False,
+                rev.MODIFIED: utcNowSQL,
+            },
+            Where=where,
+        )
+
+    @classmethod
+    @inlineCallbacks
+    def writeNotificationObjects(cls, txn, notifications, category=ChangeCategory.default):
+        """
+        Bulk version of L{writeNotificationObject}: create or update
+        notification objects in many collections. Existing objects and
+        revisions are looked up, and revisions bumped, with one statement per
+        batch rather than per object. Each changed collection is notified
+        once, with the push keys of all the collections enqueued together.
+
+        @param txn: transaction
+        @type txn: L{CommonStoreTransaction}
+        @param notifications: the notifications to write, as tuples of
+            (collection, uid, notificationtype, notificationdata), with each
+            collection and uid pair appearing at most once
+        @type notifications: C{list} of C{tuple}
+        @param category: change category for the push notifications
+        @type category: L{ChangeCategory}
+
+        @return: the notification objects, in the same order as
+            C{notifications}
+        @rtype: C{list} of L{NotificationObject}
+        """
+        results = []
+        changed = {}
+        for offset in range(0, len(notifications), cls.bulkBatchSize):
+            batch = notifications[offset:offset + cls.bulkBatchSize]
+            homeIDs = [collection._resourceID for collection, _ignore_uid, _ignore_type, _ignore_data in batch]
+            uids = [uid for _ignore_collection, uid, _ignore_type, _ignore_data in batch]
+
+            rows = yield cls._existingNotificationsQuery(len(batch)).on(txn, homeIDs=homeIDs, uids=uids)
+            existing = dict([((homeID, uid), resourceID) for homeID, uid, resourceID in rows])
+
+            # Write the object rows
+            objects = []
+            writes = []
+            for collection, uid, notificationtype, notificationdata in batch:
+                notificationObject = NotificationObject(collection, uid)
+                resourceID = existing.get((collection._resourceID, uid))
+                inserting = resourceID is None
+                if not inserting:
+                    notificationObject._resourceID = resourceID
+                objects.append((notificationObject, inserting,))
+                writes.append(notificationObject.setData(uid, notificationtype, notificationdata, inserting=inserting))
+            yield gatherResults(writes, consumeErrors=True)
+
+            # Bump existing revisions and create the missing ones - a new object may
+            # still have a revision row left from a deleted one with the same name
+            names = [obj.name() for obj, _ignore_inserting in objects]
+            rows = yield cls._existingRevisionsQuery(len(batch)).on(txn, homeIDs=homeIDs, names=names)
+            revisions = set([tuple(row) for row in rows])
+            bump = []
+            writes = []
+            for notificationObject, inserting in objects:
+                collection = notificationObject.notificationCollection()
+                key = (collection._resourceID, notificationObject.name(),)
+                if key in revisions:
+                    bump.append(key)
+                else:
+                    writes.append(collection._completelyNewRevisionQuery.on(
+                        txn, homeID=collection._resourceID, name=notificationObject.name()
+                    ))
+                    revisions.add(key)
+                if inserting and collection._notificationNames is not None:
+                    collection._notificationNames.append(notificationObject.name())
+                collection._notifications[notificationObject.uid()] = notificationObject
+                collection._syncTokenRevision = None
+                changed[collection._resourceID] = collection
+            if bump:
+                writes.append(cls._bumpRevisionsQuery(bump).on(txn))
+            yield gatherResults(writes, consumeErrors=True)
+
+            results.extend([obj for obj, _ignore_inserting in objects])
+
+        yield cls.notifyManyChanged(txn, changed.values(), category=category)
+        returnValue(results)
+
+    @classmethod
+    @inlineCallbacks
+    def notifyManyChanged(cls, txn, collections, category=ChangeCategory.default):
+        """
+        Bulk version of L{notifyChanged}: send change notifications for many
+        collections, handing all the push notifiers to the notifier together
+        so that duplicate push keys are coalesced.
+
+        @param txn: transaction
+        @type txn: L{CommonStoreTransaction}
+        @param collections: the collections that changed
+        @type collections: iterable of L{NotificationCollection}
+        @param category: change category for the push notifications
+        @type category: L{ChangeCategory}
+        """
+        pushNotifiers = []
+        for collection in collections:
+            if txn.isNotifiedAlready(collection):
+                continue
+            txn.notificationAddedForObject(collection)
+
+            # cache notifiers run in post commit
+            notifier = collection._notifiers.get("cache", None)
+            if notifier:
+                txn.postCommit(notifier.notify)
+            notifier = collection._notifiers.get("push", None)
+            if notifier:
+                pushNotifiers.append(notifier)
+
+        if pushNotifiers:
+            notifyMany = getattr(pushNotifiers[0], "notifyMany", None)
+            if notifyMany is not None:
+                yield notifyMany(pushNotifiers, txn, priority=category.value)
+            else:
+                for notifier in pushNotifiers:
+                    yield notifier.notify(txn, priority=category.value)
+
     @inlineCallbacks
     def _loadPropertyStore(self):
         self._propertyStore = yield PropertyStore.load(
@@ -0,0 +1,164 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Prepared forms of the store's hot, memoized DAL queries.
+
+Every call to a DAL query's C{on} generates its SQL text again. L{preparedQuery}
+wraps a memoized query so that its SQL text is generated once per database
+type, under a stable name, and re-used for every execution.
+
+The PostgreSQL driver (pg8000) prepares each distinct statement text as a
+named server-side statement the first time it is run on a connection, and
+re-uses it for later executions with the same text on that connection. So
+a hot query whose text is always identical is parsed once per pooled
+connection, and the server's plan cache applies to it; a new connection
+(e.g. after the pool recycles one) simply prepares it again on first use.
+The stable name is included in the statement text as a comment, which
+identifies it in the server's logs and statistics.
+"""
+
+__all__ = [
+    "PreparedQuery",
+    "preparedQuery",
+]
+
+from functools import wraps
+
+from twext.enterprise.ienterprise import POSTGRES_DIALECT
+from twext.python.log import Logger
+
+from twisted.internet.defer import succeed
+
+log = Logger()
+
+
+class _Placeholder(object):
+    """
+    Stands in for the value of a named parameter while a query's SQL text is
+    being generated.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "<_Placeholder {}>".format(self.name)
+
+
+class _RecordingTransaction(object):
+    """
+    Looks enough like a transaction for a DAL query to generate its SQL text
+    for it, and records the statement rather than executing it.
+    """
+
+    def __init__(self, txn):
+        self.dbtype = txn.dbtype
+        self.dialect = txn.dbtype.dialect
+        self.paramstyle = txn.dbtype.paramstyle
+        self.statement = None
+
+    def execSQL(self, sql, args=None, raiseOnZeroRowCount=None):
+        self.statement = (sql, list(args or ()),)
+        return succeed([])
+
+
+class PreparedQuery(object):
+    """
+    A memoized DAL query whose SQL text is generated once for each database
+    type and then re-used. This is only done for PostgreSQL, where the DAL
+    passes the results of a statement through unchanged; for other databases,
+    and for queries whose parameters are not simple values (e.g. a list of
+    values for an C{IN}), the DAL query is used as normal.
+
+    @ivar name: the stable name of the query
+    @type name: L{str}
+    @ivar query: the DAL query
+    """
+
+    def __init__(self, name, query):
+        self.name = name
+        self.query = query
+        self._statements = {}
+
+    def __repr__(self):
+        return "<PreparedQuery {}>".format(self.name)
+
+    def _statementFor(self, txn, names):
+        """
+        Generate the SQL text of the query, and the template of its arguments
+        in which each named parameter is a L{_Placeholder}.
+
+        @return: the SQL text and argument template, or C{None} if the query
+            cannot be prepared
+        @rtype: L{tuple}
+        """
+        dbtype = txn.dbtype
+        key = (dbtype.dialect, dbtype.paramstyle, tuple(sorted(getattr(dbtype, "features", ()))), names,)
+        try:
+            return self._statements[key]
+        except KeyError:
+            pass
+
+        statement = None
+        if dbtype.dialect == POSTGRES_DIALECT:
+            recorder = _RecordingTransaction(txn)
+            try:
+                self.query.on(recorder, **dict([(name, _Placeholder(name)) for name in names]))
+            except Exception as e:
+                log.debug("Query {name} cannot be prepared: {ex}", name=self.name, ex=e)
+            else:
+                if recorder.statement is not None:
+                    sql, args = recorder.statement
+                    statement = ("-- {}\n{}".format(self.name, sql), args,)
+        self._statements[key] = statement
+        return statement
+
+    def on(self, txn, raiseOnZeroRowCount=None, **kw):
+        """
+        Execute the query on a transaction, like the DAL query's own C{on}.
+        """
+        statement = self._statementFor(txn, tuple(sorted(kw.keys())))
+        if statement is None:
+            return self.query.on(txn, raiseOnZeroRowCount=raiseOnZeroRowCount, **kw)
+        sql, template = statement
+        args = [
+            kw[arg.name] if isinstance(arg, _Placeholder) else arg
+            for arg in template
+        ]
+        return txn.execSQL(sql, args, raiseOnZeroRowCount)
+
+
+def preparedQuery(thunk):
+    """
+    Decorator for the thunk of a memoized query (under a C{classproperty}),
+    which makes the query a L{PreparedQuery} named after the thunk's class
+    and name, e.g.::
+
+        @classproperty
+        @preparedQuery
+        def _textByIDQuery(cls):
+            ...
+
+    A subclass whose version of the query has different SQL text gets a
+    different prepared statement, because the statement text is what the
+    driver prepares.
+    """
+    @wraps(thunk)
+    def _prepared(cls):
+        name = "{}.{}".format(cls.__name__, thunk.__name__.lstrip("_"))
+        return PreparedQuery(name, thunk(cls))
+    return _prepared
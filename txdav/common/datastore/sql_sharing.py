@@ -26,10 +26,12 @@ from twext.python.log import Logger
 from twisted.internet.defer import inlineCallbacks, returnValue, succeed
 
 from txdav.base.propertystore.base import PropertyName
+from txdav.common.datastore.sql_prepared import preparedQuery
 from txdav.common.datastore.sql_tables import _BIND_MODE_OWN, _BIND_MODE_DIRECT, \
     _BIND_MODE_INDIRECT, _BIND_STATUS_ACCEPTED, _BIND_STATUS_DECLINED, \
     _BIND_STATUS_INVITED, _BIND_STATUS_INVALID, _BIND_STATUS_DELETED, \
     _HOME_STATUS_EXTERNAL, _HOME_STATUS_DISABLED
+from txdav.common.datastore.sql_util import insertManyStatement
 from txdav.common.icommondatastore import ExternalShareFailed, \
     HomeChildNameAlreadyExistsError, AllRetriesFailed
 from txdav.idav import ChangeCategory
@@ -278,6 +280,13 @@ class SharingMixIn(object):
     Common class for CommonHomeChild and AddressBookObject
     """
 
+    # Whether L{inviteUIDsToShare} and L{uninviteUIDsFromShare} can use the
+    # bulk code paths, or have to go through the single sharee APIs
+    _bulkShareSupported = True
+
+    # Number of sharees looked up by each directory request in bulk operations
+    bulkDirectoryBatchSize = 500
+
     @classproperty
     def _bindInsertQuery(cls, **kw):
         """
@@ -357,6 +366,7 @@ class SharingMixIn(object):
                             .And(bind.BIND_STATUS == _BIND_STATUS_ACCEPTED))
 
     @classproperty
+    @preparedQuery
     def _bindForResourceIDAndHomeID(cls):
         """
         DAL query that looks up home bind rows by home child
@@ -367,6 +377,7 @@ class SharingMixIn(object):
                             .And(bind.HOME_RESOURCE_ID == Parameter("homeID")))
 
     @classproperty
+    @preparedQuery
     def _bindForBindUIDAndHomeID(cls):
         """
         DAL query that looks up home bind rows by home child
@@ -377,6 +388,7 @@ class SharingMixIn(object):
                             .And(bind.HOME_RESOURCE_ID == Parameter("homeID")))
 
     @classproperty
+    @preparedQuery
     def _bindForNameAndHomeID(cls):
         """
         DAL query that looks up any bind rows by home child
@@ -478,6 +490,142 @@ class SharingMixIn(object):
             # Remove the bind
             yield self.removeShare(shareeView)
 
+    @inlineCallbacks
+    def inviteUIDsToShare(self, shareeUIDs, mode, summary=None):
+        """
+        Invite many users to share this collection. This is the same as calling
+        L{inviteUIDToShare} for each one, but sharees that are not already
+        invited are handled together: their homes are looked up in bulk, their
+        binds are created with one statement and their invite notifications
+        are written together. That keeps sharing with a large list of users to
+        a handful of queries rather than a dozen per sharee.
+
+        @param shareeUIDs: UIDs of the sharees
+        @type shareeUIDs: iterable of C{str}
+        @param mode: access mode
+        @type mode: C{int}
+        @param summary: share message
+        @type summary: C{str}
+
+        @return: the sharee views
+        @rtype: C{list} of L{CommonHomeChild}
+        """
+
+        shareeUIDs = self._uniqueShareeUIDs(shareeUIDs)
+        shareeViews = []
+        if not self._bulkShareSupported or mode == _BIND_MODE_DIRECT:
+            for shareeUID in shareeUIDs:
+                shareeViews.append((yield self.inviteUIDToShare(shareeUID, mode, summary)))
+            returnValue(shareeViews)
+
+        # Existing sharees (and anything that cannot be done in bulk) are
+        # updated one at a time
+        invited = set([invitation.shareeUID for invitation in (yield self.sharingInvites())])
+        newUIDs = yield self._bulkInviteUIDs([shareeUID for shareeUID in shareeUIDs if shareeUID not in invited])
+        for shareeUID in shareeUIDs:
+            if shareeUID not in newUIDs:
+                result = yield self.inviteUIDToShare(shareeUID, mode, summary)
+                if isinstance(result, tuple):
+                    shareeViews.extend(result)
+                else:
+                    shareeViews.append(result)
+
+        shareeViews.extend((yield self._createShares(newUIDs, mode, summary)))
+        returnValue(shareeViews)
+
+    @inlineCallbacks
+    def uninviteUIDsFromShare(self, shareeUIDs):
+        """
+        Remove many users from a share. This is the same as calling
+        L{uninviteUIDFromShare} for each one, but the binds are removed with
+        one statement, and the notifications and sharee home change
+        notifications are sent together.
+
+        @param shareeUIDs: UIDs of the sharees
+        @type shareeUIDs: iterable of C{str}
+        """
+
+        shareeUIDs = self._uniqueShareeUIDs(shareeUIDs)
+        if not self._bulkShareSupported:
+            for shareeUID in shareeUIDs:
+                yield self.uninviteUIDFromShare(shareeUID)
+            returnValue(None)
+
+        shareeViews = yield self.shareeViews(shareeUIDs)
+        bulkViews = []
+        for shareeUID in shareeUIDs:
+            shareeView = shareeViews.get(shareeUID)
+            if shareeView is not None and (yield self._bulkUninviteView(shareeView)):
+                bulkViews.append(shareeView)
+            else:
+                yield self.uninviteUIDFromShare(shareeUID)
+
+        yield self._removeShares(bulkViews)
+
+    def _uniqueShareeUIDs(self, shareeUIDs):
+        """
+        Remove duplicates and the owner from a list of sharee UIDs, keeping the
+        original order.
+        """
+        seen = set((self._home.uid(),))
+        results = []
+        for shareeUID in shareeUIDs:
+            if shareeUID not in seen:
+                seen.add(shareeUID)
+                results.append(shareeUID)
+        return results
+
+    @inlineCallbacks
+    def _shareeRecords(self, shareeUIDs):
+        """
+        Look up the directory records of many sharees, with one directory
+        request per batch rather than one per sharee.
+
+        @param shareeUIDs: UIDs of the sharees
+        @type shareeUIDs: iterable of C{str}
+
+        @return: the records keyed by sharee UID, UIDs with no record are left
+            out
+        @rtype: C{dict}
+        """
+        shareeUIDs = list(shareeUIDs)
+        results = {}
+        for offset in range(0, len(shareeUIDs), self.bulkDirectoryBatchSize):
+            batch = shareeUIDs[offset:offset + self.bulkDirectoryBatchSize]
+            records = yield self._txn.directoryService().recordsWithUIDs(
+                [shareeUID.decode("utf-8") for shareeUID in batch]
+            )
+            for record in records:
+                results[record.uid.encode("utf-8")] = record
+        returnValue(results)
+
+    def _bulkInviteUIDs(self, shareeUIDs):
+        """
+        Decide which of the new sharees passed to L{inviteUIDsToShare} can
+        be invited in bulk. The others go through L{inviteUIDToShare}.
+        Override in derived classes that treat some sharees specially.
+
+        @param shareeUIDs: UIDs of sharees not yet invited
+        @type shareeUIDs: C{list} of C{str}
+
+        @return: the UIDs to invite in bulk
+        @rtype: C{set} of C{str}
+        """
+        return succeed(set(shareeUIDs))
+
+    def _bulkUninviteView(self, shareeView):
+        """
+        Decide whether a sharee passed to L{uninviteUIDsFromShare} can be
+        removed in bulk. The others go through L{uninviteUIDFromShare}.
+        Override in derived classes that treat some sharees specially.
+
+        @param shareeView: the sharee view
+        @type shareeView: L{CommonHomeChild}
+
+        @rtype: C{bool}
+        """
+        return succeed(not shareeView.viewerHome().external())
+
     @inlineCallbacks
     def acceptShare(self, summary=None):
         """
@@ -603,6 +751,32 @@ class SharingMixIn(object):
         """
         Called on the owner's resource.
         """
+        notificationtype, notificationdata = yield self._inviteNotificationData(shareeView, notificationState)
+
+        # Add to sharee's collection
+        notifications = yield self._txn.notificationsWithUID(shareeView.viewerHome().uid(), create=True)
+        yield notifications.writeNotificationObject(shareeView.shareUID(), notificationtype, notificationdata)
+
+    @inlineCallbacks
+    def _sendInviteNotifications(self, shareeViews, notificationState=None):
+        """
+        Bulk version of L{_sendInviteNotification}.
+        """
+        notifications = []
+        for shareeView in shareeViews:
+            notificationtype, notificationdata = yield self._inviteNotificationData(shareeView, notificationState)
+            notifications.append((shareeView.viewerHome().uid(), shareeView.shareUID(), notificationtype, notificationdata,))
+        if notifications:
+            yield self._txn.writeNotificationObjects(notifications)
+
+    @inlineCallbacks
+    def _inviteNotificationData(self, shareeView, notificationState=None):
+        """
+        Build the notification type and data of an invite notification.
+
+        @return: the notification type and data
+        @rtype: C{tuple} of (C{dict}, C{dict})
+        """
         # When deleting the message is the sharee's display name
         displayname = shareeView.shareMessage()
         if notificationState == _BIND_STATUS_DELETED:
@@ -627,9 +801,7 @@ class SharingMixIn(object):
         if hasattr(self, "getSupportedComponents"):
             notificationdata["supported-components"] = self.getSupportedComponents()
 
-        # Add to sharee's collection
-        notifications = yield self._txn.notificationsWithUID(shareeView.viewerHome().uid(), create=True)
-        yield notifications.writeNotificationObject(shareeView.shareUID(), notificationtype, notificationdata)
+        returnValue((notificationtype, notificationdata,))
 
     @inlineCallbacks
     def _sendReplyNotification(self, ownerView, summary=None):
@@ -764,6 +936,62 @@ class SharingMixIn(object):
         shareeView = (yield shareeHome.allChildWithID(self.id())) if shareeHome is not None else None
         returnValue(shareeView)
 
+    @inlineCallbacks
+    def shareeViews(self, shareeUIDs):
+        """
+        Bulk version of L{shareeView}: return the shared resource counterparts
+        of this owned resource for many sharees, using one query for the homes
+        and one for the binds.
+
+        @param shareeUIDs: UIDs of the sharees
+        @type shareeUIDs: iterable of C{str}
+
+        @return: the sharee views keyed by sharee UID, sharees without a
+            share are left out
+        @rtype: C{dict}
+        """
+
+        shareeUIDs = self._uniqueShareeUIDs(shareeUIDs)
+        if not shareeUIDs:
+            returnValue({})
+
+        # Suppress everything if this collection is in the trash, the same as
+        # L{CommonHomeChild.objectWith} does for each sharee
+        metadataData = (yield self._metadataByIDQuery.on(self._txn, resourceID=self._resourceID))[0]
+        try:
+            isInTrash = metadataData[self.metadataColumns().index(self._homeChildMetaDataSchema.IS_IN_TRASH)]
+        except (AttributeError, ValueError):
+            isInTrash = False
+        if isInTrash:
+            returnValue({})
+
+        homes = yield self._txn.homesWithUIDs(self._home._homeType, shareeUIDs, asOwner=True)
+        homesByID = dict([(home._resourceID, home,) for home in homes.values()])
+
+        bind = self._bindSchema
+        homeIDs = sorted(homesByID.keys())
+        homeIDIndex = self.bindColumns().index(bind.HOME_RESOURCE_ID)
+        results = {}
+        for offset in range(0, len(homeIDs), self._home.bulkBatchSize):
+            batch = homeIDs[offset:offset + self._home.bulkBatchSize]
+            rows = yield self._bindFor(
+                (bind.RESOURCE_ID == Parameter("resourceID")).And(
+                    bind.HOME_RESOURCE_ID.In(Parameter("homeIDs", len(batch)))
+                )
+            ).on(self._txn, resourceID=self._resourceID, homeIDs=batch)
+
+            for row in rows:
+                home = homesByID[row[homeIDIndex]]
+                bindData = row[:self.bindColumnCount]
+                additionalBindData = row[self.bindColumnCount:self.bindColumnCount + len(self.additionalBindColumns())]
+                shareeView = yield home._childClass.makeClass(
+                    home, bindData, additionalBindData, metadataData, ownerHome=self.ownerHome(),
+                )
+                shareeView._ownerName = self.name()
+                results[home.uid()] = shareeView
+
+        returnValue(results)
+
     @inlineCallbacks
     def shareWithUID(self, shareeUID, mode, status=None, summary=None, shareName=None):
         """
@@ -879,6 +1107,102 @@ class SharingMixIn(object):
         shareeView = yield self.shareeView(shareeUID)
         returnValue(shareeView)
 
+    @inlineCallbacks
+    def _createShares(self, shareeUIDs, mode, summary=None):
+        """
+        Create invited shares for many sharees that are not yet invited, and
+        send their invite notifications. The sharee homes are looked up (and
+        created if needed) together, and the binds for local sharees are
+        created with one multi-row insert per batch. External sharees, and
+        any batch whose insert fails because of a concurrent change, go
+        through the single sharee code path.
+
+        @param shareeUIDs: UIDs of the sharees
+        @type shareeUIDs: iterable of C{str}
+        @param mode: access mode
+        @type mode: C{int}
+        @param summary: share message
+        @type summary: C{str}
+
+        @return: the sharee views
+        @rtype: C{list} of L{CommonHomeChild}
+        """
+
+        shareeUIDs = self._uniqueShareeUIDs(shareeUIDs)
+        if not shareeUIDs:
+            returnValue([])
+
+        homes = yield self._txn.homesWithUIDs(self._home._homeType, shareeUIDs, create=True)
+        singleUIDs = []
+        localHomes = []
+        for shareeUID in shareeUIDs:
+            shareeHome = homes.get(shareeUID)
+            if shareeHome is None or shareeHome.external():
+                singleUIDs.append(shareeUID)
+            else:
+                localHomes.append(shareeHome)
+
+        for offset in range(0, len(localHomes), self._home.bulkBatchSize):
+            batch = localHomes[offset:offset + self._home.bulkBatchSize]
+            statement, args = self._bindInsertManyStatement([
+                (home._resourceID, self._resourceID, self.newShareName(), mode, _BIND_STATUS_INVITED, summary,)
+                for home in batch
+            ])
+            try:
+                yield self._txn.subtransaction(
+                    lambda subt: subt.execSQL(statement, args), retries=0, failureOK=True
+                )
+            except AllRetriesFailed:
+                singleUIDs.extend([home.uid() for home in batch])
+
+        bulkUIDs = [home.uid() for home in localHomes if home.uid() not in singleUIDs]
+        shareeViews = []
+        if bulkUIDs:
+            # Mark this as shared
+            yield self.setShared(True)
+
+            # Must send notification to ensure cache invalidation occurs
+            yield self.notifyPropertyChanged()
+            yield self._home.notifyManyChanged(
+                self._txn,
+                [homes[shareeUID] for shareeUID in bulkUIDs],
+            )
+
+            views = yield self.shareeViews(bulkUIDs)
+            shareeViews = [views[shareeUID] for shareeUID in bulkUIDs if shareeUID in views]
+            yield self._sendInviteNotifications(shareeViews)
+
+        for shareeUID in singleUIDs:
+            shareeViews.append((yield SharingMixIn.inviteUIDToShare(self, shareeUID, mode, summary)))
+
+        returnValue(shareeViews)
+
+    def _bindInsertManyStatement(self, rows):
+        """
+        Build a statement that inserts many bind rows at once (see
+        L{insertManyStatement}).
+
+        @param rows: the rows to insert as tuples of (home resource id, resource
+            id, resource name, bind mode, bind status, message)
+        @type rows: C{list} of C{tuple}
+
+        @return: the SQL statement and its arguments
+        @rtype: C{tuple} of (C{str}, C{list})
+        """
+        bind = self._bindSchema
+        return insertManyStatement(
+            self._txn,
+            (
+                bind.HOME_RESOURCE_ID,
+                bind.RESOURCE_ID,
+                bind.RESOURCE_NAME,
+                bind.BIND_MODE,
+                bind.BIND_STATUS,
+                bind.MESSAGE,
+            ),
+            rows,
+        )
+
     @inlineCallbacks
     def updateShare(self, shareeView, mode=None, status=None, summary=None):
         """
@@ -991,6 +1315,63 @@ class SharingMixIn(object):
 
         yield shareeView.invalidateQueryCache()
 
+    @inlineCallbacks
+    def _removeShares(self, shareeViews):
+        """
+        Remove many local sharees from this (owned) L{CommonHomeChild}, the
+        same as L{uninviteUIDFromShare} does for each one, but with the binds
+        deleted by one statement per batch and the notifications sent
+        together.
+
+        @param shareeViews: the shared resources being removed
+        @type shareeViews: C{list} of L{CommonHomeChild}
+        """
+        if not shareeViews:
+            returnValue(None)
+
+        # If current user state is accepted then we send an invite with the new state, otherwise
+        # we cancel any existing invites for the user. Also, if the ownerHome is disabled, we assume
+        # that no sharing invites are sent.
+        if self.ownerHome().status() != _HOME_STATUS_DISABLED:
+            invitedViews = [shareeView for shareeView in shareeViews if not shareeView.direct()]
+            yield self._sendInviteNotifications(
+                [shareeView for shareeView in invitedViews if shareeView.shareStatus() == _BIND_STATUS_ACCEPTED],
+                notificationState=_BIND_STATUS_DELETED,
+            )
+            pending = [shareeView for shareeView in invitedViews if shareeView.shareStatus() != _BIND_STATUS_ACCEPTED]
+            notifications = yield self._txn.notificationsWithUIDs([shareeView.viewerHome().uid() for shareeView in pending])
+            for shareeView in pending:
+                collection = notifications.get(shareeView.viewerHome().uid())
+                if collection is not None:
+                    yield collection.removeNotificationObjectWithUID(shareeView.shareUID())
+
+        # remove sync tokens
+        key = self._home._childrenKey(self.isInTrash())
+        for shareeView in shareeViews:
+            shareeHome = shareeView.viewerHome()
+            yield shareeView._deletedSyncToken(sharedRemoval=True)
+            shareeHome._children[key].pop(shareeView._name, None)
+            shareeHome._children[key].pop(shareeView._resourceID, None)
+
+        # Must send notification to ensure cache invalidation occurs
+        yield self.notifyPropertyChanged()
+        yield self._home.notifyManyChanged(self._txn, [shareeView.viewerHome() for shareeView in shareeViews])
+
+        # delete binds including invites
+        bind = self._bindSchema
+        homeIDs = sorted([shareeView.viewerHome()._resourceID for shareeView in shareeViews])
+        for offset in range(0, len(homeIDs), self._home.bulkBatchSize):
+            batch = homeIDs[offset:offset + self._home.bulkBatchSize]
+            yield Delete(
+                From=bind,
+                Where=(bind.RESOURCE_ID == Parameter("resourceID")).And(
+                    bind.HOME_RESOURCE_ID.In(Parameter("homeIDs", len(batch)))
+                ),
+            ).on(self._txn, resourceID=self._resourceID, homeIDs=batch)
+
+        for shareeView in shareeViews:
+            yield shareeView.invalidateQueryCache()
+
     @inlineCallbacks
     def unshare(self):
         """
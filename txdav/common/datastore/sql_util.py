@@ -17,6 +17,7 @@
 
 from twext.enterprise.dal.syntax import Max, Select, Parameter, Delete, Insert, \
     Update, ColumnSyntax, TableSyntax, Upper, utcNowSQL
+from twext.enterprise.ienterprise import ORACLE_DIALECT
 from twext.python.clsprop import classproperty
 from twext.python.log import Logger
 from twisted.internet.defer import succeed, inlineCallbacks, returnValue
@@ -490,6 +491,46 @@ class _SharedSyncLogic(object):
         return succeed(None)
 
 
+def insertManyStatement(txn, columns, rows):
+    """
+    Build a statement that inserts many rows into a table at once. The DAL only
+    generates single row inserts, so this is SQL in the form each database
+    supports.
+
+    @param txn: the transaction the statement will be executed in
+    @type txn: L{CommonStoreTransaction}
+    @param columns: the columns to insert, all from the same table
+    @type columns: C{tuple} of L{ColumnSyntax}
+    @param rows: the rows to insert as tuples of values for C{columns}
+    @type rows: C{list} of C{tuple}
+
+    @return: the SQL statement and its arguments
+    @rtype: C{tuple} of (C{str}, C{list})
+    """
+    table = columns[0].model.table.name
+    names = ", ".join([column.model.name for column in columns])
+
+    args = []
+    values = []
+    for row in rows:
+        placeholders = []
+        for value in row:
+            args.append(value)
+            if txn.dbtype.paramstyle == "numeric":
+                placeholders.append(":{}".format(len(args)))
+            else:
+                placeholders.append("%s")
+        values.append("({})".format(", ".join(placeholders)))
+
+    if txn.dbtype.dialect == ORACLE_DIALECT:
+        statement = "insert all {} select * from DUAL".format(
+            " ".join(["into {} ({}) values {}".format(table, names, value) for value in values])
+        )
+    else:
+        statement = "insert into {} ({}) values {}".format(table, names, ", ".join(values))
+    return statement, args
+
+
 def determineNewest(uid, homeType):
     """
     Construct a query to determine the modification time of the newest object
@@ -20,6 +20,7 @@ Tests for L{txdav.common.datastore.sql}.
 
 from uuid import UUID
 
+from calendarserver.push.ipush import PushPriority
 from twext.enterprise.dal.syntax import Insert
 from twext.enterprise.dal.syntax import Select
 from twisted.internet.defer import Deferred
@@ -31,6 +32,7 @@ from txdav.common.datastore.sql import (
     log, CommonStoreTransactionMonitor,
     CommonHome, CommonHomeChild, ECALENDARTYPE
 )
+from txdav.common.datastore.sql_notification import NotificationCollection
 from txdav.common.datastore.sql_tables import schema
 from txdav.common.datastore.sql_util import _normalizeColumnUUIDs, \
     fixUUIDNormalization
@@ -411,6 +413,90 @@ class CommonSQLStoreTests(CommonCommonTests, TestCase):
             [[normalizedUID]]
         )
 
+    @inlineCallbacks
+    def test_writeNotificationObjects(self):
+        """
+        L{CommonStoreTransaction.writeNotificationObjects} creates and updates
+        notifications in many collections, bumps their sync tokens and sends
+        each push key once.
+        """
+        notificationtype = {"notification-type": "invite-notification"}
+
+        txn = self.transactionUnderTest()
+        home1 = yield txn.notificationsWithUID("home1", create=True)
+        yield home1.writeNotificationObject("abc", notificationtype, {"summary": "old"})
+        yield home1.writeNotificationObject("def", notificationtype, {"summary": "old"})
+        yield home1.removeNotificationObjectWithUID("def")
+        token = yield home1.syncToken()
+        yield self.commit()
+
+        txn = self.transactionUnderTest()
+        self.notifierFactory.reset()
+        self.patch(NotificationCollection, "bulkBatchSize", 2)
+        results = yield txn.writeNotificationObjects([
+            ("home1", "abc", notificationtype, {"summary": "new"},),
+            ("home1", "def", notificationtype, {"summary": "new"},),
+            ("home2", "abc", notificationtype, {"summary": "new"},),
+        ])
+        self.assertEqual([result.uid() for result in results], ["abc", "def", "abc"])
+        self.assertEqual(
+            sorted(self.notifierFactory.history),
+            sorted([
+                ("/CalDAV/example.com/home1/", PushPriority.high),
+                ("/CalDAV/example.com/home1/notification/", PushPriority.high),
+                ("/CalDAV/example.com/home2/", PushPriority.high),
+                ("/CalDAV/example.com/home2/notification/", PushPriority.high),
+            ])
+        )
+        yield self.commit()
+
+        txn = self.transactionUnderTest()
+        homes = yield txn.notificationsWithUIDs(["home1", "home2", "home3"])
+        self.assertEqual(sorted(homes.keys()), ["home1", "home2"])
+        self.assertEqual(sorted((yield homes["home1"].listNotificationObjects())), ["abc.xml", "def.xml"])
+        self.assertEqual((yield homes["home2"].listNotificationObjects()), ["abc.xml"])
+        for home in homes.values():
+            for name in (yield home.listNotificationObjects()):
+                notification = yield home.notificationObjectWithName(name)
+                self.assertEqual((yield notification.notificationData()), {"summary": "new"})
+        changed = yield homes["home1"].resourceNamesSinceToken(int(token.split("_")[1]))
+        self.assertEqual(sorted(changed[0]), ["abc.xml", "def.xml"])
+        self.assertEqual(changed[1], [])
+
+    @inlineCallbacks
+    def test_notifyManyChangedLockedHome(self):
+        """
+        L{CommonHome.notifyManyChanged} still bumps the MODIFIED value of the
+        other homes in a batch when another transaction holds one home's
+        metadata row.
+        """
+        txn = self.transactionUnderTest()
+        for uid in ("home1", "home2", "home3"):
+            yield txn.calendarHomeWithUID(uid, create=True)
+        yield self.commit()
+
+        locker = self.concurrentTransaction()
+        lockedHome = yield locker.calendarHomeWithUID("home2")
+        meta = schema.CALENDAR_HOME_METADATA
+        yield Select(
+            From=meta,
+            Where=meta.RESOURCE_ID == lockedHome.id(),
+            ForUpdate=True,
+        ).on(locker)
+
+        txn = self.transactionUnderTest()
+        homes = []
+        for uid in ("home1", "home2", "home3"):
+            homes.append((yield txn.calendarHomeWithUID(uid)))
+        before = [home._modified for home in homes]
+        yield homes[0].notifyManyChanged(txn, homes)
+        after = [home._modified for home in homes]
+        self.assertNotEqual(after[0], before[0])
+        self.assertEqual(after[1], before[1])
+        self.assertNotEqual(after[2], before[2])
+        yield self.commit()
+        yield locker.abort()
+
     @inlineCallbacks
     def test_fixUUIDNormalization_lowerToUpper_notification(self):
         """
@@ -0,0 +1,153 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Tests for L{txdav.common.datastore.sql_prepared}.
+"""
+
+from twext.enterprise.ienterprise import POSTGRES_DIALECT, ORACLE_DIALECT
+from twext.python.clsprop import classproperty
+
+from twisted.internet.defer import succeed
+from twisted.trial.unittest import TestCase
+
+from txdav.common.datastore.sql_prepared import PreparedQuery, preparedQuery
+
+
+class StubDBType(object):
+
+    def __init__(self, dialect, paramstyle="pyformat"):
+        self.dialect = dialect
+        self.paramstyle = paramstyle
+        self.features = set()
+
+
+class StubTransaction(object):
+    """
+    A transaction that records the statements executed on it.
+    """
+
+    def __init__(self, dialect=POSTGRES_DIALECT):
+        self.dbtype = StubDBType(dialect)
+        self.dialect = self.dbtype.dialect
+        self.paramstyle = self.dbtype.paramstyle
+        self.executed = []
+
+    def execSQL(self, sql, args=None, raiseOnZeroRowCount=None):
+        self.executed.append((sql, args,))
+        return succeed([["row"]])
+
+
+class StubQuery(object):
+    """
+    Stands in for a DAL query with a single C{resourceID} parameter, and
+    counts the times its SQL text is generated.
+    """
+
+    def __init__(self):
+        self.generated = 0
+
+    def on(self, txn, raiseOnZeroRowCount=None, **kw):
+        self.generated += 1
+        return txn.execSQL("select A from B where C = %s and D = %s", [kw["resourceID"], 1], raiseOnZeroRowCount)
+
+
+class ListQuery(StubQuery):
+    """
+    A query that, like a DAL query with a list parameter, needs to know the
+    values of its parameters to generate its SQL text.
+    """
+
+    def on(self, txn, raiseOnZeroRowCount=None, **kw):
+        self.generated += 1
+        return txn.execSQL(
+            "select A from B where C in ({})".format(", ".join(["%s"] * len(kw["resourceIDs"]))),
+            list(kw["resourceIDs"]),
+            raiseOnZeroRowCount,
+        )
+
+
+class PreparedQueryTests(TestCase):
+    """
+    Tests for L{PreparedQuery}.
+    """
+
+    def test_textReused(self):
+        """
+        The SQL text of the query is generated once, and executed with the
+        values of the parameters.
+        """
+        query = StubQuery()
+        prepared = PreparedQuery("Test.query", query)
+        txn = StubTransaction()
+        for resourceID in (1, 2,):
+            rows = self.successResultOf(prepared.on(txn, resourceID=resourceID))
+            self.assertEqual(rows, [["row"]])
+        self.assertEqual(query.generated, 1)
+        self.assertEqual(txn.executed, [
+            ("-- Test.query\nselect A from B where C = %s and D = %s", [1, 1],),
+            ("-- Test.query\nselect A from B where C = %s and D = %s", [2, 1],),
+        ])
+
+        # Another transaction on the same type of database re-uses it too
+        other = StubTransaction()
+        prepared.on(other, resourceID=3)
+        self.assertEqual(query.generated, 1)
+        self.assertEqual(other.executed[0][0], txn.executed[0][0])
+
+    def test_otherDialect(self):
+        """
+        Queries on databases other than PostgreSQL use the DAL query.
+        """
+        query = StubQuery()
+        prepared = PreparedQuery("Test.query", query)
+        txn = StubTransaction(ORACLE_DIALECT)
+        prepared.on(txn, resourceID=1)
+        prepared.on(txn, resourceID=2)
+        self.assertEqual(query.generated, 2)
+        self.assertEqual(txn.executed, [
+            ("select A from B where C = %s and D = %s", [1, 1],),
+            ("select A from B where C = %s and D = %s", [2, 1],),
+        ])
+
+    def test_cannotPrepare(self):
+        """
+        Queries whose SQL text cannot be generated without the values of their
+        parameters use the DAL query.
+        """
+        query = ListQuery()
+        prepared = PreparedQuery("Test.query", query)
+        txn = StubTransaction()
+        prepared.on(txn, resourceIDs=[1, 2])
+        prepared.on(txn, resourceIDs=[3])
+        self.assertEqual(txn.executed, [
+            ("select A from B where C in (%s, %s)", [1, 2],),
+            ("select A from B where C in (%s)", [3],),
+        ])
+
+    def test_decorator(self):
+        """
+        L{preparedQuery} names the query after its class and thunk.
+        """
+        class Test(object):
+            @classproperty
+            @preparedQuery
+            def _textByIDQuery(cls):  # @NoSelf
+                return StubQuery()
+
+        prepared = Test._textByIDQuery
+        self.assertIsInstance(prepared, PreparedQuery)
+        self.assertEqual(prepared.name, "Test.textByIDQuery")
@@ -341,6 +341,7 @@ class SQLStoreBuilder(object):
             except:
                 log.failure("setval sequence '{sequence}' failed", sequence=sequence.name)
         yield cleanupTxn.execSQL("update CALENDARSERVER set VALUE = '1' where NAME = 'MIN-VALID-REVISION'", [])
+        yield cleanupTxn.execSQL("delete from CALENDARSERVER where NAME = 'REVISION-CLEANUP-PROGRESS'", [])
 
         yield cleanupTxn.commit()
 
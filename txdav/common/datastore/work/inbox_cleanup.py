@@ -20,10 +20,10 @@ Remove orphaned and old inbox items, and inbox items references old events
 """
 
 from twext.enterprise.dal.record import fromTable
-from twext.enterprise.dal.syntax import Select, Count
+from twext.enterprise.dal.syntax import Select, Count, Min
 from twext.enterprise.jobs.workitem import WorkItem, RegeneratingWorkItem
 from twext.python.log import Logger
-from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed
 from twistedcaldav.config import config
 from txdav.common.datastore.sql_tables import schema, _HOME_STATUS_NORMAL
 import datetime
@@ -66,6 +66,21 @@ class InboxCleanupWork(RegeneratingWorkItem, fromTable(schema.INBOX_CLEANUP_WORK
                 "Inbox cleanup work: Can't schedule per home cleanup because {} work items still queued.",
                 queuedCleanupOneInboxWorkItems
             )
+        elif config.InboxCleanup.BulkHomeBatchSize > 0:
+            # A chain of work items each cleans up a batch of homes, starting
+            # with the lowest provisioned normal calendar home
+            ch = schema.CALENDAR_HOME
+            homeRows = yield Select(
+                [Min(ch.RESOURCE_ID)],
+                From=ch,
+                Where=ch.STATUS == _HOME_STATUS_NORMAL,
+            ).on(self.transaction)
+            if homeRows and homeRows[0][0] is not None:
+                yield CleanupOneInboxWork.reschedule(
+                    self.transaction,
+                    seconds=config.InboxCleanup.StartDelaySeconds,
+                    homeID=homeRows[0][0],
+                )
         else:
             # enumerate provisioned normal calendar homes
             ch = schema.CALENDAR_HOME
@@ -83,17 +98,35 @@ class InboxCleanupWork(RegeneratingWorkItem, fromTable(schema.INBOX_CLEANUP_WORK
 
 
 class CleanupOneInboxWork(WorkItem, fromTable(schema.CLEANUP_ONE_INBOX_WORK)):
+    """
+    Clean up the inbox of one home or, when bulk cleanup is enabled, of a batch
+    of homes starting with this one, scheduling the next batch when done.
+    """
 
     group = property(lambda self: (self.table.HOME_ID == self.homeID))
 
+    def cutoff(self):
+        """
+        Return the creation date before which inbox items are removed, or L{None}
+        if inbox item removal is disabled.
+        """
+        if float(config.InboxCleanup.ItemLifetimeDays) >= 0:  # use -1 to disable; 0 is test case
+            return datetime.datetime.utcnow() - datetime.timedelta(days=float(config.InboxCleanup.ItemLifetimeDays))
+        else:
+            return None
+
     @inlineCallbacks
     def doWork(self):
 
+        if config.InboxCleanup.BulkHomeBatchSize > 0:
+            yield self.bulkCleanup()
+            returnValue(None)
+
         # No need to delete other work items.  They are unique
 
         # get old item names
-        if float(config.InboxCleanup.ItemLifetimeDays) >= 0:  # use -1 to disable; 0 is test case
-            cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=float(config.InboxCleanup.ItemLifetimeDays))
+        cutoff = self.cutoff()
+        if cutoff is not None:
             oldItemNames = set((
                 yield self.transaction.listInboxItemsInHomeCreatedBefore(self.homeID, cutoff)
             ))
@@ -116,6 +149,44 @@ class CleanupOneInboxWork(WorkItem, fromTable(schema.CLEANUP_ONE_INBOX_WORK)):
                         yield InboxRemoveWork.reschedule(self.transaction, seconds=seconds, homeID=self.homeID, resourceName=item)
                         seconds += config.InboxCleanup.RemovalStaggerSeconds
 
+    @inlineCallbacks
+    def bulkCleanup(self):
+        """
+        Remove the old inbox items of a batch of homes with set-based deletes,
+        then schedule the work item for the next batch.
+        """
+        batchSize = config.InboxCleanup.BulkHomeBatchSize
+        ch = schema.CALENDAR_HOME
+        homeRows = yield Select(
+            [ch.RESOURCE_ID],
+            From=ch,
+            Where=(ch.STATUS == _HOME_STATUS_NORMAL).And(ch.RESOURCE_ID >= self.homeID),
+            OrderBy=ch.RESOURCE_ID,
+            Limit=batchSize + 1,
+        ).on(self.transaction)
+        homeIDs = [row[0] for row in homeRows[:batchSize]]
+
+        cutoff = self.cutoff()
+        if homeIDs and cutoff is not None:
+            limit = max(1, config.InboxCleanup.BulkRemoveBatchSize)
+            total = 0
+            while True:
+                removed = yield self.transaction.removeInboxItemsCreatedBefore(homeIDs, cutoff, limit)
+                total += removed
+                if removed < limit:
+                    break
+            log.debug(
+                "Inbox cleanup work for {count} homes from {homeID}: removed {total} items",
+                count=len(homeIDs), homeID=self.homeID, total=total,
+            )
+
+        if len(homeRows) > batchSize:
+            yield CleanupOneInboxWork.reschedule(
+                self.transaction,
+                seconds=config.InboxCleanup.StaggerSeconds,
+                homeID=homeRows[batchSize][0],
+            )
+
 
 class InboxRemoveWork(WorkItem, fromTable(schema.INBOX_REMOVE_WORK)):
 
@@ -20,16 +20,69 @@ Remove old and unused REVISION rows
 """
 
 from twext.enterprise.dal.record import fromTable
-from twext.enterprise.dal.syntax import Select, Max
+from twext.enterprise.dal.syntax import Select, Max, Parameter, Union
 from twext.enterprise.jobs.workitem import SingletonWorkItem, RegeneratingWorkItem
 from twext.python.log import Logger
 from twisted.internet.defer import inlineCallbacks, succeed
 from twistedcaldav.config import config
 from txdav.common.datastore.sql_tables import schema
 import datetime
+import time
 
 log = Logger()
 
+PROGRESS_KEY = "REVISION-CLEANUP-PROGRESS"
+
+
+def _maxRevisionOlderThanQuery():
+    """
+    DAL query to find the highest revision last modified before a given date in
+    any of the revision tables.
+    """
+    tables = (
+        schema.CALENDAR_OBJECT_REVISIONS,
+        schema.NOTIFICATION_OBJECT_REVISIONS,
+        schema.ADDRESSBOOK_OBJECT_REVISIONS,
+        schema.ABO_MEMBERS,
+    )
+    query = None
+    for table in reversed(tables):
+        query = Select(
+            [table.REVISION],
+            From=table,
+            Where=(table.MODIFIED < Parameter("dateLimit")),
+            SetExpression=Union(query, optype=Union.OPTYPE_ALL) if query is not None else None,
+        )
+    return Select(
+        [Max(tables[0].REVISION)],
+        From=query,
+    )
+
+
+@inlineCallbacks
+def _updateMinValidRevision(txn, dateLimit):
+    """
+    Advance the minimum valid revision past all revisions last modified before a
+    date, and schedule the cleanup of those revisions.
+
+    @param txn: the transaction to use
+    @param dateLimit: revisions modified before this date are no longer valid
+    @type dateLimit: L{datetime.datetime}
+    """
+    # Get the minimum valid revision
+    minValidRevision = int((yield txn.calendarserverValue("MIN-VALID-REVISION")))
+
+    # get max revision on table rows before dateLimit
+    rows = yield _maxRevisionOlderThanQuery().on(txn, dateLimit=dateLimit)
+    maxRevOlderThanDate = rows[0][0] if rows and rows[0][0] is not None else 0
+
+    if maxRevOlderThanDate > minValidRevision:
+        # save new min valid revision
+        yield txn.updateCalendarserverValue("MIN-VALID-REVISION", maxRevOlderThanDate + 1)
+
+        # Schedule revision cleanup
+        yield RevisionCleanupWork.reschedule(txn, seconds=0)
+
 
 class FindMinValidRevisionWork(RegeneratingWorkItem, fromTable(schema.FIND_MIN_VALID_REVISION_WORK)):
 
@@ -54,43 +107,17 @@ class FindMinValidRevisionWork(RegeneratingWorkItem, fromTable(schema.FIND_MIN_V
     def dateCutoff(self):
         return datetime.datetime.utcnow() - datetime.timedelta(days=float(config.RevisionCleanup.SyncTokenLifetimeDays))
 
-    @inlineCallbacks
     def doWork(self):
-
-        # Get the minimum valid revision
-        minValidRevision = int((yield self.transaction.calendarserverValue("MIN-VALID-REVISION")))
-
-        # get max revision on table rows before dateLimit
-        dateLimit = self.dateCutoff()
-        maxRevOlderThanDate = 0
-
-        # TODO: Use one Select statement
-        for table in (
-            schema.CALENDAR_OBJECT_REVISIONS,
-            schema.NOTIFICATION_OBJECT_REVISIONS,
-            schema.ADDRESSBOOK_OBJECT_REVISIONS,
-            schema.ABO_MEMBERS,
-        ):
-            revisionRows = yield Select(
-                [Max(table.REVISION)],
-                From=table,
-                Where=(table.MODIFIED < dateLimit),
-            ).on(self.transaction)
-
-            if revisionRows:
-                tableMaxRevision = revisionRows[0][0]
-                if tableMaxRevision > maxRevOlderThanDate:
-                    maxRevOlderThanDate = tableMaxRevision
-
-        if maxRevOlderThanDate > minValidRevision:
-            # save new min valid revision
-            yield self.transaction.updateCalendarserverValue("MIN-VALID-REVISION", maxRevOlderThanDate + 1)
-
-            # Schedule revision cleanup
-            yield RevisionCleanupWork.reschedule(self.transaction, seconds=0)
+        return _updateMinValidRevision(self.transaction, self.dateCutoff())
 
 
 class RevisionCleanupWork(SingletonWorkItem, fromTable(schema.REVISION_CLEANUP_WORK)):
+    """
+    Delete revisions below the minimum valid revision, a chunk of revision
+    numbers at a time. Each work item stops once it has used its time budget,
+    records how far it got, and schedules another work item to carry on in a
+    new transaction, so that the revision tables are never locked for long.
+    """
 
     group = "group_revsion_cleanup"
 
@@ -100,43 +127,43 @@ class RevisionCleanupWork(SingletonWorkItem, fromTable(schema.REVISION_CLEANUP_W
         # Get the minimum valid revision
         minValidRevision = int((yield self.transaction.calendarserverValue("MIN-VALID-REVISION")))
 
+        # Pick up where the last cleanup left off
+        progress = yield self.transaction.calendarserverValue(PROGRESS_KEY, raiseIfMissing=False)
+        if progress is None:
+            startRevision = yield self.transaction.lowestRevision()
+            if startRevision is None:
+                startRevision = minValidRevision
+        else:
+            startRevision = int(progress)
+
         # delete revisions
-        yield self.transaction.deleteRevisionsBefore(minValidRevision)
+        chunkSize = max(1, config.RevisionCleanup.ChunkSize)
+        startTime = time.time()
+        while startRevision < minValidRevision:
+            endRevision = min(startRevision + chunkSize, minValidRevision)
+            yield self.transaction.deleteRevisionsInRange(startRevision, endRevision)
+            startRevision = endRevision
+            if time.time() - startTime >= config.RevisionCleanup.TimeBudgetSeconds:
+                break
+
+        if progress is None:
+            yield self.transaction.setCalendarserverValue(PROGRESS_KEY, str(startRevision))
+        else:
+            yield self.transaction.updateCalendarserverValue(PROGRESS_KEY, str(startRevision))
+
+        if startRevision < minValidRevision:
+            log.debug(
+                "Revision cleanup paused at revision {rev} of {min}",
+                rev=startRevision, min=minValidRevision,
+            )
+            yield RevisionCleanupWork.reschedule(self.transaction, seconds=0)
+        else:
+            yield self.transaction.deleteGroupMemberRevisionsBefore(minValidRevision)
 
 
-@inlineCallbacks
 def _triggerRevisionCleanup(txn, backSeconds):
-    # Get the minimum valid revision
-    minValidRevision = int((yield txn.calendarserverValue("MIN-VALID-REVISION")))
-
-    # get max revision on table rows before dateLimit
     dateLimit = (
         datetime.datetime.utcnow() -
         datetime.timedelta(seconds=backSeconds)
     )
-    maxRevOlderThanDate = 0
-
-    # TODO: Use one Select statement
-    for table in (
-        schema.CALENDAR_OBJECT_REVISIONS,
-        schema.NOTIFICATION_OBJECT_REVISIONS,
-        schema.ADDRESSBOOK_OBJECT_REVISIONS,
-        schema.ABO_MEMBERS,
-    ):
-        revisionRows = yield Select(
-            [Max(table.REVISION)],
-            From=table,
-            Where=(table.MODIFIED < dateLimit),
-        ).on(txn)
-
-        if revisionRows:
-            tableMaxRevision = revisionRows[0][0]
-            if tableMaxRevision > maxRevOlderThanDate:
-                maxRevOlderThanDate = tableMaxRevision
-
-    if maxRevOlderThanDate > minValidRevision:
-        # save new min valid revision
-        yield txn.updateCalendarserverValue("MIN-VALID-REVISION", maxRevOlderThanDate + 1)
-
-        # Schedule revision cleanup
-        yield RevisionCleanupWork.reschedule(txn, seconds=0)
+    return _updateMinValidRevision(txn, dateLimit)
@@ -125,6 +125,7 @@ END:VCALENDAR
         Verify that InboxCleanupWork queues one CleanupOneInboxBoxWork per home
         """
         self.patch(config.InboxCleanup, "CleanupPeriodDays", -1)
+        self.patch(config.InboxCleanup, "BulkHomeBatchSize", 0)
 
         class FakeCleanupOneInboxWork(WorkItem):
             scheduledHomeIDs = []
@@ -186,6 +187,7 @@ END:VCALENDAR
         """
 
         # Patch to force remove work items
+        self.patch(config.InboxCleanup, "BulkHomeBatchSize", 0)
         self.patch(config.InboxCleanup, "InboxRemoveWorkThreshold", 0)
 
         # Predate some inbox items
@@ -210,3 +212,43 @@ END:VCALENDAR
         items = yield inbox.objectResources()
         names = [item.name() for item in items]
         self.assertEqual(set(names), set(["cal1.ics"]))
+
+    @inlineCallbacks
+    def test_old_bulk(self):
+        """
+        Verify that bulk cleanup works through all homes a batch at a time,
+        removes old inbox items and records the removals for sync
+        """
+        self.patch(config.InboxCleanup, "CleanupPeriodDays", -1)
+        self.patch(config.InboxCleanup, "StartDelaySeconds", 0)
+        self.patch(config.InboxCleanup, "StaggerSeconds", 0)
+        self.patch(config.InboxCleanup, "BulkHomeBatchSize", 1)
+        self.patch(config.InboxCleanup, "BulkRemoveBatchSize", 1)
+
+        # Predate some inbox items
+        inbox = yield self.calendarUnderTest(home="user01", name="inbox")
+        token = yield inbox.syncToken()
+        oldDate = datetime.datetime.utcnow() - datetime.timedelta(days=float(config.InboxCleanup.ItemLifetimeDays), seconds=10)
+
+        itemsToPredate = ["cal2.ics", "cal3.ics"]
+        co = schema.CALENDAR_OBJECT
+        yield Update(
+            {co.CREATED: oldDate},
+            Where=co.RESOURCE_NAME.In(Parameter("itemsToPredate", len(itemsToPredate))).And(
+                co.CALENDAR_RESOURCE_ID == inbox._resourceID)
+        ).on(self.transactionUnderTest(), itemsToPredate=itemsToPredate)
+
+        # do cleanup
+        yield InboxCleanupWork.reschedule(self.transactionUnderTest(), 0)
+        yield self.commit()
+        yield JobItem.waitEmpty(self.storeUnderTest().newTransaction, reactor, 60)
+
+        # check that old items are deleted
+        inbox = yield self.calendarUnderTest(home="user01", name="inbox")
+        items = yield inbox.objectResources()
+        names = [item.name() for item in items]
+        self.assertEqual(set(names), set(["cal1.ics"]))
+
+        # check that the deletions are reported by sync
+        _ignore_changed, deleted, _ignore_invalid = yield inbox.resourceNamesSinceToken(token)
+        self.assertEqual(set(deleted), set(itemsToPredate))
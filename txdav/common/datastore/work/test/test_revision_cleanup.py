@@ -26,7 +26,8 @@ from twistedcaldav.ical import Component
 from twistedcaldav.vcard import Component as VCard
 from txdav.common.datastore.sql_tables import schema, _BIND_MODE_READ
 from txdav.common.datastore.test.util import CommonCommonTests, populateCalendarsFrom
-from txdav.common.datastore.work.revision_cleanup import FindMinValidRevisionWork, RevisionCleanupWork
+from txdav.common.datastore.work.revision_cleanup import FindMinValidRevisionWork, RevisionCleanupWork, \
+    _maxRevisionOlderThanQuery
 from txdav.common.icommondatastore import SyncTokenValidException
 import datetime
 import time
@@ -328,6 +329,75 @@ END:VCARD
         self.assertEqual(newtoken1, newtoken)
         yield self.commit()
 
+    @inlineCallbacks
+    def test_chunkedCleanup(self):
+        """
+        Verify that RevisionCleanupWork that runs out of time records its progress
+        and carries on in further work items until all old revisions are deleted
+        """
+
+        # make changes
+        cal1Object = yield self.calendarObjectUnderTest(self.transactionUnderTest(), name="cal1.ics", calendar_name="calendar", home="user01")
+        yield cal1Object.remove()
+        cal2Object = yield self.calendarObjectUnderTest(self.transactionUnderTest(), name="cal2.ics", calendar_name="calendar", home="user01")
+        yield cal2Object.remove()
+        yield self.commit()
+
+        # Delete one revision number per work item
+        self.patch(config.RevisionCleanup, "ChunkSize", 1)
+        self.patch(config.RevisionCleanup, "TimeBudgetSeconds", 0)
+
+        yield FindMinValidRevisionWork.reschedule(self.transactionUnderTest(), 0)
+        yield self.commit()
+        yield JobItem.waitEmpty(self.storeUnderTest().newTransaction, reactor, 60)
+
+        minValidRevision = yield self.transactionUnderTest().calendarserverValue("MIN-VALID-REVISION")
+        progress = yield self.transactionUnderTest().calendarserverValue("REVISION-CLEANUP-PROGRESS")
+        self.assertEqual(progress, minValidRevision)
+
+        for table in (
+            schema.CALENDAR_OBJECT_REVISIONS,
+            schema.NOTIFICATION_OBJECT_REVISIONS,
+            schema.ADDRESSBOOK_OBJECT_REVISIONS,
+        ):
+            revisionRows = yield Select(
+                [table.REVISION],
+                From=table,
+            ).on(self.transactionUnderTest())
+            self.assertEqual(len(revisionRows), 0)
+        yield self.commit()
+
+    @inlineCallbacks
+    def test_revisionQueries(self):
+        """
+        Verify that the queries across all the revision tables find the lowest
+        revision, and the highest revision modified before a date
+        """
+        txn = self.transactionUnderTest()
+        revisions = []
+        for table in (
+            schema.CALENDAR_OBJECT_REVISIONS,
+            schema.NOTIFICATION_OBJECT_REVISIONS,
+            schema.ADDRESSBOOK_OBJECT_REVISIONS,
+        ):
+            rows = yield Select([table.REVISION], From=table).on(txn)
+            revisions.extend([row[0] for row in rows])
+        rows = yield Select([schema.ABO_MEMBERS.REVISION], From=schema.ABO_MEMBERS).on(txn)
+        allRevisions = revisions + [row[0] for row in rows]
+        self.assertNotEqual(revisions, [])
+
+        lowest = yield txn.lowestRevision()
+        self.assertEqual(lowest, min(revisions))
+
+        dateLimit = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        rows = yield _maxRevisionOlderThanQuery().on(txn, dateLimit=dateLimit)
+        self.assertEqual(rows[0][0], max(allRevisions))
+
+        dateLimit = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+        rows = yield _maxRevisionOlderThanQuery().on(txn, dateLimit=dateLimit)
+        self.assertEqual(rows[0][0], None)
+        yield self.commit()
+
     @inlineCallbacks
     def test_calendarObjectRevisions_Modified(self):
         """
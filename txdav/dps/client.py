@@ -26,7 +26,9 @@ from twext.who.idirectory import RecordType, IDirectoryService
 import twext.who.idirectory
 from twext.who.util import ConstantsContainer
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+from twisted.internet.defer import (
+    Deferred, inlineCallbacks, returnValue, succeed, gatherResults
+)
 from twisted.internet.error import ConnectError
 from twisted.internet.protocol import ClientCreator
 from twisted.protocols import amp
@@ -36,8 +38,8 @@ from txdav.caldav.icalendardirectoryservice import (
 )
 from txdav.common.idirectoryservice import IStoreDirectoryService
 from txdav.dps.commands import (
-    RecordWithShortNameCommand, RecordWithUIDCommand, RecordWithGUIDCommand,
-    RecordsWithRecordTypeCommand, RecordsWithEmailAddressCommand,
+    RecordWithShortNameCommand, RecordWithUIDCommand, RecordsWithUIDsCommand,
+    RecordWithGUIDCommand, RecordsWithRecordTypeCommand, RecordsWithEmailAddressCommand,
     RecordsMatchingTokensCommand, RecordsMatchingFieldsCommand,
     MembersCommand, GroupsCommand, SetMembersCommand,
     VerifyPlaintextPasswordCommand, VerifyHTTPDigestCommand,
@@ -91,6 +93,23 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
          txdav.who.augment.FieldName)
     )
 
+    # Maximum number of UIDs sent in one RecordsWithUIDsCommand, to keep
+    # within the AMP argument size limit
+    uidsPerCall = 1000
+
+    def __init__(self, realmName):
+        BaseDirectoryService.__init__(self, realmName)
+
+        # Connections to the DPS, by pool slot, and the callers waiting for
+        # a slot's connection to be made
+        self._connections = {}
+        self._connecting = {}
+        self._nextSlot = 0
+
+        # Lookups in progress, keyed by command and arguments, and the
+        # callers waiting for their results
+        self._inFlight = {}
+
     def _dictToRecord(self, serializedFields):
         """
         Turn a dictionary of fields sent from the server into a directory
@@ -153,33 +172,79 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
 
     @inlineCallbacks
     def _getConnection(self):
+        """
+        Get a connection to the DPS. Calls are spread across a small pool of
+        connections (config.DirectoryProxy.ClientConnections), each made
+        when first needed, so that a slow lookup does not hold up all the
+        others behind it.
+
+        @return: a L{Deferred} that fires with the L{amp.AMP} connection
+        """
 
         from twistedcaldav.config import config
         path = config.DirectoryProxy.SocketPath
-        if getattr(self, "_connection", None) is None:
-            log.debug("Creating connection")
-            connection = (
-                yield ClientCreator(reactor, amp.AMP).connectUNIX(path)
-            )
-            self._connection = connection
-        returnValue(self._connection)
+        slot = self._nextSlot % max(config.DirectoryProxy.ClientConnections, 1)
+        self._nextSlot = slot + 1
+
+        connection = self._connections.get(slot)
+        if connection is None:
+            waiting = self._connecting.get(slot)
+            if waiting is not None:
+                # Someone else is already connecting this slot
+                d = Deferred()
+                waiting.append(d)
+                connection = yield d
+            else:
+                log.debug("Creating connection {slot}", slot=slot)
+                waiting = self._connecting[slot] = []
+                try:
+                    connection = (
+                        yield ClientCreator(reactor, amp.AMP).connectUNIX(path)
+                    )
+                except Exception as e:
+                    del self._connecting[slot]
+                    for d in waiting:
+                        d.errback(e)
+                    raise
+                del self._connecting[slot]
+                self._connections[slot] = connection
+                for d in waiting:
+                    d.callback(connection)
+        returnValue(connection)
+
+    def _dropConnection(self, connection):
+        """
+        Remove a failed connection from the pool, so that it is made again
+        when next needed.
+
+        @param connection: the connection
+        @type connection: L{amp.AMP}
+        """
+        for slot, pooled in self._connections.items():
+            if pooled is connection:
+                del self._connections[slot]
 
     @inlineCallbacks
-    def _sendCommand(self, command, **kwds):
+    def _sendCommand(self, command, connection=None, **kwds):
         """
         Execute a remote AMP command, first making the connection to the peer.
         Any kwds are passed on to the AMP command.
 
         @param command: the AMP command to call
         @type command: L{twisted.protocols.amp.Command}
+        @param connection: the connection to use, or C{None} to use the next
+            one from the pool
+        @type connection: L{amp.AMP}
         """
-        ampProto = (yield self._getConnection())
+        if connection is None:
+            connection = yield self._getConnection()
+        ampProto = connection
         try:
             results = (yield ampProto.callRemote(command, **kwds))
         except Exception, e:
             log.error("Failed AMP command", error=e)
             #  FIXME: is there a way to hook into ConnectionLost?
-            self._connection = None
+            self._dropConnection(ampProto)
             raise
         returnValue(results)
 
@@ -211,7 +276,11 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
         @type postProcess: callable
         """
         startTime = time.time()
-        results = yield self._sendCommand(command, **kwds)
+
+        # The DPS keeps continuation tokens per connection, so any
+        # continuations have to be sent on the same connection
+        connection = yield self._getConnection()
+        results = yield self._sendCommand(command, connection=connection, **kwds)
         if results.get("continuation", None) is None:
             # We have all the results
             self._logResultTiming(command, startTime, results)
@@ -225,6 +294,7 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
         while results.get("continuation", None) is not None:
             results = yield self._sendCommand(
                 ContinuationCommand,
+                connection=connection,
                 continuation=results["continuation"]
             )
             multi.append(results)
@@ -236,6 +306,33 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
         self._logResultTiming(command, startTime, results)
         returnValue(postProcess(results))
 
+    def _coalescedCall(self, command, postProcess, **kwds):
+        """
+        Like L{_call}, but for lookups that do not change anything: if the
+        same lookup is already in progress, wait for its result rather than
+        sending another request.
+        """
+        key = (command, tuple(sorted(
+            (name, tuple(value) if isinstance(value, list) else value)
+            for name, value in kwds.iteritems()
+        )))
+        waiting = self._inFlight.get(key)
+        if waiting is not None:
+            d = Deferred()
+            waiting.append(d)
+            return d
+
+        waiting = self._inFlight[key] = []
+
+        def _finished(result):
+            del self._inFlight[key]
+            for d in waiting:
+                # Each caller gets its own list of records
+                d.callback(list(result) if isinstance(result, list) else result)
+            return result
+
+        return self._call(command, postProcess, **kwds).addBoth(_finished)
+
     def recordWithShortName(self, recordType, shortName, timeoutSeconds=None):
         # MOVE2WHO
         # temporary hack until we can fix all callers not to pass strings:
@@ -254,7 +351,7 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
         if timeoutSeconds is not None:
             kwds["timeoutSeconds"] = timeoutSeconds
 
-        return self._call(
+        return self._coalescedCall(
             RecordWithShortNameCommand,
             self._processSingleRecord,
             **kwds
@@ -272,12 +369,46 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
         if timeoutSeconds is not None:
             kwds["timeoutSeconds"] = timeoutSeconds
 
-        return self._call(
+        return self._coalescedCall(
             RecordWithUIDCommand,
             self._processSingleRecord,
             **kwds
         )
 
+    @inlineCallbacks
+    def recordsWithUIDs(self, uids, timeoutSeconds=None):
+        """
+        Look up the records of many UIDs with one request to the DPS (or a
+        few, for very many UIDs).
+
+        @param uids: the UIDs
+        @type uids: iterable of C{unicode}
+
+        @return: the records found, UIDs with no record are left out
+        @rtype: C{list}
+        """
+        # MOVE2WHO, REMOVE THIS:
+        uids = sorted(set(
+            uid if isinstance(uid, unicode) else uid.decode("utf-8")
+            for uid in uids
+        ))
+
+        calls = []
+        for offset in range(0, len(uids), self.uidsPerCall):
+            kwds = {
+                "uids": [uid.encode("utf-8") for uid in uids[offset:offset + self.uidsPerCall]],
+            }
+            if timeoutSeconds is not None:
+                kwds["timeoutSeconds"] = timeoutSeconds
+            calls.append(self._coalescedCall(
+                RecordsWithUIDsCommand,
+                self._processMultipleRecords,
+                **kwds
+            ))
+
+        results = yield gatherResults(calls)
+        returnValue([record for records in results for record in records])
+
     def recordWithGUID(self, guid, timeoutSeconds=None):
         kwds = {
             "guid": str(guid),
@@ -285,7 +416,7 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
         if timeoutSeconds is not None:
             kwds["timeoutSeconds"] = timeoutSeconds
 
-        return self._call(
+        return self._coalescedCall(
             RecordWithGUIDCommand,
             self._processSingleRecord,
             **kwds
@@ -318,7 +449,7 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
         if timeoutSeconds is not None:
             kwds["timeoutSeconds"] = timeoutSeconds
 
-        return self._call(
+        return self._coalescedCall(
             RecordsWithEmailAddressCommand,
             self._processMultipleRecords,
             **kwds
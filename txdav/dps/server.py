@@ -37,8 +37,8 @@ from twistedcaldav.config import config
 from twistedcaldav.stdconfig import DEFAULT_CONFIG, DEFAULT_CONFIG_FILE
 
 from txdav.dps.commands import (
-    RecordWithShortNameCommand, RecordWithUIDCommand, RecordWithGUIDCommand,
-    RecordsWithRecordTypeCommand, RecordsWithEmailAddressCommand,
+    RecordWithShortNameCommand, RecordWithUIDCommand, RecordsWithUIDsCommand,
+    RecordWithGUIDCommand, RecordsWithRecordTypeCommand, RecordsWithEmailAddressCommand,
     RecordsMatchingTokensCommand, RecordsMatchingFieldsCommand,
     MembersCommand, ExpandedMembersCommand, GroupsCommand, SetMembersCommand,
     VerifyPlaintextPasswordCommand, VerifyHTTPDigestCommand,
@@ -270,6 +270,22 @@ class DirectoryProxyAMPProtocol(amp.AMP):
         # log.debug("Responding with: {response}", response=response)
         returnValue(response)
 
+    @RecordsWithUIDsCommand.responder
+    @inlineCallbacks
+    def recordsWithUIDs(self, uids, timeoutSeconds=None):
+        uids = [uid.decode("utf-8") for uid in uids]
+        log.debug("RecordsWithUIDs: {n} uids", n=len(uids))
+        try:
+            records = (yield self._directory.recordsWithUIDs(
+                uids, timeoutSeconds=timeoutSeconds
+            ))
+        except Exception as e:
+            log.error("Failed in recordsWithUIDs", error=e)
+            records = []
+        response = self._recordsToResponse(list(records))
+        # log.debug("Responding with: {response}", response=response)
+        returnValue(response)
+
     @RecordWithGUIDCommand.responder
     @inlineCallbacks
     def recordWithGUID(self, guid, timeoutSeconds=None):
@@ -14,6 +14,8 @@
 # limitations under the License.
 ##
 
+import cPickle as pickle
+import itertools
 import os
 import uuid
 
@@ -22,14 +24,17 @@ from twext.who.expression import (
 )
 from twext.who.idirectory import RecordType, FieldName
 from twisted.cred.credentials import calcResponse, calcHA1, calcHA2
-from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.defer import Deferred, inlineCallbacks, succeed
+from twisted.internet.error import ConnectError
 from twisted.protocols.amp import AMP
 from twisted.python.filepath import FilePath
 from twisted.test.testutils import returnConnected
 from twisted.trial import unittest
 from twistedcaldav.config import config
 from twistedcaldav.test.util import StoreTestCase
+from txdav.dps import client
 from txdav.dps.client import DirectoryService
+from txdav.dps.commands import RecordWithUIDCommand
 from txdav.dps.server import DirectoryProxyAMPProtocol
 from txdav.who.directory import CalendarDirectoryServiceMixin
 from txdav.who.groups import GroupCacher
@@ -114,6 +119,16 @@ class DPSClientSingleDirectoryTest(unittest.TestCase):
         record = (yield self.directory.recordWithUID(testUID))
         self.assertTrue(testShortName in record.shortNames)
 
+    @inlineCallbacks
+    def test_uids(self):
+        records = (yield self.directory.recordsWithUIDs(
+            [testUID, u"__sagen__", u"__missing__", testUID]
+        ))
+        self.assertEquals(
+            sorted([record.uid for record in records]),
+            sorted([testUID, u"__sagen__"])
+        )
+
     @inlineCallbacks
     def test_shortName(self):
         record = (yield self.directory.recordWithShortName(
@@ -376,6 +391,91 @@ class DPSClientSingleDirectoryTest(unittest.TestCase):
                 self.assertEquals(authenticated, answer)
 
 
+class DPSClientRequestTest(unittest.TestCase):
+    """
+    Tests how the client makes requests to the DPS
+    """
+
+    def setUp(self):
+        self.directory = DirectoryService(None)
+
+        # Record the commands sent, without answering them
+        self.sent = []
+
+        def _sendCommand(command, connection=None, **kwds):
+            d = Deferred()
+            self.sent.append((command, kwds, d))
+            return d
+
+        self.patch(self.directory, "_getConnection", lambda: succeed(None))
+        self.patch(self.directory, "_sendCommand", _sendCommand)
+
+    def test_coalescing(self):
+        """
+        Concurrent identical lookups share one request, and later or different
+        lookups do not.
+        """
+        results = []
+        for uid in (u"__a__", u"__a__", u"__b__"):
+            self.directory.recordWithUID(uid).addCallback(results.append)
+        self.assertEquals(
+            [(command, kwds) for command, kwds, _ignore_d in self.sent],
+            [
+                (RecordWithUIDCommand, {"uid": "__a__"}),
+                (RecordWithUIDCommand, {"uid": "__b__"}),
+            ]
+        )
+
+        for _ignore_command, _ignore_kwds, d in self.sent:
+            d.callback({"fields": pickle.dumps({})})
+        self.assertEquals(results, [None, None, None])
+
+        self.directory.recordWithUID(u"__a__")
+        self.assertEquals(len(self.sent), 3)
+
+    def test_coalescingFailure(self):
+        """
+        A failed lookup fails for all the callers waiting for it.
+        """
+        failures = []
+        for _ignore in range(2):
+            self.directory.recordWithUID(u"__a__").addErrback(failures.append)
+        self.assertEquals(len(self.sent), 1)
+
+        self.sent[0][2].errback(ConnectError())
+        self.assertEquals(len(failures), 2)
+        for failure in failures:
+            failure.trap(ConnectError)
+
+    def test_connectionPool(self):
+        """
+        Requests are spread across a pool of connections, and a failed
+        connection is made again.
+        """
+        self.patch(config.DirectoryProxy, "ClientConnections", 2)
+        made = []
+
+        class FakeCreator(object):
+            def __init__(self, reactor, protocolClass):
+                pass
+
+            def connectUNIX(self, path):
+                made.append(object())
+                return succeed(made[-1])
+
+        self.patch(client, "ClientCreator", FakeCreator)
+
+        connections = []
+        for _ignore in range(3):
+            self.directory._getConnection().addCallback(connections.append)
+        self.assertEquals(connections, [made[0], made[1], made[0]])
+
+        self.directory._dropConnection(made[1])
+        self.directory._getConnection().addCallback(connections.append)
+        self.assertEquals(len(made), 3)
+        self.assertEquals(connections[-1], made[2])
+
+
 class DPSClientAugmentedAggregateDirectoryTest(StoreTestCase):
     """
     Similar to the above tests, but in the context of the directory structure
@@ -853,6 +953,13 @@ class DPSClientLargeResultsTest(unittest.TestCase):
         )
         self.assertEquals(len(records), self.numUsers)
 
+        # recordsWithUIDs, split across several commands
+        self.patch(self.directory, "uidsPerCall", 300)
+        records = yield self.directory.recordsWithUIDs(
+            [u"foo{ctr:05d}".format(ctr=i) for i in xrange(self.numUsers)]
+        )
+        self.assertEquals(len(records), self.numUsers)
+
         # members()
         group = yield self.directory.recordWithUID(u"bigGroup")
         members = yield group.members()
@@ -863,3 +970,41 @@ class DPSClientLargeResultsTest(unittest.TestCase):
         # expandedMemberUIDs
         memberUIDs = yield group.expandedMemberUIDs()
         self.assertEquals(len(memberUIDs), self.numUsers)
+
+    @inlineCallbacks
+    def test_continuationsWithPool(self):
+        """
+        With a pool of connections, continuations are sent on the connection
+        that returned the continuation token, since each DPS connection only
+        knows its own tokens.
+        """
+        clients = []
+        pumps = []
+        for _ignore in range(2):
+            client = AMP()
+            server = DirectoryProxyAMPProtocol(self.server._directory)
+            server._maxSize = 500
+            pumps.append(returnConnected(server, client))
+            clients.append(client)
+
+        # Hand out the connections in turn, as the pool does
+        nextClient = itertools.cycle(clients)
+        self.patch(self.directory, "_getConnection", lambda: succeed(next(nextClient)))
+
+        origCall = self.directory._call
+
+        def newCall(*args, **kwds):
+            d = origCall(*args, **kwds)
+            while any([pump.pump() for pump in pumps]):
+                pass
+            return d
+
+        self.patch(self.directory, "_call", newCall)
+
+        records = yield self.directory.recordsWithRecordType(RecordType.user)
+        self.assertEquals(len(records), self.numUsers)
+
+        records = yield self.directory.recordsWithUIDs(
+            [u"foo{ctr:05d}".format(ctr=i) for i in xrange(self.numUsers)]
+        )
+        self.assertEquals(len(records), self.numUsers)
@@ -29,7 +29,7 @@ import uuid
 
 from zope.interface import implementer
 
-from twistedcaldav.memcacheclient import ClientFactory, MemcacheError
+from twistedcaldav.memcacher import Memcacher
 from twistedcaldav.config import config
 
 from twisted.internet.defer import inlineCallbacks, returnValue
@@ -92,18 +92,12 @@ class DirectoryMemcacher(object):
         @type refresh: L{bool}
 
         @return: the client to use
-        @rtype: L{memcacheclient.Client}
+        @rtype: L{Memcacher}
         """
         if refresh or not hasattr(self, "memcacheClient"):
-
-            if config.Memcached.Pools.Default.MemcacheSocket:
-                client_addr = "unix:{}".format(config.Memcached.Pools.Default.MemcacheSocket)
-            else:
-                client_addr = "{}:{}".format(
-                    config.Memcached.Pools.Default.BindAddress,
-                    config.Memcached.Pools.Default.Port,
-                )
-            self.memcacheClient = ClientFactory.getClient([client_addr], debug=0, pickleProtocol=2)
+            self.memcacheClient = Memcacher(
+                "DirectoryRecords", pickle=True, key_normalization=False
+            )
         return self.memcacheClient
 
     def pickleRecord(self, record):
@@ -157,20 +151,22 @@ class DirectoryMemcacher(object):
 
             return record_class(self._recordService, fields)
 
-    def memcacheSetRecord(self, key, record):
+    def memcacheSetRecord(self, keys, record):
         """
-        Store a record in memcache.
+        Store a record in memcache under one or more keys.
 
-        @param key: memcache key to use
-        @type key: L{str}
+        @param keys: memcache keys to use
+        @type keys: iterable of L{str}
         @param record: record to store
         @type record: L{DirectoryRecord}
 
         @raise: L{DirectoryMemcacheError} if failure to store in memcache
         """
 
-        self.memcacheSet(key, self.pickleRecord(record))
+        pickled = self.pickleRecord(record)
+        return self.memcacheSetMultiple(dict([(key, pickled) for key in keys]))
 
+    @inlineCallbacks
     def memcacheSet(self, key, value):
         """
         Store a value in memcache.
@@ -184,16 +180,41 @@ class DirectoryMemcacher(object):
         """
 
         key = base64.b64encode(key)
-        if not self._getMemcacheClient().set(key, value, time=self._cacheTimeout):
+        if not (yield self._getMemcacheClient().set(key, value, expireTime=self._cacheTimeout)):
             log.error("Could not write to memcache, retrying")
-            if not self._getMemcacheClient(refresh=True).set(
+            if not (yield self._getMemcacheClient(refresh=True).set(
                 key, value,
-                time=self._cacheTimeout
-            ):
+                expireTime=self._cacheTimeout
+            )):
                 log.error("Could not write to memcache again, giving up")
                 del self.memcacheClient
                 raise DirectoryMemcacheError("Failed to write to memcache")
 
+    @inlineCallbacks
+    def memcacheSetMultiple(self, values):
+        """
+        Store several values in memcache with a single request.
+
+        @param values: values to store keyed by memcache key
+        @type values: L{dict}
+
+        @raise: L{DirectoryMemcacheError} if failure to store in memcache
+        """
+
+        values = dict([
+            (base64.b64encode(key), value) for key, value in values.iteritems()
+        ])
+        if not (yield self._getMemcacheClient().setMultiple(values, expireTime=self._cacheTimeout)):
+            log.error("Could not write to memcache, retrying")
+            if not (yield self._getMemcacheClient(refresh=True).setMultiple(
+                values,
+                expireTime=self._cacheTimeout
+            )):
+                log.error("Could not write to memcache again, giving up")
+                del self.memcacheClient
+                raise DirectoryMemcacheError("Failed to write to memcache")
+
+    @inlineCallbacks
     def memcacheGetRecord(self, key):
         """
         Try to get a record from memcache.
@@ -207,9 +228,10 @@ class DirectoryMemcacher(object):
         @raise: L{DirectoryMemcacheError} if failure to read from memcache
         """
 
-        pickled = self.memcacheGet(key)
-        return self.unpickleRecord(pickled) if pickled is not None else None
+        pickled = yield self.memcacheGet(key)
+        returnValue(self.unpickleRecord(pickled) if pickled is not None else None)
 
+    @inlineCallbacks
     def memcacheGet(self, key):
         """
         Try to get a record from memcache.
@@ -223,18 +245,16 @@ class DirectoryMemcacher(object):
         @raise: L{DirectoryMemcacheError} if failure to read from memcache
         """
 
+        # The memcache pool reconnects by itself, and logs connection errors
+        # and returns None for them as for a miss, so there is nothing to
+        # retry here
         key = base64.b64encode(key)
         try:
-            value = self._getMemcacheClient().get(key)
-        except MemcacheError:
-            log.error("Could not read from memcache, retrying")
-            try:
-                value = self._getMemcacheClient(refresh=True).get(key)
-            except MemcacheError:
-                log.error("Could not read from memcache again, giving up")
-                del self.memcacheClient
-                raise DirectoryMemcacheError("Failed to read from memcache")
-        return value
+            value = yield self._getMemcacheClient().get(key)
+        except Exception:
+            log.error("Could not read from memcache")
+            raise DirectoryMemcacheError("Failed to read from memcache")
+        returnValue(value)
 
     def generateMemcacheKey(self, indexType, indexKey):
         """
@@ -271,7 +291,7 @@ class DirectoryMemcacher(object):
         Flush all records from memcache. Note this is only for testing and must not be
         called in a production setup because it flushes everything from memcache
         """
-        self._getMemcacheClient().flush_all()
+        return self._getMemcacheClient().flushAll()
 
 
 @implementer(IDirectoryService, IStoreDirectoryService)
@@ -380,6 +400,7 @@ class CachingDirectoryService(
         """
         self._test_time = timestamp
 
+    @inlineCallbacks
     def cacheRecord(self, record, indexTypes, addToMemcache=True):
         """
         Store a record in the cache, within the specified indexes
@@ -420,16 +441,18 @@ class CachingDirectoryService(
             except AttributeError:
                 pass
 
-        if addToMemcache and self._memcacher is not None:
-            for indexType, key in cached:
-                memcachekey = self._memcacher.generateMemcacheKey(indexType, key)
-                log.debug("Memcache: storing %s" % (memcachekey,))
-                try:
-                    self._memcacher.memcacheSetRecord(memcachekey, record)
-                except DirectoryMemcacheError:
-                    log.error("Memcache: failed to store %s" % (memcachekey,))
-                    pass
+        if addToMemcache and self._memcacher is not None and cached:
+            memcachekeys = [
+                self._memcacher.generateMemcacheKey(indexType, key)
+                for indexType, key in cached
+            ]
+            log.debug("Memcache: storing %s" % (", ".join(memcachekeys),))
+            try:
+                yield self._memcacher.memcacheSetRecord(memcachekeys, record)
+            except DirectoryMemcacheError:
+                log.error("Memcache: failed to store %s" % (", ".join(memcachekeys),))
 
+    @inlineCallbacks
     def negativeCacheRecord(self, indexType, key):
         """
         Store a record in the negative cache, within the specified indexes
@@ -453,7 +476,7 @@ class CachingDirectoryService(
             # one recordType, so using recordTypes[0] here is always safe:
             memcachekey = self._memcacher.generateMemcacheKey(indexType, key)
             try:
-                self._memcacher.memcacheSet("-%s" % (memcachekey,), timestamp)
+                yield self._memcacher.memcacheSet("-%s" % (memcachekey,), timestamp)
             except DirectoryMemcacheError:
                 log.error("Memcache: failed to store -%s" % (memcachekey,))
                 pass
@@ -510,6 +533,7 @@ class CachingDirectoryService(
                 if now - self._expireSeconds > cachedTime:
                     del self._cache[indexType][key]
 
+    @inlineCallbacks
     def lookupRecord(self, indexType, key, name):
         """
         Looks for a record in the specified index, under the specified key.
@@ -564,7 +588,7 @@ class CachingDirectoryService(
                 )
                 self._hitCount += 1
                 self._addTiming("{}-hit".format(name), 0)
-                return (record, False,)
+                returnValue((record, False,))
 
         # Check negative cache (take cache entry timeout into account)
         if self.negativeCaching:
@@ -577,7 +601,7 @@ class CachingDirectoryService(
                         key=key
                     )
                     self._addTiming("{}-neg-hit".format(name), 0)
-                    return (None, False,)
+                    returnValue((None, False,))
                 else:
                     del self._negativeCache[indexType][key]
             except KeyError:
@@ -594,7 +618,7 @@ class CachingDirectoryService(
             log.debug("Memcache: checking %s" % (memcachekey,))
 
             try:
-                record = self._memcacher.memcacheGetRecord(memcachekey)
+                record = yield self._memcacher.memcacheGetRecord(memcachekey)
             except DirectoryMemcacheError:
                 log.error("Memcache: failed to get %s" % (memcachekey,))
                 record = None
@@ -603,20 +627,20 @@ class CachingDirectoryService(
                 log.debug("Memcache: miss %s" % (memcachekey,))
             else:
                 log.debug("Memcache: hit %s" % (memcachekey,))
-                self.cacheRecord(record, (IndexType.uid, IndexType.guid, IndexType.shortName,), addToMemcache=False)
-                return (record, False,)
+                yield self.cacheRecord(record, (IndexType.uid, IndexType.guid, IndexType.shortName,), addToMemcache=False)
+                returnValue((record, False,))
 
             # Check negative memcache
             if self.negativeCaching:
                 try:
-                    val = self._memcacher.memcacheGet("-%s" % (memcachekey,))
+                    val = yield self._memcacher.memcacheGet("-%s" % (memcachekey,))
                 except DirectoryMemcacheError:
                     log.error("Memcache: failed to get -%s" % (memcachekey,))
                     val = None
                 if val == 1:
                     log.debug("Memcache: negative hit %s" % (memcachekey,))
                     self._negativeCache[indexType][key] = now
-                    return (None, False,)
+                    returnValue((None, False,))
 
         log.debug(
             "Directory cache miss: {index} {key}",
@@ -625,7 +649,7 @@ class CachingDirectoryService(
         )
 
         self._addTiming("{}-miss".format(name), 0)
-        return (None, True,)
+        returnValue((None, True,))
 
     # Cached methods:
 
@@ -633,39 +657,69 @@ class CachingDirectoryService(
     def recordWithUID(self, uid, timeoutSeconds=None):
 
         # First check our cache
-        record, doQuery = self.lookupRecord(IndexType.uid, uid, "recordWithUID")
+        record, doQuery = yield self.lookupRecord(IndexType.uid, uid, "recordWithUID")
         if record is None and doQuery:
             record = yield self._directory._wrapped_recordWithUID(
                 uid, timeoutSeconds=timeoutSeconds
             )
             if record is not None:
                 # Note we do not index on email address; see below.
-                self.cacheRecord(
+                yield self.cacheRecord(
                     record,
                     (IndexType.uid, IndexType.guid, IndexType.shortName)
                 )
             else:
-                self.negativeCacheRecord(IndexType.uid, uid)
+                yield self.negativeCacheRecord(IndexType.uid, uid)
 
         returnValue(record)
 
+    @inlineCallbacks
+    def recordsWithUIDs(self, uids, timeoutSeconds=None):
+
+        # First check our cache, then look up all the misses in one go
+        records = []
+        missing = []
+        for uid in set(uids):
+            record, doQuery = yield self.lookupRecord(IndexType.uid, uid, "recordWithUID")
+            if record is not None:
+                records.append(record)
+            elif doQuery:
+                missing.append(uid)
+
+        if missing:
+            found = yield self._directory.recordsWithUIDs(
+                missing, timeoutSeconds=timeoutSeconds
+            )
+            for record in found:
+                yield self.cacheRecord(
+                    record,
+                    (IndexType.uid, IndexType.guid, IndexType.shortName)
+                )
+            foundUIDs = set([record.uid for record in found])
+            for uid in missing:
+                if uid not in foundUIDs:
+                    yield self.negativeCacheRecord(IndexType.uid, uid)
+            records.extend(found)
+
+        returnValue(records)
+
     @inlineCallbacks
     def recordWithGUID(self, guid, timeoutSeconds=None):
 
         # First check our cache
-        record, doQuery = self.lookupRecord(IndexType.guid, guid, "recordWithGUID")
+        record, doQuery = yield self.lookupRecord(IndexType.guid, guid, "recordWithGUID")
         if record is None and doQuery:
             record = yield self._directory._wrapped_recordWithGUID(
                 guid, timeoutSeconds=timeoutSeconds
             )
             if record is not None:
                 # Note we do not index on email address; see below.
-                self.cacheRecord(
+                yield self.cacheRecord(
                     record,
                     (IndexType.uid, IndexType.guid, IndexType.shortName)
                 )
             else:
-                self.negativeCacheRecord(IndexType.guid, guid)
+                yield self.negativeCacheRecord(IndexType.guid, guid)
 
         returnValue(record)
 
@@ -673,7 +727,7 @@ class CachingDirectoryService(
     def recordWithShortName(self, recordType, shortName, timeoutSeconds=None):
 
         # First check our cache
-        record, doQuery = self.lookupRecord(
+        record, doQuery = yield self.lookupRecord(
             IndexType.shortName,
             (recordType.name, shortName),
             "recordWithShortName"
@@ -684,12 +738,12 @@ class CachingDirectoryService(
             )
             if record is not None:
                 # Note we do not index on email address; see below.
-                self.cacheRecord(
+                yield self.cacheRecord(
                     record,
                     (IndexType.uid, IndexType.guid, IndexType.shortName)
                 )
             else:
-                self.negativeCacheRecord(IndexType.shortName, (recordType.name, shortName))
+                yield self.negativeCacheRecord(IndexType.shortName, (recordType.name, shortName))
 
         returnValue(record)
 
@@ -699,7 +753,7 @@ class CachingDirectoryService(
     ):
 
         # First check our cache
-        record, doQuery = self.lookupRecord(
+        record, doQuery = yield self.lookupRecord(
             IndexType.emailAddress,
             emailAddress,
             "recordsWithEmailAddress"
@@ -719,7 +773,7 @@ class CachingDirectoryService(
                 # the next lookup by email address would only get that record,
                 # but there might be others in the directory service with that
                 # same email address.
-                self.cacheRecord(
+                yield self.cacheRecord(
                     list(records)[0],
                     (
                         IndexType.uid, IndexType.guid,
@@ -727,7 +781,7 @@ class CachingDirectoryService(
                     )
                 )
             elif len(records) == 0:
-                self.negativeCacheRecord(IndexType.emailAddress, emailAddress)
+                yield self.negativeCacheRecord(IndexType.emailAddress, emailAddress)
         else:
             records = [record]
 
@@ -812,7 +866,7 @@ class CachingDirectoryService(
     @inlineCallbacks
     def flush(self):
         if self._memcacher is not None:
-            self._memcacher.flush()
+            yield self._memcacher.flush()
         self.resetCache()
         yield self._directory.flush()
 
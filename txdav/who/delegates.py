@@ -36,6 +36,10 @@ from twext.who.directory import (
 )
 from twext.who.expression import MatchExpression, MatchType
 
+from collections import OrderedDict
+import time
+import uuid
+
 log = Logger()
 
 
@@ -251,9 +255,29 @@ class CachingDelegates(object):
     cacheNotifier = None
 
     class DelegatesMemcacher(Memcacher):
+        """
+        Memcached cache of delegate UIDs, with a bounded per-process tier in
+        front of it so that repeated lookups do not need a memcached round
+        trip.
+
+        The per-process tier is kept in step with other processes by a
+        generation token in memcached: L{changed} replaces the token after
+        entries have been deleted, and each process discards its tier when it
+        sees the token has changed (checked at most every
+        C{config.DelegateCaching.CheckSeconds}). So after a change made by
+        another process, this process can return the old delegates for up to
+        that long (one second by default); changes made by this process are
+        seen straight away.
+        """
+
+        _generationKey = "generation"
 
         def __init__(self, namespace):
             super(CachingDelegates.DelegatesMemcacher, self).__init__(namespace, key_normalization=True)
+            self._local = OrderedDict()
+            self._localVersion = 0
+            self._generation = None
+            self._checked = None
 
         def _key(self, keyname, uid, readWrite, expanded):
             return "{}{}:{}#{}".format(
@@ -269,15 +293,92 @@ class CachingDelegates(object):
         def _membershipsKey(self, uid, readWrite):
             return self._key("memberships", uid, readWrite, False)
 
+        def _localEnabled(self):
+            """
+            The per-process tier can only be used when there is a shared cache
+            to see other processes' changes through.
+            """
+            return (
+                config.DelegateCaching.Enabled and
+                not isinstance(self._getMemcacheProtocol(), Memcacher.nullCacher)
+            )
+
+        def _localClear(self):
+            self._local.clear()
+            self._localVersion += 1
+
+        @inlineCallbacks
+        def _checkGeneration(self):
+            """
+            Discard the per-process tier if the generation token has changed
+            since it was last checked.
+            """
+            now = time.time()
+            if self._checked is not None and now - self._checked < config.DelegateCaching.CheckSeconds:
+                returnValue(None)
+            self._checked = now
+
+            generation = yield self.get(self._generationKey)
+            if generation != self._generation:
+                self._localClear()
+                self._generation = generation
+
+        def _localSet(self, key, value, version):
+            """
+            Store a value in the per-process tier, unless entries have been
+            invalidated since C{version} was read.
+            """
+            if version != self._localVersion or not self._localEnabled():
+                return
+            self._local.pop(key, None)
+            self._local[key] = frozenset(value)
+            while len(self._local) > config.DelegateCaching.MaxEntries:
+                self._local.popitem(last=False)
+
+        def _localDelete(self, key):
+            self._local.pop(key, None)
+            self._localVersion += 1
+
+        @inlineCallbacks
+        def _getValue(self, key):
+            """
+            Get the UIDs cached for a key, from the per-process tier if present
+            there, otherwise from memcached.
+
+            @param key: the cache key
+            @type key: C{str}
+
+            @return: a L{Deferred} firing with a C{set} of UIDs, or L{None} if
+                the key is not cached
+            """
+            if self._localEnabled():
+                yield self._checkGeneration()
+                value = self._local.get(key)
+                if value is not None:
+                    # Most recently used
+                    del self._local[key]
+                    self._local[key] = value
+                    returnValue(set(value))
+
+            version = self._localVersion
+            value = self._value_decode((yield self.get(key)))
+            if value is not None:
+                self._localSet(key, value, version)
+            returnValue(value)
+
         def setMembers(self, uid, readWrite, members, expanded):
+            key = self._membersKey(uid, readWrite, expanded)
+            self._localSet(key, members, self._localVersion)
             return self.set(
-                self._membersKey(uid, readWrite, expanded),
+                key,
                 ",".join(members).encode("utf-8"),
             )
 
         def setMemberships(self, uid, readWrite, memberships):
+            key = self._membershipsKey(uid, readWrite)
+            self._localSet(key, memberships, self._localVersion)
             return self.set(
-                self._membershipsKey(uid, readWrite),
+                key,
                 ",".join(memberships).encode("utf-8"),
             )
 
@@ -290,30 +391,44 @@ class CachingDelegates(object):
             else:
                 return set()
 
-        @inlineCallbacks
         def getMembers(self, uid, readWrite, expanded):
-            value = yield self.get(self._membersKey(uid, readWrite, expanded))
-            returnValue(self._value_decode(value))
+            return self._getValue(self._membersKey(uid, readWrite, expanded))
 
-        @inlineCallbacks
         def getMemberships(self, uid, readWrite):
-            value = yield self.get(self._membershipsKey(uid, readWrite))
-            returnValue(self._value_decode(value))
+            return self._getValue(self._membershipsKey(uid, readWrite))
 
         @inlineCallbacks
         def deleteMember(self, uid, readWrite):
             """
             Delete both the regular and expanded keys.
             """
-            yield self.delete(self._membersKey(uid, readWrite, False))
-            yield self.delete(self._membersKey(uid, readWrite, True))
+            for expanded in (False, True):
+                key = self._membersKey(uid, readWrite, expanded)
+                self._localDelete(key)
+                yield self.delete(key)
 
         @inlineCallbacks
         def deleteMembership(self, uid, readWrite):
             """
             Delete both the regular and expanded keys.
             """
-            yield self.delete(self._membershipsKey(uid, readWrite))
+            key = self._membershipsKey(uid, readWrite)
+            self._localDelete(key)
+            yield self.delete(key)
+
+        def changed(self):
+            """
+            Tell other processes to discard their per-process tier, after
+            entries have been deleted.
+
+            @return: a L{Deferred} that fires when the token has been changed
+            """
+            return self.set(self._generationKey, str(uuid.uuid4()))
+
+        def flushAll(self):
+            self._localClear()
+            self._checked = None
+            return super(CachingDelegates.DelegatesMemcacher, self).flushAll()
 
     def __init__(self):
         self._memcacher = CachingDelegates.DelegatesMemcacher("DelegatesDB")
@@ -383,6 +498,7 @@ class CachingDelegates(object):
         newDelegateUIDs = yield self._delegatesOfUIDs(txn, delegator, readWrite, expanded=True)
         for uid in set(newDelegateUIDs) - set(existingDelegateUIDs):
             yield self._memcacher.deleteMembership(uid, readWrite)
+        yield self._memcacher.changed()
 
     @inlineCallbacks
     def removeDelegate(self, txn, delegator, delegate, readWrite):
@@ -422,6 +538,7 @@ class CachingDelegates(object):
         newDelegateUIDs = yield self._delegatesOfUIDs(txn, delegator, readWrite, expanded=True)
         for uid in set(existingDelegateUIDs) - set(newDelegateUIDs):
             yield self._memcacher.deleteMembership(uid, readWrite)
+        yield self._memcacher.changed()
 
     @inlineCallbacks
     def groupChanged(self, txn, groupID, addedUIDs, removedUIDs):
@@ -451,6 +568,8 @@ class CachingDelegates(object):
             yield self._memcacher.deleteMembership(delegate, True)
             yield self._memcacher.deleteMembership(delegate, False)
 
+        yield self._memcacher.changed()
+
     @inlineCallbacks
     def delegatesOf(self, txn, delegator, readWrite, expanded=False):
         """
@@ -658,6 +777,8 @@ class CachingDelegates(object):
         if writeDelegateUID:
             yield self.deleteMembershipForGroup(txn, writeDelegateUID, True)
 
+        yield self._memcacher.changed()
+
     @inlineCallbacks
     def deleteMembershipForGroup(self, txn, groupUID, readWrite):
         if groupUID:
@@ -27,7 +27,7 @@ from twext.who.expression import (
 )
 from twext.who.idirectory import RecordType as BaseRecordType, FieldName as BaseFieldName
 from twisted.cred.credentials import UsernamePassword
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, gatherResults
 from twistedcaldav.config import config
 from twistedcaldav.ical import Property
 from txdav.caldav.datastore.scheduling.utils import normalizeCUAddr
@@ -133,6 +133,25 @@ class CalendarDirectoryServiceMixin(object):
 
         returnValue(None)
 
+    @inlineCallbacks
+    def recordsWithUIDs(self, uids, timeoutSeconds=None):
+        """
+        Look up the records of many UIDs. Directories that can do this in
+        one request override this; by default the lookups are done in
+        parallel.
+
+        @param uids: the UIDs
+        @type uids: iterable of C{unicode}
+
+        @return: the records found, UIDs with no record are left out
+        @rtype: C{list}
+        """
+        records = yield gatherResults([
+            self.recordWithUID(uid, timeoutSeconds=timeoutSeconds)
+            for uid in set(uids)
+        ])
+        returnValue([record for record in records if record is not None])
+
     searchContext_location = "location"
     searchContext_resource = "resource"
     searchContext_user = "user"
@@ -302,10 +302,19 @@ class GroupCacher(object):
                 "Deleted old or unused groups {d}", d=deletedGroupUIDs
             )
 
+        # Groups still waiting for the refresh scheduled by a previous update
+        # (when there are more groups than can be refreshed in one polling
+        # interval) keep that work item, rather than having more queued
+        pendingGroupUIDs = yield self.groupsPendingRefresh(txn)
+        if pendingGroupUIDs:
+            self.log.debug(
+                "{count} groups already have a pending refresh", count=len(pendingGroupUIDs)
+            )
+
         # For each of those groups, create a per-group refresh work item
         futureSeconds = self.initialSchedulingDelaySeconds
         i = 0
-        for groupUID in set(groupUIDs) - set(deletedGroupUIDs):
+        for groupUID in set(groupUIDs) - set(deletedGroupUIDs) - pendingGroupUIDs:
             self.log.debug(
                 "Enqueuing group refresh for {u} in {sec} seconds",
                 u=groupUID, sec=futureSeconds
@@ -586,3 +595,20 @@ class GroupCacher(object):
         )
 
         returnValue(frozenset(delegatedUIDs | attendeeGroupUIDs | shareeGroupUIDs))
+
+    @inlineCallbacks
+    def groupsPendingRefresh(self, txn):
+        """
+        The groups that have a L{GroupRefreshWork} item that has not yet been
+        done.
+
+        @return: a L{Deferred} firing with the group UIDs
+        @rtype: C{frozenset} of C{str}
+        """
+        grw = schema.GROUP_REFRESH_WORK
+        rows = yield Select(
+            [grw.GROUP_UID],
+            From=grw,
+            Distinct=True
+        ).on(txn)
+        returnValue(frozenset([row[0] for row in rows]))
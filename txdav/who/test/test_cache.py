@@ -345,6 +345,38 @@ class CacheTest(StoreTestCase):
         self.assertEquals(len(dir._negativeCache[IndexType.guid]), 0)
         self.assertEquals(len(dir._negativeCache[IndexType.shortName]), 0)
 
+    @inlineCallbacks
+    def test_recordsWithUIDs(self):
+        """
+        Verify L{CachingDirectoryService.recordsWithUIDs} uses and fills the
+        cache and the negative cache.
+        """
+
+        dir = self.cachingDirectory
+        dir.setTestTime(1.0)
+
+        yield dir.recordWithUID(u"cache-uid-1")
+        self.assertEquals(dir._hitCount, 0)
+
+        records = yield dir.recordsWithUIDs(
+            [u"cache-uid-1", u"cache-uid-2", u"negative-uid-1"]
+        )
+        self.assertEquals(
+            sorted([record.uid for record in records]),
+            [u"cache-uid-1", u"cache-uid-2"]
+        )
+        self.assertEquals(dir._hitCount, 1)
+        self.assertTrue(u"cache-uid-2" in dir._cache[IndexType.uid])
+        self.assertTrue(u"negative-uid-1" in dir._negativeCache[IndexType.uid])
+
+        # Everything is now answered from the cache
+        hitCount = dir._hitCount
+        records = yield dir.recordsWithUIDs(
+            [u"cache-uid-1", u"cache-uid-2", u"negative-uid-1"]
+        )
+        self.assertEquals(len(records), 2)
+        self.assertEquals(dir._hitCount, hitCount + 2)
+
     def test_differentCacheKeys(self):
         """
         Verify records are purged from cache after a certain amount of requests
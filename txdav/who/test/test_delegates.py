@@ -26,6 +26,8 @@ from txdav.who.delegates import Delegates, RecordType as DelegateRecordType, \
 from txdav.who.groups import GroupCacher
 from twext.who.idirectory import RecordType
 from twisted.internet.defer import inlineCallbacks, succeed
+from twistedcaldav.config import config
+from twistedcaldav.memcacher import Memcacher
 from twistedcaldav.test.util import StoreTestCase
 
 
@@ -439,6 +441,46 @@ class DelegationCachingTest(StoreTestCase):
         yield Delegates.delegatedTo(self.transactionUnderTest(), delegate1, False)
         self.assertEqual(delegators_query[0], 2)
 
+    @inlineCallbacks
+    def test_localCacheUsed(self):
+        """
+        Repeated lookups are answered by the per-process tier without a
+        memcached lookup, until another process signals a change.
+        """
+        self.patch(config.DelegateCaching, "CheckSeconds", 3600)
+
+        delegator = yield self.directory.recordWithUID(u"__wsanchez1__")
+        delegate1 = yield self.directory.recordWithUID(u"__sagen1__")
+        yield Delegates.addDelegate(self.transactionUnderTest(), delegator, delegate1, True)
+
+        original_get = Memcacher.get
+        memcacher_gets = []
+
+        def _get(self, key, withIdentifier=False):
+            memcacher_gets.append(key)
+            return original_get(self, key, withIdentifier)
+        self.patch(Memcacher, "get", _get)
+
+        # Not in the per-process tier
+        yield self._delegatesOfResults(delegator, True, False, (delegate1,))
+        self.assertEqual(len(memcacher_gets), 1)
+
+        # In the per-process tier
+        yield self._delegatesOfResults(delegator, True, False, (delegate1,))
+        self.assertEqual(len(memcacher_gets), 1)
+
+        # Another process changes the generation token: the entry is still
+        # used until the next check
+        yield Delegates._memcacher.set("generation", "another process")
+        yield self._delegatesOfResults(delegator, True, False, (delegate1,))
+        self.assertEqual(len(memcacher_gets), 1)
+
+        # After the next check the per-process tier is discarded
+        self.patch(config.DelegateCaching, "CheckSeconds", 0)
+        yield self._delegatesOfResults(delegator, True, False, (delegate1,))
+        self.assertEqual(len(memcacher_gets), 3)
+        self.assertTrue("generation" in memcacher_gets)
+
     @inlineCallbacks
     def test_addRemoveDelegation(self):
 
@@ -865,3 +865,55 @@ class DynamicGroupTest(StoreTestCase):
             group = yield txn.groupByUID(uid, create=False)
             yield txn.commit()
             self.assertEqual(group, None)
+
+    @inlineCallbacks
+    def test_synchronizeMembersBatches(self):
+        """
+        synchronizeMembers() applies changes larger than its batch size.
+        """
+        store = self.storeUnderTest()
+
+        txn = store.newTransaction()
+        txn.groupMembershipBatchSize = 7
+        yield self.groupCacher.refreshGroup(txn, u"testgroup")
+        group = yield txn.groupByUID(u"testgroup", create=False)
+        memberUIDs = yield txn.groupMemberUIDs(group.groupID)
+        self.assertEqual(len(memberUIDs), self.numUsers)
+
+        # Remove half of the members, and add some that were never members
+        newSet = set([u"foo{ctr:05d}".format(ctr=i) for i in xrange(50, self.numUsers)])
+        newSet.update([u"bar{ctr:05d}".format(ctr=i) for i in xrange(20)])
+        added, removed = yield txn.synchronizeMembers(group.groupID, newSet)
+        self.assertEqual(added, set([u"bar{ctr:05d}".format(ctr=i) for i in xrange(20)]))
+        self.assertEqual(removed, set([u"foo{ctr:05d}".format(ctr=i) for i in xrange(50)]))
+
+        memberUIDs = yield txn.groupMemberUIDs(group.groupID)
+        self.assertEqual(memberUIDs, newSet)
+        yield txn.commit()
+
+    @inlineCallbacks
+    def test_update_pending(self):
+        """
+        Verify that update() does not queue another refresh for a group that
+        still has one pending.
+        """
+        store = self.storeUnderTest()
+        self.groupCacher.initialSchedulingDelaySeconds = 3600
+
+        txn = store.newTransaction()
+        group = yield txn.groupByUID(u"testgroup")
+        yield txn.addDelegateGroup(delegator=u"sagen", delegateGroupID=group.groupID, readWrite=True)
+        yield txn.commit()
+
+        for _ignore in range(3):
+            txn = store.newTransaction()
+            yield self.groupCacher.update(txn)
+            yield txn.commit()
+
+        txn = store.newTransaction()
+        work = yield GroupRefreshWork.all(txn)
+        pending = yield self.groupCacher.groupsPendingRefresh(txn)
+        yield txn.commit()
+
+        self.assertEqual([item.groupUID for item in work], ["testgroup"])
+        self.assertEqual(pending, frozenset(["testgroup"]))
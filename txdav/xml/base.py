@@ -115,6 +115,87 @@ def decodeXMLName(name):
     return (namespace, localname)
 
 
+##
+# Serialization helpers
+##
+
+_pcdataEscape = re.compile("[&<>]")
+_pcdataEscapes = {"&": "&amp;", "<": "&lt;", ">": "&gt;"}
+
+
+def _pcdataReplace(match):
+    return _pcdataEscapes[match.group()]
+
+
+def _escapePCDATA(data):
+    """
+    Escape text for output, using a CDATA section if it contains line breaks.
+    """
+    if "\n" in data or "\r" in data:
+        return "<![CDATA[%s]]>" % (data.replace("]]>", "]]&gt;"),)
+    elif "&" in data or "<" in data or ">" in data:
+        return _pcdataEscape.sub(_pcdataReplace, data)
+    else:
+        return data
+
+_indents = ["  " * level for level in range(32)]
+
+
+def _indent(level):
+    """
+    Return the pretty print indent for a nesting level.
+    """
+    try:
+        return _indents[level]
+    except IndexError:
+        return "  " * level
+
+# Serialized tags for elements without attributes, keyed by element qname and
+# whether the namespace differs from the enclosing element's
+_tagCache = {}
+
+
+def _tags(element, ns):
+    """
+    Return the open, empty and close tags of an element without attributes.
+
+    @param element: the element
+    @type element: L{WebDAVElement}
+    @param ns: the namespace of the enclosing element
+    @type ns: C{str}
+
+    @return: the open tag, empty element tag and close tag
+    @rtype: C{tuple} of C{str}
+    """
+    differs = ns != element.namespace
+    if isinstance(element, WebDAVUnknownElement):
+        # Unknown elements have per-instance names chosen by clients, so are
+        # not cached
+        return _makeTags(element.namespace, element.name, differs)
+
+    key = (element.namespace, element.name, differs,)
+    try:
+        return _tagCache[key]
+    except KeyError:
+        tags = _tagCache[key] = _makeTags(element.namespace, element.name, differs)
+        return tags
+
+
+def _makeTags(namespace, name, differs):
+    if differs:
+        return (
+            "<%s xmlns='%s'>" % (name, namespace,),
+            "<%s xmlns='%s'/>" % (name, namespace,),
+            "</%s>" % (name,),
+        )
+    else:
+        return (
+            "<%s>" % (name,),
+            "<%s/>" % (name,),
+            "</%s>" % (name,),
+        )
+
+
 class WebDAVElement (object):
     """
     WebDAV XML element. (RFC 2518, section 12)
@@ -270,8 +351,9 @@ class WebDAVElement (object):
         return child in self.children
 
     def writeXML(self, output, pretty=True):
-        output.write("<?xml version='1.0' encoding='UTF-8'?>" + ("\n" if pretty else ""))
-        self._writeToStream(output, "", 0, pretty)
+        parts = ["<?xml version='1.0' encoding='UTF-8'?>" + ("\n" if pretty else "")]
+        self._serialize(parts, "", 0, pretty)
+        output.write("".join(parts))
 
     def _writeToStream(self, output, ns, level, pretty):
         """
@@ -282,61 +364,106 @@ class WebDAVElement (object):
         @param level: C{int} containing the element nesting level (starts at 0).
         @param pretty: C{bool} whether to use 'pretty' formatted output or not.
         """
+        parts = []
+        self._serialize(parts, ns, level, pretty)
+        output.write("".join(parts))
+
+    def _serialize(self, parts, ns, level, pretty):
+        """
+        Append the XML for this element and its descendants to a list of
+        strings. An explicit stack is used instead of recursion, and the tags of
+        elements without attributes are cached.
 
-        # Do pretty indent
-        if pretty and level:
-            output.write("  " * level)
-
-        # Check for empty element (one with either no children or a single PCDATA that is itself empty)
-        if (
-            len(self.children) == 0 or
-            (len(self.children) == 1 and isinstance(self.children[0], PCDATAElement) and len(str(self.children[0])) == 0)
-        ):
-
-            # Write out any attributes or the namespace if difference from enclosing element.
-            if self.attributes or (ns != self.namespace):
-                output.write("<%s" % (self.name,))
-                for name, value in self.attributes.iteritems():
-                    self._writeAttributeToStream(output, name, value)
-                if ns != self.namespace:
-                    output.write(" xmlns='%s'" % (self.namespace,))
-                output.write("/>")
+        @param parts: C{list} of C{str} to append to.
+        @param ns: C{str} containing the namespace of the enclosing element.
+        @param level: C{int} containing the element nesting level (starts at 0).
+        @param pretty: C{bool} whether to use 'pretty' formatted output or not.
+        """
+        append = parts.append
+        tagCache = _tagCache
+
+        # Each stack item is either an (element, namespace, level) tuple, or the
+        # str (or unicode, for elements with unicode names) that closes an
+        # element
+        stack = [(self, ns, level)]
+        pop = stack.pop
+        push = stack.append
+        while stack:
+            item = pop()
+            if item.__class__ is not tuple:
+                append(item)
+                continue
+
+            element, ns, level = item
+            if element.__class__ is PCDATAElement:
+                data = element.data
+                if "\n" in data or "\r" in data or "&" in data or "<" in data or ">" in data:
+                    data = _escapePCDATA(data)
+                append(data)
+                continue
+
+            indent = pretty and level
+            if indent:
+                append(_indent(level))
+
+            children = element.children
+            namespace = element.namespace
+            if element.attributes:
+                tags = None
             else:
-                output.write("<%s/>" % (self.name,))
-        else:
-            # Write out any attributes or the namespace if difference from enclosing element.
-            if self.attributes or (ns != self.namespace):
-                output.write("<%s" % (self.name,))
-                for name, value in self.attributes.iteritems():
-                    self._writeAttributeToStream(output, name, value)
-                if ns != self.namespace:
-                    output.write(" xmlns='%s'" % (self.namespace,))
-                    ns = self.namespace
-                output.write(">")
+                tags = tagCache.get((namespace, element.name, ns != namespace))
+                if tags is None:
+                    tags = _tags(element, ns)
+
+            if (
+                len(children) == 0 or
+                (len(children) == 1 and children[0].__class__ is PCDATAElement and not children[0].data)
+            ):
+                append(element._openTag(ns, "/>") if tags is None else tags[1])
+                if indent:
+                    append("\r\n")
+                continue
+
+            if tags is None:
+                append(element._openTag(ns, ">"))
+                close = "</%s>" % (element.name,)
             else:
-                output.write("<%s>" % (self.name,))
+                append(tags[0])
+                close = tags[2]
 
             # Determine nature of children when doing pretty print: we do
             # not want to insert CRLFs or any other whitespace in PCDATA.
             hasPCDATA = False
-            for child in self.children:
-                if isinstance(child, PCDATAElement):
-                    hasPCDATA = True
-                    break
-
-            # Write out the children.
-            if pretty and not hasPCDATA:
-                output.write("\r\n")
-            for child in self.children:
-                child._writeToStream(output, ns, level + 1, pretty)
-
-            # Close the element.
-            if pretty and not hasPCDATA and level:
-                output.write("  " * level)
-            output.write("</%s>" % (self.name,))
-
-        if pretty and level:
-            output.write("\r\n")
+            if pretty:
+                for child in children:
+                    if child.__class__ is PCDATAElement:
+                        hasPCDATA = True
+                        break
+                if not hasPCDATA:
+                    append("\r\n")
+                    if level:
+                        close = _indent(level) + close
+            if indent:
+                close += "\r\n"
+            push(close)
+
+            # Children are written in the namespace of this element
+            level += 1
+            for child in reversed(children):
+                push((child, namespace, level))
+
+    def _openTag(self, ns, end):
+        """
+        Return the opening tag for this element including its attributes.
+        """
+        tag = ["<%s" % (self.name,)]
+        for name, value in self.attributes.iteritems():
+            # Quote any single quotes. We do not need to be any smarter than this.
+            tag.append(" %s='%s'" % (name, value.replace("'", "&apos;"),))
+        if ns != self.namespace:
+            tag.append(" xmlns='%s'" % (self.namespace,))
+        tag.append(end)
+        return "".join(tag)
 
     def _writeAttributeToStream(self, output, name, value):
 
@@ -421,6 +548,10 @@ class WebDAVElement (object):
 
 class PCDATAElement (object):
 
+    # Text nodes are the most numerous objects in a parsed document, so avoid a
+    # per-instance __dict__
+    __slots__ = ("data",)
+
     def __init__(self, data):
         super(PCDATAElement, self).__init__()
 
@@ -433,6 +564,15 @@ class PCDATAElement (object):
 
         self.data = data
 
+    def __getstate__(self):
+        return self.data
+
+    def __setstate__(self, state):
+        # Older pickles have the instance __dict__ as their state
+        if isinstance(state, dict):
+            state = state["data"]
+        self.data = state
+
     @classmethod
     def qname(cls):
         return (None, "#PCDATA")
@@ -484,20 +624,10 @@ class PCDATAElement (object):
             raise
 
     def _writeToStream(self, output, ns, level, pretty):
-        # Do escaping/CDATA behavior
-        if "\r" in self.data or "\n" in self.data:
-            # Do CDATA
-            cdata = "<![CDATA[%s]]>" % (self.data.replace("]]>", "]]&gt;"),)
-        else:
-            cdata = self.data
-            if "&" in cdata:
-                cdata = cdata.replace("&", "&amp;")
-            if "<" in cdata:
-                cdata = cdata.replace("<", "&lt;")
-            if ">" in cdata:
-                cdata = cdata.replace(">", "&gt;")
-
-        output.write(cdata)
+        output.write(_escapePCDATA(self.data))
+
+    def _serialize(self, parts, ns, level, pretty):
+        parts.append(_escapePCDATA(self.data))
 
 
 class WebDAVOneShotElement (WebDAVElement):
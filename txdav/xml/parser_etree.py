@@ -30,7 +30,7 @@ __all__ = [
 
 from xml.etree.ElementTree import TreeBuilder, XMLParser, \
     _namespace_map
-from txdav.xml.base import WebDAVUnknownElement, PCDATAElement
+from txdav.xml.base import WebDAVElement, WebDAVUnknownElement, PCDATAElement
 from txdav.xml.base import _elements_by_qname
 from txdav.xml.parser_base import AbstractWebDAVDocument
 
@@ -39,11 +39,83 @@ try:
 except ImportError:
     from xml.parsers.expat import ExpatError as XMLParseError
 
+try:
+    from xml.etree.cElementTree import XMLParser as FastXMLParser
+    from xml.etree.cElementTree import ParseError as FastXMLParseError
+except ImportError:
+    FastXMLParser = XMLParser
+    FastXMLParseError = XMLParseError
+
 
 def QNameSplit(qname):
     return tuple(qname[1:].split("}", 1)) if "}" in qname else ("", qname,)
 
 
+# Element factories for registered elements, keyed by qname. Each factory takes
+# a list of child elements and a dict of attributes.
+_element_factories = {}
+
+
+def elementFactory(element_class):
+    """
+    Return a factory that creates instances of an element class from parsed
+    children and attributes.
+
+    Elements created by the parser only ever have L{WebDAVElement} or
+    L{PCDATAElement} children, so for classes that use the default constructor
+    the factory skips the constructor's argument checks and simply drops any
+    PCDATA the element does not allow. Other classes are constructed normally.
+
+    @param element_class: the element class
+    @type element_class: L{type}
+
+    @return: the factory
+    @rtype: callable
+    """
+    if (
+        element_class.allowed_children is not None and
+        element_class.__init__.im_func is WebDAVElement.__init__.im_func and
+        element_class.__new__ is object.__new__
+    ):
+        allowPCDATA = PCDATAElement in element_class.allowed_children
+        new = object.__new__
+
+        def factory(children, attributes):
+            element = new(element_class)
+            if allowPCDATA:
+                element.children = tuple(children)
+            else:
+                element.children = tuple([
+                    child for child in children
+                    if child.__class__ is not PCDATAElement
+                ])
+            element.attributes = attributes
+            return element
+    else:
+        def factory(children, attributes):
+            return element_class(*children, **attributes)
+
+    return factory
+
+
+def lookupElementFactory(qname):
+    """
+    Return the factory for a registered element, or L{None} if the element is
+    not registered.
+
+    @param qname: the element's qname
+    @type qname: L{tuple}
+    """
+    try:
+        return _element_factories[qname]
+    except KeyError:
+        element_class = _elements_by_qname.get(qname)
+        if element_class is None:
+            return None
+        factory = _element_factories[qname] = elementFactory(element_class)
+        return factory
+
+
 class WebDAVContentHandler (TreeBuilder):
 
     def __init__(self):
@@ -149,10 +221,110 @@ class WebDAVContentHandler (TreeBuilder):
         self.stack[-1]["children"].append(element)
 
 
+class FastWebDAVContentHandler(object):
+    """
+    Parser target that builds L{WebDAVElement}s with as little work per element
+    as possible: qnames are split once per document, registered element classes
+    are looked up via precomputed factories, and the parse stack holds plain
+    lists.
+    """
+
+    def __init__(self):
+        self._characterBuffer = None
+        self._qnames = {}
+
+        # Unknown element factories are only cached for one document, as their
+        # names are chosen by the client
+        self._unknownFactories = {}
+
+        # Each stack entry is [qname, factory, attributes, children]
+        self.stack = [[None, None, None, []]]
+
+    def doctype(self, name, pubid, system):
+        """
+        Doctype declaration is ignored.
+        """
+
+    def _qname(self, tag):
+        try:
+            return self._qnames[tag]
+        except KeyError:
+            qname = self._qnames[tag] = QNameSplit(tag)
+            return qname
+
+    def _unknownFactory(self, qname):
+        try:
+            return self._unknownFactories[qname]
+        except KeyError:
+            tag_namespace, tag_name = qname
+
+            def factory(children, attributes):
+                element = WebDAVUnknownElement(*children, **attributes)
+                element.namespace = tag_namespace
+                element.name = tag_name
+                return element
+            self._unknownFactories[qname] = factory
+            return factory
+
+    def data(self, data):
+        # Stash character data away in a list that we will "".join() when done
+        if self._characterBuffer is None:
+            self._characterBuffer = [data]
+        else:
+            self._characterBuffer.append(data)
+
+    def start(self, tag, attrs):
+        if self._characterBuffer is not None:
+            self.stack[-1][3].append(PCDATAElement("".join(self._characterBuffer)))
+            self._characterBuffer = None
+
+        qname = self._qname(tag)
+
+        # Need to convert a "full" namespace in an attribute QName to the form
+        # "%s:%s".
+        attributes = {}
+        if attrs:
+            for aname, avalue in attrs.items():
+                if aname[0] == "{":
+                    anamespace, aname = self._qname(aname)
+                    anamespace = _namespace_map.get(anamespace, anamespace)
+                    aname = "%s:%s" % (anamespace, aname,)
+                attributes[aname] = avalue
+
+        factory = lookupElementFactory(qname)
+        if factory is None:
+            factory = self._unknownFactory(qname)
+
+        self.stack.append([qname, factory, attributes, []])
+
+    def end(self, tag):
+        if self._characterBuffer is not None:
+            self.stack[-1][3].append(PCDATAElement("".join(self._characterBuffer)))
+            self._characterBuffer = None
+
+        # The XML parser guarantees start and end tags match
+        qname, factory, attributes, children = self.stack.pop()
+        self.stack[-1][3].append(factory(children, attributes))
+
+    def close(self):
+        top = self.stack[-1]
+
+        assert top[0] is None
+        assert len(top[3]) == 1, "Must have exactly one root element, got %d" % len(top[3])
+
+        return WebDAVDocument(top[3][0])
+
+
 class WebDAVDocument(AbstractWebDAVDocument):
 
+    # Whether to parse with L{FastWebDAVContentHandler} and the C XML parser
+    fastParse = True
+
     @classmethod
     def fromStream(cls, source):
+        if cls.fastParse:
+            return cls._fastFromStream(source)
+
         parser = XMLParser(target=WebDAVContentHandler())
         try:
             while 1:
@@ -164,5 +336,18 @@ class WebDAVDocument(AbstractWebDAVDocument):
             raise ValueError(e)
         return parser.close()
 
+    @classmethod
+    def _fastFromStream(cls, source):
+        parser = FastXMLParser(target=FastWebDAVContentHandler())
+        try:
+            while 1:
+                data = source.read(65536)
+                if not data:
+                    break
+                parser.feed(data)
+            return parser.close()
+        except FastXMLParseError, e:
+            raise ValueError(e)
+
     def writeXML(self, output):
         self.root_element.writeXML(output)
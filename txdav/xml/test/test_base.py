@@ -25,9 +25,11 @@
 Tests for L{txdav.xml.base}.
 """
 
+import cPickle
+
 from twisted.trial.unittest import TestCase
 from txdav.xml.base import decodeXMLName, encodeXMLName
-from txdav.xml.base import WebDAVUnknownElement
+from txdav.xml.base import WebDAVUnknownElement, PCDATAElement
 from txdav.xml.parser import WebDAVDocument
 
 
@@ -106,3 +108,149 @@ class WebDAVUnknownElementTests(WebDAVElementTestsMixin, TestCase):
         "http://twistedmatrix.com/",
         "foo"
     )
+
+
+class FastParseTests(TestCase):
+    """
+    Tests for the fast mode of L{WebDAVDocument.fromString}.
+    """
+
+    documents = (
+        """<?xml version="1.0" encoding="utf-8" ?>"""
+        """<D:propfind xmlns:D="DAV:" xmlns:T="http://twistedmatrix.com/">\n"""
+        """  <D:prop>\n"""
+        """    <D:getetag/>\n"""
+        """    <D:resourcetype/>\n"""
+        """    <D:getlastmodified>Mon, 23 May 2005 04:52:22 GMT</D:getlastmodified>\n"""
+        """    <D:creationdate>2005-06-13T16:14:11Z</D:creationdate>\n"""
+        """    <T:foo T:a="1" b="2">text &amp; more</T:foo>\n"""
+        """  </D:prop>\n"""
+        """</D:propfind>""",
+
+        """<D:lockinfo xmlns:D="DAV:">"""
+        """<D:lockscope><D:exclusive/></D:lockscope>"""
+        """<D:locktype><D:write/></D:locktype>"""
+        """</D:lockinfo>""",
+    )
+
+    def parse(self, document, fast):
+        self.patch(WebDAVDocument, "fastParse", fast)
+        return WebDAVDocument.fromString(document)
+
+    def test_sameResult(self):
+        """
+        Fast and normal parsing produce identical elements.
+        """
+        for document in self.documents:
+            fast = self.parse(document, True)
+            normal = self.parse(document, False)
+            self.assertEquals(fast, normal)
+            self.assertEquals(repr(fast.root_element), repr(normal.root_element))
+            self.assertEquals(fast.toxml(), normal.toxml())
+            fast.root_element.validate()
+
+    def test_invalid(self):
+        """
+        Badly formed XML raises L{ValueError}.
+        """
+        for document in ("", "<a>", "<a></b>", "<a/><b/>",):
+            self.assertRaises(ValueError, self.parse, document, True)
+
+
+class PCDATAElementTests(TestCase):
+    """
+    Tests for L{PCDATAElement}.
+    """
+
+    def test_pickle(self):
+        """
+        L{PCDATAElement} has no instance dictionary but can still be pickled.
+        """
+        element = PCDATAElement("text")
+        self.assertFalse(hasattr(element, "__dict__"))
+        for protocol in (0, 2,):
+            self.assertEquals(cPickle.loads(cPickle.dumps(element, protocol)), element)
+
+
+class SerializeTests(TestCase):
+    """
+    Tests for L{WebDAVElement} serialization.
+    """
+
+    def test_toxml(self):
+        """
+        Nested, empty, attribute, text and foreign namespace elements are
+        written out in both compact and pretty modes.
+        """
+        document = WebDAVDocument.fromString(
+            """<?xml version="1.0" encoding="utf-8" ?>"""
+            """<D:multistatus xmlns:D="DAV:" xmlns:T="http://example.com/ns/">"""
+            """<D:response><D:href>/a&amp;b</D:href>"""
+            """<D:propstat><D:prop><D:resourcetype/><T:foo a="1">x &lt; y</T:foo>"""
+            """<T:bar/></D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat>"""
+            """</D:response></D:multistatus>"""
+        )
+        self.assertEquals(
+            document.root_element.toxml(pretty=False),
+            """<?xml version='1.0' encoding='UTF-8'?>"""
+            """<multistatus xmlns='DAV:'><response><href>/a&amp;b</href>"""
+            """<propstat><prop><resourcetype/>"""
+            """<foo a='1' xmlns='http://example.com/ns/'>x &lt; y</foo>"""
+            """<bar xmlns='http://example.com/ns/'/></prop>"""
+            """<status>HTTP/1.1 200 OK</status></propstat></response></multistatus>""",
+        )
+        self.assertEquals(
+            document.root_element.toxml(pretty=True),
+            """<?xml version='1.0' encoding='UTF-8'?>\n"""
+            """<multistatus xmlns='DAV:'>\r\n"""
+            """  <response>\r\n"""
+            """    <href>/a&amp;b</href>\r\n"""
+            """    <propstat>\r\n"""
+            """      <prop>\r\n"""
+            """        <resourcetype/>\r\n"""
+            """        <foo a='1' xmlns='http://example.com/ns/'>x &lt; y</foo>\r\n"""
+            """        <bar xmlns='http://example.com/ns/'/>\r\n"""
+            """      </prop>\r\n"""
+            """      <status>HTTP/1.1 200 OK</status>\r\n"""
+            """    </propstat>\r\n"""
+            """  </response>\r\n"""
+            """</multistatus>""",
+        )
+
+    def test_cdata(self):
+        """
+        Text with line breaks is written as a CDATA section.
+        """
+        element = WebDAVUnknownElement.withName("http://example.com/ns/", "text")
+        element.children = (PCDATAElement("a\r\nb ]]> c"),)
+        self.assertEquals(
+            element.toxml(pretty=False),
+            """<?xml version='1.0' encoding='UTF-8'?>"""
+            """<text xmlns='http://example.com/ns/'><![CDATA[a\r\nb ]]&gt; c]]></text>""",
+        )
+
+    def test_deepNesting(self):
+        """
+        Deeply nested elements do not hit the recursion limit.
+        """
+        element = WebDAVUnknownElement.withName("urn:x", "leaf")
+        for _ignore in range(5000):
+            parent = WebDAVUnknownElement.withName("urn:x", "node")
+            parent.children = (element,)
+            element = parent
+        output = element.toxml(pretty=False)
+        self.assertEquals(output.count("<node>"), 4999)
+        self.assertTrue(output.endswith("</node>"))
+
+    def test_unicodeName(self):
+        """
+        Elements with unicode names, with and without attributes, are closed.
+        """
+        for attributes in ({}, {"a": "1"},):
+            element = WebDAVUnknownElement.withName(u"urn:x", u"foo")
+            element.attributes = attributes
+            child = WebDAVUnknownElement.withName(u"urn:x", u"bar")
+            child.children = (PCDATAElement("baz"),)
+            element.children = (child,)
+            output = element.toxml(pretty=False)
+            self.assertTrue(output.endswith("<bar>baz</bar></foo>"))
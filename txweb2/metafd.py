@@ -37,6 +37,11 @@ from twisted.internet.tcp import Server
 from twext.internet.sendfdport import IStatusWatcher
 from twext.internet.socketfile import MaxAcceptSocketFileServer
 
+from bisect import bisect
+from socket import error as SocketError
+import hashlib
+import math
+
 log = Logger()
 
 
@@ -173,7 +178,7 @@ class WorkerStatus(FancyStrMixin, object):
     The status of a worker process.
     """
 
-    showAttributes = ("acknowledged unacknowledged total started abandoned unclosed starting stopped"
+    showAttributes = ("acknowledged unacknowledged total started abandoned unclosed starting stopped draining"
                       .split())
 
     def __init__(
@@ -185,7 +190,8 @@ class WorkerStatus(FancyStrMixin, object):
         abandoned=0,
         unclosed=0,
         starting=1,
-        stopped=0
+        stopped=0,
+        draining=0,
     ):
         """
         Create a L{ConnectionStatus} with a number of sent connections and a
@@ -216,6 +222,10 @@ class WorkerStatus(FancyStrMixin, object):
 
         @param stopped: The process that owns this socket has stopped. Do not
             dispatch to it.
+
+        @param draining: The process that owns this socket is finishing its
+            outstanding connections before it is stopped. Do not dispatch to
+            it.
         """
         self.acknowledged = acknowledged
         self.unacknowledged = unacknowledged
@@ -225,6 +235,7 @@ class WorkerStatus(FancyStrMixin, object):
         self.unclosed = unclosed
         self.starting = starting
         self.stopped = stopped
+        self.draining = draining
 
     def items(self):
         return dict([(attr, getattr(self, attr)) for attr in self.showAttributes])
@@ -238,9 +249,9 @@ class WorkerStatus(FancyStrMixin, object):
     def active(self):
         """
         Is the subprocess associated with this socket available to dispatch to.
-        i.e, this socket is neither stopped nor starting
+        i.e, this socket is neither stopped, starting nor draining
         """
-        return self.starting == 0 and self.stopped == 0
+        return self.starting == 0 and self.stopped == 0 and self.draining == 0
 
     def start(self):
         """
@@ -250,6 +261,7 @@ class WorkerStatus(FancyStrMixin, object):
         return self.reset(
             starting=1,
             stopped=0,
+            draining=0,
         )
 
     def restarted(self):
@@ -273,6 +285,17 @@ class WorkerStatus(FancyStrMixin, object):
             abandoned=self.abandoned + self.unacknowledged,
             starting=0,
             stopped=1,
+            draining=0,
+        )
+
+    def drain(self):
+        """
+        The child process for this L{WorkerStatus} is going to be stopped once
+        its outstanding connections are done. Prevent any new connections
+        being dispatched to it.
+        """
+        return self.reset(
+            draining=1,
         )
 
     def adjust(self, **kwargs):
@@ -293,6 +316,150 @@ class WorkerStatus(FancyStrMixin, object):
         return self
 
 
+class AffinityDispatchPolicy(object):
+    """
+    Choose the worker for a new connection by bounded-load consistent hashing
+    of a client key, so that connections from the same client tend to go to
+    the same worker (and find that worker's in-process caches warm).
+
+    Each worker has a number of points on a hash ring. A connection goes to
+    the first active worker found going round the ring from the hash of its
+    key, skipping workers whose load is above C{loadFactor} times the average
+    load, so a busy client spills over to other workers rather than
+    overloading its preferred one. Workers are identified by their position
+    in the dispatcher, so a worker being restarted does not move the keys of
+    other workers.
+
+    @ivar loadFactor: how far above the average load (the effective load of
+        all active workers, including the new connection, divided by the
+        number of active workers) a worker may be loaded before it is skipped
+    @type loadFactor: C{float}
+
+    @ivar replicas: the number of points on the ring for each worker
+    @type replicas: C{int}
+    """
+
+    def __init__(self, loadFactor=1.25, replicas=100):
+        self.loadFactor = loadFactor
+        self.replicas = replicas
+        self._ring = []
+        self._ringHashes = []
+        self._ringSize = 0
+
+    @staticmethod
+    def _hash(value):
+        return int(hashlib.md5(value).hexdigest()[:16], 16)
+
+    def _buildRing(self, count):
+        """
+        Set up the hash ring for C{count} workers, if not already done.
+        """
+        if count == self._ringSize:
+            return
+        ring = []
+        for index in range(count):
+            for replica in range(self.replicas):
+                ring.append((self._hash("{}-{}".format(index, replica)), index,))
+        ring.sort()
+        self._ring = [index for _ignore_hash, index in ring]
+        self._ringHashes = [ringHash for ringHash, _ignore_index in ring]
+        self._ringSize = count
+
+    def keyForSocket(self, skt):
+        """
+        The client key for a connection: its source IP address. The master
+        process does not read from connections, so nothing from the request
+        itself (such as a cookie) is available here.
+
+        @param skt: the connection socket
+        @type skt: L{socket.socket}
+
+        @return: the key, or C{None} if the connection has none (e.g. a UNIX
+            socket connection)
+        @rtype: C{str}
+        """
+        try:
+            peer = skt.getpeername()
+        except (SocketError, AttributeError):
+            return None
+        if isinstance(peer, tuple) and peer:
+            return str(peer[0])
+        return None
+
+    def choose(self, key, statuses):
+        """
+        Choose the worker for a connection.
+
+        @param key: the connection's client key
+        @type key: C{str}
+        @param statuses: the status of each worker
+        @type statuses: C{list} of L{WorkerStatus}
+
+        @return: the index of the chosen worker in C{statuses}, or C{None} if
+            no worker is active
+        @rtype: C{int}
+        """
+        active = [status for status in statuses if status.active()]
+        if not active:
+            return None
+
+        total = sum([status.effective() for status in active]) + 1
+        capacity = int(math.ceil(self.loadFactor * total / len(active)))
+
+        self._buildRing(len(statuses))
+        start = bisect(self._ringHashes, self._hash(key))
+        seen = set()
+        for offset in range(len(self._ring)):
+            index = self._ring[(start + offset) % len(self._ring)]
+            if index in seen:
+                continue
+            seen.add(index)
+            status = statuses[index]
+            if status.active() and status.effective() < capacity:
+                return index
+            if len(seen) == len(statuses):
+                break
+
+        # Every active worker is at capacity: use the least loaded one
+        return min(
+            [position for position, candidate in enumerate(statuses) if candidate.active()],
+            key=lambda position: statuses[position].effective()
+        )
+
+
+class AffinitySocketDispatcher(InheritedSocketDispatcher):
+    """
+    An L{InheritedSocketDispatcher} that chooses the worker for each
+    connection with an L{AffinityDispatchPolicy}, rather than always choosing
+    the least loaded worker.
+    """
+
+    def __init__(self, statusWatcher, policy):
+        InheritedSocketDispatcher.__init__(self, statusWatcher)
+        self.policy = policy
+
+    def sendFileDescriptor(self, skt, description):
+        """
+        A connection has been received. Dispatch it to the worker chosen by
+        the policy, or as L{InheritedSocketDispatcher} would if the connection
+        has no client key.
+        """
+        key = self.policy.keyForSocket(skt)
+        if key is not None:
+            index = self.policy.choose(
+                key, [subsocket.status for subsocket in self._subprocessSockets]
+            )
+            if index is not None:
+                selectedSocket = self._subprocessSockets[index]
+                selectedSocket.sendSocketToPeer(skt, description)
+                selectedSocket.status = self.statusWatcher.newConnectionStatus(
+                    selectedSocket.status
+                )
+                self.statusesChanged()
+                return
+        InheritedSocketDispatcher.sendFileDescriptor(self, skt, description)
+
+
 @implementer(IStatusWatcher)
 class ConnectionLimiter(MultiService, object):
     """
@@ -304,16 +471,24 @@ class ConnectionLimiter(MultiService, object):
     _outstandingRequests = 0
     _maxOutstandingRequests = 0
 
-    def __init__(self, maxAccepts, maxRequests):
+    def __init__(self, maxAccepts, maxRequests, dispatchPolicy=None):
         """
         Create a L{ConnectionLimiter} with an associated dispatcher and
         list of factories.
+
+        @param dispatchPolicy: if not C{None}, the policy used to choose the
+            worker for each connection, otherwise the least loaded worker is
+            used
+        @type dispatchPolicy: L{AffinityDispatchPolicy}
         """
         MultiService.__init__(self)
         self.factories = []
         # XXX dispatcher needs to be a service, so that it can shut down its
         # sub-sockets.
-        self.dispatcher = InheritedSocketDispatcher(self)
+        if dispatchPolicy is None:
+            self.dispatcher = InheritedSocketDispatcher(self)
+        else:
+            self.dispatcher = AffinitySocketDispatcher(self, dispatchPolicy)
         self.maxAccepts = maxAccepts
         self.maxRequests = maxRequests
         self.overloaded = False
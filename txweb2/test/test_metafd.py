@@ -25,7 +25,8 @@ from errno import ENOTCONN
 from twext.internet import sendfdport
 from txweb2 import metafd
 from txweb2.channel.http import HTTPChannel
-from txweb2.metafd import ReportingHTTPService, ConnectionLimiter
+from txweb2.metafd import ReportingHTTPService, ConnectionLimiter, \
+    AffinityDispatchPolicy
 from twisted.internet.tcp import Server
 from twisted.application.service import Service
 
@@ -33,6 +34,9 @@ from twext.internet.test.test_sendfdport import ReaderAdder
 from txweb2.metafd import WorkerStatus
 from twisted.trial.unittest import TestCase
 
+import math
+import random
+
 
 class FakeSocket(object):
     """
@@ -203,14 +207,54 @@ class ConnectionLimiterTests(TestCase):
         builder.processRestart()
         self.assertEquals(builder.port.reading, True)
 
+    def test_affinityDispatch(self):
+        """
+        With an L{AffinityDispatchPolicy}, connections from the same client
+        go to the same worker until it is loaded above the load factor, and
+        connections without a client address are dispatched as usual.
+        """
+        builder = LimiterBuilder(
+            self, requestsPerSocket=4, socketCount=2,
+            dispatchPolicy=AffinityDispatchPolicy(loadFactor=1.0),
+        )
+        sockets = builder.dispatcher._subprocessSockets
+
+        # Capacity is ceil((load + 1) / 2), so the preferred worker can take
+        # alternate connections
+        for _ignore in range(4):
+            builder.dispatcher.sendFileDescriptor(PeerSocket("10.0.0.1"), "SSL")
+        self.assertEqual(sorted([skt.status.effective() for skt in sockets]), [2, 2])
+
+        builder.dispatcher.sendFileDescriptor(None, "SSL")
+        self.assertEqual(sorted([skt.status.effective() for skt in sockets]), [2, 3])
+
     def test_workerStatusRepr(self):
         """
         L{WorkerStatus.__repr__} will show all the values associated with the
         status of the worker.
         """
-        self.assertEquals(repr(WorkerStatus(1, 2, 3, 4, 5, 6, 7, 8)),
+        self.assertEquals(repr(WorkerStatus(1, 2, 3, 4, 5, 6, 7, 8, 9)),
                           "<WorkerStatus acknowledged=1 unacknowledged=2 total=3 "
-                          "started=4 abandoned=5 unclosed=6 starting=7 stopped=8>")
+                          "started=4 abandoned=5 unclosed=6 starting=7 stopped=8 "
+                          "draining=9>")
+
+    def test_drainingStopsDispatch(self):
+        """
+        No connections are dispatched to a draining worker, and it is active
+        again once restarted.
+        """
+        builder = LimiterBuilder(self)
+        sockets = builder.dispatcher._subprocessSockets
+        sockets[0].status.drain()
+        self.assertFalse(sockets[0].status.active())
+
+        builder.fillUp(acknowledged=False, count=2)
+        self.assertEquals([skt.status.effective() for skt in sockets], [0, 2])
+
+        sockets[0].stop()
+        sockets[0].start()
+        sockets[0].restarted()
+        self.assertTrue(sockets[0].status.active())
 
     def test_workerStatusNonNegative(self):
         """
@@ -228,19 +272,182 @@ class ConnectionLimiterTests(TestCase):
         self.assertEquals(w.total, 1)
 
 
+class PeerSocket(object):
+    """
+    A fake connection socket from a given client address.
+    """
+
+    def __init__(self, host):
+        self.host = host
+
+    def getpeername(self):
+        return (self.host, 4321)
+
+
+def activeStatus(load=0):
+    """
+    The L{WorkerStatus} of an active worker with a given load.
+    """
+    return WorkerStatus(acknowledged=load, starting=0)
+
+
+class AffinityDispatchPolicyTests(TestCase):
+    """
+    Tests for L{AffinityDispatchPolicy}.
+    """
+
+    def test_sameKeySameWorker(self):
+        """
+        Connections with the same key go to the same worker, and keys are
+        spread across the workers.
+        """
+        policy = AffinityDispatchPolicy()
+        statuses = [activeStatus() for _ignore in range(8)]
+        chosen = {}
+        for client in range(100):
+            key = "10.0.0.{}".format(client)
+            chosen[key] = policy.choose(key, statuses)
+            for _ignore in range(3):
+                self.assertEqual(policy.choose(key, statuses), chosen[key])
+        self.assertEqual(len(set(chosen.values())), 8)
+
+    def test_spillOver(self):
+        """
+        A connection goes to another worker when its preferred worker's load
+        is above the load factor times the average load.
+        """
+        policy = AffinityDispatchPolicy(loadFactor=1.5)
+        statuses = [activeStatus() for _ignore in range(4)]
+        preferred = policy.choose("10.0.0.1", statuses)
+
+        other = (preferred + 1) % 4
+        statuses[other] = activeStatus(1)
+
+        # Capacity is ceil(1.5 * (2 + 1) / 4) = 2
+        statuses[preferred] = activeStatus(1)
+        self.assertEqual(policy.choose("10.0.0.1", statuses), preferred)
+
+        # Capacity is ceil(1.5 * (3 + 1) / 4) = 2
+        statuses[preferred] = activeStatus(2)
+        self.assertNotEqual(policy.choose("10.0.0.1", statuses), preferred)
+
+    def test_inactiveSkipped(self):
+        """
+        Starting and stopped workers are never chosen, and keys of other
+        workers do not move when a worker is stopped.
+        """
+        policy = AffinityDispatchPolicy()
+        statuses = [activeStatus() for _ignore in range(4)]
+        keys = ["10.0.0.{}".format(client) for client in range(50)]
+        before = dict([(key, policy.choose(key, statuses)) for key in keys])
+
+        statuses[2] = WorkerStatus(starting=0, stopped=1)
+        statuses[3] = WorkerStatus()
+        for key in keys:
+            index = policy.choose(key, statuses)
+            self.assertTrue(index in (0, 1))
+            if before[key] in (0, 1):
+                self.assertEqual(index, before[key])
+
+        self.assertEqual(policy.choose("10.0.0.1", [WorkerStatus()]), None)
+
+    def test_keyForSocket(self):
+        """
+        The key of a connection is its source address, if it has one.
+        """
+        policy = AffinityDispatchPolicy()
+        self.assertEqual(policy.keyForSocket(PeerSocket("10.0.0.1")), "10.0.0.1")
+        self.assertEqual(policy.keyForSocket(None), None)
+
+    def simulate(self, choose, workers=8, connections=40, seed=42):
+        """
+        Simulate clients with skewed activity (a few clients are very busy)
+        opening and closing connections against a set of workers.
+
+        @param choose: called with a client key and the worker statuses to
+            choose the worker for a new connection
+        @type choose: callable
+
+        @return: the fraction of connections that went to the worker each
+            client used most often
+        @rtype: C{float}
+        """
+        statuses = [activeStatus() for _ignore in range(workers)]
+        rnd = random.Random(seed)
+
+        clients = ["10.0.{}.{}".format(i // 256, i % 256) for i in range(200)]
+        weights = [1.0 / (rank + 1) for rank in range(len(clients))]
+        totalWeight = sum(weights)
+
+        def pickClient():
+            target = rnd.random() * totalWeight
+            for client, weight in zip(clients, weights):
+                target -= weight
+                if target <= 0:
+                    return client
+            return clients[-1]
+
+        openConnections = []
+        counts = {}
+        for _ignore in range(20000):
+            # Keep about the given number of connections open
+            if openConnections and (len(openConnections) >= connections or rnd.random() < 0.5):
+                index = openConnections.pop(rnd.randrange(len(openConnections)))
+                statuses[index].adjust(acknowledged=-1)
+                continue
+
+            client = pickClient()
+            index = choose(client, statuses)
+            statuses[index].adjust(acknowledged=1)
+            openConnections.append(index)
+            counts.setdefault(client, {}).setdefault(index, 0)
+            counts[client][index] += 1
+
+        total = sum([sum(byWorker.values()) for byWorker in counts.values()])
+        usual = sum([max(byWorker.values()) for byWorker in counts.values()])
+        return float(usual) / total
+
+    def test_simulation(self):
+        """
+        In a simulation, far more of each client's connections go to the same
+        worker than when dispatching to the least loaded worker, and no worker
+        is chosen once it is loaded above the bound.
+        """
+        loadFactor = 1.25
+        policy = AffinityDispatchPolicy(loadFactor=loadFactor)
+
+        def affinity(key, statuses):
+            total = sum([status.effective() for status in statuses]) + 1
+            capacity = math.ceil(loadFactor * total / len(statuses))
+            index = policy.choose(key, statuses)
+            self.assertTrue(statuses[index].effective() < capacity)
+            return index
+
+        def leastLoaded(key, statuses):
+            return min(range(len(statuses)), key=lambda index: statuses[index].effective())
+
+        withAffinity = self.simulate(affinity)
+        withoutAffinity = self.simulate(leastLoaded)
+        self.assertTrue(
+            withAffinity > 2 * withoutAffinity,
+            "{:.2f} vs {:.2f}".format(withAffinity, withoutAffinity)
+        )
+
+
 class LimiterBuilder(object):
     """
     A L{LimiterBuilder} can build a L{ConnectionLimiter} and associated objects
     for a given unit test.
     """
 
-    def __init__(self, test, requestsPerSocket=3, socketCount=2):
+    def __init__(self, test, requestsPerSocket=3, socketCount=2, dispatchPolicy=None):
         # Similar to MaxRequests in the configuration.
         self.requestsPerSocket = requestsPerSocket
         # Similar to ProcessCount in the configuration.
         self.socketCount = socketCount
         self.limiter = ConnectionLimiter(
-            2, maxRequests=requestsPerSocket * socketCount
+            2, maxRequests=requestsPerSocket * socketCount,
+            dispatchPolicy=dispatchPolicy,
         )
         self.dispatcher = self.limiter.dispatcher
         self.dispatcher.reactor = ReaderAdder()